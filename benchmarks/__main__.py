@@ -0,0 +1,166 @@
+"""
+The CLI of the benchmark suite
+
+    python -m benchmarks micro [--output micro.json] [--baseline baseline.json]
+    python -m benchmarks macro --nodes 3 [--output macro.json] [--baseline baseline.json]
+    python -m benchmarks compare baseline.json current.json
+
+Every run writes a JSON report. Given a baseline report, the run is compared
+to it and exits with a non-zero status if any metric regressed by more than
+the threshold.
+"""
+import sys
+from argparse import ArgumentParser
+
+from benchmarks import cluster, common, macro, micro
+
+
+def get_argument_parser():
+    """Configures a parser for command-line arguments
+
+    Returns:
+        ArgumentParser: Built-in parser for command-line options, arguments
+    """
+    parser = ArgumentParser(prog='python -m benchmarks', description='The benchmark suite of ThunderDB')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    micro_parser = commands.add_parser('micro', help="Benchmark the hot paths of a node, in a single process")
+    micro_parser.add_argument('-b', '--benchmark',
+                              action='append',
+                              choices=sorted(micro.BENCHMARKS),
+                              help="A benchmark to run, may be repeated (default: all of them)")
+    micro_parser.add_argument('--num-keys', type=int, default=micro.DEFAULT_NUM_KEYS,
+                              help="The number of key-value pairs (default: {})".format(micro.DEFAULT_NUM_KEYS))
+    micro_parser.add_argument('--value-size', type=int, default=micro.DEFAULT_VALUE_SIZE,
+                              help="The size of the values (default: {})".format(micro.DEFAULT_VALUE_SIZE))
+    micro_parser.add_argument('--repetitions', type=int, default=micro.DEFAULT_REPETITIONS,
+                              help="The number of times the batch benchmarks are repeated (default: {})".format(
+                                  micro.DEFAULT_REPETITIONS))
+    add_report_arguments(micro_parser)
+
+    macro_parser = commands.add_parser('macro', help="Run a mixed GET/PUT workload against a cluster")
+    macro_parser.add_argument('-n', '--nodes', type=int, default=3,
+                              help="The number of nodes of the local cluster to start (default: 3)")
+    macro_parser.add_argument('-a', '--address',
+                              action='append',
+                              help="The host:port of a node of a running cluster, may be repeated "
+                                   "(default: start a local cluster)")
+    macro_parser.add_argument('--base-port', type=int, default=cluster.DEFAULT_BASE_PORT,
+                              help="The port of the first node of the local cluster (default: {})".format(
+                                  cluster.DEFAULT_BASE_PORT))
+    macro_parser.add_argument('-e', '--env',
+                              action='append',
+                              default=[],
+                              metavar='NAME=VALUE',
+                              help="An environment variable of the nodes of the local cluster, "
+                                   "like SERVER_MODE=async, may be repeated")
+    macro_parser.add_argument('--log-directory',
+                              help="The directory the logs of the nodes of the local cluster are written to")
+    macro_parser.add_argument('--num-keys', type=int, default=macro.DEFAULT_NUM_KEYS,
+                              help="The number of distinct keys (default: {})".format(macro.DEFAULT_NUM_KEYS))
+    macro_parser.add_argument('--read-ratio', type=float, default=macro.DEFAULT_READ_RATIO,
+                              help="The fraction of GET requests (default: {})".format(macro.DEFAULT_READ_RATIO))
+    macro_parser.add_argument('--theta', type=float, default=common.DEFAULT_ZIPF_THETA,
+                              help="The skew of the Zipfian distribution of the keys, 0 for uniform "
+                                   "(default: {})".format(common.DEFAULT_ZIPF_THETA))
+    macro_parser.add_argument('--duration', type=float, default=macro.DEFAULT_DURATION,
+                              help="The number of seconds the workload runs for (default: {})".format(
+                                  macro.DEFAULT_DURATION))
+    macro_parser.add_argument('--concurrency', type=int, default=macro.DEFAULT_CONCURRENCY,
+                              help="The number of concurrent clients (default: {})".format(
+                                  macro.DEFAULT_CONCURRENCY))
+    macro_parser.add_argument('--value-size', type=int, default=macro.DEFAULT_VALUE_SIZE,
+                              help="The size of the values (default: {})".format(macro.DEFAULT_VALUE_SIZE))
+    macro_parser.add_argument('--seed', type=int, default=common.DEFAULT_SEED,
+                              help="The seed of the workload (default: {})".format(common.DEFAULT_SEED))
+    macro_parser.add_argument('--direct', action='store_true',
+                              help="Send every request straight to the owner of its key, like ThunderDBClient")
+    add_report_arguments(macro_parser)
+
+    compare_parser = commands.add_parser('compare', help="Compare a report to a baseline report")
+    compare_parser.add_argument('baseline', help="The baseline report")
+    compare_parser.add_argument('current', help="The report to compare to the baseline")
+    add_threshold_argument(compare_parser)
+    return parser
+
+
+def add_report_arguments(parser):
+    parser.add_argument('-o', '--output', help="The file the JSON report is written to (default: the standard output)")
+    parser.add_argument('--baseline', help="A previous report to compare the results to")
+    add_threshold_argument(parser)
+
+
+def add_threshold_argument(parser):
+    parser.add_argument('--threshold', type=float, default=common.DEFAULT_REGRESSION_THRESHOLD,
+                        help="The relative change beyond which a metric has regressed (default: {})".format(
+                            common.DEFAULT_REGRESSION_THRESHOLD))
+
+
+def run_micro(arguments):
+    results = micro.run(arguments.benchmark, arguments.num_keys, arguments.value_size, arguments.repetitions)
+    return common.create_report('micro', results, {
+        'num_keys': arguments.num_keys,
+        'value_size': arguments.value_size,
+        'repetitions': arguments.repetitions,
+    })
+
+
+def run_macro(arguments):
+    parameters = {
+        'num_keys': arguments.num_keys,
+        'read_ratio': arguments.read_ratio,
+        'theta': arguments.theta,
+        'duration': arguments.duration,
+        'concurrency': arguments.concurrency,
+        'value_size': arguments.value_size,
+        'seed': arguments.seed,
+        'direct': arguments.direct,
+    }
+
+    def run(addresses):
+        return macro.run(addresses, arguments.num_keys, arguments.read_ratio, arguments.theta, arguments.duration,
+                         arguments.concurrency, arguments.value_size, arguments.seed, direct=arguments.direct)
+
+    if arguments.address:
+        parameters['addresses'] = arguments.address
+        return common.create_report('macro', run(arguments.address), parameters)
+
+    env = dict(variable.split('=', 1) for variable in arguments.env)
+    parameters.update(nodes=arguments.nodes, env=env)
+    with cluster.LocalCluster(arguments.nodes, arguments.base_port, env, arguments.log_directory) as local_cluster:
+        return common.create_report('macro', run(local_cluster.addresses), parameters)
+
+
+def print_comparison(baseline, current, threshold):
+    """Print how every metric changed from the baseline, returning the number of regressions
+    """
+    if baseline.get('kind') != current.get('kind'):
+        raise ValueError("Cannot compare a {} report to a {} baseline".format(current.get('kind'),
+                                                                              baseline.get('kind')))
+
+    regressions = 0
+    for name, metric, baseline_value, current_value, change, is_regression in \
+            common.compare_reports(baseline, current, threshold):
+        regressions += is_regression
+        print("{:<32} {:<18} {:>14.2f} {:>14.2f} {:>+8.1%}{}".format(
+            name, metric, baseline_value, current_value, change, "  REGRESSION" if is_regression else ""),
+            file=sys.stderr)
+    print("{} regression(s) beyond {:.0%}".format(regressions, threshold), file=sys.stderr)
+    return regressions
+
+
+def main(arguments):
+    if arguments.command == 'compare':
+        baseline, report = common.read_report(arguments.baseline), common.read_report(arguments.current)
+    else:
+        report = run_micro(arguments) if arguments.command == 'micro' else run_macro(arguments)
+        common.write_report(report, arguments.output)
+        if not arguments.baseline:
+            return 0
+        baseline = common.read_report(arguments.baseline)
+
+    return 1 if print_comparison(baseline, report, arguments.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_argument_parser().parse_args()))
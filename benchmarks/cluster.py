@@ -0,0 +1,104 @@
+"""
+A cluster of nodes running as local processes, each one on its own port
+"""
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+# The port of the first node, the other nodes listening on the following ports
+DEFAULT_BASE_PORT = 8090
+
+# The number of seconds to wait for every node to answer a ping and to know of every other node
+STARTUP_TIMEOUT = 30.0
+
+
+class LocalCluster(object):
+    """Start a cluster of num_nodes nodes on the local machine, without Docker
+
+    Node i listens on base_port + i, and knows the node after it in the ring,
+    like the nodes started by distributed_nodes_server.sh. The environment
+    variables of thunderdb.main (SERVER_MODE, PEER_TRANSPORT, ...) can be
+    set for every node through env. The standard output and error of the
+    nodes are written to the given log directory, or discarded.
+    """
+    def __init__(self, num_nodes=3, base_port=DEFAULT_BASE_PORT, env=None, log_directory=None):
+        self.num_nodes = num_nodes
+        self.base_port = base_port
+        self.env = env or {}
+        self.log_directory = log_directory
+        self.processes = []
+        self._outputs = []
+
+    @property
+    def addresses(self):
+        return ['127.0.0.1:{}'.format(self.base_port + node_id) for node_id in range(self.num_nodes)]
+
+    def start(self):
+        addresses = self.addresses
+        for node_id, address in enumerate(addresses):
+            next_node_id = (node_id + 1) % self.num_nodes
+            env = dict(os.environ,
+                       NODE_ID=str(node_id),
+                       NODE_IP=address,
+                       NEXT_NODE_ID=str(next_node_id),
+                       NEXT_NODE_IP=addresses[next_node_id],
+                       PORT=str(self.base_port + node_id),
+                       CLUSTER_SIZE=str(self.num_nodes),
+                       **self.env)
+            output = subprocess.DEVNULL
+            if self.log_directory:
+                output = open(os.path.join(self.log_directory, 'node{}.log'.format(node_id)), 'w')
+                self._outputs.append(output)
+            self.processes.append(subprocess.Popen([sys.executable, '-m', 'thunderdb.thunderdb'],
+                                                   env=env, stdout=output, stderr=subprocess.STDOUT))
+
+        try:
+            self.wait_until_ready()
+        except Exception:
+            self.stop()
+            raise
+        return self
+
+    def wait_until_ready(self, timeout=STARTUP_TIMEOUT):
+        """Wait for every node to answer a ping, then for every node to know of the whole cluster through gossip
+        """
+        deadline = time.time() + timeout
+        for process, address in zip(self.processes, self.addresses):
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError("The node at {} exited with code {}".format(address, process.returncode))
+                try:
+                    requests.get('http://{}/ping'.format(address), timeout=1).raise_for_status()
+                    break
+                except requests.exceptions.RequestException:
+                    if time.time() > deadline:
+                        raise RuntimeError("The node at {} did not start in time".format(address))
+                    time.sleep(0.1)
+
+        for address in self.addresses:
+            while len(requests.get('http://{}/cluster'.format(address), timeout=1).json()['nodes']) < self.num_nodes:
+                if time.time() > deadline:
+                    raise RuntimeError("The node at {} did not join the cluster in time".format(address))
+                time.sleep(0.1)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for output in self._outputs:
+            output.close()
+        self.processes = []
+        self._outputs = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,140 @@
+"""
+The pieces shared by the micro and macro benchmarks: the key distributions, the latency summaries and the reports
+"""
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy
+
+# The skew of the Zipfian distribution of the keys. 0.99 is the default of YCSB,
+# under which the hottest 1% of the keys get about half of the requests
+DEFAULT_ZIPF_THETA = 0.99
+
+# The seed of every random generator, so that two runs issue the same requests
+DEFAULT_SEED = 42
+
+# The percentiles of the latencies included in the reports
+PERCENTILES = (50, 99, 99.9)
+
+# A metric is flagged as a regression when it is worse than in the baseline by more than this fraction
+DEFAULT_REGRESSION_THRESHOLD = 0.1
+
+
+class ZipfianGenerator(object):
+    """Draw ranks in [0, num_keys) following a Zipfian distribution
+
+    The rank of probability 1 / (i + 1)^theta is shuffled once with the
+    seed, so that the hottest keys are spread over the whole key space (and
+    over every node) rather than being the first ones. A theta of 0 draws
+    the ranks uniformly. Generators with the same seed but different
+    streams share the same hottest keys, but draw different sequences.
+    """
+    def __init__(self, num_keys, theta=DEFAULT_ZIPF_THETA, seed=DEFAULT_SEED, stream=0):
+        self.num_keys = num_keys
+        weights = 1.0 / numpy.arange(1, num_keys + 1) ** theta
+        self.cumulative_weights = numpy.cumsum(weights) / weights.sum()
+        self.ranks = numpy.random.default_rng(seed).permutation(num_keys)
+        self.random = numpy.random.default_rng([seed, stream])
+
+    def draw(self, size):
+        """Draw size ranks at once
+        """
+        positions = numpy.searchsorted(self.cumulative_weights, self.random.random(size), side='right')
+        return self.ranks[numpy.minimum(positions, self.num_keys - 1)]
+
+
+def get_key(rank):
+    return "key{:010d}".format(rank)
+
+
+def get_value(rank, value_size):
+    return "{:010d}".format(rank).ljust(value_size, "v")
+
+
+def summarize_latencies(latencies, duration):
+    """Summarize the latencies of the operations run in the given number of seconds
+
+    The latencies are in seconds, and the percentiles are reported in microseconds
+    """
+    summary = {
+        'operations': len(latencies),
+        'ops_per_second': len(latencies) / duration if duration else 0.0,
+    }
+    if len(latencies):
+        values = numpy.percentile(numpy.asarray(latencies) * 1e6, PERCENTILES)
+        for percentile, value in zip(PERCENTILES, values):
+            summary[percentile_name(percentile)] = float(value)
+    return summary
+
+
+def percentile_name(percentile):
+    return 'p{}_us'.format(str(percentile).replace('.', ''))
+
+
+def create_report(kind, results, parameters):
+    return {
+        'kind': kind,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'parameters': parameters,
+        'results': results,
+    }
+
+
+def write_report(report, path=None):
+    """Write a report as JSON to the given file, or to the standard output
+    """
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if path:
+        with open(path, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+def read_report(path):
+    with open(path) as report_file:
+        return json.load(report_file)
+
+
+def is_higher_better(metric):
+    """True for the throughput metrics, False for the latency ones, None for the metrics which are not compared
+    """
+    if metric.endswith('_per_second'):
+        return True
+    if metric.endswith('_us'):
+        return False
+    return None
+
+
+def compare_reports(baseline, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """Compare the metrics of two reports of the same kind
+
+    Returns a list of (benchmark, metric, baseline value, current value,
+    relative change, is_regression) tuples, the relative change being
+    positive when the metric improved. Benchmarks which are only in one of
+    the reports are left out.
+    """
+    comparisons = []
+    for name, baseline_metrics in sorted(baseline['results'].items()):
+        current_metrics = current['results'].get(name)
+        if current_metrics is None:
+            continue
+        for metric, baseline_value in sorted(baseline_metrics.items()):
+            higher_is_better = is_higher_better(metric)
+            current_value = current_metrics.get(metric)
+            if higher_is_better is None or current_value is None or not baseline_value:
+                continue
+
+            change = (current_value - baseline_value) / baseline_value
+            if not higher_is_better:
+                change = -change
+            comparisons.append((name, metric, baseline_value, current_value, change, change < -threshold))
+    return comparisons
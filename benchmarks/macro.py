@@ -0,0 +1,159 @@
+"""
+Macro-benchmarks: a mixed workload of GET and PUT requests sent to a running cluster over HTTP
+"""
+import http.client
+import itertools
+import json
+import threading
+import time
+
+import numpy
+
+from benchmarks.common import (ZipfianGenerator, get_key, get_value, summarize_latencies,
+                               DEFAULT_SEED, DEFAULT_ZIPF_THETA)
+from thunderdb.client import ThunderDBClient
+
+# The number of distinct keys of the workload, all loaded before it starts
+DEFAULT_NUM_KEYS = 100000
+
+# The fraction of the requests which are GET requests, the others being PUT requests
+DEFAULT_READ_RATIO = 0.9
+
+# The number of seconds the workload runs for
+DEFAULT_DURATION = 10.0
+
+# The number of clients sending requests concurrently, each one waiting for a response before sending the next
+DEFAULT_CONCURRENCY = 16
+
+# The size of the values, in characters
+DEFAULT_VALUE_SIZE = 32
+
+# The number of key-value pairs loaded per /batch-put request
+PRELOAD_BATCH_SIZE = 10000
+
+# The number of requests drawn at once by every client
+DRAW_SIZE = 1000
+
+
+def preload(address, num_keys, value_size=DEFAULT_VALUE_SIZE):
+    """Put every key of the workload into the cluster, through the node at the given address
+    """
+    connection = http.client.HTTPConnection(address)
+    try:
+        for start in range(0, num_keys, PRELOAD_BATCH_SIZE):
+            batch = {get_key(rank): get_value(rank, value_size)
+                     for rank in range(start, min(start + PRELOAD_BATCH_SIZE, num_keys))}
+            connection.request('POST', '/batch-put', body=json.dumps(batch))
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError("Preloading failed with status {}".format(response.status))
+    finally:
+        connection.close()
+
+
+class Client(threading.Thread):
+    """Send requests to a node one after the other, on a keep-alive connection, until the deadline
+
+    With a router, a function giving the address of the owner of a key,
+    every request is sent straight to the owner of its key instead, on a
+    keep-alive connection per node
+    """
+    def __init__(self, address, generator, read_ratio, value_size, deadline, seed, router=None):
+        super(Client, self).__init__(daemon=True)
+        self.address = address
+        self.router = router
+        self.generator = generator
+        self.read_ratio = read_ratio
+        self.value_size = value_size
+        self.deadline = deadline
+        self.random = numpy.random.default_rng(seed)
+        self.latencies = {'get': [], 'put': []}
+        self.errors = 0
+
+    def run(self):
+        connections = {}
+        query = '?direct=true' if self.router is not None else ''
+        clock = time.perf_counter
+        try:
+            while time.time() < self.deadline:
+                ranks = self.generator.draw(DRAW_SIZE)
+                reads = self.random.random(DRAW_SIZE) < self.read_ratio
+                for rank, is_read in zip(ranks.tolist(), reads.tolist()):
+                    key = get_key(rank)
+                    address = self.router(key) if self.router is not None else self.address
+                    connection = connections.get(address)
+                    if connection is None:
+                        connection = connections[address] = http.client.HTTPConnection(address, timeout=30)
+                    start = clock()
+                    try:
+                        if is_read:
+                            connection.request('GET', '/get/' + key + query)
+                        else:
+                            connection.request('POST', '/put' + query,
+                                               body=json.dumps({key: get_value(rank, self.value_size)}))
+                        response = connection.getresponse()
+                        response.read()
+                    except (OSError, http.client.HTTPException):
+                        self.errors += 1
+                        connection.close()
+                        continue
+
+                    if response.status >= 300:
+                        self.errors += 1
+                    else:
+                        self.latencies['get' if is_read else 'put'].append(clock() - start)
+                    if time.time() >= self.deadline:
+                        return
+        finally:
+            for connection in connections.values():
+                connection.close()
+
+
+def run(addresses,
+        num_keys=DEFAULT_NUM_KEYS,
+        read_ratio=DEFAULT_READ_RATIO,
+        theta=DEFAULT_ZIPF_THETA,
+        duration=DEFAULT_DURATION,
+        concurrency=DEFAULT_CONCURRENCY,
+        value_size=DEFAULT_VALUE_SIZE,
+        seed=DEFAULT_SEED,
+        load=True,
+        direct=False):
+    """Run the workload against the nodes at the given addresses, returning its results
+
+    The clients are spread evenly over the nodes. The keys of every client
+    follow the same Zipfian distribution, each client drawing its own
+    sequence of keys. The results hold the throughput and latencies of the
+    GET requests, of the PUT requests and of all of them together. With
+    direct, the clients send every request to the owner of its key, which
+    they learn from the cluster as ThunderDBClient does.
+    """
+    if load:
+        preload(addresses[0], num_keys, value_size)
+
+    router = None
+    if direct:
+        with ThunderDBClient(addresses) as ring_client:
+            router = ring_client.owner
+
+    deadline = time.time() + duration
+    clients = [Client(address, ZipfianGenerator(num_keys, theta, seed, stream=index + 1),
+                      read_ratio, value_size, deadline, seed + index + 1, router)
+               for index, address in zip(range(concurrency), itertools.cycle(addresses))]
+
+    started = time.time()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.time() - started
+
+    results = {}
+    for operation in ('get', 'put'):
+        results[operation] = summarize_latencies(
+            [latency for client in clients for latency in client.latencies[operation]], elapsed)
+    results['all'] = summarize_latencies(
+        [latency for client in clients for latencies in client.latencies.values() for latency in latencies], elapsed)
+    results['all']['errors'] = sum(client.errors for client in clients)
+    return results
@@ -0,0 +1,204 @@
+"""
+Micro-benchmarks of the hot paths of a node, run in a single process without any network
+
+Every benchmark times its operations one by one, and reports their
+throughput and latency percentiles (see common.summarize_latencies). The
+benchmarks of batch operations also report how many key-value pairs they
+handle per second.
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from benchmarks.common import ZipfianGenerator, get_key, get_value, summarize_latencies
+from thunderdb.config import Config
+from thunderdb.compute.engine import Engine
+from thunderdb.compute.node import Node
+from thunderdb.hashing.consistent_hashing import ConsistentHash
+from thunderdb.storage.in_memory_store import InMemoryStore
+from thunderdb.storage.ordered_store import OrderedStore
+from thunderdb.storage.capped_store import CappedStore, ENTRY_OVERHEAD
+from thunderdb.storage.shared_store import SharedMemoryStore
+
+# The number of key-value pairs the benchmarks work on
+DEFAULT_NUM_KEYS = 100000
+
+# The size of the values, in characters
+DEFAULT_VALUE_SIZE = 32
+
+# The number of times the benchmarks of whole batches are repeated
+DEFAULT_REPETITIONS = 5
+
+# The number of nodes in the cluster of the engine benchmarks
+DEFAULT_NUM_NODES = 3
+
+# The number of key-value pairs of every page of the range scan benchmark
+RANGE_SCAN_LIMIT = 100
+
+
+def time_operations(operation, arguments):
+    """Call the operation once per argument, returning the latency of every call and the total duration
+    """
+    latencies = []
+    clock = time.perf_counter
+    started = clock()
+    for argument in arguments:
+        start = clock()
+        operation(argument)
+        latencies.append(clock() - start)
+    return latencies, clock() - started
+
+
+def create_engine(node_id=0, num_nodes=DEFAULT_NUM_NODES):
+    config = Config(node_id, "node{}".format(node_id), (node_id + 1) % num_nodes,
+                    "node{}".format((node_id + 1) % num_nodes))
+    config.add({n: "node{}".format(n) for n in range(num_nodes)})
+    return Engine(config)
+
+
+def bench_get_node_id(num_keys, value_size, repetitions):
+    ring = ConsistentHash(DEFAULT_NUM_NODES)
+    keys = [get_key(rank) for rank in ZipfianGenerator(num_keys).draw(num_keys)]
+    return summarize_latencies(*time_operations(ring.get_node_id, keys))
+
+
+def bench_get_node_ids(num_keys, value_size, repetitions):
+    ring = ConsistentHash(DEFAULT_NUM_NODES)
+    keys = [get_key(rank) for rank in range(num_keys)]
+    return summarize_batches(time_operations(ring.get_node_ids, [keys] * repetitions), num_keys)
+
+
+def bench_store_put(num_keys, value_size, repetitions):
+    store = InMemoryStore()
+    value = get_value(0, value_size)
+    keys = [get_key(rank) for rank in range(num_keys)]
+    return summarize_latencies(*time_operations(lambda key: store.put(key, value), keys))
+
+
+def bench_store_get(num_keys, value_size, repetitions):
+    store = InMemoryStore()
+    store.put_batch({get_key(rank): get_value(rank, value_size) for rank in range(num_keys)})
+    keys = [get_key(rank) for rank in ZipfianGenerator(num_keys).draw(num_keys)]
+    return summarize_latencies(*time_operations(store.get, keys))
+
+
+def bench_shared_store_get(num_keys, value_size, repetitions):
+    store = SharedMemoryStore(max_keys=num_keys, max_bytes=num_keys * (value_size + 64))
+    store.put_batch({get_key(rank): get_value(rank, value_size) for rank in range(num_keys)})
+    keys = [get_key(rank) for rank in ZipfianGenerator(num_keys).draw(num_keys)]
+    return summarize_latencies(*time_operations(store.get, keys))
+
+
+def bench_store_scan(num_keys, value_size, repetitions):
+    store = InMemoryStore()
+    store.put_batch({get_key(rank): get_value(rank, value_size) for rank in range(num_keys)})
+
+    def scan(_):
+        for _ in store.iter_pages(limit=1000):
+            pass
+
+    return summarize_batches(time_operations(scan, range(repetitions)), num_keys)
+
+
+def bench_engine_batch_put(num_keys, value_size, repetitions):
+    """Load a data file into a single node (see BulkLoader)
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        data_file = os.path.join(directory, 'data.txt')
+        with open(data_file, 'w') as output:
+            output.writelines("{} {}\n".format(get_key(rank), get_value(rank, value_size)) for rank in range(num_keys))
+
+        def load(_):
+            # Keep the progress reports of the loader out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                create_engine(num_nodes=1).batch_put(data_file)
+
+        return summarize_batches(time_operations(load, range(repetitions)), num_keys)
+
+
+def bench_engine_redistribute(num_keys, value_size, repetitions):
+    """Move the key-value pairs of a node when a node joins the cluster
+
+    The requests to the other nodes are left out, so only the work of the
+    node which sends its key-value pairs is measured
+    """
+    data = {get_key(rank): get_value(rank, value_size) for rank in range(num_keys)}
+
+    def redistribute(_):
+        engine = create_engine(num_nodes=DEFAULT_NUM_NODES - 1)
+        engine.rebalancer.max_keys_per_second = 0
+        engine.storage.put_batch(data)
+        previous_ring = engine.hash_ring
+        engine.config.add({DEFAULT_NUM_NODES - 1: "node{}".format(DEFAULT_NUM_NODES - 1)})
+        engine.redistribute(previous_ring)
+        engine.rebalancer.wait()
+
+    with mock.patch.object(Node, 'put_batch'), mock.patch.object(Node, 'replicate_batch'):
+        return summarize_batches(time_operations(redistribute, range(repetitions)), num_keys)
+
+
+def bench_ordered_store_put(num_keys, value_size, repetitions):
+    store = OrderedStore()
+    value = get_value(0, value_size)
+    keys = [get_key(rank) for rank in ZipfianGenerator(num_keys).draw(num_keys)]
+    return summarize_latencies(*time_operations(lambda key: store.put(key, value), keys))
+
+
+def bench_ordered_store_range_scan(num_keys, value_size, repetitions):
+    store = OrderedStore()
+    store.put_batch({get_key(rank): get_value(rank, value_size) for rank in range(num_keys)})
+    starts = [get_key(rank) for rank in ZipfianGenerator(num_keys).draw(num_keys // RANGE_SCAN_LIMIT)]
+    return summarize_batches(time_operations(lambda start: store.range_scan(start, limit=RANGE_SCAN_LIMIT), starts),
+                             RANGE_SCAN_LIMIT)
+
+
+def bench_capped_store_put(num_keys, value_size, repetitions):
+    """Put Zipfian keys which expire into a store which only holds half of them, evicting a key on most puts
+    """
+    value = get_value(0, value_size)
+    entry_size = sys.getsizeof(get_key(num_keys)) + sys.getsizeof(value) + ENTRY_OVERHEAD
+    store = CappedStore(max_bytes=num_keys // 2 * entry_size)
+    keys = [get_key(rank) for rank in ZipfianGenerator(num_keys).draw(num_keys)]
+    expires_at = time.time() + 3600
+    try:
+        return summarize_latencies(*time_operations(lambda key: store.put(key, value, expires_at), keys))
+    finally:
+        store.close()
+
+
+def summarize_batches(timings, batch_size):
+    latencies, duration = timings
+    summary = summarize_latencies(latencies, duration)
+    summary['items_per_second'] = batch_size * len(latencies) / duration if duration else 0.0
+    return summary
+
+
+# The micro-benchmarks, by name
+BENCHMARKS = {
+    'hash_ring.get_node_id': bench_get_node_id,
+    'hash_ring.get_node_ids': bench_get_node_ids,
+    'in_memory_store.put': bench_store_put,
+    'in_memory_store.get': bench_store_get,
+    'in_memory_store.scan': bench_store_scan,
+    'shared_memory_store.get': bench_shared_store_get,
+    'ordered_store.put': bench_ordered_store_put,
+    'ordered_store.range_scan': bench_ordered_store_range_scan,
+    'capped_store.put': bench_capped_store_put,
+    'engine.batch_put': bench_engine_batch_put,
+    'engine.redistribute': bench_engine_redistribute,
+}
+
+
+def run(names=None, num_keys=DEFAULT_NUM_KEYS, value_size=DEFAULT_VALUE_SIZE, repetitions=DEFAULT_REPETITIONS):
+    """Run the given micro-benchmarks (all of them by default), returning their results by name
+    """
+    results = {}
+    for name in names or sorted(BENCHMARKS):
+        if name not in BENCHMARKS:
+            raise ValueError("Unknown benchmark '{}', expected one of {}".format(name, sorted(BENCHMARKS)))
+        results[name] = BENCHMARKS[name](num_keys, value_size, repetitions)
+    return results
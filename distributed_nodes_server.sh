@@ -31,12 +31,12 @@ do
 
   if [[ $((${NODE_ID} + 1)) -eq ${NUM_NODES} ]] 
   then 
-    docker run --net thunderdb-network -p "${LOCAL_PORT}":80 --ip "${node_ip}" -e DATA_FILE="$1" -e NODE_ID="${NODE_ID}" -e NODE_IP="${node_ip}" -e NEXT_NODE_ID="${next_node_id}" -e NEXT_NODE_IP="${next_node_ip}" "${SERVICE}" & 
+    docker run --net thunderdb-network -p "${LOCAL_PORT}":80 --ip "${node_ip}" -e DATA_FILE="$1" -e NODE_ID="${NODE_ID}" -e NODE_IP="${node_ip}" -e NEXT_NODE_ID="${next_node_id}" -e NEXT_NODE_IP="${next_node_ip}" -e CLUSTER_SIZE="${NUM_NODES}" "${SERVICE}" & 
   fi 
 
   if [[ $((${NODE_ID} + 1)) -ne ${NUM_NODES} ]] 
   then 
-    docker run --net thunderdb-network -p "${LOCAL_PORT}":80 --ip "${node_ip}" -e NODE_ID="${NODE_ID}" -e NODE_IP="${node_ip}" -e NEXT_NODE_ID="${next_node_id}" -e NEXT_NODE_IP="${next_node_ip}" "${SERVICE}" &
+    docker run --net thunderdb-network -p "${LOCAL_PORT}":80 --ip "${node_ip}" -e NODE_ID="${NODE_ID}" -e NODE_IP="${node_ip}" -e NEXT_NODE_ID="${next_node_id}" -e NEXT_NODE_IP="${next_node_ip}" -e CLUSTER_SIZE="${NUM_NODES}" "${SERVICE}" &
   fi
 
   INFO_STRING="${INFO_STRING} ${LOCAL_PORT}"
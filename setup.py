@@ -5,10 +5,11 @@ setup(
     version='1.0',
     packages=find_packages(),
     install_requires=[
-        'pandas',
+        'numpy',
         'requests',
         'bottle',
-        'waitress'
+        'waitress',
+        'aiohttp'
     ],
     entry_points={
         'console_scripts': [
@@ -1,6 +1,11 @@
 import os
 from argparse import ArgumentParser
 from thunderdb import thunderdb
+from thunderdb.storage.backends import STORAGE_BACKENDS, DEFAULT_STORAGE_BACKEND
+from thunderdb.storage.log_store import FSYNC_POLICIES, FSYNC_INTERVAL
+from thunderdb.storage.capped_store import DEFAULT_MAX_BYTES
+from thunderdb.storage.eviction import EVICTION_POLICIES, DEFAULT_EVICTION_POLICY
+from thunderdb.thunderdb import SERVER_MODES, DEFAULT_SERVER_MODE, PEER_TRANSPORTS, DEFAULT_PEER_TRANSPORT
 
 
 def get_argument_parser():
@@ -13,6 +18,38 @@ def get_argument_parser():
     parser.add_argument('-d', '--data',
                         required=True,
                         help="Path to the file which contains the key-value pairs you want to load")
+    parser.add_argument('-s', '--storage',
+                        choices=sorted(STORAGE_BACKENDS),
+                        default=DEFAULT_STORAGE_BACKEND,
+                        help="The storage backend used to hold the key-value pairs (default: {})".format(
+                            DEFAULT_STORAGE_BACKEND))
+    parser.add_argument('-l', '--log-directory',
+                        help="Directory of the write-ahead log which makes the store durable (default: not durable)")
+    parser.add_argument('--fsync',
+                        choices=FSYNC_POLICIES,
+                        default=FSYNC_INTERVAL,
+                        help="When the write-ahead log is forced to disk (default: {})".format(FSYNC_INTERVAL))
+    parser.add_argument('--server',
+                        choices=SERVER_MODES,
+                        default=DEFAULT_SERVER_MODE,
+                        help="How the requests are served (default: {})".format(DEFAULT_SERVER_MODE))
+    parser.add_argument('--peer-transport',
+                        choices=PEER_TRANSPORTS,
+                        default=DEFAULT_PEER_TRANSPORT,
+                        help="How the nodes reach each other (default: {})".format(DEFAULT_PEER_TRANSPORT))
+    parser.add_argument('--ordered-index',
+                        action='store_true',
+                        help="Keep the keys in order, so /scan does not sort the whole store on every page")
+    parser.add_argument('--max-bytes',
+                        type=int,
+                        default=DEFAULT_MAX_BYTES,
+                        help="The memory budget of the capped storage backend, in bytes (default: {})".format(
+                            DEFAULT_MAX_BYTES))
+    parser.add_argument('--eviction',
+                        choices=sorted(EVICTION_POLICIES),
+                        default=DEFAULT_EVICTION_POLICY,
+                        help="The keys the capped storage backend evicts first (default: {})".format(
+                            DEFAULT_EVICTION_POLICY))
     return parser
 
 
@@ -44,7 +81,9 @@ def validate_arguments(arguments):
     return
 
 
-def local_mode(data_file):
+def local_mode(data_file, storage_backend=DEFAULT_STORAGE_BACKEND, log_directory=None, fsync=FSYNC_INTERVAL,
+               server_mode=DEFAULT_SERVER_MODE, peer_transport=DEFAULT_PEER_TRANSPORT, ordered_index=False,
+               max_bytes=DEFAULT_MAX_BYTES, eviction=DEFAULT_EVICTION_POLICY):
     """Run the key-value store on a single node in local mode (on your local machine, not in docker)
     """
     os.environ['NODE_ID'] = "0"
@@ -52,12 +91,23 @@ def local_mode(data_file):
     os.environ['NEXT_NODE_ID'] = "0"
     os.environ['NEXT_NODE_IP'] = "localhost"
     os.environ['DATA_FILE'] = data_file
+    os.environ['STORAGE_BACKEND'] = storage_backend
+    os.environ['FSYNC_POLICY'] = fsync
+    os.environ['SERVER_MODE'] = server_mode
+    os.environ['PEER_TRANSPORT'] = peer_transport
+    os.environ['STORE_MAX_BYTES'] = str(max_bytes)
+    os.environ['EVICTION_POLICY'] = eviction
+    if log_directory:
+        os.environ['LOG_DIRECTORY'] = log_directory
+    if ordered_index:
+        os.environ['ORDERED_INDEX'] = 'true'
 
     thunderdb.main()
 
 
 def main(arguments):
-    local_mode(arguments.data)
+    local_mode(arguments.data, arguments.storage, arguments.log_directory, arguments.fsync, arguments.server,
+               arguments.peer_transport, arguments.ordered_index, arguments.max_bytes, arguments.eviction)
 
 
 if __name__ == "__main__":
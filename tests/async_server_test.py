@@ -0,0 +1,213 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from thunderdb.config import Config
+from thunderdb.compute.async_node import AsyncNode
+from thunderdb.compute.gossip import Gossip
+from thunderdb.networking.async_server import initialize, ENGINE_KEY
+from thunderdb.storage.capped_store import CappedStore
+
+
+SAMPLE_DATA_FILE = "sample_data/data_demo_10000.txt"
+
+
+def load_sample_data():
+    with open(SAMPLE_DATA_FILE) as data_file:
+        return dict(line.split() for line in data_file)
+
+
+class AsyncServerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.app = initialize(Config(0, "localhost", 0, "localhost"))
+        self.client = TestClient(TestServer(self.app))
+        await self.client.start_server()
+        self.data = load_sample_data()
+        await self.client.post('/batch-put', data=json.dumps(self.data))
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_ping(self):
+        response = await self.client.get('/ping')
+        self.assertEqual(await response.json(), {'service': 'node', 'status': 'OK'})
+
+    async def test_put_and_get(self):
+        response = await self.client.post('/put', data=json.dumps({"foo": "bar"}))
+        self.assertEqual(response.status, 200)
+        response = await self.client.get('/get/foo')
+        self.assertEqual(await response.json(), {"foo": "bar"})
+
+    async def test_get_missing_key(self):
+        self.assertEqual((await self.client.get('/get/missing')).status, 404)
+
+    async def test_get_empty_and_zero_values(self):
+        await self.client.post('/batch-put', data=json.dumps({"empty": "", "zero": 0}))
+        self.assertEqual(await (await self.client.get('/get/empty')).json(), {"empty": ""})
+        self.assertEqual(await (await self.client.get('/get/zero')).json(), {"zero": 0})
+
+    async def test_invalid_requests(self):
+        self.assertEqual((await self.client.post('/put', data=json.dumps({"a": 1, "b": 2}))).status, 400)
+        self.assertEqual((await self.client.post('/batch-put', data=json.dumps(["foo"]))).status, 400)
+        self.assertEqual((await self.client.post('/put?ack=some', data=json.dumps({"a": 1}))).status, 400)
+        self.assertEqual((await self.client.post('/put?ttl=soon', data=json.dumps({"a": 1}))).status, 400)
+        # Only the capped storage backend expires keys
+        self.assertEqual((await self.client.post('/put?ttl=60', data=json.dumps({"a": 1}))).status, 400)
+        self.assertEqual((await self.client.post('/put', data="not json")).status, 500)
+
+    async def test_mget(self):
+        keys = list(self.data)[:10] + ["missing"]
+        response = await self.client.post('/mget', data=json.dumps(keys))
+        self.assertEqual(await response.json(), {key: self.data[key] for key in keys[:10]})
+
+    async def test_metrics(self):
+        await self.client.get('/get/missing')
+        text = await (await self.client.get('/metrics')).text()
+        self.assertIn('thunderdb_store_keys {}\n'.format(len(self.data)), text)
+        self.assertIn('thunderdb_http_request_seconds_count{method="GET",route="/get/{key}",status="404"}', text)
+
+    async def test_snapshot(self):
+        self.assertEqual(await (await self.client.get('/snapshot')).json(), self.data)
+
+    async def test_streaming_snapshot(self):
+        response = await self.client.get('/snapshot', params={'stream': 'true'})
+        self.assertEqual(response.headers['Content-Type'], 'application/x-ndjson')
+
+        snapshot = {}
+        for line in (await response.text()).splitlines():
+            snapshot.update(json.loads(line))
+        self.assertEqual(snapshot, self.data)
+
+    async def test_paginated_snapshot(self):
+        snapshot, cursor = {}, ""
+        while cursor is not None:
+            page = await (await self.client.get('/snapshot', params={'limit': 3000, 'cursor': cursor})).json()
+            snapshot.update(page['data'])
+            cursor = page['cursor']
+        self.assertEqual(snapshot, self.data)
+        self.assertEqual((await self.client.get('/snapshot', params={'limit': 0})).status, 400)
+
+    async def test_scan(self):
+        await self.client.post('/batch-put', data=json.dumps({"tenant1:b": "2", "tenant1:a": "1", "tenant2:a": "3"}))
+        response = await self.client.get('/scan', params={'prefix': 'tenant', 'limit': 2})
+        self.assertEqual(await response.json(), {'data': {"tenant1:a": "1", "tenant1:b": "2"}, 'cursor': "tenant1:b"})
+
+        response = await self.client.get('/scan', params={'prefix': 'tenant', 'stream': 'true'})
+        self.assertEqual([json.loads(line) for line in (await response.text()).splitlines()],
+                         [{"tenant1:a": "1"}, {"tenant1:b": "2"}, {"tenant2:a": "3"}])
+        self.assertEqual((await self.client.get('/scan', params={'limit': 0})).status, 400)
+
+
+class AsyncEngineTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        config = Config(0, "node0", 1, "node1", replication_factor=1)
+        config.add({2: "node2"})
+        # The other nodes are not running, there is nobody to gossip with
+        with mock.patch.object(Gossip, 'start'):
+            self.app = initialize(config)
+        self.engine = self.app[ENGINE_KEY]
+
+    def find_key(self, node_id):
+        return next(key for key in map(str, range(1000)) if self.engine.hash_ring.get_node_id(key) == node_id)
+
+    async def test_get_is_forwarded_to_the_owner(self):
+        key = self.find_key(1)
+        with mock.patch.object(AsyncNode, "get", return_value={key: "value"}) as get:
+            self.assertEqual(await self.engine.get_async(key), "value")
+        get.assert_called_once_with("node1", key, local=False)
+
+    async def test_get_many_queries_each_owner_once(self):
+        keys = [str(i) for i in range(100)]
+
+        async def get_many(node_ip, node_keys, local=False):
+            return {key: node_ip for key in node_keys}
+
+        with mock.patch.object(AsyncNode, "get_many", side_effect=get_many) as node_get_many:
+            values = await self.engine.get_many_async(keys)
+
+        # The keys owned by node 0 are not in its storage, so they do not exist
+        self.assertEqual(node_get_many.call_count, 2)
+        for key in keys:
+            owner = self.engine.hash_ring.get_node_id(key)
+            self.assertEqual(values.get(key), "node{}".format(owner) if owner else None)
+
+    async def test_direct_requests(self):
+        client = TestClient(TestServer(self.app))
+        await client.start_server()
+        self.addAsyncCleanup(client.close)
+
+        response = await client.get('/cluster')
+        self.assertEqual((await response.json())['nodes'], {'0': "node0", '1': "node1", '2': "node2"})
+
+        key, other_key = self.find_key(0), self.find_key(1)
+        response = await client.post('/put', params={'direct': 'true'}, data=json.dumps({key: "value"}))
+        self.assertEqual(response.status, 200)
+        response = await client.get('/get/' + key, params={'direct': 'true'})
+        self.assertEqual(await response.json(), {key: "value"})
+        response = await client.get('/get/' + other_key, params={'direct': 'true'})
+        self.assertEqual(response.status, 421)
+        response = await client.post('/mget', params={'direct': 'true'}, data=json.dumps([key, other_key]))
+        self.assertEqual(response.status, 421)
+
+    async def test_put_many_forwards_each_partition(self):
+        data = {str(i): i for i in range(100)}
+        with mock.patch.object(AsyncNode, "put_batch") as put_batch:
+            await self.engine.put_many_async(data)
+
+        forwarded = {}
+        for (node_ip, partition), _ in put_batch.call_args_list:
+            forwarded.update(partition)
+        self.assertEqual(put_batch.call_count, 2)
+        self.assertEqual({**forwarded, **self.engine.storage.data}, data)
+
+    async def test_put_many_forwards_the_ttl(self):
+        self.engine.storage = CappedStore()
+        self.addCleanup(self.engine.storage.close)
+        data = {str(i): i for i in range(100)}
+        with mock.patch.object(AsyncNode, "put_batch") as put_batch:
+            await self.engine.put_many_async(data, ttl=30)
+
+        for _, kwargs in put_batch.call_args_list:
+            self.assertEqual(kwargs['ttl'], 30)
+        for key in self.engine.hash_ring.get_node_ids(data)[0]:
+            self.assertAlmostEqual(self.engine.storage.expiration_time(key), time.time() + 30, delta=1)
+
+    async def test_local_writes_are_stored_outside_of_the_event_loop(self):
+        threads = []
+        put_batch = self.engine.storage.put_batch
+
+        def record_thread(data, **kwargs):
+            threads.append(threading.current_thread())
+            put_batch(data, **kwargs)
+
+        with mock.patch.object(self.engine.storage, "put_batch", side_effect=record_thread), \
+                mock.patch.object(AsyncNode, "put_batch"):
+            await self.engine.put_async(self.find_key(0), "value")
+            await self.engine.put_many_async({str(i): i for i in range(1000, 1100)})
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertEqual(self.engine.storage.get(self.find_key(0)), "value")
+
+
+class AsyncNodeTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_put_batch_splits_large_batches(self):
+        data = {str(i): i for i in range(2500)}
+        with mock.patch("thunderdb.compute.async_node.BATCH_SIZE", 1000), \
+                mock.patch.object(AsyncNode, "_issue_request") as issue_request:
+            await AsyncNode.put_batch("node1", data)
+
+        self.assertEqual(issue_request.call_count, 3)
+        sent = {}
+        for (method, url, body), _ in issue_request.call_args_list:
+            self.assertEqual((method, url), ('POST', "http://node1/batch-put"))
+            sent.update(json.loads(body))
+        self.assertEqual(sent, data)
+
+
+if __name__ == '__main__':
+    unittest.main()
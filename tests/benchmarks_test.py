@@ -0,0 +1,60 @@
+import unittest
+
+import numpy
+
+from benchmarks import micro
+from benchmarks.common import ZipfianGenerator, summarize_latencies, compare_reports
+
+
+class ZipfianGeneratorTestCase(unittest.TestCase):
+    def test_ranks_are_skewed(self):
+        ranks = ZipfianGenerator(1000).draw(100000)
+        self.assertTrue(((ranks >= 0) & (ranks < 1000)).all())
+        counts = numpy.bincount(ranks, minlength=1000)
+        self.assertGreater(numpy.sort(counts)[-10:].sum(), 0.3 * len(ranks))
+
+    def test_uniform_ranks(self):
+        counts = numpy.bincount(ZipfianGenerator(10, theta=0).draw(100000), minlength=10)
+        self.assertLess(counts.max() - counts.min(), 0.1 * counts.mean())
+
+    def test_streams_share_the_hottest_keys(self):
+        first, second = ZipfianGenerator(1000, stream=1), ZipfianGenerator(1000, stream=2)
+        numpy.testing.assert_array_equal(ZipfianGenerator(1000, stream=1).draw(100), first.draw(100))
+        self.assertFalse((first.draw(100) == second.draw(100)).all())
+        hottest = [numpy.bincount(generator.draw(10000)).argmax() for generator in (first, second)]
+        self.assertEqual(hottest[0], hottest[1])
+
+
+class ReportTestCase(unittest.TestCase):
+    def test_summarize_latencies(self):
+        summary = summarize_latencies([0.001] * 99 + [0.1], 2.0)
+        self.assertEqual(summary['operations'], 100)
+        self.assertEqual(summary['ops_per_second'], 50)
+        self.assertAlmostEqual(summary['p50_us'], 1000)
+        self.assertGreater(summary['p999_us'], summary['p99_us'])
+
+    def test_compare_reports(self):
+        baseline = {'results': {'get': {'ops_per_second': 1000, 'p99_us': 100, 'operations': 10},
+                                'removed': {'ops_per_second': 1}}}
+        current = {'results': {'get': {'ops_per_second': 850, 'p99_us': 90, 'operations': 5},
+                               'added': {'ops_per_second': 1}}}
+        comparisons = {(name, metric): (change, is_regression)
+                       for name, metric, _, _, change, is_regression in compare_reports(baseline, current, 0.1)}
+        self.assertEqual(set(comparisons), {('get', 'ops_per_second'), ('get', 'p99_us')})
+        self.assertAlmostEqual(comparisons['get', 'ops_per_second'][0], -0.15)
+        self.assertTrue(comparisons['get', 'ops_per_second'][1])
+        self.assertAlmostEqual(comparisons['get', 'p99_us'][0], 0.1)
+        self.assertFalse(comparisons['get', 'p99_us'][1])
+
+
+class MicroBenchmarksTestCase(unittest.TestCase):
+    def test_every_benchmark_runs(self):
+        results = micro.run(num_keys=1000, repetitions=1)
+        self.assertEqual(set(results), set(micro.BENCHMARKS))
+        for summary in results.values():
+            self.assertGreater(summary['ops_per_second'], 0)
+            self.assertIn('p999_us', summary)
+
+
+if __name__ == '__main__':
+    unittest.main()
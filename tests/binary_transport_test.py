@@ -0,0 +1,171 @@
+import concurrent.futures
+import threading
+import unittest
+from unittest import mock
+
+from thunderdb.config import Config
+from thunderdb.compute.async_node import AsyncNode
+from thunderdb.compute.engine import Engine
+from thunderdb.compute.node import Node
+from thunderdb.compute.replication import ACK_QUORUM
+from thunderdb.compute.transport import BinaryTransport, get_peer_address
+from thunderdb.exceptions.errors import KeyValueStoreException, ServiceError
+from thunderdb.networking import binary_protocol as protocol
+from thunderdb.networking.binary_server import BinaryServer
+
+
+class BinaryProtocolTestCase(unittest.TestCase):
+    def test_strings_round_trip(self):
+        for strings in ([], [""], ["", ""], ["foo", "bär", "\U0001F600"], ["lone \ud800 surrogate", "x"]):
+            encoded = protocol.encode_strings(strings)
+            self.assertEqual(protocol.decode_strings(encoded), (strings, len(encoded)))
+
+    def test_items_round_trip(self):
+        for data in ({}, {"": ""}, {"foo": "bar", "bär": "\U0001F600"},
+                     {"number": 1, "list": [1, "a"], "none": None, "string": "1"}):
+            encoded = protocol.encode_items(data)
+            self.assertEqual(protocol.decode_items(encoded), (data, len(encoded)))
+
+    def test_sections_are_chained(self):
+        payload = protocol.encode_strings(["cursor"]) + protocol.encode_items({"a": "b"})
+        strings, offset = protocol.decode_strings(payload)
+        self.assertEqual(strings, ["cursor"])
+        self.assertEqual(protocol.decode_items(payload, offset), ({"a": "b"}, len(payload)))
+
+    def test_malformed_section(self):
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.decode_strings(protocol.STRINGS_HEADER.pack(3, 3) + b"a\xffb")
+
+    def test_peer_address(self):
+        self.assertEqual(get_peer_address("localhost"), ("localhost", 1080))
+        self.assertEqual(get_peer_address("10.0.0.2:8091", port_offset=10), ("10.0.0.2", 8101))
+
+
+class BinaryTransportTestCase(unittest.TestCase):
+    def setUp(self):
+        config = Config(0, "localhost", 0, "localhost")
+        self.engine = Engine(config)
+        self.server = BinaryServer(self.engine, host="127.0.0.1").start()
+        self.addCleanup(self.server.close)
+        self.transport = BinaryTransport(port_offset=self.server.port - 80, max_retries=0)
+        self.addCleanup(self.transport.close)
+        self.node_ip = "127.0.0.1"
+
+    def test_ping(self):
+        self.transport.ping(self.node_ip)
+
+    def test_put_and_get(self):
+        self.transport.put(self.node_ip, "foo", "bar")
+        self.assertEqual(self.transport.get(self.node_ip, "foo"), {"foo": "bar"})
+        self.assertEqual(self.transport.get(self.node_ip, "missing"), {})
+
+    def test_batches_are_split_into_frames(self):
+        data = {str(i): str(i) for i in range(25)}
+        with mock.patch("thunderdb.compute.transport.FRAME_BATCH_SIZE", 10):
+            self.transport.put_batch(self.node_ip, data)
+        self.assertEqual(self.transport.get_many(self.node_ip, list(data) + ["missing"]), data)
+
+    def test_put_batch_without_overwrite(self):
+        self.transport.put_batch(self.node_ip, {"a": "1"})
+        self.transport.put_batch(self.node_ip, {"a": "2", "b": "2"}, overwrite=False, ack=ACK_QUORUM)
+        self.assertEqual(self.engine.snapshot(), {"a": "1", "b": "2"})
+
+    def test_replicate_and_invalidate(self):
+        self.transport.replicate_batch(self.node_ip, {"a": [1, 2]})
+        self.assertEqual(self.engine.storage.get("a"), [1, 2])
+        with mock.patch.object(self.engine, "invalidate") as invalidate:
+            self.transport.invalidate(self.node_ip, ["a", "b"])
+        invalidate.assert_called_once_with(["a", "b"])
+
+    def test_scan(self):
+        data = {"key{:02}".format(i): str(i) for i in range(30)}
+        self.engine.put_many(data)
+        scanned, cursor = {}, None
+        while True:
+            page, cursor = self.transport.scan(self.node_ip, cursor, limit=7, start="key05", end="key25")
+            scanned.update(page)
+            if cursor is None:
+                break
+        self.assertEqual(scanned, {key: value for key, value in data.items() if "key05" <= key < "key25"})
+
+    def test_range_scan(self):
+        data = {"key{:02}".format(i): str(i) for i in range(30)}
+        self.engine.put_many(data)
+        items, cursor = self.transport.range_scan(self.node_ip, "key05", "key25", limit=7, cursor="key10")
+        self.assertEqual(items, [("key{:02}".format(i), str(i)) for i in range(11, 18)])
+        self.assertEqual(cursor, "key17")
+
+    def test_pipelined_requests_are_answered_out_of_order(self):
+        release = threading.Event()
+        get_many = self.engine.get_many
+
+        def slow_get_many(keys, local=False):
+            if keys == ["slow"]:
+                release.wait(5)
+            return get_many(keys, local)
+
+        self.transport.put(self.node_ip, "fast", "value")
+        with mock.patch.object(self.engine, "get_many", side_effect=slow_get_many):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                slow = executor.submit(self.transport.get, self.node_ip, "slow")
+                self.assertEqual(self.transport.get(self.node_ip, "fast"), {"fast": "value"})
+                self.assertFalse(slow.done())
+                release.set()
+                self.assertEqual(slow.result(5), {})
+        self.assertEqual(len(self.transport._connections), 1)
+
+    def test_errors_are_raised(self):
+        with mock.patch.object(self.engine, "get_many", side_effect=ValueError("broken")), \
+                mock.patch("traceback.print_exc"):
+            with self.assertRaises(ServiceError) as context:
+                self.transport.get(self.node_ip, "foo")
+        self.assertIn("broken", context.exception.kwargs["response"])
+        self.assertFalse(context.exception.kwargs["rejected"])
+        self.transport.ping(self.node_ip)
+
+    def test_invalid_requests_are_rejected(self):
+        with mock.patch.object(self.engine, "put_many", side_effect=KeyValueStoreException("Too large")), \
+                mock.patch("traceback.print_exc"):
+            with self.assertRaises(ServiceError) as context:
+                self.transport.put_batch(self.node_ip, {"foo": "bar"})
+        self.assertTrue(context.exception.kwargs["rejected"])
+
+    def test_reconnects_after_the_connection_is_lost(self):
+        self.transport.ping(self.node_ip)
+        next(iter(self.transport._connections.values())).close()
+        self.transport.ping(self.node_ip)
+
+    def test_unreachable_peer(self):
+        self.server.close()
+        with self.assertRaises(ServiceError):
+            self.transport.ping(self.node_ip)
+
+    def test_node_delegates_to_the_transport(self):
+        Node.configure_transport(self.transport)
+        self.addCleanup(setattr, Node, "transport", None)
+        Node.put_batch(self.node_ip, {"a": "1", "b": "2"})
+        self.assertEqual(Node.get_many(self.node_ip, ["a", "b"]), {"a": "1", "b": "2"})
+        self.assertEqual(Node.scan(self.node_ip), ({"a": "1", "b": "2"}, None))
+
+
+class AsyncBinaryTransportTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = Engine(Config(0, "localhost", 0, "localhost"))
+        self.server = BinaryServer(self.engine, host="127.0.0.1").start()
+        self.transport = BinaryTransport(port_offset=self.server.port - 80, max_retries=0)
+        Node.transport = self.transport
+
+    async def asyncTearDown(self):
+        Node.transport = None
+        self.transport.close()
+        self.server.close()
+
+    async def test_async_node_delegates_to_the_transport(self):
+        await AsyncNode.put("127.0.0.1", "foo", "bar")
+        await AsyncNode.put_batch("127.0.0.1", {"a": "1"})
+        self.assertEqual(await AsyncNode.get("127.0.0.1", "foo"), {"foo": "bar"})
+        self.assertEqual(await AsyncNode.get_many("127.0.0.1", ["a", "missing"]), {"a": "1"})
+
+
+if __name__ == '__main__':
+    unittest.main()
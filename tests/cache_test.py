@@ -0,0 +1,135 @@
+import time
+import unittest
+from unittest import mock
+
+from thunderdb.config import Config
+from thunderdb.compute.cache import ReadCache
+from thunderdb.compute.engine import Engine
+from thunderdb.compute.node import Node
+
+
+def create_engine(node_id=0, num_nodes=3, cache=None):
+    config = Config(node_id, "node{}".format(node_id), (node_id + 1) % num_nodes,
+                    "node{}".format((node_id + 1) % num_nodes), replication_factor=1)
+    config.add({n: "node{}".format(n) for n in range(num_nodes)})
+    return Engine(config, cache=cache)
+
+
+def find_key(engine, node_id):
+    return next(key for key in map(str, range(1000)) if engine.hash_ring.get_node_id(key) == node_id)
+
+
+class ReadCacheTestCase(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = ReadCache()
+        self.assertIsNone(cache.get("foo"))
+        cache.put("foo", "bar", cache.generation)
+        self.assertEqual(cache.get("foo"), "bar")
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ReadCache(max_entries=2)
+        cache.put("a", "1", 0)
+        cache.put("b", "2", 0)
+        cache.get("a")
+        cache.put("c", "3", 0)
+        self.assertEqual(cache.get("a"), "1")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "3")
+        self.assertEqual(cache.evictions, 1)
+
+    def test_size_is_bounded_in_bytes(self):
+        cache = ReadCache(max_bytes=2000)
+        for i in range(100):
+            cache.put(str(i), "x" * 100, 0)
+        self.assertLessEqual(cache.size_bytes, 2000)
+        self.assertLess(len(cache), 100)
+        self.assertEqual(cache.get("99"), "x" * 100)
+
+        cache.put("big", "x" * 5000, 0)
+        self.assertIsNone(cache.get("big"))
+
+    def test_entries_expire(self):
+        cache = ReadCache(ttl=10)
+        cache.put("foo", "bar", 0)
+        with mock.patch("time.time", return_value=time.time() + 11):
+            self.assertIsNone(cache.get("foo"))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size_bytes, 0)
+
+    def test_fills_older_than_an_invalidation_are_dropped(self):
+        cache = ReadCache()
+        generation = cache.generation
+        cache.invalidate(["foo"])
+        cache.put("foo", "stale", generation)
+        self.assertIsNone(cache.get("foo"))
+
+        cache.put("bar", "fresh", generation)
+        self.assertEqual(cache.get("bar"), "fresh")
+
+        cache.put("foo", "fresh", cache.generation)
+        self.assertEqual(cache.get("foo"), "fresh")
+        cache.invalidate(["foo"])
+        self.assertIsNone(cache.get("foo"))
+        self.assertEqual(cache.invalidations, 1)
+
+
+class EngineReadCacheTestCase(unittest.TestCase):
+    def test_remote_reads_are_cached(self):
+        engine = create_engine(cache=ReadCache())
+        key = find_key(engine, 1)
+        with mock.patch.object(Node, "get", return_value={key: "value"}) as get:
+            self.assertEqual(engine.get(key), "value")
+            self.assertEqual(engine.get(key), "value")
+            self.assertEqual(engine.get_many([key]), {key: "value"})
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(engine.cache.hits, 2)
+
+    def test_get_many_fills_the_cache(self):
+        engine = create_engine(cache=ReadCache())
+        keys = [find_key(engine, 1), find_key(engine, 2)]
+        with mock.patch.object(Node, "get_many", side_effect=lambda ip, keys, local: {k: "v" for k in keys}):
+            self.assertEqual(engine.get_many(keys), {key: "v" for key in keys})
+        with mock.patch.object(Node, "get") as get:
+            self.assertEqual(engine.get(keys[0]), "v")
+        get.assert_not_called()
+
+    def test_owner_invalidates_overwritten_keys(self):
+        engine = create_engine(cache=ReadCache())
+        key = find_key(engine, 0)
+        with mock.patch.object(Node, "invalidate") as invalidate:
+            engine.put(key, "first")
+            engine.put(key, "second")
+            self.assertTrue(engine.invalidations.flush(5))
+        self.assertEqual(sorted(ip for (ip, keys), _ in invalidate.call_args_list), ["node1", "node2"])
+        for (ip, keys), _ in invalidate.call_args_list:
+            self.assertEqual(list(keys), [key])
+
+    def test_forwarded_writes_drop_the_cached_value(self):
+        engine = create_engine(cache=ReadCache())
+        key = find_key(engine, 1)
+        engine.cache.put(key, "old", 0)
+        with mock.patch.object(Node, "put"):
+            engine.put(key, "new")
+        self.assertIsNone(engine.cache.get(key))
+
+    def test_owner_without_a_cache_invalidates_the_caches_of_its_peers(self):
+        owner = create_engine()
+        peer = create_engine(node_id=1, cache=ReadCache())
+        key = find_key(owner, 0)
+        owner.put(key, "first")
+        with mock.patch.object(Node, "get", side_effect=lambda ip, key, local=False: {key: owner.get(key)}):
+            self.assertEqual(peer.get(key), "first")
+
+        def invalidate(ip, keys):
+            if ip == "node1":
+                peer.invalidate(keys)
+        with mock.patch.object(Node, "invalidate", side_effect=invalidate):
+            owner.put(key, "second")
+            self.assertTrue(owner.invalidations.flush(5))
+        self.assertIsNone(peer.cache.get(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import socket
+import threading
+import unittest
+from socketserver import ThreadingMixIn
+from unittest import mock
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+from thunderdb.client import ThunderDBClient
+from thunderdb.compute.gossip import Gossip
+from thunderdb.compute.node import Node
+from thunderdb.config import Config
+from thunderdb.exceptions.errors import ServiceError
+from thunderdb.hashing.consistent_hashing import ConsistentHash
+from thunderdb.networking.http_server import initialize
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ThunderDBClientTestCase(unittest.TestCase):
+    def setUp(self):
+        # Both nodes know of each other from their configuration, and stop after the test
+        patcher = mock.patch.object(Gossip, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addresses = ['127.0.0.1:{}'.format(get_free_port()) for _ in range(2)]
+        self.servers = []
+        self.apps = []
+        for node_id, address in enumerate(self.addresses):
+            config = Config(node_id, address, 1 - node_id, self.addresses[1 - node_id], replication_factor=1)
+            app = initialize(config)
+            server = make_server('127.0.0.1', int(address.split(':')[1]), app,
+                                 server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+            self.apps.append(app)
+
+        self.client = ThunderDBClient(self.addresses[:1])
+        # The nodes must not forward any request of the client
+        for name in ('get', 'get_many', 'put', 'put_batch'):
+            patcher = mock.patch.object(Node, name, side_effect=AssertionError("The request was forwarded"))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.client.close()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def find_key(self, node_id):
+        return next(key for key in map(str, range(1000)) if self.client.hash_ring.get_node_id(key) == node_id)
+
+    def test_membership_is_fetched_from_the_seed(self):
+        self.assertEqual(self.client.nodes, {0: self.addresses[0], 1: self.addresses[1]})
+        self.assertEqual(self.client.owner(self.find_key(1)), self.addresses[1])
+
+    def test_put_and_get(self):
+        for node_id in (0, 1):
+            key = self.find_key(node_id)
+            self.client.put(key, "value")
+            self.assertEqual(self.client.get(key), "value")
+        self.assertIsNone(self.client.get("missing key"))
+
+    def test_put_many_and_get_many(self):
+        data = {str(i): "value{}".format(i) for i in range(200)}
+        self.client.put_many(data)
+        self.assertEqual(self.client.get_many(list(data) + ["missing"]), data)
+
+        self.client.put_many({"0": "other", "new": "value"}, overwrite=False)
+        self.assertEqual(self.client.get_many(["0", "new"]), {"0": "value0", "new": "value"})
+
+    def test_stale_ring_is_refreshed(self):
+        key = self.find_key(1)
+        self.client.put(key, "value")
+
+        # The client only knows about the first node, as if the second one just joined
+        self.client.nodes, self.client.hash_ring = {0: self.addresses[0]}, ConsistentHash(1, 1)
+        self.assertEqual(self.client.get(key), "value")
+        self.assertEqual(len(self.client.nodes), 2)
+
+        self.client.nodes, self.client.hash_ring = {0: self.addresses[0]}, ConsistentHash(1, 1)
+        self.assertEqual(self.client.get_many([key, self.find_key(0)]), {key: "value"})
+
+    def test_unreachable_seed_is_skipped(self):
+        with ThunderDBClient(['127.0.0.1:{}'.format(get_free_port())] + self.addresses[1:],
+                             max_retries=0) as client:
+            self.assertEqual(len(client.nodes), 2)
+
+        with self.assertRaises(ServiceError):
+            ThunderDBClient('127.0.0.1:{}'.format(get_free_port()), max_retries=0)
+
+    def test_address_map(self):
+        client = ThunderDBClient(self.addresses[:1], address_map={self.addresses[1]: 'localhost:1'})
+        self.addCleanup(client.close)
+        self.assertEqual(client.nodes[1], 'localhost:1')
+
+    def test_requires_an_address(self):
+        with self.assertRaises(ValueError):
+            ThunderDBClient([])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,317 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+import unittest
+from unittest import mock
+
+from thunderdb.config import Config
+from thunderdb.compute.async_node import AsyncNode
+from thunderdb.compute import batching
+from thunderdb.compute.coalescing import SingleFlight, WriteCoalescer, WriteBuffer, DURABILITY_BUFFERED
+from thunderdb.compute.engine import Engine
+from thunderdb.compute.node import Node
+from thunderdb.compute.replication import ACK_QUORUM
+from thunderdb.exceptions.errors import ServiceError
+
+
+def create_engine(num_nodes=2, **options):
+    config = Config(0, "node0", 1, "node1", **options)
+    config.add({n: "node{}".format(n) for n in range(num_nodes)})
+    return Engine(config)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("The condition was not met in time")
+        time.sleep(0.001)
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def test_concurrent_calls_share_a_single_call(self):
+        flight = SingleFlight('test')
+        release = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            release.wait()
+            return "value"
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(flight.do, "key", call) for _ in range(8)]
+            wait_until(lambda: len(calls) == 1)
+            time.sleep(0.05)
+            release.set()
+            self.assertEqual([future.result() for future in futures], ["value"] * 8)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(flight), 0)
+        self.assertEqual(flight.do("key", lambda: "new value"), "new value")
+
+    def test_exceptions_are_shared(self):
+        flight = SingleFlight('test')
+        release = threading.Event()
+
+        def call():
+            release.wait()
+            raise ServiceError("Request failed")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(flight.do, "key", call) for _ in range(4)]
+            wait_until(lambda: len(flight) == 1)
+            release.set()
+            for future in futures:
+                with self.assertRaises(ServiceError):
+                    future.result()
+
+    def test_forgotten_calls_are_not_joined(self):
+        flight = SingleFlight('test')
+        release = threading.Event()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            stale = executor.submit(flight.do, "key", lambda: release.wait() and "stale")
+            wait_until(lambda: len(flight) == 1)
+            flight.forget("key")
+            self.assertEqual(flight.do("key", lambda: "fresh"), "fresh")
+            release.set()
+            self.assertEqual(stale.result(), "stale")
+
+    def test_coroutines_share_a_single_call(self):
+        flight = SingleFlight('test')
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "value"
+
+        async def run():
+            return await asyncio.gather(*(flight.do_async("key", call) for _ in range(10)))
+
+        self.assertEqual(asyncio.run(run()), ["value"] * 10)
+        self.assertEqual(len(calls), 1)
+
+
+class WriteCoalescerTestCase(unittest.TestCase):
+    def test_writes_sent_while_a_batch_is_in_flight_are_sent_together(self):
+        release = threading.Event()
+        batches = []
+
+        def send(peer, data, overwrite, ack, ttl):
+            batches.append((peer, dict(data)))
+            release.wait()
+
+        coalescer = WriteCoalescer(send, None)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            first = executor.submit(coalescer.submit, "node1", {"key": "0"})
+            wait_until(lambda: len(batches) == 1)
+            others = [executor.submit(coalescer.submit, "node1", {"key": str(i), str(i): "value"})
+                      for i in range(1, 8)]
+            time.sleep(0.05)
+            self.assertEqual(len(batches), 1)
+            release.set()
+            for future in [first] + others:
+                future.result()
+
+        self.assertEqual(len(batches), 2)
+        peer, data = batches[1]
+        self.assertEqual(peer, "node1")
+        self.assertEqual(len(data), 8)
+        self.assertIn(data["key"], [str(i) for i in range(1, 8)])
+
+    def test_failures_are_raised_to_every_writer_of_the_batch(self):
+        coalescer = WriteCoalescer(mock.Mock(side_effect=ServiceError("Request failed")), None)
+        with self.assertRaises(ServiceError):
+            coalescer.submit("node1", {"key": "value"})
+        self.assertEqual(coalescer._open, {})
+        self.assertEqual(coalescer._in_flight, {})
+
+
+class WriteBufferTestCase(unittest.TestCase):
+    def create_buffer(self, send, **kwargs):
+        buffer = WriteBuffer(send, **kwargs)
+        self.addCleanup(buffer.close)
+        return buffer
+
+    def test_writes_buffered_during_a_send_are_sent_together(self):
+        release = threading.Event()
+        batches = []
+
+        def send(peer, data):
+            batches.append((peer, dict(data)))
+            release.wait()
+
+        buffer = self.create_buffer(send)
+        buffer.submit("node1", {"key": "0"})
+        wait_until(lambda: len(batches) == 1)
+        for i in range(1, 8):
+            buffer.submit("node1", {"key": str(i), str(i): "value"})
+        buffer.submit("node2", {"other": "value"})
+        self.assertEqual(buffer.get("node1", "key"), "7")
+        self.assertIsNone(buffer.get("node2", "key"))
+        release.set()
+        buffer.flush("node1")
+        buffer.flush("node2")
+
+        self.assertEqual([data for peer, data in batches if peer == "node1"],
+                         [{"key": "0"}, dict({"key": "7"}, **{str(i): "value" for i in range(1, 8)})])
+        self.assertIn(("node2", {"other": "value"}), batches)
+        self.assertEqual(buffer.stats()["node1"]["pending"], 0)
+
+    def test_flush_fails_when_the_writes_cannot_be_sent(self):
+        with mock.patch.object(batching, "RETRY_DELAY", 0.01), mock.patch("traceback.print_exc"):
+            buffer = self.create_buffer(mock.Mock(side_effect=ServiceError("Request failed")), flush_timeout=0.1)
+            buffer.submit("node1", {"key": "value"})
+            with self.assertRaises(ServiceError):
+                buffer.flush("node1")
+            self.assertEqual(buffer.get("node1", "key"), "value")
+            buffer.send = mock.Mock()
+            buffer.flush("node1")
+
+
+class BufferedEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine(write_durability=DURABILITY_BUFFERED)
+        self.addCleanup(self.engine.buffer.close)
+        self.keys = [key for key in map(str, range(1000)) if self.engine.hash_ring.get_node_id(key) == 1][:10]
+
+    def test_unknown_durability(self):
+        with self.assertRaises(ValueError):
+            create_engine(write_durability="eventually")
+
+    def test_writes_are_acknowledged_once_buffered_and_read_back(self):
+        release = threading.Event()
+        with mock.patch.object(Node, "put", side_effect=lambda *args, **kwargs: release.wait()) as put, \
+                mock.patch.object(Node, "put_batch") as put_batch, mock.patch.object(Node, "get") as get:
+            self.engine.put(self.keys[0], "value")
+            wait_until(lambda: put.call_count == 1)
+            self.engine.put_many({key: "other" for key in self.keys[1:]})
+            self.assertEqual(self.engine.get(self.keys[0]), "value")
+            self.assertEqual(self.engine.get_many(self.keys), dict({self.keys[0]: "value"},
+                                                                   **{key: "other" for key in self.keys[1:]}))
+            get.assert_not_called()
+            release.set()
+            self.engine.buffer.flush("node1")
+        put.assert_called_once_with("node1", self.keys[0], "value", ack=None)
+        put_batch.assert_called_once_with("node1", {key: "other" for key in self.keys[1:]}, overwrite=True, ack=None)
+
+    def test_acknowledged_writes_wait_for_the_buffered_writes(self):
+        calls = []
+        with mock.patch.object(Node, "put", side_effect=lambda node_ip, key, value, **options: calls.append(value)):
+            self.engine.put(self.keys[0], "buffered")
+            self.engine.put(self.keys[0], "acknowledged", ack=ACK_QUORUM)
+        self.assertEqual(calls, ["buffered", "acknowledged"])
+
+    def test_async_writes_are_buffered(self):
+        async def run():
+            await asyncio.gather(*(self.engine.put_async(self.keys[0], str(i)) for i in range(10)))
+            return await self.engine.get_async(self.keys[0])
+
+        # The writes are not sent before the read, which would go to the owner once the buffer sent them
+        release = threading.Event()
+        with mock.patch.object(Node, "put", side_effect=lambda *args, **kwargs: release.wait()) as put, \
+                mock.patch.object(AsyncNode, "put") as async_put:
+            self.assertEqual(asyncio.run(run()), "9")
+            release.set()
+            self.engine.buffer.flush("node1")
+        async_put.assert_not_called()
+        self.assertEqual(put.call_args[0], ("node1", self.keys[0], "9"))
+
+
+class EngineCoalescingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine()
+        self.key = next(key for key in map(str, range(1000)) if self.engine.hash_ring.get_node_id(key) == 1)
+
+    def test_concurrent_forwarded_reads_share_a_request(self):
+        release = threading.Event()
+
+        def get(node_ip, key, local=False):
+            release.wait()
+            return {key: "value"}
+
+        with mock.patch.object(Node, "get", side_effect=get) as node_get, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(self.engine.get, self.key) for _ in range(8)]
+            wait_until(lambda: node_get.call_count == 1)
+            time.sleep(0.05)
+            release.set()
+            self.assertEqual([future.result() for future in futures], ["value"] * 8)
+        node_get.assert_called_once_with("node1", self.key, local=False)
+
+    def test_reads_after_a_write_do_not_join_an_earlier_read(self):
+        release = threading.Event()
+        values = iter(["before", "after"])
+
+        def get(node_ip, key, local=False):
+            value = next(values)
+            if value == "before":
+                release.wait()
+            return {key: value}
+
+        with mock.patch.object(Node, "get", side_effect=get), mock.patch.object(Node, "put"), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            before = executor.submit(self.engine.get, self.key)
+            wait_until(lambda: len(self.engine.reads) == 1)
+            self.engine.put(self.key, "after")
+            self.assertEqual(self.engine.get(self.key), "after")
+            release.set()
+            self.assertEqual(before.result(), "before")
+
+    def test_reads_after_a_write_do_not_join_a_read_issued_during_the_write(self):
+        release = threading.Event()
+        written = threading.Event()
+
+        def get(node_ip, key, local=False):
+            value = "after" if written.is_set() else "before"
+            if value == "before":
+                release.wait(5)
+            return {key: value}
+
+        with mock.patch.object(Node, "get", side_effect=get), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            during = []
+
+            def put(*args, **kwargs):
+                during.append(executor.submit(self.engine.get, self.key))
+                wait_until(lambda: len(self.engine.reads) == 1)
+
+            with mock.patch.object(Node, "put", side_effect=put):
+                self.engine.put(self.key, "after")
+            written.set()
+            self.assertEqual(self.engine.get(self.key), "after")
+            release.set()
+            self.assertEqual(during[0].result(), "before")
+
+    def test_concurrent_async_reads_share_a_request(self):
+        async def get(node_ip, key, local=False):
+            await asyncio.sleep(0.01)
+            return {key: "value"}
+
+        async def run():
+            return await asyncio.gather(*(self.engine.get_async(self.key) for _ in range(10)))
+
+        with mock.patch.object(AsyncNode, "get", side_effect=get) as node_get:
+            self.assertEqual(asyncio.run(run()), ["value"] * 10)
+        self.assertEqual(node_get.call_count, 1)
+
+    def test_concurrent_async_writes_are_batched(self):
+        async def put(node_ip, key, value, ack=None):
+            await asyncio.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(*(self.engine.put_async(self.key, str(i)) for i in range(10)))
+
+        with mock.patch.object(AsyncNode, "put", side_effect=put) as put, \
+                mock.patch.object(AsyncNode, "put_batch") as put_batch:
+            asyncio.run(run())
+        # The first write is sent on its own, and the others once it completed, with the latest value
+        self.assertEqual(put.call_count, 2)
+        put_batch.assert_not_called()
+        self.assertEqual(put.call_args_list[1][0], ("node1", self.key, "9"))
+
+
+if __name__ == '__main__':
+    unittest.main()
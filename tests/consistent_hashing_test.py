@@ -0,0 +1,116 @@
+import unittest
+from thunderdb.hashing.consistent_hashing import ConsistentHash
+
+
+SAMPLE_DATA_FILE = "sample_data/data_demo_10000.txt"
+
+
+def load_sample_keys():
+    with open(SAMPLE_DATA_FILE) as data_file:
+        return [line.split(" ")[0] for line in data_file]
+
+
+class ConsistentHashTestCase(unittest.TestCase):
+    def test_ring_has_one_point_per_virtual_node(self):
+        ring = ConsistentHash(3, num_virtual_nodes=16)
+        self.assertEqual(len(ring.ring_hashes), 3 * 16)
+        self.assertEqual(ring.ring_hashes, sorted(ring.ring_hashes))
+        self.assertEqual(set(ring.ring_nodes), {0, 1, 2})
+
+    def test_single_node_owns_every_key(self):
+        ring = ConsistentHash(1)
+        for key in ["foo", "bar", "", "d6b250e3-9480-4ed5-a4b7-5d8b28bc75da"]:
+            self.assertEqual(ring.get_node_id(key), 0)
+
+    def test_lookup_is_deterministic_across_instances(self):
+        keys = load_sample_keys()[:1000]
+        first, second = ConsistentHash(4), ConsistentHash(4)
+        self.assertEqual([first.get_node_id(k) for k in keys],
+                         [second.get_node_id(k) for k in keys])
+
+    def test_keys_past_the_last_point_wrap_around(self):
+        ring = ConsistentHash(3, num_virtual_nodes=1)
+        ring.ring_hashes = [10, 20, 30]
+        ring.ring_nodes = [2, 0, 1]
+        ring._hash = lambda key: int(key)
+        self.assertEqual(ring.get_node_id("5"), 2)
+        self.assertEqual(ring.get_node_id("20"), 0)
+        self.assertEqual(ring.get_node_id("31"), 2)
+
+    def test_virtual_nodes_balance_partitions(self):
+        keys = load_sample_keys()
+        for num_nodes in (3, 4, 5):
+            ring = ConsistentHash(num_nodes)
+            counts = [0] * num_nodes
+            for key in keys:
+                counts[ring.get_node_id(key)] += 1
+
+            expected = len(keys) / num_nodes
+            for count in counts:
+                self.assertLess(abs(count - expected) / expected, 0.25)
+
+    def test_batch_lookup_matches_scalar_lookup(self):
+        keys = load_sample_keys() + ["foo", "bar", "", "tenant123:user:42"]
+        for num_nodes, num_virtual_nodes in [(1, 1), (2, 1), (3, 128), (5, 64), (16, 256)]:
+            ring = ConsistentHash(num_nodes, num_virtual_nodes)
+            grouped_keys = ring.get_node_ids(keys)
+
+            self.assertEqual(sum(len(group) for group in grouped_keys.values()), len(keys))
+            for node_id, group in grouped_keys.items():
+                self.assertIsInstance(node_id, int)
+                self.assertEqual([ring.get_node_id(key) for key in group], [node_id] * len(group))
+
+    def test_batch_lookup_wraps_around_like_scalar_lookup(self):
+        ring = ConsistentHash(3, num_virtual_nodes=1)
+        last_point = ring.ring_hashes[-1]
+        keys = [str(i) for i in range(2000)]
+        wrapped = [key for key in keys if ring._hash(key) > last_point]
+
+        self.assertTrue(wrapped)
+        self.assertEqual(ring.get_node_ids(wrapped), {ring.ring_nodes[0]: wrapped})
+
+    def test_batch_lookup_preserves_input_order(self):
+        keys = load_sample_keys()[:500]
+        grouped_keys = ConsistentHash(3).get_node_ids(keys)
+        for group in grouped_keys.values():
+            self.assertEqual(group, sorted(group, key=keys.index))
+
+    def test_batch_lookup_of_no_keys(self):
+        self.assertEqual(ConsistentHash(3).get_node_ids([]), {})
+
+    def test_replicas_are_the_next_nodes(self):
+        ring = ConsistentHash(4)
+        self.assertEqual(ring.get_replica_node_ids(1, 3), [2, 3])
+        self.assertEqual(ring.get_replica_node_ids(3, 3), [0, 1])
+        self.assertEqual(ring.get_replica_node_ids(0, 1), [])
+        self.assertEqual(ring.get_replica_node_ids(0, 10), [1, 2, 3])
+
+    def test_moved_ranges_match_the_owners_of_both_rings(self):
+        keys = load_sample_keys()
+        previous_ring, ring = ConsistentHash(3), ConsistentHash(4)
+        moved_ranges = ring.get_moved_ranges(previous_ring)
+
+        def find_range(hash_value):
+            for start, end, previous_node_id, node_id in moved_ranges:
+                if start < hash_value <= end or (start > end and (hash_value > start or hash_value <= end)):
+                    return previous_node_id, node_id
+            return None
+
+        for key in keys:
+            previous_node_id, node_id = previous_ring.get_node_id(key), ring.get_node_id(key)
+            moved = find_range(ring._hash(key))
+            if previous_node_id == node_id:
+                self.assertIsNone(moved)
+            else:
+                self.assertEqual(moved, (previous_node_id, node_id))
+
+    def test_only_the_new_node_gains_ranges(self):
+        ring = ConsistentHash(4)
+        moved_ranges = ring.get_moved_ranges(ConsistentHash(3))
+        self.assertTrue(moved_ranges)
+        self.assertEqual({node_id for _, _, _, node_id in moved_ranges}, {3})
+        self.assertEqual(ring.get_moved_ranges(ConsistentHash(4)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+import time
+import unittest
+from unittest import mock
+
+from thunderdb.config import Config
+from thunderdb.compute.engine import Engine
+from thunderdb.compute.node import Node
+from thunderdb.exceptions.errors import KeyValueStoreException
+from thunderdb.hashing.consistent_hashing import ConsistentHash
+from thunderdb.storage.capped_store import CappedStore
+from thunderdb.storage.in_memory_store import InMemoryStore
+
+
+SAMPLE_DATA_FILE = "sample_data/data_demo_10000.txt"
+
+
+def load_sample_data(limit=None):
+    with open(SAMPLE_DATA_FILE) as data_file:
+        pairs = [line.split() for line in data_file]
+    return dict(pairs[:limit])
+
+
+def create_engine(node_id=0, num_nodes=1, replication_factor=1):
+    config = Config(node_id, "node{}".format(node_id), (node_id + 1) % num_nodes,
+                    "node{}".format((node_id + 1) % num_nodes), replication_factor=replication_factor)
+    config.add({n: "node{}".format(n) for n in range(num_nodes)})
+    return Engine(config)
+
+
+class EngineTestCase(unittest.TestCase):
+    def test_put_many_on_a_single_node(self):
+        engine = create_engine()
+        data = load_sample_data(1000)
+        engine.put_many(data)
+        self.assertEqual(engine.storage.data, data)
+
+    def test_put_many_sends_one_bulk_request_per_peer(self):
+        engine = create_engine(node_id=1, num_nodes=3)
+        data = load_sample_data(3000)
+
+        with mock.patch.object(Node, "put_batch") as put_batch:
+            engine.put_many(data)
+
+        self.assertEqual(put_batch.call_count, 2)
+        forwarded = {}
+        for (node_ip, partition), _ in put_batch.call_args_list:
+            self.assertIn(node_ip, ("node0", "node2"))
+            for key in partition:
+                self.assertEqual(engine.config.nodes[engine.hash_ring.get_node_id(key)], node_ip)
+            forwarded.update(partition)
+
+        for key in engine.storage.data:
+            self.assertEqual(engine.hash_ring.get_node_id(key), 1)
+        self.assertEqual({**forwarded, **engine.storage.data}, data)
+
+    def test_batch_put_loads_the_data_file(self):
+        engine = create_engine()
+        engine.batch_put(SAMPLE_DATA_FILE)
+        self.assertEqual(engine.storage.data, load_sample_data())
+
+    def test_redistribute_moves_keys_to_their_new_owner(self):
+        engine = create_engine(replication_factor=2)
+        data = load_sample_data(3000)
+        engine.put_many(data)
+        engine.config.add({1: "node1", 2: "node2"})
+
+        with mock.patch.object(Node, "put_batch") as put_batch, \
+                mock.patch.object(Node, "replicate_batch") as replicate_batch:
+            engine.redistribute()
+            engine.rebalancer.wait()
+
+        # The keys still owned by node 0 are copied to its new replica
+        replicated = {}
+        for (node_ip, partition), _ in replicate_batch.call_args_list:
+            self.assertEqual(node_ip, "node1")
+            replicated.update(partition)
+        self.assertEqual(set(replicated), set(engine.hash_ring.get_node_ids(data)[0]))
+
+        # Keys owned by node 2 have node 0 as their successor, so they stay as a replica
+        moved = {}
+        for (node_ip, partition), kwargs in put_batch.call_args_list:
+            self.assertEqual(kwargs, {'overwrite': False})
+            moved.update(partition)
+        for key, value in data.items():
+            owner = engine.hash_ring.get_node_id(key)
+            self.assertEqual(key in moved, owner != 0)
+            self.assertEqual(key in engine.storage.data, owner in (0, 2))
+
+    def test_redistribute_only_moves_the_ranges_which_changed_owner(self):
+        engine = create_engine(node_id=1, num_nodes=3)
+        data = load_sample_data(3000)
+        engine.storage.put_batch(data)
+        previous_ring = engine.hash_ring
+        engine.config.add({3: "node3"})
+
+        with mock.patch.object(Node, "put_batch") as put_batch:
+            engine.redistribute(previous_ring)
+            engine.rebalancer.wait()
+
+        for (node_ip, partition), _ in put_batch.call_args_list:
+            self.assertEqual(node_ip, "node3")
+            for key in partition:
+                self.assertEqual(previous_ring.get_node_id(key), 1)
+                self.assertEqual(engine.hash_ring.get_node_id(key), 3)
+
+    def test_get_falls_back_to_the_previous_owner_during_a_migration(self):
+        engine = create_engine(node_id=3, num_nodes=4)
+        previous_ring = ConsistentHash(3)
+        engine.rebalancer.previous_ring = previous_ring
+        data = load_sample_data(1000)
+        moved = [key for key in engine.hash_ring.get_node_ids(data).get(3, [])
+                 if previous_ring.get_node_id(key) != 3]
+
+        with mock.patch.object(Node, "get", return_value={moved[0]: "value"}) as get:
+            self.assertEqual(engine.get(moved[0]), "value")
+        get.assert_called_once_with(engine.config.nodes[previous_ring.get_node_id(moved[0])],
+                                    moved[0], local=True)
+
+        with mock.patch.object(Node, "get") as get:
+            self.assertIsNone(engine.get(moved[0], local=True))
+        get.assert_not_called()
+
+    def test_put_many_without_overwrite_keeps_existing_values(self):
+        engine = create_engine()
+        engine.put("foo", "bar")
+        engine.put_many({"foo": "baz", "qux": "quux"}, overwrite=False)
+        self.assertEqual(engine.storage.data, {"foo": "bar", "qux": "quux"})
+
+    def test_get_many_on_a_single_node(self):
+        engine = create_engine()
+        data = load_sample_data(100)
+        engine.put_many(data)
+
+        keys = list(data)[:50] + ["missing"]
+        self.assertEqual(engine.get_many(keys), {key: data[key] for key in keys[:50]})
+
+    def test_get_many_queries_each_owner_once(self):
+        engine = create_engine(node_id=0, num_nodes=3)
+        data = load_sample_data(300)
+        owners = engine.hash_ring.get_node_ids(data)
+        engine.storage.put_batch({key: data[key] for key in owners[0]})
+
+        def get_many(node_ip, keys, local=False):
+            self.assertEqual(set(keys), set(owners[int(node_ip[-1])]))
+            return {key: data[key] for key in keys}
+
+        with mock.patch.object(Node, "get_many", side_effect=get_many) as node_get_many:
+            self.assertEqual(engine.get_many(list(data)), data)
+        self.assertEqual(node_get_many.call_count, 2)
+
+    def test_range_scan_merges_the_pages_of_every_node(self):
+        engine = create_engine(node_id=0, num_nodes=3)
+        data = {"tenant1:{:03}".format(i): str(i) for i in range(100)}
+        data.update({"tenant2:a": "other"})
+        owners = engine.hash_ring.get_node_ids(data)
+        engine.storage.put_batch({key: data[key] for key in owners[0]})
+        # A stale copy of a key owned by another node, as left by a replication
+        stale_key = owners[1][0]
+        engine.storage.put(stale_key, "stale")
+
+        stores = {}
+        for node_id in (1, 2):
+            stores[node_id] = InMemoryStore()
+            stores[node_id].put_batch({key: data[key] for key in owners[node_id]})
+
+        def range_scan(node_ip, start=None, end=None, limit=None, cursor=None):
+            return stores[int(node_ip[-1])].range_scan(start, end, limit, cursor)
+
+        scanned, cursor = [], None
+        with mock.patch.object(Node, "range_scan", side_effect=range_scan):
+            while True:
+                items, cursor = engine.range_scan(limit=30, cursor=cursor, prefix="tenant1:")
+                self.assertLessEqual(len(items), 30)
+                scanned.extend(items)
+                if cursor is None:
+                    break
+        self.assertEqual(scanned, sorted((key, value) for key, value in data.items() if key.startswith("tenant1:")))
+
+        items, cursor = engine.range_scan(prefix="tenant1:", local=True)
+        self.assertEqual([key for key, _ in items],
+                         sorted(key for key in owners[0] + [stale_key] if key.startswith("tenant1:")))
+
+
+class ExpirationTestCase(unittest.TestCase):
+    def create_engine(self, node_id=0, num_nodes=1, replication_factor=1):
+        engine = create_engine(node_id, num_nodes, replication_factor)
+        engine.storage = CappedStore()
+        self.addCleanup(engine.storage.close)
+        self.addCleanup(engine.replication.close)
+        return engine
+
+    def test_put_with_a_ttl_on_a_single_node(self):
+        engine = self.create_engine()
+        engine.put("foo", "bar", ttl=60)
+        engine.put_many({"a": "1", "b": "2"}, ttl=0.01)
+        engine.put("persistent", "value")
+        self.assertAlmostEqual(engine.storage.expiration_time("foo"), time.time() + 60, delta=1)
+        self.assertIsNone(engine.storage.expiration_time("persistent"))
+
+        time.sleep(0.02)
+        self.assertEqual(engine.get_many(["foo", "a", "b", "persistent"]), {"foo": "bar", "persistent": "value"})
+
+    def test_ttl_needs_a_store_which_expires_keys(self):
+        engine = create_engine()
+        with self.assertRaises(KeyValueStoreException):
+            engine.put("foo", "bar", ttl=60)
+        self.assertIsNone(engine.get("foo"))
+
+    def test_ttl_is_forwarded_to_the_owner(self):
+        engine = self.create_engine(node_id=1, num_nodes=3)
+        key = next(key for key in map(str, range(1000)) if engine.hash_ring.get_node_id(key) == 0)
+        with mock.patch.object(Node, "put") as put:
+            engine.put(key, "value", ttl=30)
+        put.assert_called_once_with("node0", key, "value", ack=None, ttl=30)
+
+    def test_replicas_expire_keys_at_the_time_set_by_the_owner(self):
+        owner = self.create_engine(node_id=0, num_nodes=2, replication_factor=2)
+        replica = self.create_engine(node_id=1, num_nodes=2, replication_factor=2)
+        keys = [key for key in map(str, range(1000)) if owner.hash_ring.get_node_id(key) == 0][:10]
+
+        with mock.patch.object(Node, "replicate_batch", side_effect=lambda node_ip, data, expires_at=None:
+                               replica.replicate_many(data, expires_at=expires_at)):
+            owner.put_many({key: "value" for key in keys[:5]}, ttl=60)
+            owner.put_many({key: "value" for key in keys[5:]})
+            owner.replication.flush()
+
+        for key in keys:
+            self.assertEqual(replica.storage.get(key), "value")
+            self.assertEqual(replica.storage.expiration_time(key), owner.storage.expiration_time(key))
+        self.assertIsNotNone(replica.storage.expiration_time(keys[0]))
+
+
+class NodeTestCase(unittest.TestCase):
+    def test_put_batch_splits_large_batches(self):
+        data = load_sample_data(2500)
+        with mock.patch("thunderdb.compute.node.BATCH_SIZE", 1000), \
+                mock.patch.object(Node.connection_pool, "post") as post:
+            Node.put_batch("node1", data)
+
+        self.assertEqual(post.call_count, 3)
+        for (url,), _ in post.call_args_list:
+            self.assertEqual(url, "http://node1/batch-put")
+
+    def test_writes_which_expire_go_over_http(self):
+        transport = mock.Mock()
+        with mock.patch.object(Node, "transport", transport), \
+                mock.patch.object(Node.connection_pool, "post") as post:
+            Node.put("node1", "foo", "bar", ack="all", ttl=30)
+            Node.put_batch("node1", {"foo": "bar"}, overwrite=False, ttl=0.5)
+            Node.replicate_batch("node1", {"foo": "bar"}, expires_at=1234.5)
+            Node.put("node1", "foo", "bar")
+
+        self.assertEqual([url for (url,), _ in post.call_args_list],
+                         ["http://node1/put?ack=all&ttl=30",
+                          "http://node1/batch-put?overwrite=false&ttl=0.5",
+                          "http://node1/batch-replicate?expires_at=1234.5"])
+        transport.put.assert_called_once_with("node1", "foo", "bar", ack=None)
+
+
+if __name__ == '__main__':
+    unittest.main()
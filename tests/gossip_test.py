@@ -0,0 +1,114 @@
+import unittest
+from unittest import mock
+
+from thunderdb.config import Config
+from thunderdb.compute.engine import Engine
+from thunderdb.compute.gossip import Gossip, SETTLE_ROUNDS
+from thunderdb.compute.node import Node
+from thunderdb.exceptions.errors import ServiceError
+
+
+class Clock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def create_engine(node_id, num_nodes, **kwargs):
+    # Every node only knows of itself and of the next node of the ring at first
+    next_node_id = (node_id + 1) % num_nodes
+    config = Config(node_id, "node{}".format(node_id), next_node_id, "node{}".format(next_node_id))
+    engine = Engine(config)
+    engine.gossip = Gossip(engine, **kwargs)
+    engine.redistribute = mock.Mock()
+    return engine
+
+
+class GossipTestCase(unittest.TestCase):
+    def create_cluster(self, num_nodes, **kwargs):
+        engines = {"node{}".format(node_id): create_engine(node_id, num_nodes, **kwargs)
+                   for node_id in range(num_nodes)}
+        down = set()
+
+        def gossip(node_ip, members):
+            if node_ip in down:
+                raise ServiceError("The node is down")
+            return engines[node_ip].gossip.exchange(members)
+
+        patcher = mock.patch.object(Node, 'gossip', side_effect=gossip)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return list(engines.values()), down
+
+    def run_rounds(self, engines, rounds):
+        for _ in range(rounds):
+            for engine in engines:
+                engine.gossip.run_round()
+
+    def test_membership_converges_in_a_few_rounds(self):
+        engines, _ = self.create_cluster(10)
+        expected = {node_id: "node{}".format(node_id) for node_id in range(10)}
+
+        rounds = 0
+        while any(engine.config.nodes != expected for engine in engines):
+            self.run_rounds(engines, 1)
+            rounds += 1
+            self.assertLess(rounds, 10)
+
+        for engine in engines:
+            # The members discovered during a round are added together
+            self.assertLessEqual(engine.redistribute.call_count, rounds)
+            self.assertEqual(engine.gossip.version, engine.redistribute.call_count)
+            self.assertEqual(engine.hash_ring.get_node_id("key"), engines[0].hash_ring.get_node_id("key"))
+
+    def test_ready_once_the_expected_nodes_are_alive(self):
+        engines, _ = self.create_cluster(4, expected_nodes=4)
+        self.assertFalse(engines[0].gossip.is_ready())
+        self.assertFalse(engines[0].gossip.wait_until_ready(0))
+
+        self.run_rounds(engines, 6)
+        for engine in engines:
+            self.assertTrue(engine.gossip.wait_until_ready(0))
+
+    def test_ready_once_the_membership_settles(self):
+        engines, _ = self.create_cluster(3)
+        self.run_rounds(engines, 3 + SETTLE_ROUNDS)
+        self.assertTrue(all(engine.gossip.is_ready() for engine in engines))
+
+    def test_single_node_is_ready_right_away(self):
+        engine = Engine(Config(0, "node0", 0, "node0"))
+        self.assertTrue(engine.gossip.wait_until_ready(0))
+
+    def test_unreachable_member_is_reported_but_kept(self):
+        clock = Clock()
+        engines, down = self.create_cluster(3, clock=clock, failure_timeout=5.0)
+        self.run_rounds(engines, 4)
+        self.assertTrue(all(engines[0].gossip.is_alive(node_id) for node_id in range(3)))
+
+        down.add("node2")
+        clock.now += 10
+        self.run_rounds(engines[:2], 4)
+        stats = engines[0].gossip.stats()
+        self.assertTrue(stats['1']['alive'])
+        self.assertFalse(stats['2']['alive'])
+        self.assertFalse(engines[0].gossip.is_ready())
+        self.assertIn(2, engines[0].config.nodes)
+
+    def test_restarted_member_replaces_its_entry(self):
+        engine = create_engine(0, 2)
+        engine.gossip.merge({'1': ["node1", 100, 50]})
+        engine.gossip.merge({'1': ["node1", 100, 40]})
+        self.assertEqual(engine.gossip.members()['1'], ["node1", 100, 50])
+
+        # A newer generation wins whatever its heartbeat, and its new address is applied
+        engine.gossip.merge({'1': ["other", 200, 1]})
+        self.assertEqual(engine.gossip.members()['1'], ["other", 200, 1])
+        engine.gossip._apply()
+        self.assertEqual(engine.config.nodes[1], "other")
+        self.assertEqual(engine.gossip.version, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+from thunderdb.config import Config
+from thunderdb.compute.async_node import AsyncNode
+from thunderdb.compute.engine import Engine
+from thunderdb.compute.hedging import ReadHedger, HEDGE_BURST, DELAY_REFRESH_INTERVAL, MIN_HEDGE_DELAY, MAX_HEDGED_READS
+from thunderdb.compute.node import Node
+from thunderdb.exceptions.errors import ServiceError
+
+
+class ReadHedgerTestCase(unittest.TestCase):
+    def create_hedger(self, delay=0.01, **kwargs):
+        hedger = ReadHedger(**kwargs)
+        hedger.delay = delay
+        self.addCleanup(hedger.close)
+        return hedger
+
+    def slow_read(self, value="primary"):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def read():
+            release.wait(5)
+            return value
+        return read, release
+
+    def test_fast_primary_is_not_hedged(self):
+        hedger = self.create_hedger(delay=5)
+        backup = mock.Mock(return_value="backup")
+        primary = mock.Mock(return_value="primary")
+        self.assertEqual(hedger.read(primary, backup), "primary")
+        primary.assert_called_once_with()
+        backup.assert_not_called()
+        self.assertEqual(hedger.stats()['hedged'], 0)
+
+    def test_slow_primary_is_sent_once(self):
+        hedger = self.create_hedger()
+        primary, release = self.slow_read()
+        primary = mock.Mock(side_effect=primary)
+        backup = mock.Mock(return_value=None)
+        threading.Timer(0.05, release.set).start()
+        self.assertEqual(hedger.read(primary, backup), "primary")
+        # The first request is waited for after the hedging delay, so only the backup is extra
+        primary.assert_called_once_with()
+        backup.assert_called_once_with()
+
+    def test_slow_primary_is_hedged_with_the_backup(self):
+        hedger = self.create_hedger()
+        primary, _ = self.slow_read()
+        self.assertEqual(hedger.read(primary, lambda: "backup"), "backup")
+        self.assertEqual((hedger.hedged, hedger.won), (1, 1))
+
+    def test_primary_is_waited_for_when_the_backup_misses(self):
+        hedger = self.create_hedger()
+        primary, release = self.slow_read()
+        threading.Timer(0.05, release.set).start()
+        self.assertEqual(hedger.read(primary, lambda: None), "primary")
+
+        def fail():
+            raise ServiceError("The replica is down")
+        primary, release = self.slow_read()
+        threading.Timer(0.05, release.set).start()
+        self.assertEqual(hedger.read(primary, fail), "primary")
+        self.assertEqual((hedger.hedged, hedger.won), (2, 0))
+
+    def test_backup_answers_when_the_primary_fails(self):
+        hedger = self.create_hedger()
+        release = threading.Event()
+
+        def primary():
+            release.wait(5)
+            raise ServiceError("The owner is down")
+
+        def backup():
+            release.set()
+            return "backup"
+        self.assertEqual(hedger.read(primary, backup), "backup")
+
+        release.clear()
+        with self.assertRaises(ServiceError):
+            hedger.read(primary, lambda: release.set())
+
+    def test_hedge_rate_is_capped(self):
+        hedger = self.create_hedger(delay=0.001, max_rate=0.0)
+        for _ in range(HEDGE_BURST + 2):
+            primary, release = self.slow_read()
+            threading.Timer(0.01, release.set).start()
+            hedger.read(primary, lambda: None)
+        self.assertEqual((hedger.hedged, hedger.skipped), (HEDGE_BURST, 2))
+
+        # Once the budget is spent, the primary is read from the calling thread
+        thread = mock.Mock(side_effect=threading.current_thread)
+        self.assertIs(hedger.read(thread, None), threading.current_thread())
+        thread.assert_called_once_with()
+
+        # Every read earns max_rate of a hedged read
+        hedger = self.create_hedger(delay=5, max_rate=0.5)
+        hedger._budget = 0
+        for _ in range(4):
+            hedger.read(lambda: "primary", None)
+        self.assertEqual(hedger._budget, 2)
+
+    def test_reads_are_not_hedged_while_the_executor_is_busy(self):
+        hedger = self.create_hedger()
+        hedger._running = MAX_HEDGED_READS
+        primary, release = self.slow_read()
+        backup = mock.Mock(return_value="backup")
+        threading.Timer(0.05, release.set).start()
+        self.assertEqual(hedger.read(primary, backup), "primary")
+        backup.assert_not_called()
+        self.assertEqual((hedger.hedged, hedger.skipped), (0, 1))
+
+    def test_delay_follows_the_percentile_of_the_latencies(self):
+        hedger = ReadHedger(percentile=0.9)
+        self.addCleanup(hedger.close)
+        for i in range(DELAY_REFRESH_INTERVAL):
+            hedger.observe((i + 1) / 1000)
+        self.assertAlmostEqual(hedger.delay, 0.091)
+
+        for _ in range(DELAY_REFRESH_INTERVAL * 10):
+            hedger.observe(0)
+        self.assertEqual(hedger.delay, MIN_HEDGE_DELAY)
+
+    def test_invalid_options_are_rejected(self):
+        with self.assertRaises(ValueError):
+            ReadHedger(percentile=1.5)
+        with self.assertRaises(ValueError):
+            ReadHedger(max_rate=-1)
+
+
+class AsyncReadHedgerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_slow_primary_is_cancelled(self):
+        hedger = ReadHedger()
+        hedger.delay = 0.01
+        cancelled = asyncio.Event()
+
+        async def primary():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def backup():
+            return "backup"
+
+        self.assertEqual(await hedger.read_async(primary, backup), "backup")
+        await asyncio.wait_for(cancelled.wait(), 1)
+        self.assertEqual(hedger.won, 1)
+
+    async def test_fast_primary_is_not_hedged(self):
+        hedger = ReadHedger()
+        backup = mock.AsyncMock(return_value="backup")
+
+        async def primary():
+            return "primary"
+        self.assertEqual(await hedger.read_async(primary, backup), "primary")
+        backup.assert_not_called()
+
+
+class EngineHedgingTestCase(unittest.TestCase):
+    def create_engine(self, **kwargs):
+        config = Config(0, "node0", 1, "node1", replication_factor=2, **kwargs)
+        config.add({2: "node2"})
+        return Engine(config)
+
+    def find_key(self, engine, node_id):
+        return next(key for key in map(str, range(1000)) if engine.hash_ring.get_node_id(key) == node_id)
+
+    def test_slow_owner_is_hedged_with_its_successor(self):
+        engine = self.create_engine()
+        engine.hedger.delay = 0.01
+        key = self.find_key(engine, 1)
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def get(node_ip, key, local=False):
+            if node_ip == "node1":
+                release.wait(5)
+            return {key: node_ip}
+
+        with mock.patch.object(Node, 'get', side_effect=get) as node_get:
+            self.assertEqual(engine.get(key), "node2")
+        self.assertEqual(node_get.call_args_list, [mock.call("node1", key), mock.call("node2", key, local=True)])
+
+    def test_successor_is_not_asked_when_it_is_the_current_node(self):
+        engine = self.create_engine()
+        engine.hedger.delay = 0
+        key = self.find_key(engine, 2)
+        with mock.patch.object(Node, 'get', return_value={key: "value"}) as node_get:
+            self.assertEqual(engine.get(key), "value")
+        node_get.assert_called_once_with("node2", key, local=False)
+
+    def test_hedging_is_off_without_replicas_or_rate(self):
+        self.assertIsNone(self.create_engine(hedge_max_rate=0).hedger)
+        self.assertIsNone(Engine(Config(0, "node0", 1, "node1", replication_factor=1)).hedger)
+
+    def test_async_slow_owner_is_hedged_with_its_successor(self):
+        engine = self.create_engine()
+        engine.hedger.delay = 0.01
+        key = self.find_key(engine, 1)
+
+        async def get(node_ip, key, local=False):
+            if node_ip == "node1":
+                await asyncio.sleep(5)
+            return {key: node_ip}
+
+        with mock.patch.object(AsyncNode, 'get', side_effect=get):
+            self.assertEqual(asyncio.run(engine.get_async(key)), "node2")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+import io
+import json
+import time
+import unittest
+from unittest import mock
+from wsgiref.util import setup_testing_defaults
+
+from thunderdb.config import Config
+from thunderdb.compute.gossip import Gossip
+from thunderdb.hashing.consistent_hashing import ConsistentHash, DEFAULT_NUM_VIRTUAL_NODES
+from thunderdb.networking.http_server import initialize
+from thunderdb.storage.capped_store import CappedStore
+from thunderdb.storage.filtered_store import BloomFilter, FilteredStore
+
+
+SAMPLE_DATA_FILE = "sample_data/data_demo_10000.txt"
+
+
+def load_sample_data():
+    with open(SAMPLE_DATA_FILE) as data_file:
+        return dict(line.split() for line in data_file)
+
+
+class WSGIResponse(object):
+    def __init__(self, status, headers, body):
+        self.status_code = int(status.split()[0])
+        self.headers = dict(headers)
+        self.text = body.decode()
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def call(app, method, path, query="", body=None):
+    """Issue a request to a WSGI application without going through the network"""
+    body = json.dumps(body).encode() if body is not None else b""
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started.update(status=status, headers=headers)
+
+    chunks = app(environ, start_response)
+    content = b"".join(chunks)
+    return WSGIResponse(started['status'], started['headers'], content)
+
+
+class HttpServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = initialize(Config(0, "localhost", 0, "localhost"))
+        self.data = load_sample_data()
+        call(self.app, 'POST', '/batch-put', body=self.data)
+
+    def test_batch_put_and_get(self):
+        key, value = next(iter(self.data.items()))
+        self.assertEqual(call(self.app, 'GET', '/get/' + key).json(), {key: value})
+
+    def test_batch_put_rejects_invalid_data(self):
+        self.assertEqual(call(self.app, 'POST', '/batch-put', body=["foo"]).status_code, 400)
+
+    def test_batch_put_without_overwrite(self):
+        key = next(iter(self.data))
+        call(self.app, 'POST', '/batch-put', 'overwrite=false', body={key: "new", "other": "value"})
+        self.assertEqual(call(self.app, 'GET', '/get/' + key).json(), {key: self.data[key]})
+        self.assertEqual(call(self.app, 'GET', '/get/other', 'local=true').json(), {"other": "value"})
+
+    def test_put_with_acknowledgement_mode(self):
+        self.assertEqual(call(self.app, 'POST', '/put', 'ack=all', body={"foo": "bar"}).status_code, 200)
+        self.assertEqual(call(self.app, 'GET', '/get/foo').json(), {"foo": "bar"})
+        self.assertEqual(call(self.app, 'POST', '/put', 'ack=some', body={"foo": "bar"}).status_code, 400)
+
+    def test_batch_replicate(self):
+        call(self.app, 'POST', '/batch-replicate', body={"foo": "bar"})
+        self.assertEqual(call(self.app, 'GET', '/get/foo', 'local=true').json(), {"foo": "bar"})
+
+    def test_get_missing_key(self):
+        self.assertEqual(call(self.app, 'GET', '/get/missing').status_code, 404)
+
+    def test_get_empty_and_zero_values(self):
+        call(self.app, 'POST', '/batch-put', body={"empty": "", "zero": 0})
+        self.assertEqual(call(self.app, 'GET', '/get/empty').json(), {"empty": ""})
+        self.assertEqual(call(self.app, 'GET', '/get/zero').json(), {"zero": 0})
+
+    def test_mget(self):
+        keys = list(self.data)[:10] + ["missing"]
+        response = call(self.app, 'POST', '/mget', body=keys)
+        self.assertEqual(response.json(), {key: self.data[key] for key in keys[:10]})
+
+    def test_snapshot(self):
+        self.assertEqual(call(self.app, 'GET', '/snapshot').json(), self.data)
+
+    def test_streaming_snapshot(self):
+        response = call(self.app, 'GET', '/snapshot', 'stream=true')
+        self.assertEqual(response.headers['Content-Type'], 'application/x-ndjson')
+
+        snapshot = {}
+        lines = response.text.splitlines()
+        for line in lines:
+            snapshot.update(json.loads(line))
+        self.assertEqual(len(lines), len(self.data))
+        self.assertEqual(snapshot, self.data)
+
+    def test_paginated_snapshot(self):
+        snapshot, cursor, pages = {}, "", 0
+        while cursor is not None:
+            page = call(self.app, 'GET', '/snapshot', 'limit=3000&cursor=' + cursor).json()
+            snapshot.update(page['data'])
+            cursor = page['cursor']
+            pages += 1
+        self.assertEqual(pages, 4)
+        self.assertEqual(snapshot, self.data)
+
+    def test_snapshot_of_a_key_range(self):
+        expected = {key: value for key, value in self.data.items() if "a" <= key < "b"}
+        response = call(self.app, 'GET', '/snapshot', 'limit=100000&start=a&end=b')
+        self.assertEqual(response.json(), {'data': expected, 'cursor': None})
+
+        snapshot = {}
+        for line in call(self.app, 'GET', '/snapshot', 'stream=1&start=a&end=b').text.splitlines():
+            snapshot.update(json.loads(line))
+        self.assertEqual(snapshot, expected)
+
+    def test_metrics(self):
+        call(self.app, 'GET', '/get/missing')
+        response = call(self.app, 'GET', '/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('thunderdb_store_keys {}\n'.format(len(self.data)), response.text)
+        self.assertIn('thunderdb_http_request_seconds_count{method="GET",route="/get/<key>",status="404"}',
+                      response.text)
+
+    def test_profiler(self):
+        self.assertEqual(call(self.app, 'POST', '/admin/profiler', 'action=start&interval=0.001').json()['running'],
+                         True)
+        self.assertEqual(call(self.app, 'POST', '/admin/profiler', 'action=stop').json()['running'], False)
+        self.assertEqual(call(self.app, 'GET', '/admin/profiler').status_code, 200)
+        self.assertEqual(call(self.app, 'POST', '/admin/profiler', 'action=pause').status_code, 400)
+        self.assertEqual(call(self.app, 'POST', '/admin/profiler', 'action=start&interval=-1').status_code, 400)
+
+    def test_scan(self):
+        call(self.app, 'POST', '/batch-put', body={"tenant1:b": "2", "tenant1:a": "1", "tenant2:a": "3"})
+        response = call(self.app, 'GET', '/scan', 'prefix=tenant1:')
+        self.assertEqual(response.json(), {'data': {"tenant1:a": "1", "tenant1:b": "2"}, 'cursor': None})
+        self.assertEqual(list(response.json()['data']), ["tenant1:a", "tenant1:b"])
+
+        response = call(self.app, 'GET', '/scan', 'prefix=tenant&limit=2')
+        self.assertEqual(response.json()['cursor'], "tenant1:b")
+        response = call(self.app, 'GET', '/scan', 'prefix=tenant&limit=2&cursor=tenant1:b')
+        self.assertEqual(response.json(), {'data': {"tenant2:a": "3"}, 'cursor': None})
+
+        response = call(self.app, 'GET', '/scan', 'start=tenant1:b&stream=true')
+        self.assertEqual([json.loads(line) for line in response.text.splitlines()],
+                         [{"tenant1:b": "2"}, {"tenant2:a": "3"}])
+        self.assertEqual(call(self.app, 'GET', '/scan', 'limit=0').status_code, 400)
+
+    def test_snapshot_rejects_invalid_pagination(self):
+        self.assertEqual(call(self.app, 'GET', '/snapshot', 'limit=0').status_code, 400)
+        self.assertEqual(call(self.app, 'GET', '/snapshot', 'limit=10&cursor=nope').status_code, 400)
+
+    def test_ttl_needs_the_capped_store(self):
+        self.assertEqual(call(self.app, 'POST', '/put', 'ttl=60', body={"foo": "bar"}).status_code, 400)
+        self.assertEqual(call(self.app, 'GET', '/get/foo').status_code, 404)
+
+
+class CappedStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.storage = CappedStore(max_bytes=100 * 1000)
+        self.addCleanup(self.storage.close)
+        self.app = initialize(Config(0, "localhost", 0, "localhost"), storage=self.storage)
+
+    def test_put_with_a_ttl(self):
+        self.assertEqual(call(self.app, 'POST', '/put', 'ttl=60', body={"foo": "bar"}).status_code, 200)
+        self.assertEqual(call(self.app, 'POST', '/batch-put', 'ttl=0.01', body={"a": "1", "b": "2"}).status_code, 200)
+        self.assertAlmostEqual(self.storage.expiration_time("foo"), time.time() + 60, delta=1)
+
+        time.sleep(0.02)
+        self.assertEqual(call(self.app, 'GET', '/get/foo').json(), {"foo": "bar"})
+        self.assertEqual(call(self.app, 'GET', '/get/a').status_code, 404)
+        self.assertEqual(call(self.app, 'POST', '/mget', body=["a", "b", "foo"]).json(), {"foo": "bar"})
+
+        for ttl in ('0', '-1', 'soon', 'inf', 'nan'):
+            self.assertEqual(call(self.app, 'POST', '/put', 'ttl=' + ttl, body={"foo": "bar"}).status_code, 400)
+
+    def test_batch_replicate_with_an_expiration_time(self):
+        call(self.app, 'POST', '/batch-replicate', 'expires_at={}'.format(time.time() + 60), body={"foo": "bar"})
+        call(self.app, 'POST', '/batch-replicate', 'expires_at={}'.format(time.time() - 1), body={"old": "value"})
+        self.assertEqual(call(self.app, 'GET', '/get/foo', 'local=true').json(), {"foo": "bar"})
+        self.assertEqual(call(self.app, 'GET', '/get/old', 'local=true').status_code, 404)
+
+    def test_metrics_of_the_store(self):
+        call(self.app, 'POST', '/batch-put', body={"{:04d}".format(i): "value" for i in range(1000)})
+        text = call(self.app, 'GET', '/metrics').text
+        self.assertIn('thunderdb_store_max_bytes 100000\n', text)
+        self.assertIn('thunderdb_store_evictions_total {}\n'.format(self.storage.evictions), text)
+        self.assertGreater(self.storage.evictions, 0)
+
+
+class KeyFilterTestCase(unittest.TestCase):
+    def test_key_filter(self):
+        app = initialize(Config(0, "localhost", 0, "localhost"), storage=FilteredStore(capacity=1000))
+        call(app, 'POST', '/batch-put', body={"foo": "bar", "baz": "qux"})
+        delta = call(app, 'GET', '/key-filter').json()
+        self.assertEqual((delta['nodes'], delta['moving']), (1, False))
+        copy = BloomFilter(delta)
+        self.assertIn("foo", copy)
+
+        call(app, 'POST', '/put', body={"new": "value"})
+        delta = call(app, 'GET', '/key-filter', 'since={}&generation={}'.format(copy.version, copy.generation)).json()
+        self.assertNotIn('bits', delta)
+        copy.apply(delta)
+        self.assertIn("new", copy)
+        self.assertEqual(call(app, 'GET', '/key-filter', 'since=latest').status_code, 400)
+
+    def test_key_filter_of_a_node_without_one(self):
+        app = initialize(Config(0, "localhost", 0, "localhost"))
+        self.assertEqual(call(app, 'GET', '/key-filter').status_code, 400)
+
+
+class DirectRequestTestCase(unittest.TestCase):
+    def setUp(self):
+        config = Config(0, "node0", 1, "node1", replication_factor=1)
+        # node1 is not running, there is nobody to gossip with
+        with mock.patch.object(Gossip, 'start'):
+            self.app = initialize(config)
+        self.ring = ConsistentHash(2, config.num_virtual_nodes)
+
+    def find_key(self, node_id):
+        return next(key for key in map(str, range(1000)) if self.ring.get_node_id(key) == node_id)
+
+    def test_cluster(self):
+        self.assertEqual(call(self.app, 'GET', '/cluster').json(), {
+            'node_id': 0, 'nodes': {'0': "node0", '1': "node1"},
+            'num_virtual_nodes': DEFAULT_NUM_VIRTUAL_NODES, 'replication_factor': 1, 'version': 0,
+            # node1 is not running, so it was never heard from
+            'unreachable': ['1']})
+
+    def test_owned_keys_are_served(self):
+        key = self.find_key(0)
+        self.assertEqual(call(self.app, 'POST', '/put', 'direct=true', body={key: "value"}).status_code, 200)
+        self.assertEqual(call(self.app, 'GET', '/get/' + key, 'direct=true').json(), {key: "value"})
+        self.assertEqual(call(self.app, 'POST', '/mget', 'direct=true', body=[key]).json(), {key: "value"})
+
+    def test_keys_of_other_nodes_are_rejected(self):
+        key, other_key = self.find_key(0), self.find_key(1)
+        self.assertEqual(call(self.app, 'GET', '/get/' + other_key, 'direct=true').status_code, 421)
+        self.assertEqual(call(self.app, 'POST', '/put', 'direct=true', body={other_key: "value"}).status_code, 421)
+        self.assertEqual(call(self.app, 'POST', '/batch-put', 'direct=true',
+                              body={key: "value", other_key: "value"}).status_code, 421)
+        self.assertEqual(call(self.app, 'POST', '/mget', 'direct=true', body=[key, other_key]).status_code, 421)
+        self.assertEqual(call(self.app, 'GET', '/get/' + key, 'local=true').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from thunderdb.compute.loader import BulkLoader
+
+
+SAMPLE_DATA_FILE = "sample_data/data_demo_10000.txt"
+
+
+def load_sample_data():
+    with open(SAMPLE_DATA_FILE) as data_file:
+        return dict(line.split() for line in data_file)
+
+
+class BulkLoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = mock.Mock()
+        self.loaded = {}
+        self.engine.put_many.side_effect = self.loaded.update
+
+    def write_data_file(self, content):
+        handle, path = tempfile.mkstemp()
+        with os.fdopen(handle, "wb") as data_file:
+            data_file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_load_sample_data(self):
+        loader = BulkLoader(self.engine, batch_size=3000, progress_interval=0)
+        self.assertEqual(loader.load(SAMPLE_DATA_FILE), 10000)
+        self.assertEqual(self.loaded, load_sample_data())
+        self.assertEqual(self.engine.put_many.call_count, 4)
+
+    def test_lines_are_not_split_across_reads(self):
+        loader = BulkLoader(self.engine, batch_size=100, read_buffer_size=7)
+        loader.load(SAMPLE_DATA_FILE)
+        self.assertEqual(self.loaded, load_sample_data())
+
+    def test_batches_are_bounded(self):
+        loader = BulkLoader(self.engine, batch_size=64)
+        for batch in loader.read_batches(SAMPLE_DATA_FILE):
+            self.assertLessEqual(len(batch), 64)
+
+    def test_file_without_trailing_newline(self):
+        data_file = self.write_data_file("foo bar\r\nbaz h\xe9llo wörld\nqux quux".encode())
+        BulkLoader(self.engine, read_buffer_size=4).load(data_file)
+        self.assertEqual(self.loaded, {"foo": "bar", "baz": "h\xe9llo wörld", "qux": "quux"})
+
+    def test_malformed_lines_are_skipped(self):
+        data_file = self.write_data_file(b"foo bar\nmalformed\n\nbaz qux\n")
+        loader = BulkLoader(self.engine)
+        self.assertEqual(loader.load(data_file), 2)
+        self.assertEqual(self.loaded, {"foo": "bar", "baz": "qux"})
+        self.assertEqual(loader.skipped_lines, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from thunderdb.storage.capped_store import CappedStore
+from thunderdb.storage.compact_store import CompactStore
+from thunderdb.storage.log_store import LogStore
+
+
+SAMPLE_DATA_FILE = "sample_data/data_demo_10000.txt"
+
+
+def load_sample_data():
+    with open(SAMPLE_DATA_FILE) as data_file:
+        return dict(line.split() for line in data_file)
+
+
+class LogStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open_store(self, **kwargs):
+        store = LogStore(self.directory, **kwargs)
+        self.addCleanup(lambda: store._closed or store.close())
+        return store
+
+    def reopen(self, store, **kwargs):
+        store.close()
+        return self.open_store(**kwargs)
+
+    def test_changes_survive_a_restart(self):
+        store = self.open_store()
+        data = load_sample_data()
+        store.put_batch(data)
+        store.put("foo", "bar")
+        store.put("h\xe9llo", "w\xf6rld \U0001F600")
+        store.put("number", 42)
+        store.put("list", [1, "two"])
+        store.delete("foo")
+        for key in list(data)[:100]:
+            store.delete(key)
+            del data[key]
+
+        store = self.reopen(store)
+        data.update({"h\xe9llo": "w\xf6rld \U0001F600", "number": 42, "list": [1, "two"]})
+        self.assertEqual(dict(store.items()), data)
+        self.assertIsNone(store.get("foo"))
+
+    def test_operations_are_replayed_in_order(self):
+        store = self.open_store()
+        store.put("key", "first")
+        store.put("key", 2)
+        store.delete("key")
+        store.put("key", "last")
+        store.put_batch({"other": 1, "key": "really last"})
+
+        store = self.reopen(store)
+        self.assertEqual(dict(store.items()), {"key": "really last", "other": 1})
+
+    def test_only_the_absent_keys_are_logged(self):
+        store = self.open_store()
+        store.put("key", "first")
+        self.assertEqual(store.put_batch_if_absent({"key": "second", "other": 1}), {"other": 1})
+        self.assertEqual(store.put_batch_if_absent({"key": "third"}), {})
+
+        store = self.reopen(store)
+        self.assertEqual(dict(store.items()), {"key": "first", "other": 1})
+
+    def test_checkpoint_replaces_older_log_segments(self):
+        store = self.open_store()
+        data = load_sample_data()
+        store.put_batch(data)
+        store.checkpoint()
+        store.put("after", "checkpoint")
+        store.delete(next(iter(data)))
+
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual(len(names), 2)
+        self.assertTrue(names[0].startswith("checkpoint-"))
+        self.assertTrue(names[1].startswith("wal-"))
+
+        store = self.reopen(store)
+        data["after"] = "checkpoint"
+        del data[next(iter(data))]
+        self.assertEqual(dict(store.items()), data)
+
+    def test_checkpoint_is_taken_when_the_log_grows(self):
+        store = self.open_store(fsync_interval=0.01, checkpoint_bytes=64 * 1024)
+        store.put_batch(load_sample_data())
+
+        deadline = time.time() + 5
+        while not any(name.startswith("checkpoint-") for name in os.listdir(self.directory)):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_torn_writes_are_discarded(self):
+        store = self.open_store()
+        store.put("foo", "bar")
+        store.close()
+
+        segment = os.path.join(self.directory, sorted(os.listdir(self.directory))[-1])
+        with open(segment, "ab") as log:
+            log.write(b"\x01\x05\x00")
+
+        store = self.open_store()
+        self.assertEqual(dict(store.items()), {"foo": "bar"})
+        store.put("baz", "qux")
+
+        store = self.reopen(store)
+        self.assertEqual(dict(store.items()), {"foo": "bar", "baz": "qux"})
+
+    def test_fsync_always_waits_for_the_log(self):
+        store = self.open_store(fsync="always")
+        threads = [threading.Thread(target=store.put, args=("key{}".format(i), "value")) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store._durable_sequence, 20)
+
+        store = self.reopen(store)
+        self.assertEqual(len(store), 20)
+
+    def test_compact_store_as_index(self):
+        store = self.open_store(index=CompactStore())
+        data = load_sample_data()
+        store.put_batch(data)
+
+        store = self.reopen(store, index=CompactStore())
+        self.assertIsInstance(store.index, CompactStore)
+        self.assertEqual(dict(store.items()), data)
+
+    def test_expiration_times_survive_a_restart(self):
+        def capped_store():
+            index = CappedStore()
+            self.addCleanup(index.close)
+            return index
+
+        store = self.open_store(index=capped_store())
+        self.assertTrue(store.supports_expiration)
+        expires_at = time.time() + 3600
+        store.put("expiring", "value", expires_at=expires_at)
+        store.put_batch({"expired": "value", "list": [1]}, expires_at=time.time() + 0.05)
+        store.put("persistent", "value")
+        store.put("list", [1, "two"], expires_at=expires_at)
+
+        store = self.reopen(store, index=capped_store())
+        self.assertEqual(store.index.expiration_time("expiring"), expires_at)
+        self.assertEqual(store.get("list"), [1, "two"])
+        self.assertIsNone(store.index.expiration_time("persistent"))
+
+        # The checkpoint keeps the expiration times too, and the pairs which expired are not recovered
+        time.sleep(0.1)
+        store.checkpoint()
+        store = self.reopen(store, index=capped_store())
+        self.assertEqual(dict(store.items()), {"expiring": "value", "persistent": "value", "list": [1, "two"]})
+        self.assertEqual(store.index.expiration_time("list"), expires_at)
+
+    def test_unknown_fsync_policy(self):
+        with self.assertRaises(ValueError):
+            LogStore(self.directory, fsync="sometimes")
+
+
+if __name__ == '__main__':
+    unittest.main()
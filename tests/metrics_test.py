@@ -0,0 +1,131 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from thunderdb.config import Config
+from thunderdb.compute import metrics
+from thunderdb.compute.engine import Engine
+from thunderdb.compute.node import Node
+from thunderdb.compute.profiler import SamplingProfiler
+from thunderdb.exceptions.errors import ServiceError
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.counter('requests_total', "The requests", ('route',))
+        counter.inc('/get')
+        counter.inc('/get', amount=2)
+        counter.inc('/put')
+        self.assertEqual(counter.get('/get'), 3)
+        self.assertEqual(self.registry.render(),
+                         '# HELP requests_total The requests\n'
+                         '# TYPE requests_total counter\n'
+                         'requests_total{route="/get"} 3\n'
+                         'requests_total{route="/put"} 1\n')
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('latency_seconds', "The latency", ('route',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, 'a"b')
+        self.assertEqual(histogram.count('a"b'), 4)
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[2:], [
+            'latency_seconds_bucket{route="a\\"b",le="0.1"} 2',
+            'latency_seconds_bucket{route="a\\"b",le="1.0"} 3',
+            'latency_seconds_bucket{route="a\\"b",le="+Inf"} 4',
+            'latency_seconds_sum{route="a\\"b"} 2.65',
+            'latency_seconds_count{route="a\\"b"} 4',
+        ])
+
+    def test_names_are_unique(self):
+        self.registry.counter('requests_total', "The requests")
+        with self.assertRaises(ValueError):
+            self.registry.histogram('requests_total', "The requests")
+
+    def test_timed_functions_and_coroutines(self):
+        histogram = self.registry.histogram('operation_seconds', "The operations", ('operation',))
+
+        @metrics.timed(histogram, 'sync')
+        def sync():
+            return 1
+
+        @metrics.timed(histogram, 'async')
+        async def coroutine():
+            return 2
+
+        self.assertEqual(sync(), 1)
+        self.assertEqual(asyncio.run(coroutine()), 2)
+        self.assertEqual(histogram.count('sync'), 1)
+        self.assertEqual(histogram.count('async'), 1)
+
+    def test_failed_peer_requests_are_counted(self):
+        @metrics.peer_request('test')
+        def request(node_ip_address):
+            raise ServiceError("Request failed")
+
+        errors = metrics.PEER_ERRORS.get('node9', 'test')
+        with self.assertRaises(ServiceError):
+            request('node9')
+        self.assertEqual(metrics.PEER_ERRORS.get('node9', 'test'), errors + 1)
+        self.assertGreaterEqual(metrics.PEER_REQUESTS.count('node9', 'test'), 1)
+
+
+class EngineMetricsTestCase(unittest.TestCase):
+    def create_engine(self, num_nodes=2):
+        config = Config(0, "node0", 1 % num_nodes, "node{}".format(1 % num_nodes))
+        config.add({n: "node{}".format(n) for n in range(num_nodes)})
+        return Engine(config)
+
+    def test_reads_are_counted_by_source(self):
+        engine = self.create_engine()
+        local_key = next(key for key in map(str, range(1000)) if engine.hash_ring.get_node_id(key) == 0)
+        remote_key = next(key for key in map(str, range(1000)) if engine.hash_ring.get_node_id(key) == 1)
+        engine.storage.put(local_key, "value")
+
+        before = {source: metrics.ENGINE_READS.get(source) for source in ('local', 'forwarded')}
+        with mock.patch.object(Node, "get", return_value={remote_key: "value"}), \
+                mock.patch.object(Node, "get_many", return_value={}):
+            engine.get(local_key)
+            engine.get(remote_key)
+            engine.get_many([local_key, remote_key])
+        self.assertEqual(metrics.ENGINE_READS.get('local') - before['local'], 2)
+        self.assertEqual(metrics.ENGINE_READS.get('forwarded') - before['forwarded'], 2)
+
+    def test_render_the_state_of_the_engine(self):
+        engine = self.create_engine(num_nodes=1)
+        engine.put("foo", "bar")
+        text = metrics.render(engine)
+        self.assertIn('thunderdb_store_keys 1\n', text)
+        self.assertIn('thunderdb_cluster_nodes 1\n', text)
+        self.assertIn('thunderdb_engine_operation_seconds_count{operation="put"}', text)
+        self.assertRegex(text, r'thunderdb_process_resident_memory_bytes [1-9]')
+
+
+class SamplingProfilerTestCase(unittest.TestCase):
+    def test_samples_the_running_threads(self):
+        profiler = SamplingProfiler(interval=0.001)
+        self.assertTrue(profiler.start())
+        self.assertFalse(profiler.start())
+        deadline = time.time() + 5
+        while profiler.samples < 5 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(profiler.stop())
+        self.assertFalse(profiler.is_running())
+
+        report = profiler.report()
+        self.assertIn('MainThread;', report)
+        self.assertIn('test_samples_the_running_threads', report)
+        stack, count = report.splitlines()[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+
+    def test_invalid_interval(self):
+        with self.assertRaises(ValueError):
+            SamplingProfiler().start(interval=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+from unittest import mock
+
+from thunderdb.config import Config
+from thunderdb.compute.engine import Engine
+from thunderdb.compute.node import Node
+from thunderdb.compute.peer_filters import STALE_INTERVALS
+from thunderdb.exceptions.errors import KeyValueStoreException, ServiceError
+from thunderdb.storage.filtered_store import FilteredStore
+
+
+class Clock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class PeerFiltersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engines = {}
+        for node_id in range(2):
+            config = Config(node_id, "node{}".format(node_id), 1 - node_id, "node{}".format(1 - node_id),
+                            replication_factor=1)
+            self.engines["node{}".format(node_id)] = Engine(config, FilteredStore(capacity=1000))
+        self.engine, self.owner = self.engines["node0"], self.engines["node1"]
+        self.clock = self.engine.filters._clock = Clock()
+
+        def key_filter(node_ip, since=0, generation=None):
+            return self.engines[node_ip].key_filter(since, generation)
+
+        patcher = mock.patch.object(Node, 'key_filter', side_effect=key_filter)
+        self.key_filter = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def find_keys(self, node_id, count=1):
+        keys = (key for key in map(str, range(10000)) if self.engine.hash_ring.get_node_id(key) == node_id)
+        return [next(keys) for _ in range(count)]
+
+    def test_missing_keys_are_answered_without_asking_the_owner(self):
+        existing, missing = self.find_keys(1, 2)
+        self.owner.put(existing, "value")
+        self.engine.filters.sync()
+
+        with mock.patch.object(Node, 'get', return_value={existing: "value"}) as get:
+            self.assertIsNone(self.engine.get(missing))
+            get.assert_not_called()
+            self.assertEqual(self.engine.get(existing), "value")
+            get.assert_called_once()
+
+        with mock.patch.object(Node, 'get_many', return_value={existing: "value"}) as get_many:
+            self.assertEqual(self.engine.get_many([existing, missing]), {existing: "value"})
+            get_many.assert_called_once_with("node1", [existing], False)
+            get_many.reset_mock()
+            self.assertEqual(self.engine.get_many([missing]), {})
+            get_many.assert_not_called()
+
+    def test_filters_are_updated_incrementally(self):
+        first, second = self.find_keys(1, 2)
+        self.owner.put(first, "value")
+        self.engine.filters.sync()
+        self.owner.put(second, "value")
+        self.engine.filters.sync()
+
+        since, generation = self.key_filter.call_args[0][1:]
+        self.assertGreater(since, 0)
+        self.assertEqual(generation, self.owner.storage.key_filter.generation)
+        self.assertNotIn('bits', self.owner.key_filter(since, generation))
+        self.assertTrue(self.engine.filters.might_contain("node1", first))
+        self.assertTrue(self.engine.filters.might_contain("node1", second))
+
+    def test_forwarded_writes_are_read_back_before_the_next_update(self):
+        first, second = self.find_keys(1, 2)
+        self.engine.filters.sync()
+        with mock.patch.object(Node, 'put'), mock.patch.object(Node, 'put_batch'):
+            self.engine.put(first, "value")
+            self.engine.put_many({second: "value", "other": "value"})
+        self.assertTrue(self.engine.filters.might_contain("node1", first))
+        self.assertTrue(self.engine.filters.might_contain("node1", second))
+
+    def test_writes_forwarded_during_an_update_are_kept(self):
+        key, = self.find_keys(1)
+
+        def key_filter(node_ip, since=0, generation=None):
+            # The whole filter of the owner is sent before a write forwarded meanwhile reaches it
+            delta = self.owner.key_filter(since, generation)
+            self.engine.put(key, "value")
+            return delta
+        with mock.patch.object(Node, 'key_filter', side_effect=key_filter), mock.patch.object(Node, 'put'):
+            self.engine.filters.sync()
+        self.assertTrue(self.engine.filters.might_contain("node1", key))
+
+    def test_cleared_bits_do_not_drop_writes_in_flight(self):
+        key, = self.find_keys(1)
+        self.owner.put(key, "value")
+        self.engine.filters.sync()
+        self.owner.storage.delete(key)
+        with mock.patch.object(Node, 'put'):
+            self.engine.put(key, "value")
+
+        # The owner clears the bits of the key, which it was not written again to yet
+        copy = self.engine.filters._filters["node1"]
+        self.assertTrue(self.owner.key_filter(copy.version, copy.generation)['cleared'])
+        self.engine.filters.sync()
+        self.assertTrue(self.engine.filters.might_contain("node1", key))
+
+    def test_filters_which_are_stale_or_incomplete_are_not_used(self):
+        missing, = self.find_keys(1)
+        self.engine.filters.sync()
+        self.assertFalse(self.engine.filters.might_contain("node1", missing))
+
+        self.clock.now += self.engine.filters.interval * STALE_INTERVALS + 1
+        self.assertTrue(self.engine.filters.might_contain("node1", missing))
+
+        # The owner is still receiving the keys of its new ranges
+        with mock.patch.object(self.owner.rebalancer, 'is_moving', return_value=True):
+            self.engine.filters.sync()
+        self.assertTrue(self.engine.filters.might_contain("node1", missing))
+
+        with mock.patch.object(Node, 'key_filter', side_effect=ServiceError("The node is down")):
+            self.engine.filters.sync()
+        self.assertTrue(self.engine.filters.might_contain("node1", missing))
+
+    def test_nodes_without_a_filter(self):
+        engine = Engine(Config(0, "node0", 1, "node1"))
+        self.assertIsNone(engine.filters)
+        with self.assertRaises(KeyValueStoreException):
+            engine.key_filter()
+
+
+if __name__ == '__main__':
+    unittest.main()
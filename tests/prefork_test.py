@@ -0,0 +1,110 @@
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import unittest
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+import requests
+
+from tests.http_server_test import call, load_sample_data
+from thunderdb.config import Config
+from thunderdb.networking import prefork
+from thunderdb.networking.http_server import initialize
+from thunderdb.storage.shared_store import SharedMemoryStore
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class PreforkWorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = SharedMemoryStore(max_keys=20000, max_bytes=4 * 1024 * 1024)
+        self.data = load_sample_data()
+        self.store.put_batch(self.data)
+
+        # The writer runs the full application, over the same store
+        self.writer = make_server('127.0.0.1', 0, initialize(Config(0, "localhost", 0, "localhost"), storage=self.store),
+                                  handler_class=QuietHandler)
+        threading.Thread(target=self.writer.serve_forever, daemon=True).start()
+        self.app = prefork.initialize_worker(self.store, '127.0.0.1:{}'.format(self.writer.server_port))
+
+    def tearDown(self):
+        self.writer.shutdown()
+        self.writer.server_close()
+
+    def test_reads_are_served_from_the_shared_store(self):
+        self.writer.shutdown()
+        key, value = next(iter(self.data.items()))
+        self.assertEqual(call(self.app, 'GET', '/get/' + key).json(), {key: value})
+        self.assertEqual(call(self.app, 'GET', '/get/missing', 'local=true').status_code, 404)
+        self.assertEqual(call(self.app, 'POST', '/mget', 'local=true', body=[key, 'missing']).json(), {key: value})
+
+        # An empty value is a value, which does not need the writer
+        self.store.put("empty", "")
+        self.assertEqual(call(self.app, 'GET', '/get/empty').json(), {"empty": ""})
+
+    def test_other_requests_are_forwarded_to_the_writer(self):
+        self.assertEqual(call(self.app, 'POST', '/put', body={"foo": "bar"}).status_code, 200)
+        self.assertEqual(self.store.get("foo"), "bar")
+        self.assertEqual(call(self.app, 'GET', '/get/foo').json(), {"foo": "bar"})
+        self.assertEqual(call(self.app, 'GET', '/get/missing').status_code, 404)
+        self.assertEqual(call(self.app, 'POST', '/put', body={"a": "1", "b": "2"}).status_code, 400)
+
+        response = call(self.app, 'GET', '/snapshot', 'limit=10')
+        self.assertEqual(len(response.json()['data']), 10)
+
+    def test_mget_asks_the_writer_for_the_missing_keys(self):
+        key, value = next(iter(self.data.items()))
+        self.store.delete(key)
+        call(self.app, 'POST', '/put', body={key: value})
+        second_key = list(self.data)[1]
+        self.assertEqual(call(self.app, 'POST', '/mget', body=[key, second_key, 'missing']).json(),
+                         {key: value, second_key: self.data[second_key]})
+
+    def test_unreachable_writer(self):
+        self.writer.shutdown()
+        self.writer.server_close()
+        response = call(self.app, 'POST', '/put', body={"foo": "bar"})
+        self.assertEqual(response.status_code, 500)
+
+
+class PreforkServerTestCase(unittest.TestCase):
+    def test_workers_share_the_port_and_the_store(self):
+        store = SharedMemoryStore(max_keys=1000, max_bytes=1024 * 1024)
+        port = get_free_port()
+        pids = prefork.start_workers(store, '127.0.0.1:1', '127.0.0.1', port, num_workers=2, threads=2)
+        try:
+            store.put("foo", "bar")
+            url = 'http://127.0.0.1:{}/get/foo'.format(port)
+            deadline = time.time() + 10
+            while True:
+                try:
+                    response = requests.get(url, timeout=1)
+                    break
+                except requests.exceptions.ConnectionError:
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(0.05)
+            self.assertEqual(json.loads(response.text), {"foo": "bar"})
+
+            store.put("foo", "baz")
+            self.assertEqual(requests.get(url, timeout=1).json(), {"foo": "baz"})
+        finally:
+            for pid in pids:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
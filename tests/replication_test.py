@@ -0,0 +1,319 @@
+import itertools
+import threading
+import time
+import unittest
+from unittest import mock
+
+from thunderdb.config import Config
+from thunderdb.compute import batching
+from thunderdb.compute.batching import Acknowledgement, BatchingQueue
+from thunderdb.compute.engine import Engine
+from thunderdb.compute.node import Node
+from thunderdb.compute.replication import ReplicationPipeline, ACK_PRIMARY, ACK_QUORUM, ACK_ALL
+from thunderdb.exceptions.errors import KeyValueStoreException, ServiceError
+
+
+def create_engine(node_id=0, num_nodes=3, replication_factor=3):
+    config = Config(node_id, "node{}".format(node_id), (node_id + 1) % num_nodes,
+                    "node{}".format((node_id + 1) % num_nodes), replication_factor=replication_factor)
+    config.add({n: "node{}".format(n) for n in range(num_nodes)})
+    return Engine(config)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("The condition was not met in time")
+        time.sleep(0.001)
+
+
+class BatchingQueueTestCase(unittest.TestCase):
+    def create_queue(self, send, **kwargs):
+        queue = BatchingQueue("test", send, **kwargs)
+        self.addCleanup(queue.close)
+        return queue
+
+    def test_writes_queued_during_a_send_are_batched(self):
+        batches = []
+        sending = threading.Event()
+        release = threading.Event()
+
+        def send(data):
+            batches.append(data)
+            sending.set()
+            release.wait()
+
+        queue = self.create_queue(send)
+        queue.put({"a": 1})
+        sending.wait()
+        for i in range(100):
+            queue.put({"key{}".format(i): i})
+        queue.put({"a": 2})
+        release.set()
+
+        self.assertTrue(queue.flush(5))
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(batches[0], {"a": 1})
+        self.assertEqual(len(batches[1]), 101)
+        self.assertEqual(list(batches[1])[-1], "a")
+        self.assertEqual(batches[1]["a"], 2)
+
+    def test_batches_are_capped(self):
+        batches = []
+        queue = self.create_queue(batches.append, max_batch_size=10, linger=0.05)
+        queue.put({i: i for i in range(25)})
+        self.assertTrue(queue.flush(5))
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+        self.assertEqual([key for batch in batches for key in batch], list(range(25)))
+
+    def test_failed_batches_are_retried(self):
+        batches = []
+
+        def send(data):
+            if not batches:
+                batches.append(None)
+                raise ServiceError("Request failed")
+            batches.append(data)
+
+        acknowledgement = Acknowledgement(1, 1)
+        with mock.patch.object(batching, "RETRY_DELAY", 0.01), mock.patch("traceback.print_exc"):
+            queue = self.create_queue(send)
+            queue.put({"a": 1}, acknowledgement)
+            self.assertFalse(acknowledgement.wait(5))
+            self.assertTrue(queue.flush(5))
+        self.assertEqual(batches[-1], {"a": 1})
+
+    def test_only_transient_failures_are_retried(self):
+        self.assertTrue(batching.is_retryable(ServiceError("Request failed", exception="ConnectionError()")))
+        self.assertTrue(batching.is_retryable(ServiceError("Request Failed", status_code=503)))
+        self.assertTrue(batching.is_retryable(ServiceError("Request Failed", status_code=429)))
+        self.assertTrue(batching.is_retryable(ConnectionResetError()))
+        self.assertFalse(batching.is_retryable(ServiceError("Request Failed", status_code=400)))
+        self.assertFalse(batching.is_retryable(ServiceError("Request Failed", rejected=True)))
+        self.assertFalse(batching.is_retryable(KeyValueStoreException("Too large")))
+
+    def test_rejected_writes_are_dropped_without_blocking_the_queue(self):
+        batches = []
+        sending = threading.Event()
+        release = threading.Event()
+
+        def send(data):
+            sending.set()
+            release.wait(5)
+            if "bad" in data:
+                raise ServiceError("Request Failed", status_code=400)
+            batches.append(data)
+
+        acknowledgement = Acknowledgement(1, 1)
+        with mock.patch("traceback.print_exc") as print_exc:
+            queue = self.create_queue(send)
+            queue.put({"first": 0})
+            sending.wait(5)
+            queue.put({i: i for i in range(10)})
+            queue.put({"bad": "too large"}, acknowledgement)
+            queue.put({i: i for i in range(10, 20)})
+            release.set()
+            self.assertTrue(queue.flush(5))
+            self.assertFalse(acknowledgement.wait(5))
+            queue.put({"after": 1})
+            self.assertTrue(queue.flush(5))
+
+        self.assertEqual(queue.rejected, 1)
+        print_exc.assert_called_once()
+        self.assertEqual([key for batch in batches for key in batch], ["first"] + list(range(20)) + ["after"])
+
+    def test_oldest_writes_are_dropped_beyond_the_limit(self):
+        release = threading.Event()
+        queue = self.create_queue(lambda data: release.wait(), max_pending=10)
+        queue.put({"first": 0})
+        queue.put({i: i for i in range(20)})
+        self.assertLessEqual(len(queue), 10)
+        self.assertGreaterEqual(queue.dropped, 10)
+        release.set()
+
+    def test_linger_adapts_to_the_rate_of_writes(self):
+        queue = self.create_queue(lambda data: None, max_linger=0.005)
+        self.assertEqual(queue.current_linger(), 0.0)
+        # Fewer than MIN_LINGER_WRITES writes are expected within the longest linger
+        queue.rate = 100
+        self.assertEqual(queue.current_linger(), 0.0)
+        lingers = []
+        for rate in (1000, 20000, 40000, 100000, 1000000):
+            queue.rate = rate
+            lingers.append(queue.current_linger())
+        self.assertEqual(lingers[:2], [0.005, 0.005])
+        # Past the rate which fills a target batch within max_linger, the linger is the time it takes to fill
+        for linger, expected in zip(lingers[2:], (0.0025, 0.001, 0.0001)):
+            self.assertAlmostEqual(linger, expected)
+
+    def test_linger_stops_once_a_target_batch_is_queued(self):
+        sending = threading.Event()
+        release = threading.Event()
+        queue = self.create_queue(lambda data: (sending.set(), release.wait()), max_linger=0.005,
+                                  target_batch_size=10)
+        queue.put({"first": 0})
+        sending.wait()
+        queue.put({i: i for i in range(5)})
+        queue.rate = 100000
+        self.assertAlmostEqual(queue.current_linger(), 0.00005)
+        queue.put({i: i for i in range(5, 20)})
+        self.assertEqual(queue.current_linger(), 0.0)
+        release.set()
+
+    def test_flush_does_not_wait_for_the_writes_queued_during_the_call(self):
+        sent = []
+        queue = self.create_queue(lambda data: (sent.extend(data), time.sleep(0.001)))
+        stop = threading.Event()
+
+        def write(writer):
+            for i in itertools.count():
+                if stop.is_set():
+                    return
+                queue.put({(writer, i): i})
+                time.sleep(0.0001)
+
+        writers = [threading.Thread(target=write, args=(writer,)) for writer in range(4)]
+        for writer in writers:
+            writer.start()
+        try:
+            wait_until(lambda: len(sent) > 100)
+            queue.put({"flushed": 1})
+            self.assertTrue(queue.flush(2))
+            self.assertIn("flushed", sent)
+            self.assertFalse(stop.is_set())
+        finally:
+            stop.set()
+            for writer in writers:
+                writer.join()
+
+    def test_full_batches_are_sent_without_lingering(self):
+        batches = []
+        queue = self.create_queue(batches.append, max_batch_size=10, max_linger=60)
+        queue.rate = 1000000
+        started_at = time.monotonic()
+        queue.put({i: i for i in range(10)})
+        self.assertTrue(queue.flush(5))
+        self.assertLess(time.monotonic() - started_at, 5)
+        self.assertEqual(batches, [{i: i for i in range(10)}])
+        self.assertGreater(queue.rate, 0)
+
+    def test_writes_are_readable_until_sent(self):
+        sending = threading.Event()
+        release = threading.Event()
+        queue = self.create_queue(lambda data: (sending.set(), release.wait()))
+        queue.put({"a": 1})
+        sending.wait()
+        queue.put({"b": 2})
+        self.assertEqual((queue.get("a"), queue.get("b"), queue.get("c")), (1, 2, None))
+        release.set()
+        self.assertTrue(queue.flush(5))
+        self.assertIsNone(queue.get("a"))
+
+
+class AcknowledgementTestCase(unittest.TestCase):
+    def test_complete_once_enough_peers_succeeded(self):
+        acknowledgement = Acknowledgement(2, 3)
+        acknowledgement.succeed()
+        self.assertFalse(acknowledgement.wait(0))
+        acknowledgement.succeed()
+        self.assertTrue(acknowledgement.wait(0))
+
+    def test_complete_once_too_many_peers_failed(self):
+        acknowledgement = Acknowledgement(2, 3)
+        acknowledgement.succeed()
+        acknowledgement.fail()
+        acknowledgement.fail()
+        self.assertTrue(acknowledgement.future.done())
+        self.assertFalse(acknowledgement.wait(0))
+
+
+class ReplicationPipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(Node, "replicate_batch")
+        self.replicate_batch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_engine(self, **kwargs):
+        engine = create_engine(**kwargs)
+        self.addCleanup(engine.replication.close)
+        return engine
+
+    def replicated(self):
+        replicated = {}
+        for (node_ip, data), _ in self.replicate_batch.call_args_list:
+            replicated.setdefault(node_ip, {}).update(data)
+        return replicated
+
+    def test_required_acknowledgements(self):
+        self.assertEqual(ReplicationPipeline.required_acknowledgements(ACK_PRIMARY, 2), 0)
+        self.assertEqual(ReplicationPipeline.required_acknowledgements(ACK_QUORUM, 1), 1)
+        self.assertEqual(ReplicationPipeline.required_acknowledgements(ACK_QUORUM, 2), 1)
+        self.assertEqual(ReplicationPipeline.required_acknowledgements(ACK_QUORUM, 4), 2)
+        self.assertEqual(ReplicationPipeline.required_acknowledgements(ACK_ALL, 2), 2)
+
+    def test_owned_writes_are_sent_to_the_next_nodes(self):
+        engine = self.create_engine(node_id=1, num_nodes=4)
+        key = next(key for key in map(str, range(1000)) if engine.hash_ring.get_node_id(key) == 1)
+        engine.put(key, "value")
+
+        self.assertTrue(engine.replication.flush(5))
+        self.assertEqual(self.replicated(), {"node2": {key: "value"}, "node3": {key: "value"}})
+        self.assertEqual(engine.storage.get(key), "value")
+
+    def test_put_many_replicates_the_local_partition(self):
+        engine = self.create_engine(num_nodes=3, replication_factor=2)
+        data = {str(i): i for i in range(1000)}
+        with mock.patch.object(Node, "put_batch"):
+            engine.put_many(data)
+
+        self.assertTrue(engine.replication.flush(5))
+        owned = engine.hash_ring.get_node_ids(data)[0]
+        self.assertEqual(self.replicated(), {"node1": {key: data[key] for key in owned}})
+
+    def test_default_writes_do_not_wait_for_replicas(self):
+        release = threading.Event()
+        self.replicate_batch.side_effect = lambda node_ip, data: release.wait()
+        engine = self.create_engine()
+        key = next(key for key in map(str, range(1000)) if engine.hash_ring.get_node_id(key) == 0)
+
+        engine.put(key, "value")
+        self.assertEqual(engine.storage.get(key), "value")
+        release.set()
+
+    def test_quorum_writes_fail_without_enough_replicas(self):
+        engine = self.create_engine(num_nodes=3)
+        engine.replication.ack_timeout = 0.1
+        key = next(key for key in map(str, range(1000)) if engine.hash_ring.get_node_id(key) == 0)
+
+        engine.put(key, "value", ack=ACK_QUORUM)
+        engine.put(key, "value", ack=ACK_ALL)
+
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.replicate_batch.side_effect = \
+            lambda node_ip, data: release.wait() if node_ip == "node2" else None
+        engine.put(key, "value", ack=ACK_QUORUM)
+        with self.assertRaises(ServiceError):
+            engine.put(key, "value", ack=ACK_ALL)
+
+    def test_no_replication_on_a_single_node(self):
+        engine = self.create_engine(num_nodes=1)
+        engine.put("foo", "bar", ack=ACK_ALL)
+        self.assertTrue(engine.replication.flush(5))
+        self.replicate_batch.assert_not_called()
+
+    def test_forwarded_writes_keep_their_acknowledgement_mode(self):
+        engine = self.create_engine(num_nodes=3)
+        key = next(key for key in map(str, range(1000)) if engine.hash_ring.get_node_id(key) == 1)
+        with mock.patch.object(Node, "put") as put:
+            engine.put(key, "value", ack=ACK_QUORUM)
+        put.assert_called_once_with("node1", key, "value", ack=ACK_QUORUM)
+
+    def test_unknown_replication_factor(self):
+        with self.assertRaises(ValueError):
+            create_engine(replication_factor=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,690 @@
+import multiprocessing
+import itertools
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+import unittest.mock
+import uuid
+
+from thunderdb.storage.backends import create_store
+from thunderdb.storage.capped_store import CappedStore, TimerWheel, WHEEL_BITS
+from thunderdb.storage.compact_store import CompactStore
+from thunderdb.storage.filtered_store import BloomFilter, CountingBloomFilter, FilteredStore, MAX_COUNT
+from thunderdb.storage import filtered_store
+from thunderdb.storage.eviction import LFUPolicy, LRUPolicy, SampledLRUPolicy, create_eviction_policy
+from thunderdb.exceptions.errors import KeyValueStoreException, ServiceError
+from thunderdb.storage.in_memory_store import InMemoryStore
+from thunderdb.storage.ordered_store import OrderedIndex, OrderedStore, prefix_range
+from thunderdb.storage import ordered_store
+from thunderdb.storage.shared_store import SharedMemoryStore
+
+
+SAMPLE_DATA_FILE = "sample_data/data_demo_10000.txt"
+
+
+def load_sample_data():
+    with open(SAMPLE_DATA_FILE) as data_file:
+        return dict(line.split() for line in data_file)
+
+
+class KeyValueStoreTestMixin(object):
+    """Tests shared by every KeyValueStore implementation"""
+    def create_store(self):
+        raise NotImplementedError
+
+    def test_put_and_get(self):
+        store = self.create_store()
+        store.put("foo", "bar")
+        self.assertEqual(store.get("foo"), "bar")
+        self.assertIsNone(store.get("missing"))
+        self.assertEqual(len(store), 1)
+
+    def test_overwrite_and_delete(self):
+        store = self.create_store()
+        key = str(uuid.uuid4())
+        store.put(key, str(uuid.uuid4()))
+        store.put(key, "not a uuid")
+        self.assertEqual(store.get(key), "not a uuid")
+
+        store.delete(key)
+        store.delete(key)
+        self.assertIsNone(store.get(key))
+        self.assertEqual(len(store), 0)
+
+        store.put(key, "revived")
+        self.assertEqual(store.get(key), "revived")
+
+    def test_put_batch_and_items(self):
+        store = self.create_store()
+        data = load_sample_data()
+        data.update({"foo": "bar", str(uuid.uuid4()): "h\xe9llo", str(uuid.uuid4()).upper(): "upper", "n": 42})
+        store.put_batch(data)
+
+        self.assertEqual(len(store), len(data))
+        self.assertEqual(dict(store.items()), data)
+        for key, value in data.items():
+            self.assertEqual(store.get(key), value)
+
+    def test_put_batch_if_absent_keeps_existing_values(self):
+        store = self.create_store()
+        existing, deleted, new = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+        store.put_batch({existing: "old", deleted: "old", "foo": "old"})
+        store.delete(deleted)
+
+        stored = store.put_batch_if_absent({existing: "new", deleted: "new", new: "new", "foo": "new", "bar": "new"})
+        self.assertEqual(stored, {deleted: "new", new: "new", "bar": "new"})
+        self.assertEqual(dict(store.items()), {existing: "old", deleted: "new", new: "new", "foo": "old", "bar": "new"})
+
+    def test_items_is_a_copy(self):
+        store = self.create_store()
+        store.put_batch({"a": "1", "b": "2"})
+        items = store.items()
+        store.put("c", "3")
+        self.assertEqual(dict(items), {"a": "1", "b": "2"})
+
+    def test_scan_pages_through_the_store(self):
+        store = self.create_store()
+        data = load_sample_data()
+        data.update({"foo": "bar", "n": 42})
+        store.put_batch(data)
+
+        scanned, cursor = [], None
+        while True:
+            items, cursor = store.scan(cursor, 999)
+            self.assertLessEqual(len(items), 999)
+            scanned.extend(items)
+            if cursor is None:
+                break
+        self.assertEqual(len(scanned), len(data))
+        self.assertEqual(dict(scanned), data)
+
+    def test_iter_pages_tolerates_concurrent_changes(self):
+        store = self.create_store()
+        data = load_sample_data()
+        store.put_batch(data)
+
+        scanned = {}
+        for page in store.iter_pages(limit=500):
+            scanned.update(page)
+            store.put(str(uuid.uuid4()), "added while scanning")
+        self.assertEqual({key: scanned[key] for key in data}, data)
+
+    def test_range_scan_returns_the_keys_of_a_range_in_order(self):
+        store = self.create_store()
+        data = load_sample_data()
+        data.update({"tenant1:a": "1", "tenant1:b": "2", "tenant2:a": "3"})
+        store.put_batch(data)
+        store.delete("tenant1:b")
+
+        start, end = prefix_range("tenant1:")
+        self.assertEqual(store.range_scan(start, end), ([("tenant1:a", "1")], None))
+
+        expected = sorted((key, value) for key, value in data.items() if "1" <= key < "8" and key != "tenant1:b")
+        scanned, cursor = [], None
+        while True:
+            items, cursor = store.range_scan("1", "8", 333, cursor)
+            self.assertLessEqual(len(items), 333)
+            scanned.extend(items)
+            if cursor is None:
+                break
+        self.assertEqual(scanned, expected)
+
+
+class InMemoryStoreTestCase(KeyValueStoreTestMixin, unittest.TestCase):
+    def create_store(self):
+        return InMemoryStore()
+
+    def test_scan_does_not_skip_keys_deleted_or_added_between_pages(self):
+        store = self.create_store()
+        store.put_batch({"k{}".format(i): i for i in range(6)})
+        items, cursor = store.scan(limit=3)
+        self.assertEqual([key for key, _ in items], ["k0", "k1", "k2"])
+        store.delete("k0")
+        store.delete("k4")
+        store.put("k6", 6)
+        store.put("k1", "overwritten")
+
+        items, cursor = store.scan(cursor, 3)
+        self.assertEqual(items, [("k3", 3), ("k5", 5), ("k6", 6)])
+        self.assertEqual(store.scan(cursor, 3), ([], None))
+
+    def test_scan_cursors_survive_a_compaction(self):
+        store = self.create_store()
+        store.put_batch({i: i for i in range(5000)})
+        items, cursor = store.scan(limit=100)
+        for i in range(5000):
+            if i % 4:
+                store.delete(i)
+        self.assertLess(len(store._order._keys), 5000)
+        for i in range(5000, 5100):
+            store.put(i, i)
+
+        scanned = []
+        while cursor is not None:
+            items, cursor = store.scan(cursor, 100)
+            scanned.extend(key for key, _ in items)
+        self.assertEqual(scanned, list(range(100, 5000, 4)) + list(range(5000, 5100)))
+
+    def test_keys_added_during_compactions_are_scanned(self):
+        store = self.create_store()
+        done = threading.Event()
+
+        def churn():
+            for i in range(20000):
+                store.put(("churn", i), i)
+                store.delete(("churn", i))
+            done.set()
+        thread = threading.Thread(target=churn)
+        thread.start()
+        i = 0
+        while not done.is_set():
+            store.put(i, i)
+            i += 1
+        thread.join()
+
+        scanned = [key for page in store.iter_pages(limit=1000) for key, _ in page]
+        self.assertEqual(scanned, list(range(i)))
+
+    def test_keys_added_again_are_returned_once_per_page(self):
+        store = self.create_store()
+        store.put_batch({i: i for i in range(10)})
+        items, cursor = store.scan(limit=2)
+        store.delete(5)
+        store.put(5, "added again")
+        store.put(5, "overwritten")
+        store.put(3, "overwritten")
+
+        items, cursor = store.scan(cursor, 100)
+        # The key is listed at its first place and at its new one, but returned once
+        self.assertEqual(items, [(2, 2), (3, "overwritten"), (4, 4), (5, "overwritten"), (6, 6), (7, 7), (8, 8),
+                                 (9, 9)])
+        self.assertIsNone(cursor)
+
+    def test_compaction_drops_removed_and_duplicate_keys(self):
+        store = self.create_store()
+        store.put_batch({i: i for i in range(3000)})
+        for i in range(2000):
+            store.delete(i)
+        store.delete(2999)
+        store.put(2999, "added again")
+        self.assertLessEqual(len(store._order._keys), 2 * len(store))
+        self.assertEqual(dict(store.scan(limit=5000)[0]), {**{i: i for i in range(2000, 2999)}, 2999: "added again"})
+
+
+class OrderedStoreTestCase(KeyValueStoreTestMixin, unittest.TestCase):
+    def create_store(self):
+        return OrderedStore()
+
+    def test_existing_keys_are_indexed(self):
+        store = InMemoryStore()
+        store.put_batch({"b": "2", "a": "1"})
+        self.assertEqual(OrderedStore(store).range_scan(), ([("a", "1"), ("b", "2")], None))
+
+    def test_index_matches_a_sorted_set(self):
+        index = OrderedIndex()
+        expected = set()
+        keys = ["{:04}".format(i) for i in range(0, 5000, 7)]
+        with unittest.mock.patch.object(ordered_store, 'CHUNK_SIZE', 8):
+            for position, key in enumerate(keys):
+                index.add(key)
+                expected.add(key)
+                if position % 3 == 0:
+                    index.discard(keys[position // 2])
+                    expected.discard(keys[position // 2])
+            index.update(["{:04}".format(i) for i in range(10)])
+            expected.update("{:04}".format(i) for i in range(10))
+
+        self.assertEqual(list(index), sorted(expected))
+        self.assertEqual(len(index), len(expected))
+        self.assertIn("0007", index)
+        self.assertNotIn("0013", index)
+        self.assertEqual(list(index.irange("0100", "0200", after="0150")),
+                         sorted(key for key in expected if "0150" < key < "0200"))
+        self.assertEqual(list(index.irange(after="4999")), [])
+
+    def test_prefix_range(self):
+        self.assertEqual(prefix_range("tenant123:"), ("tenant123:", "tenant123;"))
+        self.assertEqual(prefix_range("a\U0010ffff"), ("a\U0010ffff", "b"))
+        self.assertEqual(prefix_range("\U0010ffff"), ("\U0010ffff", None))
+
+
+class FilteredStoreTestCase(KeyValueStoreTestMixin, unittest.TestCase):
+    def create_store(self):
+        return FilteredStore()
+
+    def test_filter_follows_the_keys_of_the_store(self):
+        store = InMemoryStore()
+        store.put("existing", "value")
+        store = FilteredStore(store, capacity=1000)
+        store.put("a", "1")
+        store.put("a", "2")
+        store.put_batch({"b": "1", "c": "1"})
+        store.delete("a")
+        store.delete("missing")
+
+        for key in ("existing", "b", "c"):
+            self.assertIn(key, store.key_filter)
+        self.assertNotIn("a", store.key_filter)
+        self.assertEqual(sum("missing{}".format(i) in store.key_filter for i in range(1000)), 0)
+
+    def test_expiring_writes_reach_the_inner_store(self):
+        store = FilteredStore(CappedStore())
+        self.assertTrue(store.supports_expiration)
+        store.put("key", "value", expires_at=time.time() - 1)
+        self.assertIsNone(store.get("key"))
+        # Expired keys stay in the filter, which only costs a false positive
+        self.assertIn("key", store.key_filter)
+
+
+class BloomFilterTestCase(unittest.TestCase):
+    def test_false_positive_rate_matches_the_capacity(self):
+        key_filter = CountingBloomFilter(capacity=2000, error_rate=0.01)
+        for i in range(2000):
+            key_filter.add(str(i))
+
+        self.assertTrue(all(str(i) in key_filter for i in range(2000)))
+        false_positives = sum("other{}".format(i) in key_filter for i in range(20000))
+        self.assertLess(false_positives, 20000 * 0.02)
+
+    def test_saturated_counters_are_never_decremented(self):
+        key_filter = CountingBloomFilter(capacity=10)
+        for _ in range(MAX_COUNT + 10):
+            key_filter.add("key")
+        for _ in range(MAX_COUNT + 10):
+            key_filter.remove("key")
+        self.assertIn("key", key_filter)
+
+    def test_copies_follow_the_deltas(self):
+        key_filter = CountingBloomFilter(capacity=1000)
+        key_filter.add("a")
+        copy = BloomFilter(key_filter.delta())
+        self.assertIn("bits", key_filter.delta())
+        self.assertIn("a", copy)
+
+        key_filter.add("b")
+        key_filter.remove("a")
+        delta = key_filter.delta(copy.version, copy.generation)
+        self.assertNotIn("bits", delta)
+        copy.apply(delta)
+        self.assertIn("b", copy)
+        self.assertNotIn("a", copy)
+        self.assertEqual(copy.version, key_filter.version)
+
+        # The filter of another process of the node is sent whole
+        self.assertIn("bits", key_filter.delta(copy.version, "other"))
+
+    def test_whole_filter_is_sent_once_the_changes_are_dropped(self):
+        key_filter = CountingBloomFilter(capacity=1000)
+        copy = BloomFilter(key_filter.delta())
+        with unittest.mock.patch.object(filtered_store, 'MAX_CHANGES', 10):
+            for i in range(100):
+                key_filter.add(str(i))
+        delta = key_filter.delta(copy.version, copy.generation)
+        self.assertIn("bits", delta)
+        copy.apply(delta)
+        self.assertTrue(all(str(i) in copy for i in range(100)))
+
+
+class CompactStoreTestCase(KeyValueStoreTestMixin, unittest.TestCase):
+    def create_store(self):
+        return CompactStore()
+
+    def test_resize_drops_deleted_entries(self):
+        store = CompactStore()
+        data = load_sample_data()
+        store.put_batch(data)
+        for key in list(data)[::2]:
+            store.delete(key)
+            del data[key]
+        store.put_batch({str(uuid.uuid4()): str(uuid.uuid4()) for _ in range(10000)})
+        data.update(dict(store.items()))
+
+        self.assertEqual(len(store), len(data))
+        for key, value in data.items():
+            self.assertEqual(store.get(key), value)
+
+    def test_scan_does_not_skip_keys_deleted_before_a_resize(self):
+        store = CompactStore()
+        keys = [str(uuid.uuid4()) for _ in range(600)]
+        store.put_batch(dict.fromkeys(keys, "value"))
+        store.put_batch({"overflow-{}".format(i): i for i in range(600)})
+        items, cursor = store.scan(limit=300)
+        for key, _ in items[:200]:
+            store.delete(key)
+        # Enough keys to resize the table, which drops the deleted entries
+        capacity = len(store._index)
+        store.put_batch({str(uuid.uuid4()): "added" for _ in range(800)})
+        self.assertGreater(len(store._index), capacity)
+
+        scanned = []
+        while cursor is not None:
+            page, cursor = store.scan(cursor, 300)
+            scanned.extend(key for key, _ in page)
+            if cursor is not None and cursor.startswith('o'):
+                for i in range(0, 600, 2):
+                    store.delete("overflow-{}".format(i))
+        self.assertTrue(set(keys[300:]).issubset(scanned))
+        self.assertTrue({"overflow-{}".format(i) for i in range(1, 600, 2)}.issubset(scanned))
+        self.assertEqual(len(scanned), len(set(scanned)))
+
+    def test_overwritten_arena_values_are_reclaimed(self):
+        store = CompactStore()
+        key = str(uuid.uuid4())
+        for i in range(20000):
+            store.put(key, "value-{}".format(i) * 10)
+        self.assertEqual(store.get(key), "value-19999" * 10)
+        self.assertLess(len(store._arena), 4 * 1024 * 1024)
+
+    def test_uuid_records_use_less_memory_than_a_dictionary(self):
+        records = [(uuid.uuid4().int, uuid.uuid4().int) for _ in range(10000)]
+        usage = {}
+        for store_class in (InMemoryStore, CompactStore):
+            tracemalloc.start()
+            store = store_class()
+            for key, value in records:
+                store.put(str(uuid.UUID(int=key)), str(uuid.UUID(int=value)))
+            usage[store_class] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del store
+
+        self.assertLess(usage[CompactStore] * 3, usage[InMemoryStore])
+
+
+def read_consistent_values(store, keys, num_reads, errors):
+    """Read keys whose values repeat their version, counting the torn values read"""
+    torn = 0
+    for i in range(num_reads):
+        value = store.get(keys[i % len(keys)])
+        if value is not None and value != value[:8] * (len(value) // 8):
+            torn += 1
+    errors.put(torn)
+
+
+class SharedMemoryStoreTestCase(KeyValueStoreTestMixin, unittest.TestCase):
+    def create_store(self):
+        return SharedMemoryStore(max_keys=50000, max_bytes=16 * 1024 * 1024)
+
+    def test_compaction_reclaims_deleted_and_overwritten_records(self):
+        store = SharedMemoryStore(max_keys=100, max_bytes=4096)
+        store.put("foo", "bar")
+        for i in range(1000):
+            store.put("key-{}".format(i), "value")
+            store.delete("key-{}".format(i))
+            store.put("overwritten", str(i))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(dict(store.items()), {"foo": "bar", "overwritten": "999"})
+
+    def test_scan_starts_over_after_a_compaction(self):
+        store = SharedMemoryStore(max_keys=100, max_bytes=1024 * 1024)
+        store.put_batch({"key-{}".format(i): "value" for i in range(50)})
+        items, cursor = store.scan(limit=10)
+        for i in range(50, 200):
+            store.put("key-{}".format(i), "value")
+            store.delete("key-{}".format(i))
+
+        scanned = dict(items)
+        while cursor is not None:
+            items, cursor = store.scan(cursor, 10)
+            scanned.update(items)
+        self.assertEqual(scanned, {"key-{}".format(i): "value" for i in range(50)})
+
+    def test_full_store(self):
+        store = SharedMemoryStore(max_keys=10, max_bytes=1024)
+        with self.assertRaises(ServiceError):
+            store.put_batch({"key-{}".format(i): "value" for i in range(100)})
+        with self.assertRaises(ServiceError):
+            store.put("foo", "x" * 1024)
+        self.assertIsNone(store.get("foo"))
+
+    def test_file_backed_store_survives_reopening(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'store')
+            store = SharedMemoryStore(max_keys=1000, max_bytes=1024 * 1024, path=path)
+            store.put_batch({"foo": "bar", "n": 42})
+            store.close()
+
+            store = SharedMemoryStore(max_keys=1000, max_bytes=1024 * 1024, path=path)
+            self.assertEqual(dict(store.items()), {"foo": "bar", "n": 42})
+            store.close()
+
+            with self.assertRaises(ValueError):
+                SharedMemoryStore(max_keys=10000, max_bytes=1024 * 1024, path=path)
+
+    def test_forked_readers_see_writes_without_torn_values(self):
+        store = SharedMemoryStore(max_keys=1000, max_bytes=64 * 1024 * 1024)
+        keys = ["key-{}".format(i) for i in range(100)]
+        context = multiprocessing.get_context('fork')
+        errors = context.Queue()
+        reader = context.Process(target=read_consistent_values, args=(store, keys, 200000, errors))
+        reader.start()
+
+        version = 0
+        while reader.is_alive() and version < 100000:
+            version += 1
+            store.put(keys[version % len(keys)], "{:08d}".format(version) * (1 + version % 16))
+        reader.join()
+
+        self.assertEqual(errors.get(timeout=10), 0)
+        self.assertEqual(store.get(keys[version % len(keys)]), "{:08d}".format(version) * (1 + version % 16))
+
+
+class CappedStoreTestCase(KeyValueStoreTestMixin, unittest.TestCase):
+    def create_store(self):
+        return CappedStore()
+
+    def test_evicts_the_least_recently_used_keys_to_fit_its_budget(self):
+        store = CappedStore(max_bytes=10 * 1000)
+        keys = ["{:04d}".format(i) for i in range(100)]
+        for key in keys:
+            store.put(key, "value")
+            store.get(keys[0])
+
+        self.assertLessEqual(store.size_bytes, store.max_bytes)
+        self.assertGreater(store.evictions, 0)
+        self.assertEqual(len(store) + store.evictions, len(keys))
+        self.assertEqual(store.get(keys[0]), "value")
+        self.assertEqual(store.get(keys[-1]), "value")
+        self.assertIsNone(store.get(keys[1]))
+
+        store.put(keys[-1], "x" * 1000)
+        self.assertLessEqual(store.size_bytes, store.max_bytes)
+        with self.assertRaises(KeyValueStoreException):
+            store.put("too large", "x" * store.max_bytes)
+
+    def test_keys_expire_at_their_expiration_time(self):
+        now = [1000.0]
+        store = CappedStore(clock=lambda: now[0])
+        self.addCleanup(store.close)
+        store.put_batch({"a": "1", "b": "2"}, expires_at=1010.0)
+        store.put("c", "3", expires_at=1020.0)
+        store.put("d", "4")
+        store.put("b", "persistent")
+        self.assertEqual(store.expiration_time("a"), 1010.0)
+        self.assertIsNone(store.expiration_time("b"))
+
+        now[0] = 1015.0
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(dict(store.items()), {"b": "persistent", "c": "3", "d": "4"})
+        self.assertEqual(store.expire(), 0)
+
+        now[0] = 1020.0
+        self.assertEqual(store.expire(), 1)
+        self.assertEqual(dict(store.items()), {"b": "persistent", "d": "4"})
+        self.assertEqual(store.stats()['expirations'], 2)
+        self.assertEqual(store.stats()['expiring_keys'], 0)
+
+    def test_expired_keys_are_absent(self):
+        now = [1000.0]
+        store = CappedStore(clock=lambda: now[0])
+        self.addCleanup(store.close)
+        store.put_batch({"a": "1", "b": "2"}, expires_at=1010.0)
+        now[0] = 1015.0
+        self.assertEqual(store.put_batch_if_absent({"a": "new"}, expires_at=1020.0), {"a": "new"})
+        self.assertEqual(store.expiration_time("a"), 1020.0)
+        self.assertEqual(dict(store.items()), {"a": "new"})
+
+    def test_keys_are_expired_in_the_background(self):
+        store = CappedStore(timer_resolution=0.01)
+        self.addCleanup(store.close)
+        store.put("a", "1", expires_at=time.time() + 0.05)
+        deadline = time.time() + 5
+        while len(store) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.expirations, 1)
+
+    def test_scan_does_not_skip_keys_after_evictions(self):
+        keys = ["{:04d}".format(i) for i in range(10)]
+        store = CappedStore(max_bytes=11 * CappedStore()._size(keys[0], "value"))
+        store.put_batch({key: "value" for key in keys})
+        items, cursor = store.scan(limit=5)
+        self.assertEqual([key for key, _ in items], keys[:5])
+        # Evict the least recently used keys, which the scan already returned
+        store.put_batch({"new{}".format(i): "value" for i in range(3)})
+        self.assertGreater(store.evictions, 0)
+
+        scanned = []
+        while cursor is not None:
+            items, cursor = store.scan(cursor, 5)
+            scanned.extend(key for key, _ in items)
+        self.assertEqual(scanned[:5], keys[5:])
+
+    def test_ordered_index_forgets_evicted_and_expired_keys(self):
+        now = [1000.0]
+        capped = CappedStore(max_bytes=20 * CappedStore()._size("0000", "value"), clock=lambda: now[0])
+        self.addCleanup(capped.close)
+        store = OrderedStore(capped)
+        self.assertTrue(store.supports_expiration)
+        for i in range(200):
+            store.put("{:04d}".format(i), "value")
+        store.put_batch({"b{:04d}".format(i): "value" for i in range(100)})
+        self.assertEqual(len(store._index), len(capped))
+
+        store.put("expiring", "value", expires_at=1010.0)
+        self.assertEqual(store.expiration_time("expiring"), 1010.0)
+        now[0] = 1020.0
+        capped.expire()
+        self.assertNotIn("expiring", store._index)
+        self.assertEqual(len(store._index), len(capped))
+
+    def test_range_scan_skips_keys_removed_from_the_inner_store(self):
+        store = OrderedStore(InMemoryStore())
+        store.put_batch({"{:02d}".format(i): i for i in range(20)})
+        for i in range(10):
+            # Removed behind the back of the ordered store
+            store.store.delete("{:02d}".format(i))
+        self.assertEqual(store.range_scan(limit=5), ([("{:02d}".format(i), i) for i in range(10, 15)], "14"))
+        self.assertEqual(store.range_scan(limit=5, cursor="14")[1], "19")
+        self.assertEqual(store.range_scan(limit=5, cursor="19"), ([], None))
+
+    def test_eviction_policy_by_name(self):
+        self.assertIsInstance(CappedStore(eviction="lfu").policy, LFUPolicy)
+        with self.assertRaises(ValueError):
+            CappedStore(eviction="unknown")
+
+
+class TimerWheelTestCase(unittest.TestCase):
+    def test_keys_are_returned_once_their_time_has_passed(self):
+        wheel = TimerWheel(resolution=1.0, now=0)
+        expiration_times = {str(seconds): seconds for seconds in
+                            [1, 2, 63, 64, 65, 100, 4095, 4096, 4097, 300000, 2 ** (4 * WHEEL_BITS) + 5]}
+        for key, expires_at in expiration_times.items():
+            wheel.schedule(key, expires_at)
+        wheel.schedule("cancelled", 50)
+        wheel.cancel("cancelled")
+        wheel.cancel("never scheduled")
+        wheel.schedule("rescheduled", 10)
+        wheel.schedule("rescheduled", 70)
+        expiration_times["rescheduled"] = 70
+
+        expired = {}
+        for now in itertools.chain(range(0, 5000), range(5000, 2 ** (4 * WHEEL_BITS) + 1000, 997)):
+            for key in wheel.advance(now):
+                expired[key] = now
+        for key, expires_at in expiration_times.items():
+            self.assertGreaterEqual(expired[key], expires_at, key)
+            if expires_at < 5000:
+                self.assertEqual(expired[key], expires_at, key)
+        self.assertEqual(len(wheel), 0)
+
+    def test_advancing_by_a_large_step_returns_every_expired_key(self):
+        wheel = TimerWheel(resolution=0.1, now=100.0)
+        for i in range(1000):
+            wheel.schedule(str(i), 100.0 + i)
+        self.assertEqual(len(wheel.advance(100.0 + 499.95)), 500)
+        self.assertEqual(len(wheel), 500)
+
+    def test_idle_ticks_are_skipped(self):
+        # A billion ticks of a millisecond: walking them one by one would take minutes
+        wheel = TimerWheel(resolution=0.001, now=0)
+        self.assertEqual(wheel.advance(10 ** 6), [])
+        wheel.schedule("soon", 10 ** 6 + 1)
+        wheel.schedule("later", 2 * 10 ** 6)
+        self.assertEqual(wheel.advance(10 ** 6 + 0.999), [])
+        self.assertEqual(wheel.advance(10 ** 6 + 1), ["soon"])
+        self.assertEqual(wheel.advance(2 * 10 ** 6 - 0.001), [])
+        self.assertEqual(wheel.advance(3 * 10 ** 6), ["later"])
+        self.assertEqual(len(wheel), 0)
+
+
+class EvictionPolicyTestCase(unittest.TestCase):
+    def test_lru_evicts_the_least_recently_used_key(self):
+        policy = LRUPolicy()
+        for key in "abc":
+            policy.add(key)
+        policy.touch("a")
+        self.assertEqual(policy.victim(), "b")
+        policy.remove("b")
+        self.assertEqual(policy.victim(), "c")
+
+    def test_lfu_evicts_the_least_frequently_used_key(self):
+        policy = LFUPolicy()
+        for key in "abcd":
+            policy.add(key)
+        for key in "aabbbcd":
+            policy.touch(key)
+        self.assertEqual(policy.victim(), "c")
+        policy.remove("c")
+        self.assertEqual(policy.victim(), "d")
+        policy.remove("d")
+        self.assertEqual(policy.victim(), "a")
+        policy.remove("a")
+        policy.remove("b")
+        self.assertIsNone(policy.victim())
+        self.assertEqual(len(policy), 0)
+
+    def test_sampled_lru_evicts_an_old_key(self):
+        policy = SampledLRUPolicy(samples=10, seed=0)
+        keys = [str(i) for i in range(1000)]
+        for key in keys:
+            policy.add(key)
+        for key in keys[:500]:
+            policy.remove(key)
+        self.assertEqual(len(policy), 500)
+
+        victims = [policy.victim() for _ in range(100)]
+        # The least recently used of 10 keys drawn from 500 is in the oldest fifth with a probability of 0.9
+        self.assertGreater(sum(int(victim) < 600 for victim in victims), 70)
+
+    def test_create_eviction_policy_by_name(self):
+        self.assertIsInstance(create_eviction_policy(), LRUPolicy)
+        self.assertIsInstance(create_eviction_policy("sampled-lru"), SampledLRUPolicy)
+        with self.assertRaises(ValueError):
+            create_eviction_policy("unknown")
+
+
+class CreateStoreTestCase(unittest.TestCase):
+    def test_create_store_by_name(self):
+        self.assertIsInstance(create_store(), InMemoryStore)
+        self.assertIsInstance(create_store("compact"), CompactStore)
+        self.assertIsInstance(create_store("shared", max_keys=10, max_bytes=1024), SharedMemoryStore)
+        self.assertIsInstance(create_store("capped", max_bytes=1024, eviction="lfu"), CappedStore)
+        with self.assertRaises(ValueError):
+            create_store("unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from unittest import mock
+
+import requests
+import thunderdb.compute.utils as request
+from thunderdb.exceptions.errors import ServiceError
+
+
+def response_with_status(status_code):
+    response = mock.Mock()
+    response.status_code = status_code
+    return response
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = request.ConnectionPool(connect_timeout=0.5, read_timeout=2, backoff_factor=0)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_sessions_are_reused_per_peer(self):
+        first = self.pool.session("http://node0/get/foo")
+        self.assertIs(self.pool.session("http://node0/put"), first)
+        self.assertIsNot(self.pool.session("http://node1/put"), first)
+
+    def test_requests_use_the_configured_timeouts(self):
+        session = self.pool.session("http://node0/get/foo")
+        with mock.patch.object(session, "get", return_value=response_with_status(200)) as get:
+            self.pool.get("http://node0/get/foo")
+        get.assert_called_once_with("http://node0/get/foo", timeout=(0.5, 2))
+
+    def test_idempotent_requests_are_retried(self):
+        session = self.pool.session("http://node0/get/foo")
+        side_effect = [requests.exceptions.ConnectionError(), requests.exceptions.Timeout(),
+                       response_with_status(200)]
+        with mock.patch.object(session, "get", side_effect=side_effect) as get:
+            self.assertEqual(self.pool.get("http://node0/get/foo").status_code, 200)
+        self.assertEqual(get.call_count, 3)
+
+    def test_requests_fail_once_the_retries_are_exhausted(self):
+        session = self.pool.session("http://node0/put")
+        with mock.patch.object(session, "post", side_effect=requests.exceptions.ConnectionError()) as post:
+            with self.assertRaises(ServiceError):
+                self.pool.post("http://node0/put", data="{}", idempotent=True)
+        self.assertEqual(post.call_count, 1 + self.pool.max_retries)
+
+    def test_non_idempotent_requests_are_not_retried(self):
+        session = self.pool.session("http://node0/put")
+        with mock.patch.object(session, "post", side_effect=requests.exceptions.Timeout()) as post:
+            with self.assertRaises(ServiceError):
+                self.pool.post("http://node0/put", data="{}")
+        self.assertEqual(post.call_count, 1)
+
+    def test_server_errors_are_not_retried(self):
+        session = self.pool.session("http://node0/get/foo")
+        with mock.patch.object(session, "get", return_value=response_with_status(500)) as get:
+            with self.assertRaises(ServiceError):
+                self.pool.get("http://node0/get/foo")
+        self.assertEqual(get.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
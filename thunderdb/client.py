@@ -0,0 +1,235 @@
+"""
+A client of ThunderDB which sends every request straight to the node owning its keys
+
+    with ThunderDBClient(['localhost:80']) as client:
+        client.put('foo', 'bar')
+        client.get('foo')
+
+A node which is asked for a key it does not own forwards the request to the
+owner, which costs a second round trip. The client fetches the membership of
+the cluster from the nodes (see /cluster) and builds the same consistent
+hash ring as they do, so it can skip that hop.
+"""
+import concurrent.futures
+import json
+import threading
+from urllib.parse import quote
+
+from thunderdb.compute import utils
+from thunderdb.exceptions.errors import ServiceError
+from thunderdb.hashing.consistent_hashing import ConsistentHash
+
+# The number of times a request is routed again after the node it was sent to
+# answered that it does not own its keys, the membership of the cluster being
+# fetched again every time. The last attempt lets the node forward the request
+DEFAULT_MAX_REDIRECTS = 2
+
+# The maximum number of requests issued concurrently by a batch operation
+MAX_CONCURRENT_REQUESTS = 16
+
+# The status code of the nodes asked for keys they do not own (see NotOwnerError)
+MISDIRECTED_REQUEST = 421
+
+
+class ThunderDBClient(object):
+    """Route the requests of an application to the nodes owning their keys, over pooled connections
+
+    The membership of the cluster is fetched from the nodes at the given
+    addresses (host:port) when the client is created. Every request is
+    then sent to the owner of its keys, flagged with ?direct=true so that a
+    node which does not own them answers 421 instead of forwarding it; the
+    client then fetches the membership again and routes the request anew.
+    Batch operations are split by owner, and the requests to the owners
+    are issued concurrently.
+
+    The nodes advertise the addresses they reach each other at. When the
+    client reaches them at other addresses, as through the ports Docker
+    publishes, address_map maps the advertised addresses to those.
+    """
+    def __init__(self, addresses,
+                 address_map=None,
+                 pool_size=utils.DEFAULT_POOL_SIZE,
+                 connect_timeout=utils.DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=utils.DEFAULT_READ_TIMEOUT,
+                 max_retries=utils.DEFAULT_MAX_RETRIES,
+                 max_redirects=DEFAULT_MAX_REDIRECTS):
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        if not addresses:
+            raise ValueError("The client needs the address of at least one node")
+
+        self.seed_addresses = list(addresses)
+        self.address_map = dict(address_map or {})
+        self.max_redirects = max_redirects
+        self.connection_pool = utils.ConnectionPool(pool_size=pool_size, connect_timeout=connect_timeout,
+                                                    read_timeout=read_timeout, max_retries=max_retries)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
+        self.nodes = {}
+        self.hash_ring = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.connection_pool.close()
+
+    def refresh(self, preferred_address=None):
+        """Fetch the membership of the cluster from the first node which answers, and rebuild the ring
+
+        The node at the preferred address is asked first, as it is the one
+        which just told that the ring of the client is out of date
+        """
+        with self._lock:
+            known_addresses = list(self.nodes.values())
+        addresses = [preferred_address] if preferred_address else []
+        addresses += [address for address in self.seed_addresses + known_addresses if address not in addresses]
+
+        errors = {}
+        for address in addresses:
+            try:
+                cluster = self.connection_pool.get('http://' + address + '/cluster').json()
+            except (ServiceError, ValueError) as error:
+                errors[address] = str(error)
+                continue
+
+            nodes = {int(node_id): self.address_map.get(node_ip, node_ip)
+                     for node_id, node_ip in cluster['nodes'].items()}
+            hash_ring = ConsistentHash(len(nodes), cluster['num_virtual_nodes'])
+            with self._lock:
+                self.nodes, self.hash_ring = nodes, hash_ring
+            return
+        raise ServiceError("No node of the cluster could be reached", errors=errors)
+
+    def owner(self, key):
+        """The address of the node owning a key, according to the last membership fetched
+        """
+        with self._lock:
+            nodes, hash_ring = self.nodes, self.hash_ring
+        return nodes[hash_ring.get_node_id(key)]
+
+    def get(self, key):
+        """Get the value of a key, or None if it does not exist
+        """
+        response = self._send(key, lambda address, query: self.connection_pool.get(
+            'http://' + address + '/get/' + quote(key, safe='') + query))
+        if response.status_code == 404:
+            return None
+        self._check(response)
+        return response.json().get(key)
+
+    def put(self, key, value, ack=None):
+        """Put a key-value pair, waiting for as many replicas as the acknowledgement mode requires, if any
+        """
+        body = json.dumps({key: value})
+        response = self._send(key, lambda address, query: self.connection_pool.post(
+            'http://' + address + '/put' + query, data=body, idempotent=True), ack=ack)
+        self._check(response)
+
+    def get_many(self, keys):
+        """Get the values of many keys, with one request per owner, leaving out the keys which do not exist
+        """
+        values = {}
+        for response in self._send_batches(list(keys), '/mget'):
+            values.update(response.json())
+        return values
+
+    def put_many(self, data, overwrite=True, ack=None):
+        """Put many key-value pairs, with one request per owner
+
+        Unless overwrite is True, keys which already exist keep their value
+        """
+        query = {} if overwrite else {'overwrite': 'false'}
+        self._send_batches(dict(data), '/batch-put', query, ack)
+
+    def _send(self, key, send, ack=None):
+        """Send a request about a key to its owner, routing it again while the node is not the owner
+
+        send(address, query) issues the request to the node at the given
+        address, with the given query string
+        """
+        for attempt in range(self.max_redirects + 1):
+            address = self.owner(key)
+            try:
+                response = send(address, self._query(attempt, ack=ack))
+            except ServiceError:
+                if attempt == self.max_redirects:
+                    raise
+                # The node may have left the cluster
+                self.refresh()
+                continue
+
+            if response.status_code != MISDIRECTED_REQUEST:
+                return response
+            self.refresh(address)
+        raise ServiceError("The request could not be routed to the owner of its key", key=key)
+
+    def _send_batches(self, items, path, query=None, ack=None, attempt=0):
+        """Send a list of keys or a dictionary of key-value pairs in one request per owner
+
+        The batches which reach a node which does not own them are routed
+        again. Returns the responses of the owners
+        """
+        with self._lock:
+            nodes, hash_ring = self.nodes, self.hash_ring
+        partitions = {nodes[node_id]: keys for node_id, keys in hash_ring.get_node_ids(items).items()}
+
+        query_string = self._query(attempt, ack=ack, **(query or {}))
+        futures = {}
+        for address, keys in partitions.items():
+            batch = keys if isinstance(items, list) else {key: items[key] for key in keys}
+            futures[self.executor.submit(self.connection_pool.post, 'http://' + address + path + query_string,
+                                         data=json.dumps(batch), idempotent=True)] = (address, batch)
+
+        responses = []
+        misrouted = []
+        misrouted_address = None
+        for future in concurrent.futures.as_completed(futures):
+            address, batch = futures[future]
+            try:
+                response = future.result()
+            except ServiceError:
+                if attempt == self.max_redirects:
+                    raise
+                # The node may have left the cluster
+                misrouted.append(batch)
+                continue
+
+            if response.status_code == MISDIRECTED_REQUEST:
+                misrouted_address = address
+                misrouted.append(batch)
+                continue
+            self._check(response)
+            responses.append(response)
+
+        if misrouted:
+            if attempt == self.max_redirects:
+                raise ServiceError("The request could not be routed to the owners of its keys")
+            self.refresh(misrouted_address)
+            if isinstance(items, list):
+                remaining = [key for batch in misrouted for key in batch]
+            else:
+                remaining = {key: value for batch in misrouted for key, value in batch.items()}
+            responses.extend(self._send_batches(remaining, path, query, ack, attempt + 1))
+        return responses
+
+    def _query(self, attempt, **parameters):
+        """The query string of a request, asking the node to check it owns the keys unless it is the last attempt
+        """
+        if attempt < self.max_redirects:
+            parameters['direct'] = 'true'
+        parameters = {name: value for name, value in parameters.items() if value}
+        if not parameters:
+            return ''
+        return '?' + '&'.join('{}={}'.format(name, value) for name, value in sorted(parameters.items()))
+
+    @staticmethod
+    def _check(response):
+        if response.status_code >= 300:
+            raise ServiceError("Request Failed", url=response.url, response=response.text,
+                               status_code=response.status_code)
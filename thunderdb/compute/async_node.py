@@ -0,0 +1,139 @@
+import asyncio
+import itertools
+import json
+
+import aiohttp
+
+import thunderdb.compute.utils as request
+from thunderdb.compute import metrics
+from thunderdb.compute.node import Node, BATCH_SIZE
+from thunderdb.exceptions.errors import ServiceError
+
+# The maximum number of connections opened to each peer by the event loop. As
+# waiting for a response does not hold a thread, this can be much larger than
+# the threaded connection pool
+DEFAULT_ASYNC_POOL_SIZE = 256
+
+
+class AsyncNode(object):
+    """The asynchronous counterpart of Node, used by the asyncio server mode
+
+    The requests are issued on the event loop through a single aiohttp
+    session, so thousands of them can be in flight at once without holding
+    any thread. Like the ConnectionPool of Node, every peer gets at most
+    pool_size keep-alive connections, requests time out after
+    connect_timeout and read_timeout seconds, and idempotent requests are
+    retried with an exponential backoff when they fail to connect or time out.
+
+    When Node is configured with a transport, the requests go through the
+    asynchronous methods of the transport instead.
+    """
+    session = None
+    max_retries = request.DEFAULT_MAX_RETRIES
+    backoff_factor = request.DEFAULT_BACKOFF_FACTOR
+
+    @classmethod
+    async def open_session(cls,
+                           pool_size=DEFAULT_ASYNC_POOL_SIZE,
+                           connect_timeout=request.DEFAULT_CONNECT_TIMEOUT,
+                           read_timeout=request.DEFAULT_READ_TIMEOUT,
+                           max_retries=request.DEFAULT_MAX_RETRIES,
+                           backoff_factor=request.DEFAULT_BACKOFF_FACTOR):
+        """Open the session used to reach the other nodes, on the running event loop
+        """
+        await cls.close_session()
+        cls.max_retries = max_retries
+        cls.backoff_factor = backoff_factor
+        cls.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=pool_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout))
+
+    @classmethod
+    async def close_session(cls):
+        session, cls.session = cls.session, None
+        if session is not None:
+            await session.close()
+
+    @staticmethod
+    @metrics.peer_request('put')
+    async def put(node_ip_address, key, value, ack=None, ttl=None):
+        """Set a key-value pair on a specific node, which expires after ttl seconds if given
+        """
+        if Node.transport is not None and ttl is None:
+            return await Node.transport.put_async(node_ip_address, key, value, ack=ack)
+        url = 'http://' + node_ip_address + '/put' + Node._query(ack=ack, ttl=ttl)
+        await AsyncNode._issue_request('POST', url, json.dumps({key: value}), idempotent=True)
+
+    @staticmethod
+    @metrics.peer_request('put_batch')
+    async def put_batch(node_ip_address, data, overwrite=True, ack=None, ttl=None):
+        """Set many key-value pairs on a specific node, in bulk requests of at most BATCH_SIZE pairs each
+        """
+        if Node.transport is not None and ttl is None:
+            return await Node.transport.put_batch_async(node_ip_address, data, overwrite=overwrite, ack=ack)
+        url = 'http://' + node_ip_address + '/batch-put' + Node._query(overwrite, ack=ack, ttl=ttl)
+        items = iter(data.items())
+        batch = dict(itertools.islice(items, BATCH_SIZE))
+        while batch:
+            await AsyncNode._issue_request('POST', url, json.dumps(batch), idempotent=True)
+            batch = dict(itertools.islice(items, BATCH_SIZE))
+
+    @staticmethod
+    @metrics.peer_request('get')
+    async def get(node_ip_address, key, local=False):
+        """Get the value for a given key from a specific node
+
+        Returns an empty dictionary if the key does not exist
+        """
+        if Node.transport is not None:
+            return await Node.transport.get_async(node_ip_address, key, local=local)
+        url = 'http://' + node_ip_address + '/get/{}'.format(key) + ('?local=true' if local else '')
+        status, body = await AsyncNode._issue_request('GET', url, idempotent=True)
+        if status == 404:
+            return {}
+        return json.loads(body)
+
+    @staticmethod
+    @metrics.peer_request('get_many')
+    async def get_many(node_ip_address, keys, local=False):
+        """Get the values for many keys from a specific node in one request
+        """
+        if Node.transport is not None:
+            return await Node.transport.get_many_async(node_ip_address, keys, local=local)
+        url = 'http://' + node_ip_address + '/mget' + ('?local=true' if local else '')
+        status, body = await AsyncNode._issue_request('POST', url, json.dumps(list(keys)), idempotent=True)
+        return json.loads(body)
+
+    @staticmethod
+    async def _issue_request(method, url, data=None, idempotent=False):
+        """Issue an HTTP request, returning its status code and body
+
+        Mirrors utils._issue_request: server errors raise a ServiceError, and
+        so do requests which could not be completed after all their retries
+        """
+        if AsyncNode.session is None:
+            await AsyncNode.open_session()
+
+        retries = AsyncNode.max_retries if idempotent else 0
+        last_raised_exception = None
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(AsyncNode.backoff_factor * (2 ** (attempt - 1)))
+
+            try:
+                async with AsyncNode.session.request(method, url, data=data) as response:
+                    body = await response.read()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as ex:
+                last_raised_exception = ex
+                continue
+
+            if not request.is_valid_response_code(response.status):
+                raise ServiceError("Request Failed",
+                                   url=url,
+                                   response=body.decode(errors='replace'),
+                                   status_code=response.status)
+            return response.status, body
+
+        raise ServiceError("Request failed",
+                           url=url,
+                           exception=repr(last_raised_exception))
@@ -0,0 +1,340 @@
+import concurrent.futures
+import itertools
+import threading
+import time
+import traceback
+
+from thunderdb.exceptions.errors import ServiceError
+
+# The maximum number of key-value pairs sent to a peer in a single batch
+DEFAULT_MAX_BATCH_SIZE = 10000
+
+# The number of seconds a batch waits for more writes before it is sent. No
+# time is spent waiting by default: writes pile up while the previous batch is
+# in flight, so the batches grow with the load without adding any latency
+DEFAULT_LINGER = 0.0
+
+# The number of writes a queue whose linger adapts to its rate waits for
+# before sending a batch (see BatchingQueue): enough writes that the cost of
+# a request is spread thin, without holding them for a whole max_batch_size
+DEFAULT_TARGET_BATCH_SIZE = 100
+
+# The weight of the latest batch in the estimated rate of writes of a queue
+# whose linger adapts to it (see BatchingQueue)
+RATE_SMOOTHING = 0.2
+
+# A queue whose linger adapts to its rate of writes only lingers when it
+# expects at least this many more writes during the longest linger
+MIN_LINGER_WRITES = 2
+
+# The maximum number of key-value pairs waiting to be sent to a peer. Beyond
+# this number, the oldest writes are dropped rather than using up the memory
+# of the node while the peer is unreachable
+DEFAULT_MAX_PENDING = 1000000
+
+# The number of seconds to wait before sending a batch again after a failure,
+# doubled after every consecutive failure up to MAX_RETRY_DELAY
+RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 5.0
+
+# The HTTP statuses of the client errors which a request may not fail with when it is sent again
+RETRYABLE_STATUS_CODES = (408, 429)
+
+
+def is_retryable(error):
+    """True if a batch which failed to be sent with the given error may be sent successfully later
+
+    Connection failures, timeouts and server errors may go away. A request
+    the peer rejected as invalid fails the same way every time: a 4xx
+    response over HTTP, but for RETRYABLE_STATUS_CODES, or a rejected
+    request over the binary protocol. So does a batch which could not be
+    sent at all, raising anything but a ServiceError or an OSError
+    """
+    if isinstance(error, OSError):
+        return True
+    if not isinstance(error, ServiceError) or error.kwargs.get('rejected'):
+        return False
+    status_code = error.kwargs.get('status_code')
+    return status_code is None or not 400 <= status_code < 500 or status_code in RETRYABLE_STATUS_CODES
+
+
+class _SendFailure(Exception):
+    """A batch failed to be sent with a retryable error, leaving the given pairs unsent
+    """
+    def __init__(self, unsent):
+        super(_SendFailure, self).__init__()
+        self.unsent = unsent
+
+
+class Acknowledgement(object):
+    """Track how many peers acknowledged a write
+
+    The acknowledgement is complete once `required` peers stored the write,
+    or as soon as enough of them failed that it can never be. Its future
+    then holds whether enough peers stored the write, so that it can be
+    awaited from an event loop as well (see asyncio.wrap_future)
+    """
+    def __init__(self, required, num_peers):
+        self.required = required
+        self.num_peers = num_peers
+        self.successes = 0
+        self.failures = 0
+        self.future = concurrent.futures.Future()
+        self._lock = threading.Lock()
+        self._update()
+
+    def succeed(self):
+        with self._lock:
+            self.successes += 1
+            self._update()
+
+    def fail(self):
+        with self._lock:
+            self.failures += 1
+            self._update()
+
+    def wait(self, timeout=None):
+        """Wait for the acknowledgement to be complete, returning True if enough peers stored the write
+        """
+        try:
+            return self.future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            return False
+
+    def _update(self):
+        if self.future.done():
+            return
+        if self.successes >= self.required:
+            self.future.set_result(True)
+        elif self.num_peers - self.failures < self.required:
+            self.future.set_result(False)
+
+
+class BatchingQueue(object):
+    """Queue the writes sent to a peer node, and send them in batches from a background thread
+
+    Writes are appended to the queue without blocking the caller. A single
+    sender thread takes everything queued so far (up to max_batch_size
+    pairs), sends it with one call to send(data), and starts over. As the
+    same thread sends every batch in order, the writes to a key reach the
+    peer in the order they were queued, and a key written many times
+    while the previous batch was in flight is only sent once, with its
+    latest value.
+
+    A batch which fails to be sent is retried with an exponential backoff,
+    after failing the acknowledgements waiting for it, so that callers
+    never wait for an unreachable peer. A batch the peer rejects is not
+    retried, as it would block the writes queued after it for good (see
+    is_retryable): its halves are sent on their own, down to the pairs the
+    peer rejects, which are dropped and counted as rejected.
+
+    Before taking a batch, the sender waits `linger` seconds for more
+    writes, or less if max_batch_size pairs are queued before. When
+    max_linger is given instead, the linger adapts to the rate of writes
+    of the queue: the sender waits as long as it takes target_batch_size
+    writes to be queued at the current rate, up to max_linger, so the
+    linger shrinks as the rate grows. It does not wait at all when fewer
+    than MIN_LINGER_WRITES more writes are expected by then.
+    """
+    def __init__(self, name, send,
+                 max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 linger=DEFAULT_LINGER,
+                 max_pending=DEFAULT_MAX_PENDING,
+                 max_linger=None,
+                 target_batch_size=DEFAULT_TARGET_BATCH_SIZE):
+        self.name = name
+        self.send = send
+        self.max_batch_size = max_batch_size
+        self.linger = linger
+        self.max_pending = max_pending
+        self.max_linger = max_linger
+        self.target_batch_size = target_batch_size
+        self.dropped = 0
+        self.rejected = 0
+        self.rate = 0.0
+        self._received = 0
+        self._rate_updated_at = time.monotonic()
+        self._in_flight = {}
+        self._pending = {}
+        # The number of calls to put, and the number of the latest call whose writes were all sent
+        self._sequence = 0
+        self._sent_sequence = 0
+        self._acknowledgements = []
+        self._condition = threading.Condition()
+        self._sending = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, data, acknowledgement=None):
+        """Queue a dictionary of key-value pairs to be sent to the peer
+        """
+        with self._condition:
+            for key, value in data.items():
+                # Move rewritten keys to the end of the queue, keeping the queue in write order
+                self._pending.pop(key, None)
+                self._pending[key] = value
+
+            self._received += len(data)
+            self._sequence += 1
+            while len(self._pending) > self.max_pending:
+                del self._pending[next(iter(self._pending))]
+                self.dropped += 1
+
+            if acknowledgement is not None:
+                self._acknowledgements.append(acknowledgement)
+            self._condition.notify()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def get(self, key):
+        """The latest value of a key which is queued or being sent, or None
+        """
+        value = self._pending.get(key)
+        return value if value is not None else self._in_flight.get(key)
+
+    def current_linger(self):
+        """The number of seconds the sender waits for more writes before taking the next batch
+        """
+        if self.max_linger is None:
+            return self.linger
+        if self.rate * self.max_linger < MIN_LINGER_WRITES:
+            return 0.0
+        return min(self.max_linger, max(self._batch_size() - len(self._pending), 0) / self.rate)
+
+    def flush(self, timeout=None):
+        """Wait for the writes queued before the call to be sent, returning False on timeout
+
+        The writes queued during the call are not waited for, so a flush
+        completes while other callers keep queuing writes
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            sequence = self._sequence
+            while self._sent_sequence < sequence:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self):
+        """Stop the sender thread once the writes queued so far have been sent
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        retry_delay = RETRY_DELAY
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+
+            with self._condition:
+                linger = self.current_linger()
+                if linger:
+                    self._condition.wait_for(lambda: len(self._pending) >= self._batch_size() or self._closed,
+                                             linger)
+                batch, acknowledgements, sequence = self._take_batch()
+                self._update_rate()
+                self._in_flight = batch
+                self._sending = True
+
+            try:
+                rejected = self._send(batch)
+            except _SendFailure as failure:
+                for acknowledgement in acknowledgements:
+                    acknowledgement.fail()
+                with self._condition:
+                    # Put the unsent writes back in front of the writes queued since, unless they replaced them
+                    batch = failure.unsent
+                    for key, value in self._pending.items():
+                        batch[key] = value
+                    self._pending = batch
+                    self._in_flight = {}
+                    self._sending = False
+                    self._condition.notify_all()
+                    if self._closed:
+                        return
+                time.sleep(retry_delay)
+                retry_delay = min(2 * retry_delay, MAX_RETRY_DELAY)
+                continue
+
+            retry_delay = RETRY_DELAY
+            for acknowledgement in acknowledgements:
+                if rejected:
+                    acknowledgement.fail()
+                else:
+                    acknowledgement.succeed()
+            with self._condition:
+                self.rejected += rejected
+                self._sent_sequence = max(self._sent_sequence, sequence)
+                self._in_flight = {}
+                self._sending = False
+                self._condition.notify_all()
+
+    def _send(self, batch):
+        """Send a batch, returning the number of its pairs which the peer rejected
+
+        A rejected batch is split in halves, sent on their own in order, until
+        the rejected pairs are isolated and dropped. Raises a _SendFailure
+        with the pairs left unsent when sending fails with a retryable error
+        """
+        chunks = [batch]
+        rejected = 0
+        while chunks:
+            chunk = chunks.pop()
+            try:
+                self.send(chunk)
+            except Exception as error:
+                if is_retryable(error):
+                    traceback.print_exc()
+                    for remaining in reversed(chunks):
+                        chunk.update(remaining)
+                    raise _SendFailure(chunk)
+                if len(chunk) == 1:
+                    traceback.print_exc()
+                    rejected += 1
+                    continue
+                items = list(chunk.items())
+                middle = len(items) // 2
+                chunks.append(dict(items[middle:]))
+                chunks.append(dict(items[:middle]))
+        return rejected
+
+    def _batch_size(self):
+        """The number of queued writes after which the sender stops lingering
+        """
+        return self.max_batch_size if self.max_linger is None else min(self.target_batch_size, self.max_batch_size)
+
+    def _update_rate(self):
+        """Update the estimated number of writes per second with the writes received since the previous batch
+        """
+        now = time.monotonic()
+        elapsed, self._rate_updated_at = now - self._rate_updated_at, now
+        received, self._received = self._received, 0
+        if elapsed > 0:
+            self.rate += RATE_SMOOTHING * (received / elapsed - self.rate)
+
+    def _take_batch(self):
+        """Take the oldest max_batch_size queued writes, along with the acknowledgements waiting for them
+
+        Also returns the number of the latest call to put whose writes are
+        all sent once the batch is, or 0 if the batch leaves writes behind
+        """
+        if len(self._pending) <= self.max_batch_size:
+            batch, self._pending = self._pending, {}
+            acknowledgements, self._acknowledgements = self._acknowledgements, []
+            return batch, acknowledgements, self._sequence
+
+        batch = {}
+        for key in list(itertools.islice(self._pending, self.max_batch_size)):
+            batch[key] = self._pending.pop(key)
+        # The acknowledgements can only be complete once the remaining writes are sent as well
+        return batch, [], 0
@@ -0,0 +1,184 @@
+import collections
+import sys
+import threading
+import time
+
+from thunderdb.compute.batching import BatchingQueue
+from thunderdb.compute.node import Node
+
+# The maximum number of key-value pairs held by the cache
+DEFAULT_MAX_ENTRIES = 100000
+
+# The maximum number of bytes used by the keys and values held by the cache
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# The number of seconds a cached value is served for, bounding how stale it
+# can be when an invalidation is lost
+DEFAULT_TTL = 5.0
+
+# The number of recently invalidated keys remembered to reject stale fills
+MAX_RECENT_INVALIDATIONS = 10000
+
+
+class ReadCache(object):
+    """A bounded, least recently used cache of the values owned by other nodes
+
+    The cache holds at most max_entries key-value pairs and max_bytes of
+    keys and values, evicting the least recently used pairs first, and
+    every pair expires ttl seconds after it was fetched. The owner of a key
+    tells the other nodes to invalidate it when it is overwritten (see
+    InvalidationBroadcaster).
+
+    A value fetched while the key was being invalidated may already be
+    stale, so fills carry the generation read before the fetch (see
+    generation), and are dropped if the key was invalidated since.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.size_bytes = 0
+        self._entries = collections.OrderedDict()
+        self._generation = 0
+        self._recent_invalidations = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        """The number of invalidations so far, to be passed to put"""
+        return self._generation
+
+    def get(self, key):
+        """Get the cached value of a key, or None if it is not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, size = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation):
+        """Cache the value of a key, fetched after reading the given generation
+        """
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if not self._is_fresh(key, generation):
+                return
+
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.time() + self.ttl, size)
+            self.size_bytes += size
+
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        """Drop the cached values of the given keys
+        """
+        with self._lock:
+            for key in keys:
+                self._generation += 1
+                self._recent_invalidations.pop(key, None)
+                self._recent_invalidations[key] = self._generation
+                if key in self._entries:
+                    self._remove(key)
+                    self.invalidations += 1
+
+            while len(self._recent_invalidations) > MAX_RECENT_INVALIDATIONS:
+                self._recent_invalidations.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        """The counters of the cache, as a dictionary
+        """
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _is_fresh(self, key, generation):
+        """True if the key was not invalidated after the given generation
+        """
+        if generation >= self._generation:
+            return True
+        if key in self._recent_invalidations:
+            return self._recent_invalidations[key] <= generation
+        # The key was not invalidated recently, unless it was forgotten since
+        oldest = next(iter(self._recent_invalidations.values()), self._generation)
+        return oldest <= generation + 1
+
+    def _remove(self, key):
+        self.size_bytes -= self._entries.pop(key)[2]
+
+
+class InvalidationBroadcaster(object):
+    """Tell the other nodes of the cluster to drop the cached values of overwritten keys
+
+    The invalidations sent to each node are queued and sent in batches from
+    the background, like replicated writes (see BatchingQueue), so that
+    overwriting a key adds no round trip to the write path
+    """
+    def __init__(self, engine, **queue_options):
+        self.engine = engine
+        self.queue_options = queue_options
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def broadcast(self, keys):
+        keys = dict.fromkeys(keys)
+        if not keys:
+            return
+        for node_id in list(self.engine.config.nodes):
+            if node_id != self.engine.config.node_id:
+                self._queue(node_id).put(keys)
+
+    def flush(self, timeout=None):
+        return all(queue.flush(timeout) for queue in list(self._queues.values()))
+
+    def close(self):
+        with self._lock:
+            queues, self._queues = self._queues, {}
+        for queue in queues.values():
+            queue.close()
+
+    def _queue(self, node_id):
+        queue = self._queues.get(node_id)
+        if queue is None:
+            with self._lock:
+                queue = self._queues.get(node_id)
+                if queue is None:
+                    queue = BatchingQueue("invalidation-{}".format(node_id),
+                                          lambda keys: Node.invalidate(self.engine.config.nodes[node_id], keys),
+                                          **self.queue_options)
+                    self._queues[node_id] = queue
+        return queue
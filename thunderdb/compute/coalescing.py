@@ -0,0 +1,269 @@
+"""
+Coalescing of the concurrent requests a node forwards to its peers
+
+When a key is hot, many clients ask a node which does not own it for the
+same key at the same time, and each of their requests used to be forwarded
+to the owner on its own. The owner then received the same request N times
+at once. Concurrent reads of the same key now share a single request, and
+concurrent writes forwarded to the same peer are sent together. When the
+client does not need to wait for the owner, the writes forwarded to a peer
+are buffered and sent in bulk in the background instead.
+"""
+import asyncio
+import concurrent.futures
+import threading
+
+from thunderdb.compute import metrics
+from thunderdb.compute.batching import BatchingQueue, DEFAULT_MAX_BATCH_SIZE, DEFAULT_TARGET_BATCH_SIZE
+from thunderdb.exceptions.errors import ServiceError
+
+# When a write forwarded to the owner of its key is acknowledged to the client:
+# once the owner stored it, or as soon as it is buffered to be sent to the
+# owner, in which case it is lost if the node stops before sending it
+DURABILITY_OWNER = 'owner'
+DURABILITY_BUFFERED = 'buffered'
+DURABILITY_MODES = (DURABILITY_OWNER, DURABILITY_BUFFERED)
+DEFAULT_WRITE_DURABILITY = DURABILITY_OWNER
+
+# The longest time in seconds the buffered writes to a peer wait for more
+# writes before they are sent (see WriteBuffer)
+DEFAULT_MAX_WRITE_LINGER = 0.005
+
+# The number of seconds a write which must reach the owner waits for the writes
+# buffered for the owner before it to be sent
+BUFFER_FLUSH_TIMEOUT = 5.0
+
+
+class SingleFlight(object):
+    """Share the result of a call among every caller asking for the same key while it is in flight
+
+    The first caller of a key runs the call, and the callers which ask for
+    the key before it returns wait for its result, or its exception,
+    instead of running the call again. Results are not kept once the call
+    returned: a key asked for afterwards runs a new call.
+
+    A write to a key should forget its call in flight, so the reads issued
+    after the write returned do not get a value read before it
+    """
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Run func(), unless a call for the key is already in flight, returning the result of the call
+        """
+        future, is_leader = self._join(key)
+        if is_leader:
+            self._run(key, future, func)
+        return future.result()
+
+    async def do_async(self, key, coroutine_function):
+        """Same as do, awaiting coroutine_function() without blocking the event loop
+        """
+        future, is_leader = self._join(key)
+        if is_leader:
+            try:
+                future.set_result(await coroutine_function())
+            except BaseException as error:
+                future.set_exception(error)
+            finally:
+                self._leave(key, future)
+        return await asyncio.wrap_future(future)
+
+    def forget(self, key):
+        """Let the next caller of the key run a new call, even though one is still in flight
+        """
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def __len__(self):
+        return len(self._calls)
+
+    def _join(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                metrics.COALESCED_REQUESTS.inc(self.name)
+                return future, False
+            future = self._calls[key] = concurrent.futures.Future()
+            return future, True
+
+    def _run(self, key, future, func):
+        try:
+            future.set_result(func())
+        except BaseException as error:
+            future.set_exception(error)
+        finally:
+            self._leave(key, future)
+
+    def _leave(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+
+class _Batch(object):
+    __slots__ = ('data', 'future')
+
+    def __init__(self):
+        self.data = {}
+        self.future = concurrent.futures.Future()
+
+
+class WriteCoalescer(object):
+    """Send the concurrent writes forwarded to the same peer together, one batch at a time
+
+    Writes are grouped by peer and by how they must be stored (overwrite,
+    acknowledgement mode and ttl). A group has at most one batch in flight and
+    one batch open: the writes submitted while a batch is in flight join
+    the open batch, in which a key written many times only keeps its latest
+    value. The first writer of the open batch waits for the batch in flight
+    to complete, then sends the open batch with send(peer, data, overwrite,
+    ack, ttl). Every writer of a batch returns once it was stored, or raises the
+    exception it failed with, so a write never returns before the peer
+    stored it.
+    """
+    def __init__(self, send, send_async):
+        self.send = send
+        self.send_async = send_async
+        self._open = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, peer, data, overwrite=True, ack=None, ttl=None):
+        """Send key-value pairs to a peer along with the concurrent writes to it, waiting for them to be stored
+        """
+        group = (peer, overwrite, ack, ttl)
+        batch, is_leader, previous = self._join(group, data)
+        if is_leader:
+            if previous is not None:
+                concurrent.futures.wait([previous])
+            self._start(group, batch)
+            try:
+                self.send(peer, batch.data, overwrite, ack, ttl)
+                batch.future.set_result(None)
+            except BaseException as error:
+                batch.future.set_exception(error)
+            finally:
+                self._finish(group, batch)
+        return batch.future.result()
+
+    async def submit_async(self, peer, data, overwrite=True, ack=None, ttl=None):
+        """Same as submit, waiting for the batches without blocking the event loop
+        """
+        group = (peer, overwrite, ack, ttl)
+        batch, is_leader, previous = self._join(group, data)
+        if is_leader:
+            if previous is not None:
+                await asyncio.wait([asyncio.wrap_future(previous)])
+            self._start(group, batch)
+            try:
+                await self.send_async(peer, batch.data, overwrite, ack, ttl)
+                batch.future.set_result(None)
+            except BaseException as error:
+                batch.future.set_exception(error)
+            finally:
+                self._finish(group, batch)
+        return await asyncio.wrap_future(batch.future)
+
+    def _join(self, group, data):
+        """Add key-value pairs to the open batch of a group
+
+        Returns the batch, whether the caller opened it, and the future of
+        the batch in flight when it did
+        """
+        with self._lock:
+            batch = self._open.get(group)
+            is_leader = batch is None
+            if is_leader:
+                batch = self._open[group] = _Batch()
+            else:
+                metrics.COALESCED_REQUESTS.inc('put')
+            batch.data.update(data)
+            in_flight = self._in_flight.get(group)
+            return batch, is_leader, in_flight.future if in_flight is not None else None
+
+    def _start(self, group, batch):
+        """Close the open batch of a group to the new writes, as it is being sent
+        """
+        with self._lock:
+            del self._open[group]
+            self._in_flight[group] = batch
+
+    def _finish(self, group, batch):
+        with self._lock:
+            if self._in_flight.get(group) is batch:
+                del self._in_flight[group]
+
+
+class WriteBuffer(object):
+    """Buffer the writes forwarded to each peer, and send them in bulk from the background
+
+    Every peer gets its own BatchingQueue, which sends the buffered writes
+    with send(peer, data) once target_batch_size of them are buffered, or
+    once they waited long enough. How long adapts to the rate of writes to
+    the peer: a trickle of writes is sent right away, a moderate rate waits
+    up to max_linger, and the wait shrinks as the rate grows, as the batch
+    fills sooner (see BatchingQueue). A batch holds at most max_batch_size
+    writes.
+
+    Submitting a write only buffers it, so the writes are not known to be
+    stored and the failed batches are retried in the background. The
+    buffered values are read back by the current node until they are sent
+    (see get), and a write which must reach the peer first waits for the
+    writes buffered before it (see flush), so the writes to a key reach the
+    peer in order.
+    """
+    def __init__(self, send, max_linger=DEFAULT_MAX_WRITE_LINGER, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 target_batch_size=DEFAULT_TARGET_BATCH_SIZE, flush_timeout=BUFFER_FLUSH_TIMEOUT):
+        self.send = send
+        self.max_linger = max_linger
+        self.max_batch_size = max_batch_size
+        self.target_batch_size = target_batch_size
+        self.flush_timeout = flush_timeout
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, peer, data):
+        """Buffer key-value pairs to be sent to a peer, without waiting
+        """
+        self._queue(peer).put(data)
+
+    def get(self, peer, key):
+        """The latest value buffered for a key owned by a peer, or None once it was sent
+        """
+        queue = self._queues.get(peer)
+        return queue.get(key) if queue is not None else None
+
+    def flush(self, peer):
+        """Wait for the writes buffered for a peer so far to be sent, raising a ServiceError if they were not in time
+        """
+        queue = self._queues.get(peer)
+        if queue is not None and not queue.flush(self.flush_timeout):
+            raise ServiceError("The writes buffered for the node could not be sent", node=peer, pending=len(queue))
+
+    def stats(self):
+        """The buffered, dropped and rejected writes, write rate and linger of each peer, by address
+        """
+        return {peer: {'pending': len(queue), 'dropped': queue.dropped, 'rejected': queue.rejected,
+                       'rate': queue.rate, 'linger': queue.current_linger()}
+                for peer, queue in list(self._queues.items())}
+
+    def close(self):
+        with self._lock:
+            queues, self._queues = self._queues, {}
+        for queue in queues.values():
+            queue.close()
+
+    def _queue(self, peer):
+        queue = self._queues.get(peer)
+        if queue is None:
+            with self._lock:
+                queue = self._queues.get(peer)
+                if queue is None:
+                    queue = BatchingQueue("write-buffer-{}".format(peer), lambda data: self.send(peer, data),
+                                          max_batch_size=self.max_batch_size, max_linger=self.max_linger,
+                                          target_batch_size=self.target_batch_size)
+                    self._queues[peer] = queue
+        return queue
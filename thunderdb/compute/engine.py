@@ -1,34 +1,334 @@
+import asyncio
 import concurrent.futures
-import copy
+import heapq
+import itertools
+import time
 
 from thunderdb.storage.in_memory_store import InMemoryStore
+from thunderdb.storage.filtered_store import FilteredStore
+from thunderdb.storage.key_value_store import DEFAULT_SCAN_LIMIT
+from thunderdb.storage.ordered_store import prefix_range
 from thunderdb.hashing.consistent_hashing import ConsistentHash
+from thunderdb.compute import metrics
 from thunderdb.compute.node import Node
+from thunderdb.compute.async_node import AsyncNode
+from thunderdb.compute.loader import BulkLoader
+from thunderdb.compute.rebalancer import Rebalancer
+from thunderdb.compute.replication import ReplicationPipeline, ACK_PRIMARY
+from thunderdb.compute.cache import InvalidationBroadcaster
+from thunderdb.compute.gossip import Gossip
+from thunderdb.compute.hedging import ReadHedger
+from thunderdb.compute.peer_filters import PeerFilters
+from thunderdb.compute.coalescing import SingleFlight, WriteCoalescer, WriteBuffer, DURABILITY_BUFFERED
+from thunderdb.exceptions.errors import KeyValueStoreException, NotOwnerError
+
+# The maximum number of concurrent requests issued to peer nodes
+MAX_PEER_REQUESTS = 16
 
 
 class Engine(object):
     """A class responsible for all the operations that can be performed in the app
+
+    The key-value pairs owned by other nodes can be cached in an optional
+    ReadCache, which the owners invalidate when the pairs are overwritten.
+    Concurrent reads of the same key owned by another node share a single
+    request to it, and concurrent writes forwarded to the same node are sent
+    to it together (see coalescing). The reads an owner is slow to answer
+    are sent to its first replica as well (see ReadHedger). When the storage
+    keeps a filter of its keys (see FilteredStore), the node keeps a copy of
+    the filters of the other nodes, and answers the reads of the keys they
+    do not hold without asking them (see PeerFilters). With the buffered
+    write durability, the writes forwarded to the other nodes are
+    acknowledged once buffered, and sent in bulk from the background (see
+    WriteBuffer)
     """
-    def __init__(self, config):
+    def __init__(self, config, storage=None, cache=None):
         self.config = config
-        self.storage = InMemoryStore()
+        self.storage = storage if storage is not None else InMemoryStore()
+        self.cache = cache
+        self._hash_ring = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_PEER_REQUESTS)
+        self.rebalancer = Rebalancer(self)
+        self.replication = ReplicationPipeline(self)
+        self.invalidations = InvalidationBroadcaster(self)
+        self.gossip = Gossip(self, interval=config.gossip_interval, expected_nodes=config.cluster_size)
+        self.reads = SingleFlight('get')
+        self.hedger = None
+        if config.hedge_max_rate > 0 and config.replication_factor > 1:
+            self.hedger = ReadHedger(config.hedge_percentile, config.hedge_max_rate)
+        self.filters = None
+        if isinstance(self.storage, FilteredStore):
+            self.filters = PeerFilters(self, config.filter_sync_interval)
+        self.writes = WriteCoalescer(self._send_writes, self._send_writes_async)
+        self.buffer = None
+        if config.write_durability == DURABILITY_BUFFERED:
+            self.buffer = WriteBuffer(self._send_buffered_writes, config.max_write_linger)
+
+    @property
+    def hash_ring(self):
+        """The consistent hash ring for the current cluster configuration
+
+        Building the ring hashes every virtual node, so it is built once and
+        cached until the number of nodes in the cluster changes
+        """
+        hash_ring = self._hash_ring
+        if hash_ring is None or hash_ring.num_nodes != len(self.config.nodes):
+            hash_ring = ConsistentHash(len(self.config.nodes), self.config.num_virtual_nodes)
+            self._hash_ring = hash_ring
+        return hash_ring
 
-    def put(self, key, value):
+    @metrics.timed(metrics.ENGINE_OPERATIONS, 'put')
+    def put(self, key, value, ack=ACK_PRIMARY, ttl=None):
         """Put a key-pair into the right node(s) in the cluster
 
         We will use Consistent Hashing to find the correct id of the node where
-        the key-value pair should be stored. We also create a replica for the
-        key-value pair on an adjacent node
+        the key-value pair should be stored. The owner then replicates the
+        key-value pair on the nodes which follow it in the cluster, in the
+        background unless the acknowledgement mode asks to wait for them.
+        When a ttl is given, the key-value pair expires after that many
+        seconds, on the owner and on its replicas alike
         """
+        expires_at = self._expiration_time(ttl)
         if len(self.config.nodes.keys()) == 1:
-            self.storage.put(key, value)
+            metrics.ENGINE_WRITES.inc('local')
+            self._store(key, value, expires_at)
         else:
-            node_id = ConsistentHash(len(self.config.nodes)).get_node_id(key)
+            node_id = self.hash_ring.get_node_id(key)
             if node_id == self.config.node_id:
                 # Store the value in the current node!
-                self.storage.put(key, value)
+                metrics.ENGINE_WRITES.inc('local')
+                self.replication.replicate(self._store_owned({key: value}, expires_at=expires_at), ack, expires_at)
             else:
-                Node.put(self.config.nodes[node_id], key, value)
+                if self.cache is not None:
+                    self.cache.invalidate([key])
+                self._forget_reads([key])
+                if self.filters is not None:
+                    self.filters.add(self.config.nodes[node_id], [key])
+                metrics.ENGINE_WRITES.inc('forwarded')
+                self._forward_writes(self.config.nodes[node_id], {key: value}, ack=ack, ttl=ttl)
+
+    @metrics.timed(metrics.ENGINE_OPERATIONS, 'put')
+    async def put_async(self, key, value, ack=ACK_PRIMARY, ttl=None):
+        """Same as put, forwarding the key-value pair without blocking the event loop
+
+        The storage may block, on its lock or on its log, so the pair is
+        stored from the executor of the engine rather than on the event loop
+        """
+        expires_at = self._expiration_time(ttl)
+        loop = asyncio.get_running_loop()
+        if len(self.config.nodes.keys()) == 1:
+            metrics.ENGINE_WRITES.inc('local')
+            await loop.run_in_executor(self.executor, self._store, key, value, expires_at)
+        else:
+            node_id = self.hash_ring.get_node_id(key)
+            if node_id == self.config.node_id:
+                metrics.ENGINE_WRITES.inc('local')
+                stored = await loop.run_in_executor(self.executor, self._store_owned, {key: value}, True, expires_at)
+                await self.replication.replicate_async(stored, ack, expires_at)
+            else:
+                if self.cache is not None:
+                    self.cache.invalidate([key])
+                self._forget_reads([key])
+                if self.filters is not None:
+                    self.filters.add(self.config.nodes[node_id], [key])
+                metrics.ENGINE_WRITES.inc('forwarded')
+                await self._forward_writes_async(self.config.nodes[node_id], {key: value}, ack=ack, ttl=ttl)
+
+    @metrics.timed(metrics.ENGINE_OPERATIONS, 'put_many')
+    def put_many(self, data, overwrite=True, ack=ACK_PRIMARY, ttl=None):
+        """Put a dictionary of key-value pairs into the right nodes in the cluster
+
+        The keys are partitioned by their owning node, the local partition is
+        stored in one batch and every other partition is forwarded to its
+        owner in bulk, instead of issuing one request per key-value pair.
+        Unless overwrite is True, keys which already exist keep their value.
+        The ttl is the same as for put
+        """
+        expires_at = self._expiration_time(ttl)
+        if len(self.config.nodes.keys()) == 1:
+            metrics.ENGINE_WRITES.inc('local', amount=len(data))
+            self._store_batch(data, overwrite, expires_at)
+            return
+
+        for node_id, partition in self._partition(data).items():
+            if node_id == self.config.node_id:
+                self.replication.replicate(self._store_owned(partition, overwrite, expires_at), ack, expires_at)
+            else:
+                self._forward_writes(self.config.nodes[node_id], partition, overwrite, ack, ttl)
+
+    @metrics.timed(metrics.ENGINE_OPERATIONS, 'put_many')
+    async def put_many_async(self, data, overwrite=True, ack=ACK_PRIMARY, ttl=None):
+        """Same as put_many, forwarding the partitions to their owners concurrently
+
+        Like put_async, the local partition is stored from the executor of
+        the engine
+        """
+        expires_at = self._expiration_time(ttl)
+        loop = asyncio.get_running_loop()
+        if len(self.config.nodes.keys()) == 1:
+            metrics.ENGINE_WRITES.inc('local', amount=len(data))
+            await loop.run_in_executor(self.executor, self._store_batch, data, overwrite, expires_at)
+            return
+
+        async def store_and_replicate(partition):
+            stored = await loop.run_in_executor(self.executor, self._store_owned, partition, overwrite, expires_at)
+            await self.replication.replicate_async(stored, ack, expires_at)
+
+        requests = []
+        for node_id, partition in self._partition(data).items():
+            if node_id == self.config.node_id:
+                requests.append(store_and_replicate(partition))
+            else:
+                requests.append(self._forward_writes_async(self.config.nodes[node_id], partition, overwrite, ack, ttl))
+        await asyncio.gather(*requests)
+
+    def _partition(self, data):
+        """Group key-value pairs by their owning node, as {node_id: {key: value}}
+
+        The cached values of the keys owned by other nodes are dropped, as
+        they are being overwritten
+        """
+        with metrics.ENGINE_PHASES.time('hash'):
+            node_ids = self.hash_ring.get_node_ids(data.keys())
+
+        partitions = {}
+        for node_id, keys in node_ids.items():
+            if node_id != self.config.node_id:
+                if self.cache is not None:
+                    self.cache.invalidate(keys)
+                self._forget_reads(keys)
+                if self.filters is not None:
+                    self.filters.add(self.config.nodes[node_id], keys)
+            partitions[node_id] = {key: data[key] for key in keys}
+            metrics.ENGINE_WRITES.inc('local' if node_id == self.config.node_id else 'forwarded', amount=len(keys))
+        return partitions
+
+    def _store_owned(self, data, overwrite=True, expires_at=None):
+        """Store key-value pairs owned by the current node, returning the pairs which were stored
+
+        The other nodes are told to drop the values they cached for the
+        overwritten keys, whether the current node caches values or not, as
+        the read cache is set for every node on its own. The reads of the
+        keys in flight from the previous owners of the keys (see get) are
+        forgotten
+        """
+        overwritten = []
+        if overwrite:
+            overwritten = [key for key in data if self.storage.get(key) is not None]
+        data = self._store_batch(data, overwrite, expires_at)
+        self._forget_reads(data)
+        self.invalidations.broadcast(overwritten)
+        return data
+
+    def _store_batch(self, data, overwrite=True, expires_at=None):
+        """Store key-value pairs in the current node, returning the pairs which were stored
+
+        When expires_at is given, the pairs expire at that time. Unless
+        overwrite is True, the storage checks and stores the pairs at once, so
+        a concurrent write of a key is never overwritten
+        """
+        options = {} if expires_at is None else {'expires_at': expires_at}
+        with metrics.STORE_OPERATIONS.time('put_batch'):
+            if not overwrite:
+                return self.storage.put_batch_if_absent(data, **options)
+            self.storage.put_batch(data, **options)
+        return data
+
+    def _store(self, key, value, expires_at=None):
+        if expires_at is None:
+            self.storage.put(key, value)
+        else:
+            self.storage.put(key, value, expires_at=expires_at)
+
+    def _expiration_time(self, ttl):
+        """The time at which a key-value pair written now with the given ttl expires, or None without a ttl
+
+        Raises a KeyValueStoreException when the storage of the node cannot
+        expire its keys (see CappedStore)
+        """
+        if ttl is None:
+            return None
+        if not getattr(self.storage, 'supports_expiration', False):
+            raise KeyValueStoreException("The storage backend of the node does not support expiring keys",
+                                         storage=type(self.storage).__name__)
+        return time.time() + ttl
+
+    def _forward_writes(self, node_ip, data, overwrite=True, ack=ACK_PRIMARY, ttl=None):
+        """Send writes to the node which owns them, returning once it stored them, or once they are buffered
+
+        Only the plain writes which the client does not want acknowledged by
+        replicas are buffered (see WriteBuffer). The others wait for the
+        writes buffered before them to be sent, so they are not overtaken.
+        The reads of the keys which started while the writes were being sent
+        are forgotten once they are, so the reads issued after the writes
+        returned do not join them
+        """
+        try:
+            if self.buffer is not None:
+                if self._is_bufferable(overwrite, ack, ttl):
+                    self.buffer.submit(node_ip, data)
+                    return
+                self.buffer.flush(node_ip)
+            self.writes.submit(node_ip, data, overwrite, self._forwarded_ack(ack), ttl)
+        finally:
+            self._forget_reads(data)
+
+    async def _forward_writes_async(self, node_ip, data, overwrite=True, ack=ACK_PRIMARY, ttl=None):
+        """Same as _forward_writes, without blocking the event loop
+        """
+        try:
+            if self.buffer is not None:
+                if self._is_bufferable(overwrite, ack, ttl):
+                    self.buffer.submit(node_ip, data)
+                    return
+                await asyncio.get_running_loop().run_in_executor(None, self.buffer.flush, node_ip)
+            await self.writes.submit_async(node_ip, data, overwrite, self._forwarded_ack(ack), ttl)
+        finally:
+            self._forget_reads(data)
+
+    @staticmethod
+    def _is_bufferable(overwrite, ack, ttl):
+        return overwrite and ack == ACK_PRIMARY and ttl is None
+
+    @staticmethod
+    def _send_buffered_writes(node_ip, data):
+        """Send a batch of buffered writes to the node which owns them (see WriteBuffer)
+        """
+        Engine._send_writes(node_ip, data, True, None)
+
+    @staticmethod
+    def _send_writes(node_ip, data, overwrite, ack, ttl=None):
+        """Send a batch of coalesced writes to the node which owns them (see WriteCoalescer)
+        """
+        # The ttl is left out of the writes which do not expire, as for the acknowledgement mode
+        options = {} if ttl is None else {'ttl': ttl}
+        if len(data) == 1 and overwrite:
+            (key, value), = data.items()
+            Node.put(node_ip, key, value, ack=ack, **options)
+        else:
+            Node.put_batch(node_ip, data, overwrite=overwrite, ack=ack, **options)
+
+    @staticmethod
+    async def _send_writes_async(node_ip, data, overwrite, ack, ttl=None):
+        options = {} if ttl is None else {'ttl': ttl}
+        if len(data) == 1 and overwrite:
+            (key, value), = data.items()
+            await AsyncNode.put(node_ip, key, value, ack=ack, **options)
+        else:
+            await AsyncNode.put_batch(node_ip, data, overwrite=overwrite, ack=ack, **options)
+
+    def _forget_reads(self, keys):
+        """Keep the reads issued after a write from sharing the result of a read issued before it
+        """
+        if len(self.reads):
+            for key in keys:
+                self.reads.forget((key, False))
+                self.reads.forget((key, True))
+
+    @staticmethod
+    def _forwarded_ack(ack):
+        # The default acknowledgement mode is left out of forwarded requests
+        return ack if ack != ACK_PRIMARY else None
 
     def batch_put(self, data_file):
         """Insert all entries from a file into the key-value store
@@ -36,76 +336,445 @@ class Engine(object):
         The intended use of this function is to load data at initialization,
         however, this can be adapted to batching data through HTTP calls
         """
-        import time
-        start_time = time.time()
-
-        import pandas as pd
-        chunksize = 10000
-        for chunk in pd.read_csv(data_file, sep=" ", chunksize=chunksize, names=["key", "value"]):
-            with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                [executor.submit(self.put, row["key"], row["value"]) for _, row in chunk.iterrows()]
-
-        print("Finished loading initial dataset... Took {} seconds...".format(time.time() - start_time))
+        return BulkLoader(self).load(data_file)
 
     def replicate(self, key, value):
         self.storage.put(key, value)
 
-    def get(self, key):
+    @metrics.timed(metrics.ENGINE_OPERATIONS, 'replicate_many')
+    def replicate_many(self, data, overwrite=True, expires_at=None):
+        """Store the key-value pairs sent by the node which owns them, in the current node
+
+        When expires_at is given, the pairs expire at that time, as set by the owner
+        """
+        metrics.ENGINE_WRITES.inc('replica', amount=len(data))
+        self._store_batch(data, overwrite, expires_at)
+
+    @metrics.timed(metrics.ENGINE_OPERATIONS, 'get')
+    def get(self, key, local=False):
         """Get the value associated with a given key
 
         This function will find the node that contains the
-        corresponding data by using Consistent Hashing
+        corresponding data by using Consistent Hashing. When local
+        is True, the key is only looked up in the current node
         """
         # Try to lookup the key in the current node.
         # In some cases, we may get a hit without the overhead
         # of searching for the key in another node in the cluster.
         value = self.storage.get(key)
-        if value is not None:
+        if value is not None or local:
+            metrics.ENGINE_READS.inc('local')
             return value
 
-        # In the case where the value is not in the current node,
-        # determine which node to perform the lookup in by using Consistent Hashing
-        node_id = ConsistentHash(len(self.config.nodes)).get_node_id(key)
-        if node_id == self.config.node_id:
-            # We've already tried searching in our current node, therefore,
-            # the key does not exist in our key-value store
+        route = self._route(key)
+        if route is None:
+            metrics.ENGINE_READS.inc('local')
+            return None
+
+        node_ip, local = route
+        if not local and self.buffer is not None:
+            # A write buffered for the owner is read back until it was sent
+            value = self.buffer.get(node_ip, key)
+            if value is not None:
+                metrics.ENGINE_READS.inc('buffered')
+                return value
+        if not local and self.filters is not None and not self.filters.might_contain(node_ip, key):
+            metrics.ENGINE_READS.inc('filtered')
             return None
-        return Node.get(self.config.nodes[node_id], key)[key]
+        if local or self.cache is None:
+            metrics.ENGINE_READS.inc('previous_owner' if local else 'forwarded')
+            return self._forward_get(node_ip, key, local)
 
-    def update_cluster_configuration_with_node_config(self):
-        """Update all nodes in the cluster with the current node's configuration
+        # Serve the hottest keys of the other nodes from the read cache
+        value = self.cache.get(key)
+        metrics.ENGINE_READS.inc('cache' if value is not None else 'forwarded')
+        if value is None:
+            generation = self.cache.generation
+            value = self._forward_get(node_ip, key)
+            if value is not None:
+                self.cache.put(key, value, generation)
+        return value
+
+    @metrics.timed(metrics.ENGINE_OPERATIONS, 'get')
+    async def get_async(self, key, local=False):
+        """Same as get, querying the other nodes without blocking the event loop
         """
-        nodes = copy.deepcopy(self.config.nodes)
-        for node_id, node_ip in nodes.items():
+        value = self.storage.get(key)
+        if value is not None or local:
+            metrics.ENGINE_READS.inc('local')
+            return value
+
+        route = self._route(key)
+        if route is None:
+            metrics.ENGINE_READS.inc('local')
+            return None
+
+        node_ip, local = route
+        if not local and self.buffer is not None:
+            # A write buffered for the owner is read back until it was sent
+            value = self.buffer.get(node_ip, key)
+            if value is not None:
+                metrics.ENGINE_READS.inc('buffered')
+                return value
+        if not local and self.filters is not None and not self.filters.might_contain(node_ip, key):
+            metrics.ENGINE_READS.inc('filtered')
+            return None
+        if local or self.cache is None:
+            metrics.ENGINE_READS.inc('previous_owner' if local else 'forwarded')
+            return await self._forward_get_async(node_ip, key, local)
+
+        value = self.cache.get(key)
+        metrics.ENGINE_READS.inc('cache' if value is not None else 'forwarded')
+        if value is None:
+            generation = self.cache.generation
+            value = await self._forward_get_async(node_ip, key)
+            if value is not None:
+                self.cache.put(key, value, generation)
+        return value
+
+    def _forward_get(self, node_ip, key, local=False):
+        """Ask another node for the value of a key, along with the concurrent reads of the key
+
+        The read of a key from its owner is hedged with a read from the
+        first replica of the owner, which may not have the latest write of
+        the key yet (see ReadHedger)
+        """
+        replica_ip = None if local else self._hedging_replica(key)
+        if replica_ip is None:
+            return self.reads.do((key, local), lambda: Node.get(node_ip, key, local=local).get(key))
+
+        return self.reads.do((key, local), lambda: self.hedger.read(
+            lambda: Node.get(node_ip, key).get(key), lambda: Node.get(replica_ip, key, local=True).get(key)))
+
+    async def _forward_get_async(self, node_ip, key, local=False):
+        async def get_value():
+            return (await AsyncNode.get(node_ip, key, local=local)).get(key)
+
+        replica_ip = None if local else self._hedging_replica(key)
+        if replica_ip is None:
+            return await self.reads.do_async((key, local), get_value)
+
+        async def get_replica_value():
+            return (await AsyncNode.get(replica_ip, key, local=True)).get(key)
+
+        return await self.reads.do_async((key, local),
+                                         lambda: self.hedger.read_async(get_value, get_replica_value))
+
+    def _hedging_replica(self, key):
+        """The address of the node to hedge the read of a key owned by another node with, or None
+
+        The first replica of the owner holds a copy of the key, unless it is
+        the current node, which was already looked up
+        """
+        if self.hedger is None:
+            return None
+        hash_ring = self.hash_ring
+        replica_ids = hash_ring.get_replica_node_ids(hash_ring.get_node_id(key), self.config.replication_factor)
+        if not replica_ids or replica_ids[0] == self.config.node_id:
+            return None
+        return self.config.nodes.get(replica_ids[0])
+
+    def _route(self, key):
+        """Find the node to ask for a key which is not in the current node
+
+        Returns a (node_ip, local) tuple, where local tells whether the node
+        should only look in its own storage, or None if no other node can
+        hold the key
+        """
+        # Determine which node to perform the lookup in by using Consistent Hashing
+        node_id = self.hash_ring.get_node_id(key)
+        if node_id != self.config.node_id:
+            return self.config.nodes[node_id], False
+
+        # We've already tried searching in our current node, therefore,
+        # the key does not exist in our key-value store, unless it is
+        # still being moved here from its previous owner
+        previous_node_id = self.rebalancer.previous_owner(key)
+        if previous_node_id is None:
+            return None
+        return self.config.nodes[previous_node_id], True
+
+    def invalidate(self, keys):
+        """Drop the cached values of keys which were overwritten on their owner
+        """
+        if self.cache is not None:
+            self.cache.invalidate(keys)
+        self._forget_reads(keys)
+
+    def key_filter(self, since=0, generation=None):
+        """The changes of the filter of the keys of the node since the given version, for the other nodes
+
+        Along with the changes (see CountingBloomFilter.delta) come the
+        number of nodes the node knows of, and whether it is still receiving
+        the keys of its new ranges, in which case its filter is not complete
+        """
+        if not isinstance(self.storage, FilteredStore):
+            raise KeyValueStoreException("The node does not keep a filter of its keys")
+        delta = self.storage.key_filter_delta(since, generation)
+        delta['nodes'] = len(self.config.nodes)
+        delta['moving'] = self.rebalancer.is_moving()
+        return delta
+
+    def membership(self):
+        """The nodes of the cluster and the parameters of the ring, for the clients routing to the owners
+        """
+        return {
+            'node_id': self.config.node_id,
+            'nodes': {str(node_id): node_ip for node_id, node_ip in self.config.nodes.items()},
+            'num_virtual_nodes': self.config.num_virtual_nodes,
+            'replication_factor': self.config.replication_factor,
+            'version': self.gossip.version,
+            'unreachable': [str(node_id) for node_id in sorted(self.config.nodes)
+                            if not self.gossip.is_alive(node_id)],
+        }
+
+    def check_owner(self, keys):
+        """Raise NotOwnerError unless the current node owns every key
+
+        A client which sent a request to the owner of its keys uses it to
+        learn that its view of the cluster is out of date, instead of the
+        request being forwarded
+        """
+        if len(self.config.nodes) <= 1:
+            return
+        with metrics.ENGINE_PHASES.time('hash'):
+            node_ids = self.hash_ring.get_node_ids(keys)
+        if any(node_id != self.config.node_id for node_id in node_ids):
+            raise NotOwnerError("The node does not own every key of the request", node_id=self.config.node_id)
+
+    @metrics.timed(metrics.ENGINE_OPERATIONS, 'get_many')
+    def get_many(self, keys, local=False):
+        """Get the values associated with many keys at once
+
+        Keys held by the current node are served directly from its storage.
+        The remaining keys are grouped by their owning node and each owner
+        is queried with one request, all issued concurrently, so the latency
+        stays close to a single round trip no matter how many keys are asked
+        for. Keys that do not exist are left out of the result. When local
+        is True, the keys are only looked up in the current node.
+        """
+        values, requests, generation = self._plan_get_many(keys, local)
+        futures = {self.executor.submit(Node.get_many, node_ip, node_keys, local): local
+                   for node_ip, node_keys, local in requests}
+        for future in concurrent.futures.as_completed(futures):
+            self._merge_values(values, future.result(), futures[future], generation)
+        return values
+
+    @metrics.timed(metrics.ENGINE_OPERATIONS, 'get_many')
+    async def get_many_async(self, keys, local=False):
+        """Same as get_many, querying the other nodes without blocking the event loop
+        """
+        values, requests, generation = self._plan_get_many(keys, local)
+        responses = await asyncio.gather(*(AsyncNode.get_many(node_ip, node_keys, local)
+                                           for node_ip, node_keys, local in requests))
+        for (_, _, local), remote_values in zip(requests, responses):
+            self._merge_values(values, remote_values, local, generation)
+        return values
+
+    def _plan_get_many(self, keys, local=False):
+        """Look keys up in the current node and its read cache, and group the others by the node to ask
+
+        Returns the values found so far, a list of (node_ip, keys, local)
+        requests to issue (see _route), and the generation of the read cache
+        """
+        values = {}
+        remote_keys = []
+        for key in keys:
+            value = self.storage.get(key)
+            if value is not None:
+                values[key] = value
+            else:
+                remote_keys.append(key)
+
+        if local or not remote_keys or len(self.config.nodes.keys()) == 1:
+            metrics.ENGINE_READS.inc('local', amount=len(values) + len(remote_keys))
+            return values, [], None
+
+        metrics.ENGINE_READS.inc('local', amount=len(values))
+        generation = None
+        if self.cache is not None:
+            num_remote_keys = len(remote_keys)
+            remote_keys = self._get_cached(remote_keys, values)
+            metrics.ENGINE_READS.inc('cache', amount=num_remote_keys - len(remote_keys))
+            generation = self.cache.generation
+
+        with metrics.ENGINE_PHASES.time('hash'):
+            node_ids = self.hash_ring.get_node_ids(remote_keys)
+
+        requests = []
+        for node_id, node_keys in node_ids.items():
             if node_id != self.config.node_id:
-                Node.update_configuration_for_node(node_ip, nodes)
+                node_ip = self.config.nodes[node_id]
+                if self.buffer is not None:
+                    num_keys = len(node_keys)
+                    node_keys = [key for key in node_keys if not self._get_buffered(node_ip, key, values)]
+                    metrics.ENGINE_READS.inc('buffered', amount=num_keys - len(node_keys))
+                    if not node_keys:
+                        continue
+                if self.filters is not None:
+                    num_keys = len(node_keys)
+                    node_keys = [key for key in node_keys if self.filters.might_contain(node_ip, key)]
+                    metrics.ENGINE_READS.inc('filtered', amount=num_keys - len(node_keys))
+                    if not node_keys:
+                        continue
+                metrics.ENGINE_READS.inc('forwarded', amount=len(node_keys))
+                requests.append((node_ip, node_keys, False))
+            elif self.rebalancer.is_running() or self.rebalancer.previous_ring is not None:
+                # Keys which are still being moved here are asked to their previous owner
+                moved_keys = {}
+                for key in node_keys:
+                    previous_node_id = self.rebalancer.previous_owner(key)
+                    if previous_node_id is not None:
+                        moved_keys.setdefault(previous_node_id, []).append(key)
+                requests.extend((self.config.nodes[previous_node_id], previous_keys, True)
+                                for previous_node_id, previous_keys in moved_keys.items())
+                metrics.ENGINE_READS.inc('previous_owner', amount=sum(map(len, moved_keys.values())))
+        return values, requests, generation
+
+    def _get_buffered(self, node_ip, key, values):
+        """Add the value buffered for a key owned by a node to values, returning whether there was one
+        """
+        value = self.buffer.get(node_ip, key)
+        if value is not None:
+            values[key] = value
+        return value is not None
+
+    def _merge_values(self, values, remote_values, local, generation):
+        values.update(remote_values)
+        if self.cache is not None and not local:
+            for key, value in remote_values.items():
+                self.cache.put(key, value, generation)
+
+    def _get_cached(self, keys, values):
+        """Add the cached values of the given keys to values, returning the keys which are not cached
+        """
+        missing_keys = []
+        for key in keys:
+            value = self.cache.get(key)
+            if value is not None:
+                values[key] = value
+            else:
+                missing_keys.append(key)
+        return missing_keys
 
     def update_cluster_configuration_and_redistribute(self, configuration):
         """Update the configuration of the cluster
 
         This function will redistribute the data after the configuration
         has been modified. For example, if we add a new node, it may inherit
-        some data from its adjacent node in the cluster.
+        some data from its adjacent node in the cluster. The other nodes
+        learn of the change through gossip (see Gossip)
         """
+        previous_ring = self.hash_ring
         updated_configuration = self.config.add(configuration)
         if updated_configuration:
-            self.redistribute()
-            self.update_cluster_configuration_with_node_config()
+            if self.cache is not None:
+                # Some of the cached keys may have moved to the current node
+                self.cache.clear()
+            self.redistribute(previous_ring)
 
-    def redistribute(self):
+    def redistribute(self, previous_ring=None):
         """Redistribute the key-value pairs accross all nodes according to the latest config
-        """
-        kv_store = copy.deepcopy(self.storage.data)
-        for key, value in kv_store.items():
-            self.put(key, value)
 
-            node_id = ConsistentHash(len(self.config.nodes)).get_node_id(key)
-            if (node_id != self.config.node_id and
-               (node_id + 1) % len(self.config.nodes) != self.config.node_id):
-                # Remove the key-value pair from the node it no longer belongs in
-                self.storage.delete(key)
+        The key-value pairs are moved in the background (see Rebalancer). Only
+        the pairs in the ranges of the ring which changed owner since the
+        previous ring are moved, or every pair the current node does not own
+        when the previous ring is unknown
+        """
+        self.rebalancer.start(previous_ring)
 
     def snapshot(self):
         """Return a snapshot of the data in the current node
         """
-        return self.storage.data
+        return dict(self.storage.items())
+
+    @metrics.timed(metrics.ENGINE_OPERATIONS, 'scan')
+    def scan(self, cursor=None, limit=DEFAULT_SCAN_LIMIT, start=None, end=None):
+        """Return a page of the data in the current node, and the cursor of the next page
+
+        A page covers `limit` key-value pairs of the store, of which only the
+        keys in the range [start, end) are returned, so a page may hold fewer
+        pairs than the limit even though the scan is not over. The cursor is
+        None once every key-value pair has been scanned.
+        """
+        items, next_cursor = self.storage.scan(cursor, limit)
+        return self._select_range(items, start, end), next_cursor
+
+    def stream_snapshot(self, cursor=None, start=None, end=None):
+        """Iterate over the data in the current node, one page at a time
+
+        Only one page is held in memory at a time, no matter how many
+        key-value pairs are stored in the node
+        """
+        for items in self.storage.iter_pages(cursor, DEFAULT_SCAN_LIMIT):
+            yield self._select_range(items, start, end)
+
+    @metrics.timed(metrics.ENGINE_OPERATIONS, 'range_scan')
+    def range_scan(self, start=None, end=None, limit=DEFAULT_SCAN_LIMIT, cursor=None, prefix=None, local=False):
+        """Return the key-value pairs of the cluster whose key is in the range [start, end), in the order of their keys
+
+        With a prefix, only the keys which start with it are returned. The
+        page holds at most `limit` pairs, after the key given as cursor, and
+        the cursor of the next page is its last key, or None once the range
+        has been scanned. Every node scans its own storage, and their pages
+        are merged into one ordered page. When local is True, only the
+        storage of the current node is scanned
+        """
+        if prefix:
+            start, end = self._intersect_range(prefix_range(prefix), start, end)
+        if local or len(self.config.nodes) <= 1:
+            return self.storage.range_scan(start, end, limit, cursor)
+
+        futures = {self.executor.submit(Node.range_scan, node_ip, start, end, limit, cursor): node_id
+                   for node_id, node_ip in self.config.nodes.items() if node_id != self.config.node_id}
+        pages = {self.config.node_id: self.storage.range_scan(start, end, limit, cursor)[0]}
+        for future in concurrent.futures.as_completed(futures):
+            pages[futures[future]] = future.result()[0]
+        return self._merge_pages(pages, limit)
+
+    def stream_range_scan(self, start=None, end=None, cursor=None, prefix=None):
+        """Iterate over the key-value pairs of the cluster in a range of keys, one ordered page at a time
+        """
+        while True:
+            items, cursor = self.range_scan(start, end, DEFAULT_SCAN_LIMIT, cursor, prefix)
+            yield dict(items)
+            if cursor is None:
+                return
+
+    def _merge_pages(self, pages, limit):
+        """Merge the ordered pages of the nodes, given as {node_id: [(key, value)]}, into a single ordered page
+
+        A key found on many nodes, like the replicas of its owner, is only
+        returned once, with the value held by its owner when it has one. Any
+        node which filled its page has `limit` distinct keys, so the merged
+        page is only shorter than the limit once every node is exhausted
+        """
+        merged = heapq.merge(*([(key, node_id, value) for key, value in items] for node_id, items in pages.items()))
+        items = []
+        for key, copies in itertools.groupby(merged, key=lambda item: item[0]):
+            values = {node_id: value for _, node_id, value in copies}
+            owner = self.hash_ring.get_node_id(key)
+            items.append((key, values[owner] if owner in values else next(iter(values.values()))))
+            if len(items) == limit:
+                return items, key
+        return items, None
+
+    @staticmethod
+    def _intersect_range(key_range, start=None, end=None):
+        """Intersect a range of keys [start, end) with another one, where None is unbounded
+        """
+        range_start, range_end = key_range
+        if start is None or (range_start is not None and range_start > start):
+            start = range_start
+        if end is None or (range_end is not None and range_end < end):
+            end = range_end
+        return start, end
+
+    @staticmethod
+    def _select_range(items, start=None, end=None):
+        """Keep the key-value pairs whose key is in the range [start, end)
+        """
+        if start is None and end is None:
+            return dict(items)
+        return {key: value for key, value in items
+                if (start is None or key >= start) and (end is None or key < end)}
@@ -0,0 +1,203 @@
+import random
+import threading
+import time
+
+from thunderdb.compute.node import Node
+from thunderdb.exceptions.errors import ServiceError
+
+# The number of seconds between two rounds of gossip
+DEFAULT_GOSSIP_INTERVAL = 0.5
+
+# The number of peers a node exchanges its membership table with every round
+DEFAULT_GOSSIP_FANOUT = 2
+
+# The number of seconds after which a member whose heartbeat did not advance is reported as unreachable
+DEFAULT_FAILURE_TIMEOUT = 5.0
+
+# When the size of the cluster is not known, a node is ready once every member
+# it knows of is alive and no new member was discovered for this many rounds
+SETTLE_ROUNDS = 3
+
+# The maximum number of seconds a node waits to be ready before loading its data file anyway
+DEFAULT_READY_TIMEOUT = 60.0
+
+
+class Gossip(object):
+    """Spread the membership of the cluster between the nodes, and tell when the cluster is ready
+
+    Every node keeps a table of the members of the cluster it knows of,
+    with the address, the generation (the time the member started at) and
+    the heartbeat of each, a counter the member increments every round.
+    Every interval, a node increments its heartbeat and exchanges its table
+    with `fanout` peers drawn at random (see /gossip): both sides keep, for
+    every member, the entry with the latest (generation, heartbeat). A new
+    member, or a new heartbeat, thus reaches every node in O(log N) rounds,
+    and a node restarted with a new address replaces its previous entry.
+
+    The members discovered during a round are added to the configuration
+    of the cluster together, so a node redistributes its key-value pairs at
+    most once per round, however many nodes join at once. A member whose
+    heartbeat did not advance for failure_timeout seconds is reported as
+    unreachable, but it stays in the ring, as its keys have nowhere to go.
+
+    The node is ready once every member it knows of is alive, and it either
+    knows of expected_nodes members or no new member was discovered for
+    SETTLE_ROUNDS rounds (see wait_until_ready).
+    """
+    def __init__(self, engine,
+                 interval=DEFAULT_GOSSIP_INTERVAL,
+                 fanout=DEFAULT_GOSSIP_FANOUT,
+                 failure_timeout=DEFAULT_FAILURE_TIMEOUT,
+                 expected_nodes=None,
+                 clock=time.time):
+        self.engine = engine
+        self.interval = interval
+        self.fanout = fanout
+        self.failure_timeout = failure_timeout
+        self.expected_nodes = expected_nodes
+        self.version = 0
+        self.rounds = 0
+        self.generation = int(clock() * 1000)
+        self.heartbeat = 0
+        self._clock = clock
+        self._members = {}
+        self._heard_at = {}
+        self._discovered = {}
+        self._stable_rounds = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start gossiping in a background thread, the first round being run right away
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="gossip", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._closed.set()
+
+    def members(self):
+        """The membership table of the node, as {node_id: [address, generation, heartbeat]}
+
+        The nodes of the configuration which were never heard from have a
+        generation and a heartbeat of 0
+        """
+        config = self.engine.config
+        with self._lock:
+            self._members[config.node_id] = [config.node_ip, self.generation, self.heartbeat]
+            for node_id, node_ip in list(config.nodes.items()):
+                if node_id not in self._members:
+                    self._members[node_id] = [node_ip, 0, 0]
+            return {str(node_id): list(member) for node_id, member in self._members.items()}
+
+    def exchange(self, members):
+        """Merge the membership table of a peer, returning the table of the node (see /gossip)
+        """
+        self.merge(members)
+        return self.members()
+
+    def merge(self, members):
+        """Keep the latest entry of every member of the given table
+
+        The members which are not in the configuration of the cluster yet
+        are added to it at the end of the current round
+        """
+        config = self.engine.config
+        now = self._clock()
+        with self._lock:
+            for node_id, (node_ip, generation, heartbeat) in members.items():
+                node_id = int(node_id)
+                if node_id == config.node_id:
+                    continue
+                current = self._members.get(node_id)
+                if current is None or (generation, heartbeat) > (current[1], current[2]):
+                    self._members[node_id] = [node_ip, generation, heartbeat]
+                    if generation:
+                        self._heard_at[node_id] = now
+                if config.nodes.get(node_id) != self._members[node_id][0]:
+                    self._discovered[node_id] = self._members[node_id][0]
+
+    def run_round(self):
+        """Increment the heartbeat of the node, and exchange its table with `fanout` random peers
+        """
+        with self._lock:
+            self.heartbeat += 1
+        members = self.members()
+        peers = [member[0] for node_id, member in members.items() if int(node_id) != self.engine.config.node_id]
+        peers = random.sample(peers, min(self.fanout, len(peers)))
+        for response in self.engine.executor.map(lambda node_ip: self._send(node_ip, members), peers):
+            if response is not None:
+                self.merge(response)
+
+        self._apply()
+        self.rounds += 1
+        if self.is_ready():
+            self._ready.set()
+
+    def is_alive(self, node_id):
+        """Whether the heartbeat of a member advanced in the last failure_timeout seconds
+        """
+        if node_id == self.engine.config.node_id:
+            return True
+        heard_at = self._heard_at.get(node_id)
+        return heard_at is not None and self._clock() - heard_at < self.failure_timeout
+
+    def is_ready(self):
+        nodes = list(self.engine.config.nodes)
+        if len(nodes) == 1 and self.expected_nodes in (None, 1):
+            return True
+        if self.expected_nodes is not None and len(nodes) < self.expected_nodes:
+            return False
+        if not all(self.is_alive(node_id) for node_id in nodes):
+            return False
+        return self.expected_nodes is not None or self._stable_rounds >= SETTLE_ROUNDS
+
+    def wait_until_ready(self, timeout=None):
+        """Wait for the node to be ready, returning False on timeout
+        """
+        if self.is_ready():
+            self._ready.set()
+        return self._ready.wait(timeout)
+
+    def stats(self):
+        """The address, the heartbeat and the liveness of every member, by node id
+        """
+        return {node_id: {'address': node_ip, 'heartbeat': heartbeat, 'alive': self.is_alive(int(node_id))}
+                for node_id, (node_ip, _, heartbeat) in self.members().items()}
+
+    def _send(self, node_ip, members):
+        try:
+            return Node.gossip(node_ip, members)
+        except ServiceError:
+            # The peer is not up yet, or not anymore: its heartbeat stops advancing
+            return None
+
+    def _apply(self):
+        """Add the members discovered during the round to the configuration of the cluster, in one change
+        """
+        with self._lock:
+            discovered, self._discovered = self._discovered, {}
+        if not discovered:
+            self._stable_rounds += 1
+            return
+
+        self._stable_rounds = 0
+        self.version += 1
+        self.engine.update_cluster_configuration_and_redistribute(discovered)
+
+    def _run(self):
+        while True:
+            try:
+                self.run_round()
+            except RuntimeError:
+                # The executor of the engine was shut down, with the interpreter
+                return
+            except Exception as error:
+                print("Gossip round failed: {}".format(error))
+            if self._closed.wait(self.interval):
+                return
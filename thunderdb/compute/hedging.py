@@ -0,0 +1,220 @@
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
+
+from thunderdb.compute import metrics
+
+# The percentile of the latency of the reads sent to the owners after which a
+# read is sent to the successor of the owner as well
+DEFAULT_HEDGE_PERCENTILE = 0.95
+
+# The highest fraction of the reads which may be hedged, so that a slow owner
+# does not double the load of its successor
+DEFAULT_HEDGE_MAX_RATE = 0.05
+
+# The number of hedged reads which may be sent in a row before the rate applies
+HEDGE_BURST = 10
+
+# The number of latencies of the latest reads the hedging delay is computed from
+LATENCY_WINDOW = 1000
+
+# The number of reads after which the hedging delay is computed again
+DELAY_REFRESH_INTERVAL = 100
+
+# The number of seconds after which a read is hedged until enough latencies were observed
+DEFAULT_HEDGE_DELAY = 0.01
+
+# The bounds of the hedging delay in seconds, so that a burst of very fast or
+# very slow reads does not make every read, or no read at all, hedged
+MIN_HEDGE_DELAY = 0.0005
+MAX_HEDGE_DELAY = 1.0
+
+# The maximum number of reads, primary or backup, which run on the executor of the hedger at once
+MAX_HEDGED_READS = 64
+
+
+class ReadHedger(object):
+    """Send a read to a second node when the first one is slower than usual, returning the first answer
+
+    A read is first sent to the primary node only, through the executor of
+    the hedger, and waited for during the given percentile of the latencies
+    of the latest LATENCY_WINDOW reads. When it did not answer by then, the
+    read is sent to the backup node as well, and the first of the two to
+    answer wins, so the only extra request is the backup. The backup not
+    finding the key, or failing, is not an answer: the primary is waited
+    for then.
+
+    The read which loses is abandoned, not cancelled: it keeps its thread
+    until it returns, and its answer is ignored. The asyncio reads are
+    cancelled while in flight instead. At most MAX_HEDGED_READS reads run
+    on the executor at once, so a read never waits for a thread of it: when
+    they are all taken, as when the primary is slow, the read is sent from
+    the calling thread and not hedged.
+
+    Hedged reads are paid for with a budget which every completed read adds
+    max_rate to, up to HEDGE_BURST, so at most a max_rate fraction of the
+    reads are hedged over time, however slow the primary is. A read sent
+    while the budget is spent is waited for without hedging it.
+    """
+    def __init__(self, percentile=DEFAULT_HEDGE_PERCENTILE, max_rate=DEFAULT_HEDGE_MAX_RATE):
+        if not 0 < percentile < 1:
+            raise ValueError("The hedging percentile must be between 0 and 1, got {}".format(percentile))
+        if not 0 <= max_rate <= 1:
+            raise ValueError("The hedging rate must be between 0 and 1, got {}".format(max_rate))
+
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.delay = DEFAULT_HEDGE_DELAY
+        self.hedged = 0
+        self.won = 0
+        self.skipped = 0
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._observations = 0
+        self._budget = HEDGE_BURST
+        self._running = 0
+        self._lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_HEDGED_READS,
+                                                              thread_name_prefix="hedged-read")
+
+    def read(self, primary, backup):
+        """Call primary(), then backup() too if primary did not return within the hedging delay
+
+        Both functions return the value read, or None if the key was not
+        found. Returns the first value found
+        """
+        if self._budget < 1 or not self._reserve():
+            # The read could not be hedged, so it is sent from the calling thread
+            started_at = time.perf_counter()
+            try:
+                return primary()
+            finally:
+                latency = time.perf_counter() - started_at
+                if latency > self.delay:
+                    self._skip()
+                self.observe(latency)
+
+        first = self.executor.submit(self._run, primary, observe=True)
+        try:
+            return first.result(timeout=self.delay)
+        except concurrent.futures.TimeoutError:
+            pass
+        if not self._reserve():
+            self._skip()
+            return first.result()
+        if not self._spend():
+            self._release()
+            return first.result()
+
+        second = self.executor.submit(self._run, backup)
+        done, _ = concurrent.futures.wait((first, second), return_when=concurrent.futures.FIRST_COMPLETED)
+        if first in done and first.exception() is None:
+            return first.result()
+        try:
+            value = second.result()
+        except Exception:
+            value = None
+        if value is None:
+            return first.result()
+        self._count_win()
+        return value
+
+    async def read_async(self, primary, backup):
+        """Same as read, primary and backup being coroutine functions
+        """
+        started_at = time.perf_counter()
+        first = asyncio.ensure_future(primary())
+        first.add_done_callback(lambda _: self.observe(time.perf_counter() - started_at))
+        done, _ = await asyncio.wait((first,), timeout=self.delay)
+        if done or not self._spend():
+            return await first
+
+        second = asyncio.ensure_future(backup())
+        try:
+            done, _ = await asyncio.wait((first, second), return_when=asyncio.FIRST_COMPLETED)
+            if first in done and first.exception() is None:
+                return first.result()
+            await asyncio.wait((second,))
+            value = second.result() if second.exception() is None else None
+            if value is None:
+                return await first
+            self._count_win()
+            return value
+        finally:
+            for future in (first, second):
+                if not future.done():
+                    future.cancel()
+                elif not future.cancelled():
+                    # The error of the read which lost is not raised, nor reported as never retrieved
+                    future.exception()
+
+    def observe(self, latency):
+        """Record the latency of a read sent to a primary node, in seconds
+        """
+        with self._lock:
+            self._latencies.append(latency)
+            self._observations += 1
+            self._budget = min(self._budget + self.max_rate, HEDGE_BURST)
+            if self._observations % DELAY_REFRESH_INTERVAL == 0:
+                latencies = sorted(self._latencies)
+                delay = latencies[min(int(len(latencies) * self.percentile), len(latencies) - 1)]
+                self.delay = min(max(delay, MIN_HEDGE_DELAY), MAX_HEDGE_DELAY)
+
+    def stats(self):
+        """The hedging delay and the counts of the hedged reads, as a dictionary
+        """
+        return {'delay': self.delay, 'hedged': self.hedged, 'won': self.won, 'skipped': self.skipped}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    def _run(self, read, observe=False):
+        """Call read() on the executor, recording its latency if observe is True, then free its thread
+        """
+        started_at = time.perf_counter()
+        try:
+            return read()
+        finally:
+            if observe:
+                self.observe(time.perf_counter() - started_at)
+            self._release()
+
+    def _reserve(self):
+        """Reserve a thread of the executor for a read, returning False if they are all taken
+        """
+        with self._lock:
+            if self._running >= MAX_HEDGED_READS:
+                return False
+            self._running += 1
+            return True
+
+    def _release(self):
+        with self._lock:
+            self._running -= 1
+
+    def _spend(self):
+        """Take a hedged read from the budget, returning False if the budget is spent
+        """
+        with self._lock:
+            spent = self._budget >= 1
+            if spent:
+                self._budget -= 1
+                self.hedged += 1
+        if spent:
+            metrics.HEDGED_READS.inc('sent')
+        else:
+            self._skip()
+        return spent
+
+    def _skip(self):
+        """Count a read which was not hedged, as the budget was spent or the executor was busy
+        """
+        with self._lock:
+            self.skipped += 1
+        metrics.HEDGED_READS.inc('skipped')
+
+    def _count_win(self):
+        with self._lock:
+            self.won += 1
+        metrics.HEDGED_READS.inc('won')
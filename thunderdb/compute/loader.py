@@ -0,0 +1,118 @@
+import collections
+import concurrent.futures
+import time
+
+from thunderdb.compute import metrics
+
+# The number of bytes read from the data file at a time
+READ_BUFFER_SIZE = 8 * 1024 * 1024
+
+# The number of key-value pairs handed to the engine at a time
+DEFAULT_BATCH_SIZE = 50000
+
+# The number of batches that can be stored or forwarded concurrently
+DEFAULT_MAX_WORKERS = 4
+
+# The number of seconds between two progress reports
+DEFAULT_PROGRESS_INTERVAL = 5.0
+
+
+class BulkLoader(object):
+    """Load a space-delimited file of key-value pairs into the key-value store
+
+    The file is streamed in large buffered reads and split into lines
+    without any intermediate data frame. Every batch of key-value pairs is
+    handed to Engine.put_many, which partitions it by owning node, stores
+    the local partition in one call and forwards the others in bulk. A few
+    batches are in flight at once, so parsing the file overlaps with
+    forwarding data to the other nodes, while the number of pending batches
+    stays bounded so the memory usage does not grow with the file size.
+    """
+    def __init__(self, engine,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 max_workers=DEFAULT_MAX_WORKERS,
+                 progress_interval=DEFAULT_PROGRESS_INTERVAL,
+                 read_buffer_size=READ_BUFFER_SIZE):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.progress_interval = progress_interval
+        self.read_buffer_size = read_buffer_size
+        self.skipped_lines = 0
+
+    def load(self, data_file):
+        """Load every key-value pair of the data file, returning the number of pairs loaded
+        """
+        start_time = last_report_time = time.time()
+        num_records = 0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = collections.deque()
+            for batch in self.read_batches(data_file):
+                if len(pending) >= 2 * self.max_workers:
+                    pending.popleft().result()
+                pending.append(executor.submit(self.engine.put_many, batch))
+                num_records += len(batch)
+                metrics.LOADER_RECORDS.inc(amount=len(batch))
+
+                if time.time() - last_report_time >= self.progress_interval:
+                    last_report_time = time.time()
+                    self._report("Loaded {} records...".format(num_records), num_records, start_time)
+
+            while pending:
+                pending.popleft().result()
+
+        self._report("Finished loading initial dataset... Took {:.2f} seconds...".format(time.time() - start_time),
+                     num_records, start_time)
+        return num_records
+
+    def read_batches(self, data_file):
+        """Stream the data file, yielding dictionaries of at most batch_size key-value pairs
+        """
+        batch = {}
+        for lines in self._read_lines(data_file):
+            for line in lines:
+                pair = line.split(" ", 1)
+                if len(pair) != 2:
+                    if line.strip():
+                        self.skipped_lines += 1
+                        metrics.LOADER_SKIPPED_LINES.inc()
+                    continue
+
+                batch[pair[0]] = pair[1].rstrip("\r")
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = {}
+
+        if batch:
+            yield batch
+
+    def _read_lines(self, data_file):
+        """Read the data file in large blocks, yielding the complete lines of each block
+
+        Blocks are split on the last newline before being decoded, so a line
+        (or a multi-byte character) is never cut in half
+        """
+        remainder = b""
+        with open(data_file, "rb") as file:
+            while True:
+                block = file.read(self.read_buffer_size)
+                if not block:
+                    break
+
+                block = remainder + block
+                end_of_last_line = block.rfind(b"\n")
+                if end_of_last_line == -1:
+                    remainder = block
+                    continue
+
+                remainder = block[end_of_last_line + 1:]
+                yield block[:end_of_last_line].decode().split("\n")
+
+        if remainder:
+            yield [remainder.decode()]
+
+    def _report(self, message, num_records, start_time):
+        elapsed = max(time.time() - start_time, 1e-9)
+        print("{} ({} records, {:.0f} records per second, {} malformed lines skipped)".format(
+            message, num_records, num_records / elapsed, self.skipped_lines))
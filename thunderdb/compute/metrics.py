@@ -0,0 +1,352 @@
+"""
+Counters and latency histograms of the hot paths of a node, exposed on /metrics in the Prometheus text format
+
+The metrics are plain dictionaries of counts keyed by the values of their
+labels, updated under a lock, so recording an observation costs about a
+microsecond. The values which are cheaper to read when the metrics are
+scraped than to keep up to date, like the size of the store, are collected
+from the Engine at that time (see collect_engine).
+"""
+import bisect
+import functools
+import inspect
+import os
+import resource
+import threading
+import time
+from abc import abstractmethod
+
+from thunderdb.exceptions.errors import ServiceError
+from thunderdb.storage.capped_store import CappedStore
+
+# The upper bounds of the buckets of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric(object):
+    """A family of time series sharing a name, one per combination of the values of its labels
+    """
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    @abstractmethod
+    def samples(self):
+        """The (suffix, labels, value) samples of the family, labels being a list of (name, value) pairs
+        """
+        pass
+
+    def _label_pairs(self, label_values):
+        return list(zip(self.labels, label_values))
+
+
+class Counter(Metric):
+    """A count which only goes up, like the number of requests
+    """
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self._series.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            series = list(self._series.items())
+        return [('', self._label_pairs(label_values), value) for label_values, value in series]
+
+
+class Histogram(Metric):
+    """The distribution of observed values, like latencies, counted in buckets
+
+    The number and the sum of the observations are kept as well, so a
+    histogram also counts the requests it times
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def time(self, *label_values):
+        """A context manager observing the number of seconds spent in its block
+        """
+        return _Timer(self, label_values)
+
+    def samples(self):
+        with self._lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self._series.items()]
+
+        samples = []
+        for label_values, counts, total in series:
+            labels = self._label_pairs(label_values)
+            cumulative_count = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative_count += count
+                samples.append(('_bucket', labels + [('le', _format_value(bound))], cumulative_count))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, cumulative_count))
+        return samples
+
+
+class _Timer(object):
+    __slots__ = ('histogram', 'label_values', 'start')
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class MetricsRegistry(object):
+    """The metrics of a process, rendered together in the Prometheus text format
+    """
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.clear()
+
+    def render(self, collected=()):
+        """Render every metric, followed by the collected (name, type, help, samples) families
+        """
+        families = [(metric.name, metric.type, metric.help, metric.samples()) for metric in self.metrics.values()]
+        lines = []
+        for name, type, help, samples in families + list(collected):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, type))
+            for suffix, labels, value in samples:
+                lines.append('{}{}{} {}'.format(name, suffix, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("A metric named '{}' is already registered".format(metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                           .replace('\n', '\\n'))
+                          for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.histogram(
+    'thunderdb_http_request_seconds', "The latency of the HTTP requests served", ('method', 'route', 'status'))
+HTTP_ERRORS = REGISTRY.counter(
+    'thunderdb_http_errors_total', "The exceptions raised while serving HTTP requests", ('route', 'type'))
+BINARY_REQUESTS = REGISTRY.histogram(
+    'thunderdb_binary_request_seconds', "The latency of the binary requests served", ('opcode', 'status'))
+SERIALIZATION = REGISTRY.histogram(
+    'thunderdb_serialization_seconds', "The time spent decoding the bodies of the HTTP requests", ('format',))
+ENGINE_OPERATIONS = REGISTRY.histogram(
+    'thunderdb_engine_operation_seconds', "The latency of the operations of the engine", ('operation',))
+ENGINE_PHASES = REGISTRY.histogram(
+    'thunderdb_engine_phase_seconds', "The time spent in the phases of the batch operations of the engine",
+    ('phase',))
+ENGINE_READS = REGISTRY.counter(
+    'thunderdb_engine_reads_total', "The keys read, by where their value was looked up", ('source',))
+ENGINE_WRITES = REGISTRY.counter(
+    'thunderdb_engine_writes_total', "The key-value pairs written, by where they were stored", ('destination',))
+COALESCED_REQUESTS = REGISTRY.counter(
+    'thunderdb_coalesced_requests_total', "The requests to the other nodes saved by joining a concurrent one",
+    ('operation',))
+HEDGED_READS = REGISTRY.counter(
+    'thunderdb_hedged_reads_total', "The reads sent to a replica as well because the owner was slow to answer",
+    ('outcome',))
+PEER_REQUESTS = REGISTRY.histogram(
+    'thunderdb_peer_request_seconds', "The latency of the requests sent to the other nodes", ('peer', 'method'))
+PEER_ERRORS = REGISTRY.counter(
+    'thunderdb_peer_errors_total', "The requests sent to the other nodes which failed", ('peer', 'method'))
+STORE_OPERATIONS = REGISTRY.histogram(
+    'thunderdb_store_operation_seconds', "The latency of the batch operations of the store", ('operation',))
+LOADER_RECORDS = REGISTRY.counter(
+    'thunderdb_loader_records_total', "The key-value pairs read from the initial dataset")
+LOADER_SKIPPED_LINES = REGISTRY.counter(
+    'thunderdb_loader_skipped_lines_total', "The malformed lines skipped in the initial dataset")
+
+
+def timed(histogram, *label_values):
+    """Decorate a function or a coroutine function to observe how long its calls take
+    """
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, *label_values)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, *label_values)
+        return wrapper
+    return decorate
+
+
+def peer_request(method):
+    """Decorate a request to another node, whose address is the first argument, to time it and count its failures
+    """
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(node_ip_address, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(node_ip_address, *args, **kwargs)
+                except ServiceError:
+                    PEER_ERRORS.inc(node_ip_address, method)
+                    raise
+                finally:
+                    PEER_REQUESTS.observe(time.perf_counter() - start, node_ip_address, method)
+        else:
+            @functools.wraps(func)
+            def wrapper(node_ip_address, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(node_ip_address, *args, **kwargs)
+                except ServiceError:
+                    PEER_ERRORS.inc(node_ip_address, method)
+                    raise
+                finally:
+                    PEER_REQUESTS.observe(time.perf_counter() - start, node_ip_address, method)
+        return wrapper
+    return decorate
+
+
+def get_resident_memory():
+    """The number of bytes of memory used by the process, or its peak usage where the current one is unknown
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def collect_engine(engine):
+    """Read the state of an Engine, as (name, type, help, samples) families
+    """
+    families = [
+        ('thunderdb_store_keys', 'gauge', "The number of key-value pairs held by the node",
+         [('', [], len(engine.storage))]),
+        ('thunderdb_process_resident_memory_bytes', 'gauge', "The memory used by the node",
+         [('', [], get_resident_memory())]),
+        ('thunderdb_cluster_nodes', 'gauge', "The number of nodes in the cluster",
+         [('', [], len(engine.config.nodes))]),
+        ('thunderdb_rebalancing', 'gauge', "1 while the node moves key-value pairs to their new owner",
+         [('', [], int(engine.rebalancer.is_running()))]),
+    ]
+
+    replication = engine.replication.stats()
+    families.append(('thunderdb_replication_pending', 'gauge', "The writes waiting to be sent to each replica",
+                     [('', [('replica', node_id)], stats['pending']) for node_id, stats in replication.items()]))
+    families.append(('thunderdb_replication_dropped_total', 'counter',
+                     "The writes dropped because too many were waiting to be sent to a replica",
+                     [('', [('replica', node_id)], stats['dropped']) for node_id, stats in replication.items()]))
+    families.append(('thunderdb_replication_rejected_total', 'counter',
+                     "The writes dropped because a replica rejected them",
+                     [('', [('replica', node_id)], stats['rejected']) for node_id, stats in replication.items()]))
+
+    if engine.buffer is not None:
+        buffered = engine.buffer.stats()
+        families.append(('thunderdb_write_buffer_pending', 'gauge',
+                         "The forwarded writes buffered to be sent to each node",
+                         [('', [('node', node_ip)], stats['pending']) for node_ip, stats in buffered.items()]))
+        families.append(('thunderdb_write_buffer_dropped_total', 'counter',
+                         "The forwarded writes dropped because too many were buffered for a node",
+                         [('', [('node', node_ip)], stats['dropped']) for node_ip, stats in buffered.items()]))
+        families.append(('thunderdb_write_buffer_rejected_total', 'counter',
+                         "The forwarded writes dropped because the node which owns them rejected them",
+                         [('', [('node', node_ip)], stats['rejected']) for node_ip, stats in buffered.items()]))
+        families.append(('thunderdb_write_buffer_linger_seconds', 'gauge',
+                         "The time the writes buffered for each node wait for more writes before they are sent",
+                         [('', [('node', node_ip)], stats['linger']) for node_ip, stats in buffered.items()]))
+
+    if isinstance(engine.storage, CappedStore):
+        stats = engine.storage.stats()
+        families.append(('thunderdb_store_bytes', 'gauge', "The estimated size of the key-value pairs held by the node",
+                         [('', [], stats['bytes'])]))
+        families.append(('thunderdb_store_max_bytes', 'gauge', "The memory budget of the store",
+                         [('', [], stats['max_bytes'])]))
+        families.append(('thunderdb_store_expiring_keys', 'gauge', "The number of keys which expire",
+                         [('', [], stats['expiring_keys'])]))
+        for counter in ('evictions', 'expirations'):
+            families.append(('thunderdb_store_{}_total'.format(counter), 'counter',
+                             "The {} of keys of the store".format(counter), [('', [], stats[counter])]))
+
+    if engine.cache is not None:
+        stats = engine.cache.stats()
+        families.append(('thunderdb_cache_entries', 'gauge', "The number of values in the read cache",
+                         [('', [], stats['entries'])]))
+        families.append(('thunderdb_cache_bytes', 'gauge', "The estimated size of the values in the read cache",
+                         [('', [], stats['bytes'])]))
+        for counter in ('hits', 'misses', 'evictions', 'invalidations'):
+            families.append(('thunderdb_cache_{}_total'.format(counter), 'counter',
+                             "The {} of the read cache".format(counter), [('', [], stats[counter])]))
+    return families
+
+
+def render(engine):
+    """Render the metrics of the process and the state of the engine in the Prometheus text format
+    """
+    return REGISTRY.render(collect_engine(engine))
@@ -1,6 +1,13 @@
 import thunderdb.compute.utils as request
+import itertools
 import json
 
+from thunderdb.compute import metrics
+from thunderdb.storage.key_value_store import DEFAULT_SCAN_LIMIT
+
+# The maximum number of key-value pairs sent in a single bulk request
+BATCH_SIZE = 10000
+
 
 class Node(object):
     """Object representing a node in the cluster
@@ -8,28 +15,195 @@ class Node(object):
     This class provides functions to get and set key-value pairs, 
     set the replica for the key-value pair, and update the node's 
     configuration
+
+    All the requests go through a pool of keep-alive connections which is
+    shared by every thread of the server (see configure_connection_pool).
+    When a transport is configured (see configure_transport), the requests
+    which read and write key-value pairs go through it instead, and only the
+    configuration of the cluster is still shared over HTTP
     """
+    connection_pool = request.ConnectionPool()
+    transport = None
+
+    @classmethod
+    def configure_connection_pool(cls, **kwargs):
+        """Replace the connection pool used to reach the other nodes
+
+        The keyword arguments are passed to ConnectionPool
+        """
+        previous_pool, cls.connection_pool = cls.connection_pool, request.ConnectionPool(**kwargs)
+        previous_pool.close()
+
+    @classmethod
+    def configure_transport(cls, transport):
+        """Replace the transport used to read and write key-value pairs on the other nodes
+
+        The transport must provide the same methods as Node, like BinaryTransport.
+        Passing None sends every request over HTTP again
+        """
+        previous_transport, cls.transport = cls.transport, transport
+        if previous_transport is not None:
+            previous_transport.close()
+
     @staticmethod
-    def put(node_ip_address, key, value):
+    @metrics.peer_request('put')
+    def put(node_ip_address, key, value, ack=None, ttl=None):
         """Set a key-value pair on a specific node
+
+        When an acknowledgement mode is given, the node only responds once
+        the pair is stored on as many replicas as the mode requires. When a
+        ttl is given, the pair expires after that many seconds. The
+        transport has no way to carry the ttl, so such writes go over HTTP
         """
+        if Node.transport is not None and ttl is None:
+            return Node.transport.put(node_ip_address, key, value, ack=ack)
         payload = {key: value}
-        request.post('http://' + node_ip_address + '/put', data=json.dumps(payload))
+        url = 'http://' + node_ip_address + '/put' + Node._query(ack=ack, ttl=ttl)
+        Node.connection_pool.post(url, data=json.dumps(payload), idempotent=True)
 
     @staticmethod
-    def get(node_ip_address, key):
+    @metrics.peer_request('put_batch')
+    def put_batch(node_ip_address, data, overwrite=True, ack=None, ttl=None):
+        """Set many key-value pairs on a specific node
+
+        The pairs are sent in bulk requests of at most BATCH_SIZE pairs each.
+        Unless overwrite is True, keys which already exist on the node keep
+        their current value. The acknowledgement mode and the ttl are the
+        same as for put
+        """
+        if Node.transport is not None and ttl is None:
+            return Node.transport.put_batch(node_ip_address, data, overwrite=overwrite, ack=ack)
+        url = 'http://' + node_ip_address + '/batch-put' + Node._query(overwrite, ack=ack, ttl=ttl)
+        items = iter(data.items())
+        batch = dict(itertools.islice(items, BATCH_SIZE))
+        while batch:
+            Node.connection_pool.post(url, data=json.dumps(batch), idempotent=True)
+            batch = dict(itertools.islice(items, BATCH_SIZE))
+
+    @staticmethod
+    @metrics.peer_request('get')
+    def get(node_ip_address, key, local=False):
         """Get the value for a given key from a specific node
+
+        Returns an empty dictionary if the key does not exist. When local is
+        True, the node only looks the key up in its own storage
         """
-        response = request.get('http://' + node_ip_address + '/get/{}'.format(key))
+        if Node.transport is not None:
+            return Node.transport.get(node_ip_address, key, local=local)
+        url = 'http://' + node_ip_address + '/get/{}'.format(key) + ('?local=true' if local else '')
+        response = Node.connection_pool.get(url)
+        if response.status_code == 404:
+            return {}
         return response.json()
 
     @staticmethod
+    @metrics.peer_request('get_many')
+    def get_many(node_ip_address, keys, local=False):
+        """Get the values for many keys from a specific node in one request
+
+        When local is True, the node only looks the keys up in its own storage
+        """
+        if Node.transport is not None:
+            return Node.transport.get_many(node_ip_address, keys, local=local)
+        url = 'http://' + node_ip_address + '/mget' + ('?local=true' if local else '')
+        response = Node.connection_pool.post(url, data=json.dumps(list(keys)), idempotent=True)
+        return response.json()
+
+    @staticmethod
+    @metrics.peer_request('put_in_replica')
     def put_in_replica(node_ip_address, key, value):
         """Replicate a key-value pair on another node (uses Consistent Hasing) 
         """
         payload = {key: value}
-        request.post('http://' + node_ip_address + '/replicate', data=json.dumps(payload))
+        Node.connection_pool.post('http://' + node_ip_address + '/replicate', data=json.dumps(payload), idempotent=True)
     
     @staticmethod
-    def update_configuration_for_node(node_ip_address, configuration):
-        request.post('http://' + node_ip_address + '/update-node-configuration', data=json.dumps(configuration))
+    @metrics.peer_request('replicate_batch')
+    def replicate_batch(node_ip_address, data, overwrite=True, expires_at=None):
+        """Store many key-value pairs on a replica node
+
+        The pairs are stored as they are by the replica, which does not
+        forward them to their owner. Unless overwrite is True, keys which
+        already exist on the replica keep their current value. When
+        expires_at is given, the pairs expire at that time (as given by
+        time.time on the owner, the clocks of the nodes being assumed to
+        be synchronized), and they are sent over HTTP
+        """
+        if Node.transport is not None and expires_at is None:
+            return Node.transport.replicate_batch(node_ip_address, data, overwrite=overwrite)
+        url = 'http://' + node_ip_address + '/batch-replicate' + Node._query(overwrite, expires_at=expires_at)
+        items = iter(data.items())
+        batch = dict(itertools.islice(items, BATCH_SIZE))
+        while batch:
+            Node.connection_pool.post(url, data=json.dumps(batch), idempotent=True)
+            batch = dict(itertools.islice(items, BATCH_SIZE))
+
+    @staticmethod
+    @metrics.peer_request('invalidate')
+    def invalidate(node_ip_address, keys):
+        """Tell a node to drop the cached values of the given keys
+        """
+        if Node.transport is not None:
+            return Node.transport.invalidate(node_ip_address, keys)
+        Node.connection_pool.post('http://' + node_ip_address + '/invalidate',
+                                  data=json.dumps(list(keys)), idempotent=True)
+
+    @staticmethod
+    @metrics.peer_request('scan')
+    def scan(node_ip_address, cursor=None, limit=None, start=None, end=None):
+        """Get a page of the key-value pairs stored by a specific node, and the cursor of the next page
+
+        The pages are the ones of a paginated /snapshot (see Engine.scan). The
+        cursor is None once every key-value pair of the node has been scanned
+        """
+        if Node.transport is not None:
+            return Node.transport.scan(node_ip_address, cursor, limit, start, end)
+        query = {'limit': limit or DEFAULT_SCAN_LIMIT, 'cursor': cursor, 'start': start, 'end': end}
+        response = Node.connection_pool.get('http://' + node_ip_address + '/snapshot',
+                                            params={name: value for name, value in query.items() if value})
+        page = response.json()
+        return page['data'], page['cursor']
+
+    @staticmethod
+    @metrics.peer_request('range_scan')
+    def range_scan(node_ip_address, start=None, end=None, limit=None, cursor=None):
+        """Get the key-value pairs stored by a specific node in the range of keys [start, end), in order
+
+        Returns a list of (key, value) pairs and the cursor of the next page
+        (see KeyValueStore.range_scan)
+        """
+        if Node.transport is not None:
+            return Node.transport.range_scan(node_ip_address, start, end, limit, cursor)
+        query = {'local': 'true', 'limit': limit or DEFAULT_SCAN_LIMIT, 'cursor': cursor, 'start': start, 'end': end}
+        response = Node.connection_pool.get('http://' + node_ip_address + '/scan',
+                                            params={name: value for name, value in query.items() if value})
+        page = response.json()
+        return list(page['data'].items()), page['cursor']
+
+    @staticmethod
+    def _query(overwrite=True, **parameters):
+        """The query string of a write, leaving out the parameters which are not set
+        """
+        query = [] if overwrite else ['overwrite=false']
+        query += ['{}={}'.format(name, value) for name, value in parameters.items() if value is not None]
+        return '?' + '&'.join(query) if query else ''
+
+    @staticmethod
+    @metrics.peer_request('gossip')
+    def gossip(node_ip_address, members):
+        """Exchange membership tables with a specific node, returning its table (see Gossip)
+
+        The request is not retried, as the next round of gossip will try again
+        """
+        response = Node.connection_pool.post('http://' + node_ip_address + '/gossip', data=json.dumps(members))
+        return response.json()
+
+    @staticmethod
+    @metrics.peer_request('key_filter')
+    def key_filter(node_ip_address, since=0, generation=None):
+        """Get the changes of the key filter of a specific node since the given version (see PeerFilters)
+        """
+        url = 'http://' + node_ip_address + '/key-filter?since={}'.format(since)
+        if generation is not None:
+            url += '&generation={}'.format(generation)
+        return Node.connection_pool.get(url).json()
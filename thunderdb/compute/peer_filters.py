@@ -0,0 +1,142 @@
+import threading
+import time
+
+from thunderdb.compute.node import Node
+from thunderdb.exceptions.errors import ServiceError
+from thunderdb.storage.filtered_store import BloomFilter
+
+# The number of seconds between two updates of the key filters of the other nodes
+DEFAULT_FILTER_SYNC_INTERVAL = 0.2
+
+# The filter of a node which could not be updated for this many intervals is
+# not used anymore, so that the node is asked for the keys again
+STALE_INTERVALS = 5
+
+
+class PeerFilters(object):
+    """Keep a copy of the key filter of every other node, to answer the reads of the keys they do not hold
+
+    Every interval, each other node is asked for the changes of its key
+    filter since the version the current node last saw (see /key-filter
+    and FilteredStore), so keeping up with a node only costs the bits which
+    changed. A read of a key which the filter of its owner does not contain
+    is answered locally, without a round trip to the owner.
+
+    A key written to the owner by another node is only known once the
+    filter of the owner is updated, an interval later, or up to
+    STALE_INTERVALS intervals later when the updates fail: until then the
+    key is answered as missing, so the filters give up reading the writes
+    of the other nodes right after they return. The keys the current node
+    forwards to their owner are added to its copy of the filter of the
+    owner right away, so they are read back. An update may replace or
+    clear the bits of the copy with the filter of the owner as it was
+    before these writes reached it, so the keys forwarded since the update
+    before it was asked for are added again once it is applied. The filter
+    of a node is not used while the node receives the keys of its new
+    ranges, while it sees a cluster of another size, nor once it is
+    STALE_INTERVALS intervals out of date: the node is asked for the keys
+    then.
+    """
+    def __init__(self, engine, interval=DEFAULT_FILTER_SYNC_INTERVAL, clock=time.monotonic):
+        self.engine = engine
+        self.interval = interval
+        self._clock = clock
+        self._filters = {}
+        self._synced_at = {}
+        self._usable = {}
+        # The keys forwarded to every node since the update before the last
+        # one was asked for, and since the last one was, which the owner may
+        # not have had yet when it answered the last update
+        self._forwarded = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start updating the filters in a background thread, the first update being run right away
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="peer-filters", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._closed.set()
+
+    def might_contain(self, node_ip, key):
+        """False if the node at the given address definitely does not hold the key, True if it may
+        """
+        bloom_filter = self._filters.get(node_ip)
+        if bloom_filter is None or not self._usable[node_ip]:
+            return True
+        if self._clock() - self._synced_at[node_ip] > self.interval * STALE_INTERVALS:
+            return True
+        return key in bloom_filter
+
+    def add(self, node_ip, keys):
+        """Add keys written to the node at the given address to its filter
+        """
+        with self._lock:
+            forwarded = self._forwarded.get(node_ip)
+            if forwarded is not None:
+                forwarded[1].extend(keys)
+            bloom_filter = self._filters.get(node_ip)
+            if bloom_filter is not None:
+                for key in keys:
+                    bloom_filter.add(key)
+
+    def sync(self):
+        """Update the filter of every other node of the cluster
+        """
+        config = self.engine.config
+        node_ips = [node_ip for node_id, node_ip in list(config.nodes.items()) if node_id != config.node_id]
+        for node_ip in set(self._filters) - set(node_ips):
+            # The node left the cluster, or came back at another address
+            self._filters.pop(node_ip, None)
+            self._forwarded.pop(node_ip, None)
+        list(self.engine.executor.map(self._sync, node_ips))
+
+    def stats(self):
+        """The version, the age in seconds and the usability of the filter of every other node, by address
+        """
+        now = self._clock()
+        return {node_ip: {'version': bloom_filter.version, 'age': now - self._synced_at[node_ip],
+                          'usable': self._usable[node_ip]}
+                for node_ip, bloom_filter in list(self._filters.items())}
+
+    def _sync(self, node_ip):
+        with self._lock:
+            bloom_filter = self._filters.get(node_ip)
+            previous = self._forwarded.get(node_ip, ([], []))[1]
+            self._forwarded[node_ip] = (previous, [])
+        since, generation = (0, None) if bloom_filter is None else (bloom_filter.version, bloom_filter.generation)
+        try:
+            delta = Node.key_filter(node_ip, since, generation)
+        except ServiceError:
+            # The filter goes stale, and the node is asked for the keys again
+            return
+
+        with self._lock:
+            self._usable[node_ip] = not delta['moving'] and delta['nodes'] == len(self.engine.config.nodes)
+            self._synced_at[node_ip] = self._clock()
+            if bloom_filter is None or 'bits' in delta:
+                bloom_filter = self._filters[node_ip] = BloomFilter(delta)
+            else:
+                bloom_filter.apply(delta)
+            # Writes forwarded while the owner answered, or still in flight when it was asked, may be missing
+            for keys in self._forwarded[node_ip]:
+                for key in keys:
+                    bloom_filter.add(key)
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except RuntimeError:
+                # The executor of the engine was shut down, with the interpreter
+                return
+            except Exception as error:
+                print("Key filter update failed: {}".format(error))
+            if self._closed.wait(self.interval):
+                return
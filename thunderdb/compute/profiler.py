@@ -0,0 +1,95 @@
+import collections
+import os
+import sys
+import threading
+
+# The number of seconds between two samples of the stacks of the threads
+DEFAULT_SAMPLING_INTERVAL = 0.005
+
+# The number of innermost frames kept in each sampled stack
+MAX_STACK_DEPTH = 64
+
+
+class SamplingProfiler(object):
+    """Sample the stacks of every thread of the node at a fixed interval, while it is running
+
+    The profiler only costs anything while it is running: a thread wakes up
+    every interval and counts the stack every other thread is executing.
+    Stacks are reported in the collapsed format of flame graphs, one line
+    per distinct stack with the number of times it was sampled, the
+    outermost frame first. As it samples the wall clock, the threads which
+    wait for a request or a lock show up in the report as well.
+    """
+    def __init__(self, interval=DEFAULT_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, interval=None):
+        """Start sampling, discarding the stacks of the previous run
+        """
+        with self._lock:
+            if self._thread is not None:
+                return False
+            if interval is not None:
+                if interval <= 0:
+                    raise ValueError("The sampling interval must be positive, got {}".format(interval))
+                self.interval = interval
+            self.samples = 0
+            self._stacks = collections.Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return False
+        self._stop.set()
+        thread.join()
+        return True
+
+    def is_running(self):
+        return self._thread is not None
+
+    def stats(self):
+        return {
+            'running': self.is_running(),
+            'interval': self.interval,
+            'samples': self.samples,
+            'stacks': len(self._stacks),
+        }
+
+    def report(self, limit=None):
+        """The sampled stacks in the collapsed format, the most frequent ones first
+        """
+        with self._lock:
+            stacks = self._stacks.most_common(limit)
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in stacks)
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread_id:
+                    stacks.append(self._collapse(thread_names.get(thread_id, thread_id), frame))
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    @staticmethod
+    def _collapse(thread_name, frame):
+        frames = []
+        while frame is not None and len(frames) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            frames.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+            frame = frame.f_back
+        frames.append(str(thread_name))
+        return ';'.join(reversed(frames))
@@ -0,0 +1,170 @@
+import threading
+import time
+
+from thunderdb.compute.node import Node
+
+# The number of key-value pairs examined (and at most sent to a node) at a time
+DEFAULT_BATCH_SIZE = 10000
+
+# The maximum number of key-value pairs examined per second, to leave room for the regular traffic
+DEFAULT_MAX_KEYS_PER_SECOND = 200000
+
+# The number of seconds during which reads keep falling back to the previous
+# owner of a key once the migration of the current node is over, giving the
+# other nodes time to finish sending their own key-value pairs
+MIGRATION_GRACE_PERIOD = 30.0
+
+
+class Rebalancer(object):
+    """Move the key-value pairs a node no longer owns to their new owner, in the background
+
+    When the cluster configuration changes, only the ranges of the ring
+    whose owner changed need to move. The rebalancer walks the local store
+    one page at a time, and sends the pairs this node owned in the previous
+    ring but not in the new one to their new owner, in one bulk request per
+    owner and page. The pairs are only removed from the current node once
+    they have all been sent, so reads keep being answered during the
+    migration, and new owners fall back to the previous owner of a key they
+    do not hold yet (see previous_owner).
+
+    Pairs sent during a migration never overwrite a value already held by
+    the new owner, which may have been written after the migration began.
+    The nodes which became a replica of the current node are sent a copy
+    of the pairs it owns the same way.
+    """
+    def __init__(self, engine,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 max_keys_per_second=DEFAULT_MAX_KEYS_PER_SECOND):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.max_keys_per_second = max_keys_per_second
+        self.previous_ring = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._restart = False
+        self._finished_at = None
+
+    def start(self, previous_ring=None):
+        """Start moving the key-value pairs according to the current ring
+
+        The previous ring is the one the pairs were distributed with. When it
+        is unknown, every pair the current node does not own is sent to its
+        owner. If a migration is already running, it starts over with the
+        current ring, keeping the previous ring of the first migration.
+        """
+        with self._lock:
+            if self._thread is not None:
+                self._restart = True
+                return
+
+            self.previous_ring = previous_ring
+            self._finished_at = None
+            self._thread = threading.Thread(target=self._run, name="rebalancer", daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """Wait for the migration in progress, if any, to be over
+        """
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def is_running(self):
+        return self._thread is not None
+
+    def is_moving(self):
+        """Whether the reads of the keys which changed owner may still have to fall back to their previous owner
+        """
+        previous_ring, finished_at = self.previous_ring, self._finished_at
+        if previous_ring is None:
+            return False
+        return finished_at is None or time.time() - finished_at <= MIGRATION_GRACE_PERIOD
+
+    def previous_owner(self, key):
+        """Get the node which owned a key before the latest configuration change
+
+        Returns None when no migration is in progress (or recently over),
+        when the previous configuration is unknown or when the key did not
+        change owner
+        """
+        previous_ring, finished_at = self.previous_ring, self._finished_at
+        if previous_ring is None:
+            return None
+        if finished_at is not None and time.time() - finished_at > MIGRATION_GRACE_PERIOD:
+            return None
+
+        node_id = previous_ring.get_node_id(key)
+        return node_id if node_id != self.engine.hash_ring.get_node_id(key) else None
+
+    def _run(self):
+        while True:
+            self._migrate()
+            with self._lock:
+                if not self._restart:
+                    self._finished_at = time.time()
+                    self._thread = None
+                    return
+                self._restart = False
+
+    def _migrate(self):
+        config, storage = self.engine.config, self.engine.storage
+        ring, previous_ring = self.engine.hash_ring, self.previous_ring
+        replication_factor = config.replication_factor
+
+        # The nodes which became a replica of the current node get a copy of the pairs it owns
+        new_replica_node_ids = set(ring.get_replica_node_ids(config.node_id, replication_factor))
+        if previous_ring is not None:
+            new_replica_node_ids -= set(previous_ring.get_replica_node_ids(config.node_id, replication_factor))
+            if not new_replica_node_ids and not self._has_moved_ranges(ring, previous_ring):
+                return
+
+        stale_keys = []
+        for page in storage.iter_pages(limit=self.batch_size):
+            started = time.time()
+            values = dict(page)
+            for node_id, keys in ring.get_node_ids(values).items():
+                if node_id == config.node_id:
+                    for replica_node_id in new_replica_node_ids:
+                        Node.replicate_batch(config.nodes[replica_node_id], {key: values[key] for key in keys},
+                                             overwrite=False)
+                    continue
+
+                moved_keys = keys
+                if previous_ring is not None:
+                    moved_keys = previous_ring.get_node_ids(keys).get(config.node_id, [])
+                if moved_keys:
+                    Node.put_batch(config.nodes[node_id], {key: values[key] for key in moved_keys},
+                                   overwrite=False)
+
+                if config.node_id not in ring.get_replica_node_ids(node_id, replication_factor):
+                    # The current node is not a replica of the new owner either
+                    stale_keys.extend(keys)
+
+            if self._restart:
+                return
+            self._throttle(len(page), started)
+
+        for key in stale_keys:
+            storage.delete(key)
+
+    def _has_moved_ranges(self, ring, previous_ring):
+        """True if the current node lost some of the ranges it held, either as an owner or as a replica
+        """
+        held_node_ids = self._get_held_node_ids(previous_ring)
+        if self._get_held_node_ids(ring) != held_node_ids:
+            return True
+        return any(previous_node_id in held_node_ids
+                   for _, _, previous_node_id, _ in ring.get_moved_ranges(previous_ring))
+
+    def _get_held_node_ids(self, ring):
+        """The ids of the nodes whose key-value pairs are held by the current node, itself included
+        """
+        node_id, replication_factor = self.engine.config.node_id, self.engine.config.replication_factor
+        return {owner for owner in range(ring.num_nodes)
+                if owner == node_id or node_id in ring.get_replica_node_ids(owner, replication_factor)}
+
+    def _throttle(self, num_keys, started):
+        if self.max_keys_per_second:
+            delay = num_keys / self.max_keys_per_second - (time.time() - started)
+            if delay > 0:
+                time.sleep(delay)
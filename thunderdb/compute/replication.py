@@ -0,0 +1,154 @@
+import asyncio
+import collections
+import threading
+
+from thunderdb.compute.batching import Acknowledgement, BatchingQueue
+from thunderdb.compute.node import Node
+from thunderdb.exceptions.errors import ServiceError
+
+# The number of nodes holding a copy of each key-value pair, the owner included
+DEFAULT_REPLICATION_FACTOR = 2
+
+# How many copies of a write must be stored before the client gets a response:
+# only the one of the owner, a majority of them, or every one of them
+ACK_PRIMARY = 'primary'
+ACK_QUORUM = 'quorum'
+ACK_ALL = 'all'
+ACK_MODES = (ACK_PRIMARY, ACK_QUORUM, ACK_ALL)
+
+# The number of seconds a write waits for its replicas to acknowledge it
+ACK_TIMEOUT = 5.0
+
+# A value queued for replication along with the time it expires at
+Expiring = collections.namedtuple('Expiring', ['value', 'expires_at'])
+
+
+class ReplicationPipeline(object):
+    """Copy the key-value pairs written to the current node onto its replicas, in the background
+
+    Every replica of the current node gets its own BatchingQueue, which
+    sends the writes queued while its previous batch was in flight in a
+    single /batch-replicate request. Queuing a write never blocks, so
+    replication adds no round trip to the write path unless the client
+    asks for the write to be acknowledged by a quorum or by all replicas,
+    in which case the write waits for its batches to be delivered.
+
+    The writes which expire are queued along with their expiration time,
+    and the replicas are sent one request per expiration time, so that
+    they expire the pairs at the same time as the owner.
+    """
+    def __init__(self, engine, ack_timeout=ACK_TIMEOUT, **queue_options):
+        self.engine = engine
+        self.ack_timeout = ack_timeout
+        self.queue_options = queue_options
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def replicate(self, data, ack=ACK_PRIMARY, expires_at=None):
+        """Queue key-value pairs owned by the current node for replication
+
+        Unless ack is ACK_PRIMARY, wait until enough replicas stored the
+        pairs, raising a ServiceError if they did not in time. When
+        expires_at is given, the pairs expire at that time on the replicas
+        """
+        acknowledgement = self.submit(data, ack, expires_at)
+        if acknowledgement is not None:
+            self._check(acknowledgement, ack, acknowledgement.wait(self.ack_timeout))
+
+    async def replicate_async(self, data, ack=ACK_PRIMARY, expires_at=None):
+        """Same as replicate, waiting for the replicas without blocking the event loop
+        """
+        acknowledgement = self.submit(data, ack, expires_at)
+        if acknowledgement is not None:
+            try:
+                acknowledged = await asyncio.wait_for(asyncio.wrap_future(acknowledgement.future),
+                                                      self.ack_timeout)
+            except asyncio.TimeoutError:
+                acknowledged = False
+            self._check(acknowledgement, ack, acknowledged)
+
+    def submit(self, data, ack=ACK_PRIMARY, expires_at=None):
+        """Queue key-value pairs owned by the current node for replication, without waiting
+
+        Returns the Acknowledgement to wait for, or None if the acknowledgement
+        mode does not require any replica to store the pairs
+        """
+        if ack not in ACK_MODES:
+            raise ValueError("Unknown acknowledgement mode '{}', expected one of {}".format(ack, ACK_MODES))
+
+        replica_node_ids = self.engine.hash_ring.get_replica_node_ids(self.engine.config.node_id,
+                                                                      self.engine.config.replication_factor)
+        if not replica_node_ids or not data:
+            return None
+
+        if expires_at is not None:
+            data = {key: Expiring(value, expires_at) for key, value in data.items()}
+        required = self.required_acknowledgements(ack, len(replica_node_ids))
+        acknowledgement = Acknowledgement(required, len(replica_node_ids)) if required else None
+        for node_id in replica_node_ids:
+            self._queue(node_id).put(data, acknowledgement)
+        return acknowledgement
+
+    @staticmethod
+    def _check(acknowledgement, ack, acknowledged):
+        if not acknowledged:
+            raise ServiceError("The write was not acknowledged by enough replicas",
+                               ack=ack,
+                               required=acknowledgement.required,
+                               acknowledged=acknowledgement.successes)
+
+    @staticmethod
+    def required_acknowledgements(ack, num_replicas):
+        """The number of replicas which must acknowledge a write, besides the owner
+        """
+        if ack == ACK_ALL:
+            return num_replicas
+        if ack == ACK_QUORUM:
+            # A majority of the num_replicas + 1 copies, one of which is on the owner
+            return (num_replicas + 1) // 2
+        return 0
+
+    def flush(self, timeout=None):
+        """Wait for every queued write to reach the replicas, returning False on timeout
+        """
+        return all(queue.flush(timeout) for queue in list(self._queues.values()))
+
+    def stats(self):
+        """The number of writes waiting to be sent to each replica, dropped and rejected, by replica node id
+        """
+        return {node_id: {'pending': len(queue), 'dropped': queue.dropped, 'rejected': queue.rejected}
+                for node_id, queue in list(self._queues.items())}
+
+    def close(self):
+        with self._lock:
+            queues, self._queues = self._queues, {}
+        for queue in queues.values():
+            queue.close()
+
+    def _queue(self, node_id):
+        queue = self._queues.get(node_id)
+        if queue is None:
+            with self._lock:
+                queue = self._queues.get(node_id)
+                if queue is None:
+                    queue = BatchingQueue("replication-{}".format(node_id),
+                                          lambda data: self._send(node_id, data),
+                                          **self.queue_options)
+                    self._queues[node_id] = queue
+        return queue
+
+    def _send(self, node_id, data):
+        """Send a batch of the replication queue to a replica, with one request per expiration time
+        """
+        node_ip = self.engine.config.nodes[node_id]
+        persistent, expiring = {}, collections.defaultdict(dict)
+        for key, value in data.items():
+            if isinstance(value, Expiring):
+                expiring[value.expires_at][key] = value.value
+            else:
+                persistent[key] = value
+
+        if persistent:
+            Node.replicate_batch(node_ip, persistent)
+        for expires_at, batch in expiring.items():
+            Node.replicate_batch(node_ip, batch, expires_at=expires_at)
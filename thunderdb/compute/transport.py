@@ -0,0 +1,329 @@
+import asyncio
+import concurrent.futures
+import itertools
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import thunderdb.compute.utils as request
+from thunderdb.compute.replication import ACK_QUORUM, ACK_ALL
+from thunderdb.exceptions.errors import ServiceError
+from thunderdb.networking import binary_protocol as protocol
+
+# The port a node serves the binary protocol on is the port of its HTTP
+# server plus this offset, so the address of every peer can be derived from
+# the address the cluster already knows it by
+DEFAULT_PEER_PORT_OFFSET = 1000
+
+# The maximum number of key-value pairs sent in a single frame. The frames of
+# a larger batch are pipelined on the same connection
+FRAME_BATCH_SIZE = 10000
+
+# The flag of each acknowledgement mode (the default mode has none)
+ACK_FLAGS = {
+    ACK_QUORUM: protocol.FLAG_ACK_QUORUM,
+    ACK_ALL: protocol.FLAG_ACK_ALL,
+}
+
+
+def get_peer_address(node_ip_address, port_offset=DEFAULT_PEER_PORT_OFFSET):
+    """The (host, port) a node serves the binary protocol on, given the address of its HTTP server
+    """
+    address = urlsplit('//' + node_ip_address)
+    return address.hostname, (address.port or 80) + port_offset
+
+
+class Connection(object):
+    """A persistent TCP connection to a peer, multiplexing any number of requests
+
+    Every request gets an id, which the peer echoes in its response, so
+    requests are written as soon as they are issued without waiting for the
+    responses of the previous ones, and the responses are matched to their
+    request whatever order they come back in. A reader thread completes the
+    future of each request with its response. When the connection breaks,
+    every request still in flight fails with a ConnectionError.
+    """
+    def __init__(self, address, connect_timeout=request.DEFAULT_CONNECT_TIMEOUT):
+        self.address = address
+        self.closed = False
+        self._socket = socket.create_connection(address, timeout=connect_timeout)
+        self._socket.settimeout(None)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._request_ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_responses,
+                                        name="binary-transport-{}:{}".format(*address),
+                                        daemon=True)
+        self._reader.start()
+
+    def submit(self, code, flags=0, payload=b''):
+        """Send a request, returning the future of its (status, payload) response
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("The connection to {}:{} is closed".format(*self.address))
+            request_id = next(self._request_ids) & 0xffffffff
+            self._pending[request_id] = future
+            try:
+                self._socket.sendall(protocol.encode_frame(request_id, code, flags, payload))
+            except OSError:
+                self._pending.pop(request_id, None)
+                self._close()
+                raise
+        future.request_id = request_id
+        return future
+
+    def cancel(self, future):
+        """Forget a request whose response is not awaited anymore
+        """
+        with self._lock:
+            self._pending.pop(getattr(future, 'request_id', None), None)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("The connection to {}:{} was closed".format(*self.address)))
+
+    def _read_responses(self):
+        try:
+            reader = self._socket.makefile('rb')
+            while True:
+                header = reader.read(protocol.FRAME_HEADER.size)
+                if len(header) < protocol.FRAME_HEADER.size:
+                    break
+                size, request_id, status, _ = protocol.FRAME_HEADER.unpack(header)
+                payload = reader.read(size)
+                if len(payload) < size:
+                    break
+                with self._lock:
+                    future = self._pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result((status, payload))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.close()
+
+
+class BinaryTransport(object):
+    """Reach the other nodes through the binary protocol instead of HTTP (see binary_protocol)
+
+    Every peer is reached through a single persistent Connection, opened on
+    the first request and reopened after it breaks. The requests of every
+    thread, and of the event loop, are multiplexed on it. Like the
+    ConnectionPool of Node, requests time out after connect_timeout and
+    read_timeout seconds, and requests which fail to connect or time out are
+    retried with an exponential backoff.
+    """
+    def __init__(self,
+                 port_offset=DEFAULT_PEER_PORT_OFFSET,
+                 connect_timeout=request.DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=request.DEFAULT_READ_TIMEOUT,
+                 max_retries=request.DEFAULT_MAX_RETRIES,
+                 backoff_factor=request.DEFAULT_BACKOFF_FACTOR):
+        self.port_offset = port_offset
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def ping(self, node_ip_address):
+        self._call(node_ip_address, protocol.OP_PING)
+
+    def put(self, node_ip_address, key, value, ack=None):
+        self.put_batch(node_ip_address, {key: value}, ack=ack)
+
+    def put_batch(self, node_ip_address, data, overwrite=True, ack=None):
+        self._call_batches(node_ip_address, protocol.OP_PUT, self._write_flags(overwrite, ack), data)
+
+    def replicate_batch(self, node_ip_address, data, overwrite=True):
+        self._call_batches(node_ip_address, protocol.OP_REPLICATE, self._write_flags(overwrite), data)
+
+    def get(self, node_ip_address, key, local=False):
+        return self.get_many(node_ip_address, [key], local)
+
+    def get_many(self, node_ip_address, keys, local=False):
+        payload = self._call(node_ip_address, protocol.OP_GET, protocol.FLAG_LOCAL if local else 0,
+                             protocol.encode_strings(list(keys)))
+        return protocol.decode_items(payload)[0]
+
+    def invalidate(self, node_ip_address, keys):
+        self._call(node_ip_address, protocol.OP_INVALIDATE, payload=protocol.encode_strings(list(keys)))
+
+    def scan(self, node_ip_address, cursor=None, limit=None, start=None, end=None):
+        """Get a page of the key-value pairs stored by a node, and the cursor of the next page (see Engine.scan)
+        """
+        payload = self._call(node_ip_address, protocol.OP_SCAN, payload=self._encode_scan(cursor, limit, start, end))
+        return self._decode_scan(payload)
+
+    def range_scan(self, node_ip_address, start=None, end=None, limit=None, cursor=None):
+        """Get the key-value pairs of a node in a range of keys, in order (see Engine.range_scan)
+        """
+        payload = self._call(node_ip_address, protocol.OP_SCAN, protocol.FLAG_ORDERED,
+                             self._encode_scan(cursor, limit, start, end))
+        data, next_cursor = self._decode_scan(payload)
+        return list(data.items()), next_cursor
+
+    async def put_async(self, node_ip_address, key, value, ack=None):
+        await self.put_batch_async(node_ip_address, {key: value}, ack=ack)
+
+    async def put_batch_async(self, node_ip_address, data, overwrite=True, ack=None):
+        await asyncio.gather(*(self._call_async(node_ip_address, protocol.OP_PUT, self._write_flags(overwrite, ack),
+                                                protocol.encode_items(batch))
+                               for batch in self._batches(data)))
+
+    async def get_async(self, node_ip_address, key, local=False):
+        return await self.get_many_async(node_ip_address, [key], local)
+
+    async def get_many_async(self, node_ip_address, keys, local=False):
+        payload = await self._call_async(node_ip_address, protocol.OP_GET, protocol.FLAG_LOCAL if local else 0,
+                                         protocol.encode_strings(list(keys)))
+        return protocol.decode_items(payload)[0]
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, {}
+        for connection in connections.values():
+            connection.close()
+
+    @staticmethod
+    def _write_flags(overwrite=True, ack=None):
+        return (0 if overwrite else protocol.FLAG_NO_OVERWRITE) | ACK_FLAGS.get(ack, 0)
+
+    @staticmethod
+    def _batches(data):
+        items = iter(data.items())
+        batch = dict(itertools.islice(items, FRAME_BATCH_SIZE))
+        while batch:
+            yield batch
+            batch = dict(itertools.islice(items, FRAME_BATCH_SIZE))
+
+    @staticmethod
+    def _encode_scan(cursor=None, limit=None, start=None, end=None):
+        return protocol.LIMIT.pack(limit or 0) + protocol.encode_strings([cursor or '', start or '', end or ''])
+
+    @staticmethod
+    def _decode_scan(payload):
+        (next_cursor,), offset = protocol.decode_strings(payload)
+        return protocol.decode_items(payload, offset)[0], next_cursor or None
+
+    def _connection(self, node_ip_address):
+        address = get_peer_address(node_ip_address, self.port_offset)
+        connection = self._connections.get(address)
+        if connection is None or connection.closed:
+            with self._lock:
+                connection = self._connections.get(address)
+                if connection is None or connection.closed:
+                    connection = Connection(address, self.connect_timeout)
+                    self._connections[address] = connection
+        return connection
+
+    def _call_batches(self, node_ip_address, code, flags, data):
+        """Send a batch of key-value pairs in frames of at most FRAME_BATCH_SIZE pairs, all in flight at once
+        """
+        requests = []
+        for batch in self._batches(data):
+            payload = protocol.encode_items(batch)
+            requests.append((payload, self._submit(node_ip_address, code, flags, payload)))
+        for payload, future in requests:
+            self._result(node_ip_address, code, flags, payload, future)
+
+    def _call(self, node_ip_address, code, flags=0, payload=b''):
+        return self._result(node_ip_address, code, flags, payload,
+                            self._submit(node_ip_address, code, flags, payload))
+
+    def _submit(self, node_ip_address, code, flags, payload):
+        try:
+            return self._connection(node_ip_address).submit(code, flags, payload)
+        except OSError as ex:
+            # Issued again by _result, with the same retries as a request which failed in flight
+            future = concurrent.futures.Future()
+            future.set_exception(ex)
+            return future
+
+    def _result(self, node_ip_address, code, flags, payload, future):
+        """Wait for the response of a request, issuing it again when it failed to connect or timed out
+
+        Every request of the protocol is idempotent, so all of them are retried
+        """
+        last_raised_exception = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+                future = self._submit(node_ip_address, code, flags, payload)
+
+            try:
+                status, response = future.result(self.read_timeout)
+            except (OSError, concurrent.futures.TimeoutError) as ex:
+                self._cancel(node_ip_address, future)
+                last_raised_exception = ex
+                continue
+            return self._check(node_ip_address, code, status, response)
+
+        raise ServiceError("Request failed",
+                           node=node_ip_address,
+                           opcode=code,
+                           exception=repr(last_raised_exception))
+
+    async def _call_async(self, node_ip_address, code, flags=0, payload=b''):
+        """Same as _call, waiting for the response without blocking the event loop
+        """
+        loop = asyncio.get_running_loop()
+        last_raised_exception = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+
+            future = None
+            try:
+                connection = self._connections.get(get_peer_address(node_ip_address, self.port_offset))
+                if connection is None or connection.closed:
+                    # Connecting blocks, so it is done outside of the event loop
+                    connection = await loop.run_in_executor(None, self._connection, node_ip_address)
+                future = connection.submit(code, flags, payload)
+                status, response = await asyncio.wait_for(asyncio.wrap_future(future), self.read_timeout)
+            except (OSError, asyncio.TimeoutError) as ex:
+                if future is not None:
+                    self._cancel(node_ip_address, future)
+                last_raised_exception = ex
+                continue
+            return self._check(node_ip_address, code, status, response)
+
+        raise ServiceError("Request failed",
+                           node=node_ip_address,
+                           opcode=code,
+                           exception=repr(last_raised_exception))
+
+    def _cancel(self, node_ip_address, future):
+        connection = self._connections.get(get_peer_address(node_ip_address, self.port_offset))
+        if connection is not None:
+            connection.cancel(future)
+
+    @staticmethod
+    def _check(node_ip_address, code, status, payload):
+        if status != protocol.STATUS_OK:
+            # Like the 4xx responses over HTTP, the requests the peer rejected are not worth sending again
+            raise ServiceError("Request Failed",
+                               node=node_ip_address,
+                               opcode=code,
+                               response=payload.decode('utf-8', 'replace'),
+                               rejected=status == protocol.STATUS_REJECTED)
+        return payload
@@ -1,7 +1,17 @@
 import requests
+import threading
+import time
 import traceback
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
 from thunderdb.exceptions.errors import ServiceError
 
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 1.0
+DEFAULT_READ_TIMEOUT = 10.0
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_BACKOFF_FACTOR = 0.05
+
 
 def is_valid_response_code(code):
     """True if the response code is valid and is not a Server Error
@@ -9,21 +19,28 @@ def is_valid_response_code(code):
     return 200 <= code < 500
 
 
-def _issue_request(func, url, *args, **kwargs):
-    """Issue an HTTP request 
-    
-    This function will issue an HTTP POST or GET request and handle 
-    any exceptions that are thrown in the process
+def _issue_request(func, url, *args, retries=0, backoff_factor=DEFAULT_BACKOFF_FACTOR, **kwargs):
+    """Issue an HTTP request
+
+    This function will issue an HTTP POST or GET request and handle
+    any exceptions that are thrown in the process. Requests that fail to
+    connect or time out are retried up to `retries` times, waiting
+    backoff_factor * 2^attempt seconds between attempts
     """
     response = None
     last_raised_exception = None
     last_raised_exception_tb = None
 
-    try:
-        response = func(url, *args, **kwargs)
-    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
-        last_raised_exception = ex
-        last_raised_exception_tb = traceback.format_exc()
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff_factor * (2 ** (attempt - 1)))
+
+        try:
+            response = func(url, *args, **kwargs)
+            break
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+            last_raised_exception = ex
+            last_raised_exception_tb = traceback.format_exc()
 
     if response is not None and is_valid_response_code(response.status_code):
         return response
@@ -49,3 +66,69 @@ def get(url, *args, **kwargs):
     """Issue an HTTP GET request to the specified URL
     """
     return _issue_request(requests.get, url, *args, **kwargs)
+
+
+class ConnectionPool(object):
+    """A pool of keep-alive HTTP connections to the other nodes in the cluster
+
+    Every peer gets its own session holding at most pool_size connections,
+    which are reused across requests and shared by all the threads of the
+    server. Requests time out after connect_timeout seconds when connecting
+    and read_timeout seconds when waiting for a response. Idempotent
+    requests (GET requests and POST requests flagged as idempotent) are
+    retried with an exponential backoff when they fail to connect or time out
+    """
+    def __init__(self,
+                 pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, url):
+        """Get the session holding the connections to the host of the given URL
+        """
+        host = urlsplit(url).netloc
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = requests.Session()
+                    # Block when the pool is exhausted, rather than opening extra connections
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._sessions[host] = session
+        return session
+
+    def post(self, url, *args, idempotent=False, **kwargs):
+        """Issue an HTTP POST request to the specified URL over a pooled connection
+        """
+        return self._issue_request('post', url, *args, idempotent=idempotent, **kwargs)
+
+    def get(self, url, *args, **kwargs):
+        """Issue an HTTP GET request to the specified URL over a pooled connection
+        """
+        return self._issue_request('get', url, *args, idempotent=True, **kwargs)
+
+    def close(self):
+        """Close every connection held by the pool
+        """
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    def _issue_request(self, method, url, *args, idempotent=False, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return _issue_request(getattr(self.session(url), method), url, *args,
+                              retries=self.max_retries if idempotent else 0,
+                              backoff_factor=self.backoff_factor,
+                              **kwargs)
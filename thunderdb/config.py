@@ -1,10 +1,55 @@
+from thunderdb.hashing.consistent_hashing import DEFAULT_NUM_VIRTUAL_NODES
+from thunderdb.compute.replication import DEFAULT_REPLICATION_FACTOR
+from thunderdb.compute.gossip import DEFAULT_GOSSIP_INTERVAL
+from thunderdb.compute.hedging import DEFAULT_HEDGE_PERCENTILE, DEFAULT_HEDGE_MAX_RATE
+from thunderdb.compute.peer_filters import DEFAULT_FILTER_SYNC_INTERVAL
+from thunderdb.compute.coalescing import DURABILITY_MODES, DEFAULT_WRITE_DURABILITY, DEFAULT_MAX_WRITE_LINGER
+
+
 class Config(object):
     """Configuration object for the cluster
+
+    A node starts by knowing itself and the next node only, and learns of
+    the others through gossip (see Gossip). When the number of nodes of the
+    cluster is given as cluster_size, a node knows when it met all of them.
+    The reads of the keys of other nodes are hedged as set by
+    hedge_percentile and hedge_max_rate (see ReadHedger), a rate of 0
+    turning hedging off. The key filters of the other nodes are updated
+    every filter_sync_interval seconds (see PeerFilters). The
+    write_durability tells when a write forwarded to the owner of its key
+    is acknowledged, the buffered writes waiting up to max_write_linger
+    seconds to be sent (see WriteBuffer)
     """
-    def __init__(self, node_id, node_ip, next_node_id, next_node_ip):
+    def __init__(self, node_id, node_ip, next_node_id, next_node_ip,
+                 num_virtual_nodes=DEFAULT_NUM_VIRTUAL_NODES,
+                 replication_factor=DEFAULT_REPLICATION_FACTOR,
+                 cluster_size=None,
+                 gossip_interval=DEFAULT_GOSSIP_INTERVAL,
+                 hedge_percentile=DEFAULT_HEDGE_PERCENTILE,
+                 hedge_max_rate=DEFAULT_HEDGE_MAX_RATE,
+                 filter_sync_interval=DEFAULT_FILTER_SYNC_INTERVAL,
+                 write_durability=DEFAULT_WRITE_DURABILITY,
+                 max_write_linger=DEFAULT_MAX_WRITE_LINGER):
+        if replication_factor < 1:
+            raise ValueError("The replication factor must be at least 1, got {}".format(replication_factor))
+        if write_durability not in DURABILITY_MODES:
+            raise ValueError("Unknown write durability '{}', expected one of {}".format(write_durability,
+                                                                                       DURABILITY_MODES))
+        if max_write_linger < 0:
+            raise ValueError("The write linger must not be negative, got {}".format(max_write_linger))
+
         self.node_id = node_id
         self.node_ip = node_ip
         self.next_node_ip = next_node_ip
+        self.num_virtual_nodes = num_virtual_nodes
+        self.replication_factor = replication_factor
+        self.cluster_size = cluster_size
+        self.gossip_interval = gossip_interval
+        self.hedge_percentile = hedge_percentile
+        self.hedge_max_rate = hedge_max_rate
+        self.filter_sync_interval = filter_sync_interval
+        self.write_durability = write_durability
+        self.max_write_linger = max_write_linger
         self.nodes = {
             self.node_id: self.node_ip,
             next_node_id: next_node_ip
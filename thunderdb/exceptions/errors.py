@@ -12,3 +12,9 @@ class ServiceError(KeyValueStoreException):
     """A 500-level HTTP error for the service 
     """
     code = 500
+
+
+class NotOwnerError(KeyValueStoreException):
+    """A 421-level HTTP error when a request sent directly to the owner of its keys reached another node
+    """
+    code = 421
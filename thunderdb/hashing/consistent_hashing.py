@@ -1,43 +1,105 @@
 import bisect
 import hashlib
 
+import numpy as np
+
+DEFAULT_NUM_VIRTUAL_NODES = 128
+
 
 class ConsistentHash:
-    """Create a consistent hash for a cluster of size n
+    """Create a consistent hash ring for a cluster of size n
 
-    The class gives you the ability to specify how many replicas
-    to create for your data, giving us redundancy in our application.
+    Each physical node is placed on the ring several times (virtual nodes),
+    which spreads the keyspace evenly across the cluster even when there
+    are only a handful of nodes. The ring is built once, at construction
+    time, so a lookup is a single binary search over a prebuilt array.
 
-    ConsistentHash has a total of three atrributes:
+    ConsistentHash has a total of four attributes:
 
         - num_nodes: the number of nodes in your cluster
-        - num_replicas: the number of replicas to create
-        - consistent_hash_tuples: a list of tuples that (n, m, k), where:
-            - n ranges over the number of nodes
-            - m ranges over the number of replicas
-            - j ranges over the possible hash values (creating the ring)
+        - num_virtual_nodes: the number of points each node owns on the ring
+        - ring_hashes: the sorted 64-bit hash values of every virtual node
+        - ring_nodes: the node id owning the point at the same index in ring_hashes
+
+    The ring is also kept as NumPy arrays so that batches of keys can be
+    placed with a single vectorized search (see get_node_ids).
     """
-    def __init__(self, num_nodes=1):
+    def __init__(self, num_nodes=1, num_virtual_nodes=DEFAULT_NUM_VIRTUAL_NODES):
         self.num_nodes = num_nodes
-        hash_tuples = [(n, self._hash(str(n))) for n in range(self.num_nodes)]
-        hash_tuples.sort(key=lambda x: x[1])  # sort based on hash values
-        self.hash_tuples = hash_tuples
+        self.num_virtual_nodes = num_virtual_nodes
+
+        points = [(self._hash("{}-{}".format(n, v)), n)
+                  for n in range(self.num_nodes)
+                  for v in range(self.num_virtual_nodes)]
+        points.sort()  # sort based on hash values, ties broken by node id
+        self.ring_hashes = [hash_value for hash_value, _ in points]
+        self.ring_nodes = [node_id for _, node_id in points]
+        self._ring_hashes_array = np.array(self.ring_hashes, dtype=np.uint64)
+        self._ring_nodes_array = np.array(self.ring_nodes, dtype=np.int64)
 
     def get_node_id(self, key):
         """Get the node id of the node which the key gets sent to
         """
-        hash_value = self._hash(key)
-        
-        # Edge Case: Cycle past hash value of 1 and we loop back around to 0.
-        if hash_value > self.hash_tuples[-1][1]:
-            return self.hash_tuples[0][0]
+        index = bisect.bisect_left(self.ring_hashes, self._hash(key))
+
+        # Edge Case: Cycle past the last point on the ring and we loop back around to 0.
+        if index == len(self.ring_hashes):
+            index = 0
+        return self.ring_nodes[index]
+
+    def get_node_ids(self, keys):
+        """Get the owning node id for a batch of keys, grouped by owner
+
+        The keys are hashed into one contiguous buffer and placed on the ring
+        with a single searchsorted call, which gives exactly the same result
+        as calling get_node_id on every key. Returns a dictionary of
+        {node_id: [keys owned by that node]}, preserving the input order.
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        digests = b"".join([hashlib.md5(key.encode()).digest()[:8] for key in keys])
+        owners = self._get_owners(np.frombuffer(digests, dtype='>u8').astype(np.uint64))
+
+        grouped_keys = {}
+        for node_id in np.unique(owners).tolist():
+            grouped_keys[node_id] = [keys[i] for i in np.flatnonzero(owners == node_id).tolist()]
+        return grouped_keys
+
+    def get_replica_node_ids(self, node_id, replication_factor):
+        """Get the ids of the nodes holding a replica of the key-value pairs owned by a node
+
+        The replicas of a node are the replication_factor - 1 nodes which
+        follow it in the cluster, wrapping around to node 0, so every key is
+        held by at most replication_factor distinct nodes
+        """
+        return [(node_id + i) % self.num_nodes for i in range(1, min(replication_factor, self.num_nodes))]
+
+    def get_moved_ranges(self, previous_ring):
+        """Find the ranges of hash values whose owner changed since the previous ring
+
+        Returns a list of (start, end, previous_node_id, node_id) tuples, each
+        covering the hash values in (start, end]. The range whose start is
+        greater than its end wraps around the ring.
+        """
+        boundaries = np.union1d(previous_ring._ring_hashes_array, self._ring_hashes_array)
+        previous_owners = previous_ring._get_owners(boundaries)
+        owners = self._get_owners(boundaries)
+        return [(int(boundaries[i - 1]), int(boundaries[i]), int(previous_owners[i]), int(owners[i]))
+                for i in np.flatnonzero(previous_owners != owners).tolist()]
+
+    def _get_owners(self, hash_values):
+        """Get the owning node id of every hash value of an array
+        """
+        indices = np.searchsorted(self._ring_hashes_array, hash_values, side='left')
 
-        hash_values = list(map(lambda x: x[1], self.hash_tuples))
-        index = bisect.bisect_left(hash_values, hash_value)
-        return self.hash_tuples[index][0]
+        # Edge Case: Cycle past the last point on the ring and we loop back around to 0.
+        indices[indices == len(self.ring_hashes)] = 0
+        return self._ring_nodes_array[indices]
 
     @staticmethod
     def _hash(key):
-        """Returns a hash for the key in the range of [0,1)
+        """Returns a hash for the key in the range of [0, 2^64)
         """
-        return (int(hashlib.md5(key.encode()).hexdigest(), 16) % 1000000) / 1000000.0
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
@@ -0,0 +1,399 @@
+"""
+An asyncio implementation of the HTTP server, serving the same routes on a single event loop
+"""
+import asyncio
+import functools
+import json
+import time
+
+from aiohttp import web
+
+from thunderdb.compute import metrics
+from thunderdb.compute.async_node import AsyncNode
+from thunderdb.compute.engine import Engine
+from thunderdb.compute.profiler import SamplingProfiler
+from thunderdb.compute.replication import ACK_MODES, ACK_PRIMARY
+from thunderdb.exceptions.errors import KeyValueStoreException
+from thunderdb.networking.http_server import start_background_tasks
+from thunderdb.storage.key_value_store import DEFAULT_SCAN_LIMIT
+
+# The key of the Engine in the application
+ENGINE_KEY = web.AppKey('engine', Engine)
+
+# The errors raised by abort, by status code
+HTTP_ERRORS = {
+    400: web.HTTPBadRequest,
+    404: web.HTTPNotFound,
+}
+
+
+def initialize(config, data_file=None, storage=None, cache=None, peer_port=None, **session_options):
+    """Initialize the asyncio application with the given configuration
+
+    The routes are the same as the ones of the threaded server (see
+    http_server.initialize), but every request is a coroutine. Requests
+    forwarded to the other nodes go through AsyncNode, so a request waiting
+    for a peer does not hold a thread, and a node can keep thousands of
+    them in flight. The session_options are passed to AsyncNode.open_session.
+    The binary protocol of the other nodes is served on the given peer port,
+    if any, by threads of its own
+    """
+    app = web.Application(middlewares=[record_metrics, handle_error])
+    engine = Engine(config, storage, cache)
+    profiler = SamplingProfiler()
+    app[ENGINE_KEY] = engine
+
+    async def open_session(app):
+        await AsyncNode.open_session(**session_options)
+        start_background_tasks(engine, data_file, peer_port)
+
+    async def close_session(app):
+        await AsyncNode.close_session()
+
+    app.on_startup.append(open_session)
+    app.on_cleanup.append(close_session)
+
+    async def read_json(request):
+        body = await request.read()
+        with metrics.SERIALIZATION.time('json'):
+            return json.loads(body)
+
+    def is_overwrite(request):
+        return request.query.get('overwrite') not in ('0', 'false')
+
+    def is_local(request):
+        return request.query.get('local') in ('1', 'true')
+
+    def check_direct(request, keys):
+        # Requests sent straight to the owner of their keys are not forwarded
+        if request.query.get('direct') in ('1', 'true'):
+            engine.check_owner(keys)
+
+    def get_ack_mode(request):
+        ack = request.query.get('ack', ACK_PRIMARY)
+        if ack not in ACK_MODES:
+            abort(400, "The acknowledgement mode is not valid.. "
+                       "Please provide one of: {}".format(", ".join(ACK_MODES)))
+        return ack
+
+    def get_number(request, name):
+        # A positive number of seconds, or a time, given in the query of a write
+        value = request.query.get(name)
+        if value is None:
+            return None
+        try:
+            number = float(value)
+        except ValueError:
+            number = 0
+        if not 0 < number < float('inf'):
+            abort(400, "The {} is not valid.. Please provide a positive number of seconds".format(name))
+        return number
+
+    async def ping(request):
+        """Ping the node to see if its active
+        """
+        return web.json_response({
+            'service': 'node',
+            'status': 'OK'
+        })
+
+    async def cluster(request):
+        """Get the nodes of the cluster and the parameters of its ring
+        """
+        return web.json_response(engine.membership())
+
+    async def put(request):
+        """Put a key-value pair into the key-value store
+        """
+        data = await read_json(request)
+
+        if len(data.keys()) != 1:
+            abort(400, "The request data is not valid.. "
+                       "Please provide exactly one key-value pair")
+
+        key, value = next(iter(data.items()))
+        check_direct(request, [key])
+        await engine.put_async(key, value, ack=get_ack_mode(request), ttl=get_number(request, 'ttl'))
+        return web.Response()
+
+    async def batch_put(request):
+        """Put many key-value pairs into the key-value store in one request
+        """
+        data = await read_json(request)
+
+        if not isinstance(data, dict):
+            abort(400, "The request data is not valid.. "
+                       "Please provide a JSON object of key-value pairs")
+
+        check_direct(request, data.keys())
+        await engine.put_many_async(data, overwrite=is_overwrite(request), ack=get_ack_mode(request),
+                                    ttl=get_number(request, 'ttl'))
+        return web.Response()
+
+    async def replicate(request):
+        """Put the key-value pair in the replica node
+        """
+        data = await read_json(request)
+
+        if len(data.keys()) != 1:
+            abort(400, "The request data is not valid.. "
+                       "Please provide exactly one key-value pair")
+
+        key, value = next(iter(data.items()))
+        engine.replicate(key, value)
+        return web.Response()
+
+    async def batch_replicate(request):
+        """Put many key-value pairs sent by their owner into the replica node
+        """
+        data = await read_json(request)
+
+        if not isinstance(data, dict):
+            abort(400, "The request data is not valid.. "
+                       "Please provide a JSON object of key-value pairs")
+
+        engine.replicate_many(data, overwrite=is_overwrite(request), expires_at=get_number(request, 'expires_at'))
+        return web.Response()
+
+    async def get(request):
+        """Get the value for the given key from the key-value store
+        """
+        key = request.match_info['key']
+        check_direct(request, [key])
+        value = await engine.get_async(key, local=is_local(request))
+        if value is not None:
+            return web.json_response({key: value})
+        else:
+            abort(404, "The key '{}' was not found in the key-value store".format(key))
+
+    async def mget(request):
+        """Get the values for a list of keys from the key-value store
+        """
+        keys = await read_json(request)
+
+        if not isinstance(keys, list):
+            abort(400, "The request data is not valid.. "
+                       "Please provide a JSON list of keys")
+
+        check_direct(request, keys)
+        return web.json_response(await engine.get_many_async(keys, local=is_local(request)))
+
+    async def invalidate(request):
+        """Drop the cached values of a list of keys which were overwritten on their owner
+        """
+        keys = await read_json(request)
+
+        if not isinstance(keys, list):
+            abort(400, "The request data is not valid.. "
+                       "Please provide a JSON list of keys")
+
+        engine.invalidate(keys)
+        return web.Response()
+
+    async def cache_stats(request):
+        """Get the counters of the read cache of the current node
+        """
+        if engine.cache is None:
+            return web.json_response({'enabled': False})
+        return web.json_response(dict(engine.cache.stats(), enabled=True))
+
+    async def get_metrics(request):
+        """Get the metrics of the current node, in the Prometheus text format
+        """
+        return web.Response(text=metrics.render(engine), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+    async def get_profile(request):
+        """Get the stacks sampled by the profiler, in the collapsed format of flame graphs
+        """
+        limit = request.query.get('limit')
+        return web.Response(text=profiler.report(int(limit) if limit else None))
+
+    async def toggle_profiler(request):
+        """Start (?action=start, sampling every ?interval= seconds) or stop (?action=stop) the sampling profiler
+        """
+        action = request.query.get('action')
+        if action == 'start':
+            interval = request.query.get('interval')
+            try:
+                profiler.start(float(interval) if interval else None)
+            except ValueError:
+                abort(400, "The sampling interval is not valid.. Please provide a positive number of seconds")
+        elif action == 'stop':
+            await asyncio.get_running_loop().run_in_executor(None, profiler.stop)
+        else:
+            abort(400, "The action is not valid.. Please provide one of: start, stop")
+        return web.json_response(profiler.stats())
+
+    async def gossip(request):
+        """Merge the membership table of another node, and respond with the table of the current node
+        """
+        return web.json_response(engine.gossip.exchange(await read_json(request)))
+
+    async def key_filter(request):
+        """Get the changes of the filter of the keys of the node since the version given as ?since=
+        """
+        try:
+            since = int(request.query.get('since', 0))
+        except ValueError:
+            abort(400, "The version is not valid.. Please provide a whole number")
+        # The whole filter takes a few milliseconds to encode, off the event loop
+        delta = await asyncio.get_running_loop().run_in_executor(None, engine.key_filter, since,
+                                                                 request.query.get('generation'))
+        return web.json_response(delta)
+
+    async def update_node_configuration(request):
+        """Add nodes to the configuration of the cluster, which the node then gossips to the other nodes
+        """
+        request_body = await read_json(request)
+        configuration = {}
+        for node_id in request_body:
+            configuration[int(node_id)] = request_body[node_id]
+
+        # Starting the redistribution of the key-value pairs takes locks
+        await asyncio.get_running_loop().run_in_executor(
+            engine.executor, engine.update_cluster_configuration_and_redistribute, configuration)
+        return web.Response()
+
+    async def snapshot(request):
+        """Dump a snapshot of the data for the current node
+
+        Supports the same streaming (?stream=true) and pagination (?limit=,
+        ?cursor=, ?start=, ?end=) modes as the threaded server
+        """
+        cursor = request.query.get('cursor') or None
+        start = request.query.get('start')
+        end = request.query.get('end')
+
+        # Scanning the store may take a while, so it is done outside of the event loop
+        loop = asyncio.get_running_loop()
+        try:
+            if request.query.get('stream') in ('1', 'true'):
+                pages = engine.stream_snapshot(cursor, start, end)
+                page = await loop.run_in_executor(engine.executor, next, pages, None)
+                response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+                await response.prepare(request)
+                while page is not None:
+                    await response.write(''.join(json.dumps({key: value}) + '\n'
+                                                 for key, value in page.items()).encode())
+                    page = await loop.run_in_executor(engine.executor, next, pages, None)
+                await response.write_eof()
+                return response
+
+            if 'limit' in request.query or cursor or start or end:
+                limit = int(request.query.get('limit', DEFAULT_SCAN_LIMIT))
+                if limit <= 0:
+                    raise ValueError(limit)
+                data, next_cursor = await loop.run_in_executor(engine.executor, engine.scan, cursor, limit, start, end)
+                return web.json_response({'data': data, 'cursor': next_cursor})
+        except (ValueError, IndexError):
+            abort(400, "The request is not valid.. "
+                       "Please provide a positive limit and a cursor returned by a previous snapshot")
+
+        data = await loop.run_in_executor(engine.executor, engine.snapshot)
+        return web.json_response(data)
+
+    async def scan(request):
+        """Get the key-value pairs of the cluster in a range of keys, in the order of their keys
+
+        Supports the same parameters (?prefix=, ?start=, ?end=, ?limit=,
+        ?cursor=, ?stream=true and ?local=true) as the threaded server
+        """
+        prefix = request.query.get('prefix') or None
+        start = request.query.get('start') or None
+        end = request.query.get('end') or None
+        cursor = request.query.get('cursor') or None
+
+        try:
+            limit = int(request.query.get('limit', DEFAULT_SCAN_LIMIT))
+            if limit <= 0:
+                raise ValueError(limit)
+        except ValueError:
+            abort(400, "The request is not valid.. "
+                       "Please provide a positive limit")
+
+        # The other nodes are scanned from threads, outside of the event loop
+        loop = asyncio.get_running_loop()
+        if request.query.get('stream') in ('1', 'true'):
+            pages = engine.stream_range_scan(start, end, cursor, prefix)
+            response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+            await response.prepare(request)
+            page = await loop.run_in_executor(None, next, pages, None)
+            while page is not None:
+                await response.write(''.join(json.dumps({key: value}) + '\n' for key, value in page.items()).encode())
+                page = await loop.run_in_executor(None, next, pages, None)
+            await response.write_eof()
+            return response
+
+        data, next_cursor = await loop.run_in_executor(
+            None, functools.partial(engine.range_scan, start, end, limit, cursor, prefix, local=is_local(request)))
+        return web.json_response({'data': dict(data), 'cursor': next_cursor})
+
+    app.router.add_get('/ping', ping)
+    app.router.add_get('/cluster', cluster)
+    app.router.add_post('/put', put)
+    app.router.add_post('/batch-put', batch_put)
+    app.router.add_post('/replicate', replicate)
+    app.router.add_post('/batch-replicate', batch_replicate)
+    app.router.add_get('/get/{key}', get)
+    app.router.add_post('/mget', mget)
+    app.router.add_post('/invalidate', invalidate)
+    app.router.add_get('/cache-stats', cache_stats)
+    app.router.add_get('/metrics', get_metrics)
+    app.router.add_get('/admin/profiler', get_profile)
+    app.router.add_post('/admin/profiler', toggle_profiler)
+    app.router.add_post('/gossip', gossip)
+    app.router.add_get('/key-filter', key_filter)
+    app.router.add_post('/update-node-configuration', update_node_configuration)
+    app.router.add_get('/snapshot', snapshot)
+    app.router.add_get('/scan', scan)
+    return app
+
+
+def run(app, host='0.0.0.0', port=80):
+    """Serve the application on a single event loop
+    """
+    web.run_app(app, host=host, port=port, print=None, access_log=None)
+
+
+def abort(code, text):
+    """Stop handling the request, responding with the given status code and message
+    """
+    raise HTTP_ERRORS[code](text='{} {}'.format(code, text))
+
+
+def get_route(request):
+    resource = request.match_info.route.resource
+    return resource.canonical if resource is not None else 'unmatched'
+
+
+@web.middleware
+async def record_metrics(request, handler):
+    """Time every request (the exceptions raised while serving them are counted by handle_error)
+    """
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as error:
+        status = error.status
+        raise
+    finally:
+        metrics.HTTP_REQUESTS.observe(time.perf_counter() - start, request.method, get_route(request), str(status))
+
+
+@web.middleware
+async def handle_error(request, handler):
+    """Turn the exceptions raised while handling a request into error responses
+    """
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except Exception as error:
+        metrics.HTTP_ERRORS.inc(get_route(request), type(error).__name__)
+        code = error.code if isinstance(error, KeyValueStoreException) else 500
+        return web.Response(status=code,
+                            text='{}: {}'.format(code, error),
+                            content_type='application/json')
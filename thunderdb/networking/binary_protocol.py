@@ -0,0 +1,126 @@
+"""
+The binary framing used between the nodes of the cluster (see BinaryServer and BinaryTransport)
+
+Every request and response is a frame: a FRAME_HEADER followed by its
+payload. The header carries the size of the payload, the id of the request
+(echoed in its response, so that many requests can be in flight on the same
+connection and be answered in any order), the opcode of the request or the
+status of the response, and the flags of the request.
+
+Payloads are made of sections. A section of strings holds their count, the
+size of their encoded form, and the UTF-8 strings joined by SEPARATOR, a
+byte which never appears in UTF-8. A section of key-value pairs holds their
+count, the sizes of the keys and of the values, then the keys and the values
+joined the same way. Values which are not strings are sent as JSON, prefixed
+by JSON_MARKER, another byte which never appears in UTF-8.
+"""
+import json
+import struct
+
+FRAME_HEADER = struct.Struct('<IIBB')
+STRINGS_HEADER = struct.Struct('<II')
+ITEMS_HEADER = struct.Struct('<III')
+LIMIT = struct.Struct('<I')
+
+SEPARATOR = b'\xff'
+JSON_MARKER = b'\xfe'
+
+# How SEPARATOR reads once decoded with the surrogateescape error handler,
+# and the first byte of the encoded surrogates which this handler cannot read
+SEPARATOR_ESCAPE = '\udcff'
+SURROGATE_PREFIX = b'\xed'
+
+# The largest payload accepted in a frame
+MAX_PAYLOAD_SIZE = 512 * 1024 * 1024
+
+# Request opcodes. Every opcode but PING works on a batch of keys
+OP_PING = 0
+OP_GET = 1
+OP_PUT = 2
+OP_REPLICATE = 3
+OP_INVALIDATE = 4
+OP_SCAN = 5
+
+# Response statuses. A request is rejected when it is invalid, so sending it again would fail the same way
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_REJECTED = 2
+
+# Request flags
+FLAG_LOCAL = 1
+FLAG_NO_OVERWRITE = 2
+FLAG_ACK_QUORUM = 4
+FLAG_ACK_ALL = 8
+FLAG_ORDERED = 16  # A SCAN of a range of keys in order, rather than of a page of the store
+
+
+class ProtocolError(Exception):
+    """An exception when a frame or a payload is malformed
+    """
+    pass
+
+
+def encode_frame(request_id, code, flags=0, payload=b''):
+    return FRAME_HEADER.pack(len(payload), request_id, code, flags) + payload
+
+
+def encode_strings(strings):
+    encoded = SEPARATOR.join([string.encode('utf-8', 'surrogatepass') for string in strings])
+    return STRINGS_HEADER.pack(len(strings), len(encoded)) + encoded
+
+
+def decode_strings(buffer, offset=0):
+    """Decode a section of strings, returning the strings and the offset of the next section
+    """
+    count, size = STRINGS_HEADER.unpack_from(buffer, offset)
+    offset += STRINGS_HEADER.size
+    return _decode(bytes(buffer[offset:offset + size]), count), offset + size
+
+
+def encode_items(data):
+    keys = SEPARATOR.join([key.encode('utf-8', 'surrogatepass') for key in data])
+    values = SEPARATOR.join([value.encode('utf-8', 'surrogatepass') if isinstance(value, str)
+                             else JSON_MARKER + json.dumps(value).encode()
+                             for value in data.values()])
+    return ITEMS_HEADER.pack(len(data), len(keys), len(values)) + keys + values
+
+
+def decode_items(buffer, offset=0):
+    """Decode a section of key-value pairs, returning them as a dictionary and the offset of the next section
+    """
+    count, keys_size, values_size = ITEMS_HEADER.unpack_from(buffer, offset)
+    offset += ITEMS_HEADER.size
+    keys = _decode(bytes(buffer[offset:offset + keys_size]), count)
+    offset += keys_size
+    encoded_values = bytes(buffer[offset:offset + values_size])
+    offset += values_size
+
+    if JSON_MARKER not in encoded_values:
+        return dict(zip(keys, _decode(encoded_values, count))), offset
+
+    values = [json.loads(value[1:]) if value[:1] == JSON_MARKER else value.decode('utf-8', 'surrogatepass')
+              for value in _split(encoded_values, count)]
+    return dict(zip(keys, values)), offset
+
+
+def _decode(encoded, count):
+    """Decode count strings joined by SEPARATOR
+    """
+    if SURROGATE_PREFIX in encoded:
+        # The strings may hold surrogates, which need to be decoded one by one
+        return [string.decode('utf-8', 'surrogatepass') for string in _split(encoded, count)]
+
+    # Otherwise decode them all at once, the separator being decoded as SEPARATOR_ESCAPE
+    strings = encoded.decode('utf-8', 'surrogateescape').split(SEPARATOR_ESCAPE) if count else []
+    if len(strings) != count:
+        raise ProtocolError("Expected {} strings, found {}".format(count, len(strings)))
+    return strings
+
+
+def _split(encoded, count):
+    if count == 0:
+        return []
+    strings = encoded.split(SEPARATOR)
+    if len(strings) != count:
+        raise ProtocolError("Expected {} strings, found {}".format(count, len(strings)))
+    return strings
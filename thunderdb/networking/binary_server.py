@@ -0,0 +1,179 @@
+"""
+A server for the binary protocol the nodes use to reach each other (see binary_protocol)
+"""
+import concurrent.futures
+import socket
+import threading
+import time
+import traceback
+
+from thunderdb.compute import metrics
+from thunderdb.compute.replication import ACK_PRIMARY, ACK_QUORUM, ACK_ALL
+from thunderdb.exceptions.errors import KeyValueStoreException
+from thunderdb.networking import binary_protocol as protocol
+from thunderdb.storage.key_value_store import DEFAULT_SCAN_LIMIT
+
+# The number of threads handling the requests of every connection. A request
+# may wait for the replicas of a write, so the others are handled meanwhile
+DEFAULT_BINARY_SERVER_THREADS = 16
+
+# The name of every opcode, in the metrics
+OPCODE_NAMES = {
+    protocol.OP_PING: 'ping',
+    protocol.OP_GET: 'get',
+    protocol.OP_PUT: 'put',
+    protocol.OP_REPLICATE: 'replicate',
+    protocol.OP_INVALIDATE: 'invalidate',
+    protocol.OP_SCAN: 'scan',
+}
+
+
+class BinaryServer(object):
+    """Serve the requests of the other nodes on persistent TCP connections
+
+    Every connection gets a thread which reads its frames one after the
+    other and hands them to a pool of worker threads. Each response is
+    written as soon as its request has been handled, with the id of the
+    request, so a slow request does not hold back the ones pipelined after
+    it on the same connection.
+    """
+    def __init__(self, engine, host='0.0.0.0', port=0, max_workers=DEFAULT_BINARY_SERVER_THREADS):
+        self.engine = engine
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        self._socket.listen(socket.SOMAXCONN)
+        self.port = self._socket.getsockname()[1]
+        self._connections = set()
+        self._closed = False
+        self._handlers = {
+            protocol.OP_PING: self._ping,
+            protocol.OP_GET: self._get,
+            protocol.OP_PUT: self._put,
+            protocol.OP_REPLICATE: self._replicate,
+            protocol.OP_INVALIDATE: self._invalidate,
+            protocol.OP_SCAN: self._scan,
+        }
+
+    def start(self):
+        """Start accepting connections, in a background thread
+        """
+        threading.Thread(target=self._accept, name="binary-server", daemon=True).start()
+        return self
+
+    def close(self):
+        self._closed = True
+        self._socket.close()
+        for connection in list(self._connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.executor.shutdown(wait=False)
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._connections.add(connection)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        """Read the requests of a connection until it is closed
+        """
+        write_lock = threading.Lock()
+
+        def respond(request_id, code, flags, payload):
+            status, response = self._handle(code, flags, payload)
+            with write_lock:
+                try:
+                    connection.sendall(protocol.encode_frame(request_id, status, 0, response))
+                except OSError:
+                    pass  # The connection was closed, which the reader notices
+
+        try:
+            reader = connection.makefile('rb')
+            while True:
+                header = reader.read(protocol.FRAME_HEADER.size)
+                if len(header) < protocol.FRAME_HEADER.size:
+                    break
+                size, request_id, code, flags = protocol.FRAME_HEADER.unpack(header)
+                if size > protocol.MAX_PAYLOAD_SIZE:
+                    break
+                payload = reader.read(size)
+                if len(payload) < size:
+                    break
+
+                if code == protocol.OP_PING:
+                    respond(request_id, code, flags, payload)
+                else:
+                    self.executor.submit(respond, request_id, code, flags, payload)
+        except (OSError, ValueError, RuntimeError):
+            pass
+        finally:
+            self._connections.discard(connection)
+            connection.close()
+
+    def _handle(self, code, flags, payload):
+        """Handle a request, returning the status and the payload of its response
+        """
+        handler = self._handlers.get(code)
+        if handler is None:
+            return protocol.STATUS_ERROR, "Unknown opcode {}".format(code).encode()
+
+        start = time.perf_counter()
+        status = protocol.STATUS_ERROR
+        try:
+            response = handler(flags, payload)
+            status = protocol.STATUS_OK
+            return status, response
+        except Exception as error:
+            traceback.print_exc()
+            if isinstance(error, KeyValueStoreException) and error.code < 500:
+                status = protocol.STATUS_REJECTED
+            return status, "{}: {}".format(type(error).__name__, error).encode('utf-8', 'replace')
+        finally:
+            metrics.BINARY_REQUESTS.observe(time.perf_counter() - start, OPCODE_NAMES[code],
+                                            'ok' if status == protocol.STATUS_OK else 'error')
+
+    def _ping(self, flags, payload):
+        return b''
+
+    def _get(self, flags, payload):
+        keys, _ = protocol.decode_strings(payload)
+        return protocol.encode_items(self.engine.get_many(keys, local=bool(flags & protocol.FLAG_LOCAL)))
+
+    def _put(self, flags, payload):
+        data, _ = protocol.decode_items(payload)
+        if flags & protocol.FLAG_ACK_ALL:
+            ack = ACK_ALL
+        elif flags & protocol.FLAG_ACK_QUORUM:
+            ack = ACK_QUORUM
+        else:
+            ack = ACK_PRIMARY
+        self.engine.put_many(data, overwrite=not flags & protocol.FLAG_NO_OVERWRITE, ack=ack)
+        return b''
+
+    def _replicate(self, flags, payload):
+        data, _ = protocol.decode_items(payload)
+        self.engine.replicate_many(data, overwrite=not flags & protocol.FLAG_NO_OVERWRITE)
+        return b''
+
+    def _invalidate(self, flags, payload):
+        keys, _ = protocol.decode_strings(payload)
+        self.engine.invalidate(keys)
+        return b''
+
+    def _scan(self, flags, payload):
+        (limit,) = protocol.LIMIT.unpack_from(payload)
+        (cursor, start, end), _ = protocol.decode_strings(payload, protocol.LIMIT.size)
+        if flags & protocol.FLAG_ORDERED:
+            items, next_cursor = self.engine.range_scan(start or None, end or None, limit or DEFAULT_SCAN_LIMIT,
+                                                        cursor or None, local=True)
+            return protocol.encode_strings([next_cursor or '']) + protocol.encode_items(dict(items))
+        data, next_cursor = self.engine.scan(cursor or None, limit or DEFAULT_SCAN_LIMIT, start or None, end or None)
+        return protocol.encode_strings([next_cursor or '']) + protocol.encode_items(data)
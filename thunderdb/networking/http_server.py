@@ -2,41 +2,99 @@
 A lightweight implementation of a multi-threaded HTTP server
 """
 from thunderdb.exceptions.errors import KeyValueStoreException
+import itertools
 import json
 import time
 import threading
 
+from thunderdb.compute import metrics
 from thunderdb.compute.engine import Engine
-from bottle import Bottle, request, response, abort
+from thunderdb.compute.gossip import DEFAULT_READY_TIMEOUT
+from thunderdb.compute.profiler import SamplingProfiler
+from thunderdb.compute.replication import ACK_MODES, ACK_PRIMARY
+from thunderdb.networking.binary_server import BinaryServer
+from thunderdb.storage.key_value_store import DEFAULT_SCAN_LIMIT
+from bottle import Bottle, HTTPResponse, request, response, abort
 
 
-def initialize(config, data_file=None):
-    """Initialize the application with the given configuration
+class MetricsPlugin(object):
+    """Time every request served by the application, and count the exceptions raised while serving them
+    """
+    name = 'metrics'
+    api = 2
 
-    In this instance, the application uses Bottle as the HTTP Server
-    framework because it is lightweight and provides a simple API. Any
-    other framework, like Flask, could be used in its place depending on
-    your application's needs
+    def apply(self, callback, route):
+        rule, method = route.rule, route.method
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            status = 500
+            try:
+                body = callback(*args, **kwargs)
+                status = response.status_code
+                return body
+            except HTTPResponse as error:
+                status = error.status_code
+                raise
+            except Exception as error:
+                if isinstance(error, KeyValueStoreException):
+                    status = error.code
+                metrics.HTTP_ERRORS.inc(rule, type(error).__name__)
+                raise
+            finally:
+                metrics.HTTP_REQUESTS.observe(time.perf_counter() - start, method, rule, str(status))
+        return wrapper
+
+
+def handle_error(error):
+    """Render the errors of an application, with the status code of the KeyValueStoreException which caused them
     """
-    app = Bottle()
-    engine = Engine(config)
+    message = str(error.exception) if error.exception else str()
+    resp = {
+        'exception_type': type(error.exception).__name__
+    }
 
-    def update_configuration():
-        """Update the configuration for the given application
+    if issubclass(type(error.exception), KeyValueStoreException):
+        response.status = error.exception.code
+        resp.update(error.exception.kwargs)
+    else:
+        response.status = error.status_code
+
+    response.set_header('Content-type', 'application/json')
+    return '{} {}: {}'.format(response.status, message, error.body)
 
-        This is only used as a target for our threads
-        """
-        time.sleep(2)  # Wait for our other nodes to be ready
-        engine.update_cluster_configuration_with_node_config()
 
-    # Execute this function in a new thread, so the main thread remains uninterrupted
-    update_configuration_thread = threading.Thread(target=update_configuration)
-    update_configuration_thread.start()
+def start_background_tasks(engine, data_file=None, peer_port=None):
+    """Gossip the membership of the cluster with the other nodes and load the initial dataset
+
+    The node also keeps the key filters of the other nodes up to date, if it
+    uses them (see PeerFilters)
+    Both tasks run in their own thread, so the server starts serving requests
+    right away. When a peer port is given, the node also serves the binary
+    protocol of the other nodes on it (see BinaryServer)
+    """
+    if peer_port is not None:
+        BinaryServer(engine, port=peer_port).start()
+
+    engine.gossip.start()
+    if engine.filters is not None:
+        engine.filters.start()
 
     def load_data():
         """Load an initial dataset into our key-value store
+
+        The dataset is loaded once the node met the other nodes of the
+        cluster (see Gossip.wait_until_ready), so the key-value pairs are
+        sent straight to their owner. A durable store which recovered its
+        data on startup is not loaded again
         """
-        time.sleep(3)  # Wait for our other nodes to be ready
+        if len(engine.storage):
+            print("Recovered {} key-value pairs, skipping the initial dataset...".format(len(engine.storage)))
+            return
+
+        if not engine.gossip.wait_until_ready(DEFAULT_READY_TIMEOUT):
+            print("The cluster is still not ready after {} seconds, loading the initial dataset anyway...".format(
+                DEFAULT_READY_TIMEOUT))
         engine.batch_put(data_file)
 
     if data_file:
@@ -44,22 +102,65 @@ def initialize(config, data_file=None):
         load_data_thread = threading.Thread(target=load_data)
         load_data_thread.start()
 
-    @app.error()
-    @app.error(404)
-    def handle_error(error):
-        message = str(error.exception) if error.exception else str()
-        resp = {
-            'exception_type': type(error.exception).__name__
-        }
 
-        if issubclass(type(error.exception), KeyValueStoreException):
-            response.status = error.exception.code
-            resp.update(error.exception.extra_data)
-        else:
-            response.status = error.status_code
+def initialize(config, data_file=None, storage=None, cache=None, peer_port=None):
+    """Initialize the application with the given configuration
+
+    In this instance, the application uses Bottle as the HTTP Server
+    framework because it is lightweight and provides a simple API. Any
+    other framework, like Flask, could be used in its place depending on
+    your application's needs
+
+    The key-value pairs are kept in the given KeyValueStore, or in an
+    InMemoryStore if no store is provided. The values owned by other nodes
+    are cached in the given ReadCache, if any. The other nodes can also reach
+    the node through the binary protocol on the given peer port, if any
+    """
+    app = Bottle()
+    app.install(MetricsPlugin())
+    engine = Engine(config, storage, cache)
+    profiler = SamplingProfiler()
+
+    start_background_tasks(engine, data_file, peer_port)
+
+    app.error()(handle_error)
+    app.error(404)(handle_error)
+
+    def read_json():
+        body = request.body.read()
+        with metrics.SERIALIZATION.time('json'):
+            return json.loads(body)
+
+    def is_overwrite():
+        return request.query.get('overwrite') not in ('0', 'false')
+
+    def is_local():
+        return request.query.get('local') in ('1', 'true')
+
+    def check_direct(keys):
+        # Requests sent straight to the owner of their keys are not forwarded
+        if request.query.get('direct') in ('1', 'true'):
+            engine.check_owner(keys)
+
+    def get_ack_mode():
+        ack = request.query.get('ack', ACK_PRIMARY)
+        if ack not in ACK_MODES:
+            abort(400, "The acknowledgement mode is not valid.. "
+                       "Please provide one of: {}".format(", ".join(ACK_MODES)))
+        return ack
 
-        response.set_header('Content-type', 'application/json')
-        return '{} {}: {}'.format(response.status, message, error.body)
+    def get_number(name):
+        # A positive number of seconds, or a time, given in the query of a write
+        value = request.query.get(name)
+        if value is None:
+            return None
+        try:
+            number = float(value)
+        except ValueError:
+            number = 0
+        if not 0 < number < float('inf'):
+            abort(400, "The {} is not valid.. Please provide a positive number of seconds".format(name))
+        return number
 
     @app.route('/ping', method=['GET'])
     def ping():
@@ -70,25 +171,57 @@ def initialize(config, data_file=None):
             'status': 'OK'
         }
 
+    @app.route('/cluster', method=['GET'])
+    def cluster():
+        """Get the nodes of the cluster and the parameters of its ring, for the clients which route to the owners
+        """
+        return engine.membership()
+
     @app.route('/put', method=['POST'])
     def put():
         """Put a key-value pair into the key-value store
+
+        The response is sent as soon as the owner of the key stored the pair.
+        With ?ack=quorum or ?ack=all, it waits for a majority of the
+        replicas, or for all of them, to store the pair as well. With
+        ?direct=true, a node which does not own the key answers 421 instead
+        of forwarding the request. With ?ttl=, the pair expires after that
+        many seconds, which only the capped storage backend supports
         """
-        data = json.loads(request.body.read())
+        data = read_json()
 
         if len(data.keys()) != 1:
             abort(400, "The request data is not valid.. "
                        "Please provide exactly one key-value pair")
 
         key, value = next(iter(data.items()))
-        engine.put(key, value)
+        check_direct([key])
+        engine.put(key, value, ack=get_ack_mode(), ttl=get_number('ttl'))
+        return
+
+    @app.route('/batch-put', method=['POST'])
+    def batch_put():
+        """Put many key-value pairs into the key-value store in one request
+
+        With ?overwrite=false, keys which already exist keep their current
+        value. The acknowledgement mode is given by ?ack=, and ?direct=true
+        and ?ttl= are handled as for /put
+        """
+        data = read_json()
+
+        if not isinstance(data, dict):
+            abort(400, "The request data is not valid.. "
+                       "Please provide a JSON object of key-value pairs")
+
+        check_direct(data.keys())
+        engine.put_many(data, overwrite=is_overwrite(), ack=get_ack_mode(), ttl=get_number('ttl'))
         return
 
     @app.route('/replicate', method=['POST'])
     def replicate():
         """Put the key-value pair in the replica node
         """
-        data = json.loads(request.body.read())
+        data = read_json()
 
         if len(data.keys()) != 1:
             abort(400, "The request data is not valid.. "
@@ -98,21 +231,133 @@ def initialize(config, data_file=None):
         engine.replicate(key, value)
         return
 
+    @app.route('/batch-replicate', method=['POST'])
+    def batch_replicate():
+        """Put many key-value pairs sent by their owner into the replica node
+
+        With ?expires_at=, the pairs expire at that time, as set by the owner
+        """
+        data = read_json()
+
+        if not isinstance(data, dict):
+            abort(400, "The request data is not valid.. "
+                       "Please provide a JSON object of key-value pairs")
+
+        engine.replicate_many(data, overwrite=is_overwrite(), expires_at=get_number('expires_at'))
+        return
+
     @app.route('/get/<key>', method=['GET'])
     def get(key):
         """Get the value for the given key from the key-value store
+
+        With ?local=true, the key is only looked up in the current node. With
+        ?direct=true, a node which does not own the key answers 421
         """
-        value = engine.get(key)
-        if value:
+        check_direct([key])
+        value = engine.get(key, local=is_local())
+        if value is not None:
             return {key: value}
         else:
             abort(404, "The key '{}' was not found in the key-value store".format(key))
 
+    @app.route('/mget', method=['POST'])
+    def mget():
+        """Get the values for a list of keys from the key-value store
+
+        Only the keys that exist in the key-value store are returned. With
+        ?local=true, the keys are only looked up in the current node, and
+        ?direct=true is handled as for /get
+        """
+        keys = read_json()
+
+        if not isinstance(keys, list):
+            abort(400, "The request data is not valid.. "
+                       "Please provide a JSON list of keys")
+
+        check_direct(keys)
+
+        return engine.get_many(keys, local=is_local())
+
+    @app.route('/invalidate', method=['POST'])
+    def invalidate():
+        """Drop the cached values of a list of keys which were overwritten on their owner
+        """
+        keys = read_json()
+
+        if not isinstance(keys, list):
+            abort(400, "The request data is not valid.. "
+                       "Please provide a JSON list of keys")
+
+        engine.invalidate(keys)
+        return
+
+    @app.route('/cache-stats', method=['GET'])
+    def cache_stats():
+        """Get the counters of the read cache of the current node
+        """
+        if engine.cache is None:
+            return {'enabled': False}
+        return dict(engine.cache.stats(), enabled=True)
+
+    @app.route('/metrics', method=['GET'])
+    def get_metrics():
+        """Get the metrics of the current node, in the Prometheus text format
+        """
+        response.content_type = metrics.CONTENT_TYPE
+        return metrics.render(engine)
+
+    @app.route('/admin/profiler', method=['GET'])
+    def get_profile():
+        """Get the stacks sampled by the profiler, in the collapsed format of flame graphs
+
+        The most frequent stacks come first, and ?limit= keeps only that many
+        """
+        limit = request.query.get('limit')
+        response.content_type = 'text/plain; charset=utf-8'
+        return profiler.report(int(limit) if limit else None)
+
+    @app.route('/admin/profiler', method=['POST'])
+    def toggle_profiler():
+        """Start (?action=start, sampling every ?interval= seconds) or stop (?action=stop) the sampling profiler
+        """
+        action = request.query.get('action')
+        if action == 'start':
+            interval = request.query.get('interval')
+            try:
+                profiler.start(float(interval) if interval else None)
+            except ValueError:
+                abort(400, "The sampling interval is not valid.. Please provide a positive number of seconds")
+        elif action == 'stop':
+            profiler.stop()
+        else:
+            abort(400, "The action is not valid.. Please provide one of: start, stop")
+        return profiler.stats()
+
+    @app.route('/gossip', method=['POST'])
+    def gossip():
+        """Merge the membership table of another node, and respond with the table of the current node
+        """
+        return engine.gossip.exchange(read_json())
+
+    @app.route('/key-filter', method=['GET'])
+    def key_filter():
+        """Get the changes of the filter of the keys of the node since the version given as ?since=
+
+        The ?generation= of the filter the version belongs to is given by the
+        previous response. The whole filter is returned when the changes are
+        not known anymore (see PeerFilters)
+        """
+        try:
+            since = int(request.query.get('since', 0))
+        except ValueError:
+            abort(400, "The version is not valid.. Please provide a whole number")
+        return engine.key_filter(since, request.query.get('generation'))
+
     @app.route('/update-node-configuration', method=['POST'])
     def update_node_configuration():
-        """Update the configuration for a node
+        """Add nodes to the configuration of the cluster, which the node then gossips to the other nodes
         """
-        request_body = json.loads(request.body.read())
+        request_body = read_json()
         configuration = {}
         for node_id in request_body:
             configuration[int(node_id)] = request_body[node_id]
@@ -121,7 +366,68 @@ def initialize(config, data_file=None):
     @app.route('/snapshot', method=['GET'])
     def snapshot():
         """Dump a snapshot of the data for the current node
+
+        By default, the whole snapshot is returned as a single JSON object.
+        With ?stream=true it is streamed as newline-delimited JSON, one
+        {key: value} object per line, and with ?limit= it is paginated: each
+        response holds one page of the data and the cursor of the next page,
+        to be passed as ?cursor=. In both modes, ?start= and ?end= only keep
+        the keys in the range [start, end).
         """
+        cursor = request.query.get('cursor') or None
+        start = request.query.get('start')
+        end = request.query.get('end')
+
+        try:
+            if request.query.get('stream') in ('1', 'true'):
+                pages = engine.stream_snapshot(cursor, start, end)
+                first_page = next(pages)
+                response.content_type = 'application/x-ndjson'
+                return (''.join(json.dumps({key: value}) + '\n' for key, value in page.items())
+                        for page in itertools.chain([first_page], pages))
+
+            if 'limit' in request.query or cursor or start or end:
+                limit = int(request.query.get('limit', DEFAULT_SCAN_LIMIT))
+                if limit <= 0:
+                    raise ValueError(limit)
+                data, next_cursor = engine.scan(cursor, limit, start, end)
+                return {'data': data, 'cursor': next_cursor}
+        except (ValueError, IndexError):
+            abort(400, "The request is not valid.. "
+                       "Please provide a positive limit and a cursor returned by a previous snapshot")
+
         return engine.snapshot()
 
+    @app.route('/scan', method=['GET'])
+    def scan():
+        """Get the key-value pairs of the cluster in a range of keys, in the order of their keys
+
+        ?prefix= only keeps the keys which start with it, and ?start= and
+        ?end= the keys in the range [start, end). Each response holds at most
+        ?limit= pairs, and the cursor of the next page, to be passed as
+        ?cursor=, which is null once the range has been scanned. With
+        ?stream=true, every pair is streamed instead, as newline-delimited
+        JSON. With ?local=true, only the current node is scanned
+        """
+        prefix = request.query.get('prefix') or None
+        start = request.query.get('start') or None
+        end = request.query.get('end') or None
+        cursor = request.query.get('cursor') or None
+
+        try:
+            limit = int(request.query.get('limit', DEFAULT_SCAN_LIMIT))
+            if limit <= 0:
+                raise ValueError(limit)
+        except ValueError:
+            abort(400, "The request is not valid.. "
+                       "Please provide a positive limit")
+
+        if request.query.get('stream') in ('1', 'true'):
+            response.content_type = 'application/x-ndjson'
+            return (''.join(json.dumps({key: value}) + '\n' for key, value in page.items())
+                    for page in engine.stream_range_scan(start, end, cursor, prefix))
+
+        data, next_cursor = engine.range_scan(start, end, limit, cursor, prefix, local=is_local())
+        return {'data': dict(data), 'cursor': next_cursor}
+
     return app
@@ -0,0 +1,172 @@
+"""
+A prefork server: worker processes sharing the port of the node serve reads from a shared-memory store
+
+The node itself runs in a single process, the writer, which owns the
+SharedMemoryStore and serves the full application on a loopback port. The
+worker processes are forked before the writer starts any thread, and each
+binds the public port of the node with SO_REUSEPORT, so the kernel spreads
+the incoming connections among them. A worker answers the reads of the keys
+held by the node straight from the shared store, without taking any lock or
+involving the writer, and forwards every other request to the writer.
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import requests
+import waitress
+from bottle import Bottle, HTTPResponse, request, abort
+
+from thunderdb.compute import utils
+from thunderdb.exceptions.errors import ServiceError
+from thunderdb.networking.http_server import handle_error
+
+# The number of worker processes, one per core by default
+DEFAULT_PREFORK_WORKERS = os.cpu_count() or 1
+
+# The writer listens on the loopback interface, on the port of the node plus this offset
+DEFAULT_WRITER_PORT_OFFSET = 2000
+
+# The number of seconds between two checks that the writer is still running
+PARENT_CHECK_INTERVAL = 1.0
+
+# The size of the chunks of the responses of the writer streamed back to the clients
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+
+def initialize_worker(store, writer_address, pool_size=utils.DEFAULT_POOL_SIZE,
+                      connect_timeout=utils.DEFAULT_CONNECT_TIMEOUT, read_timeout=utils.DEFAULT_READ_TIMEOUT):
+    """Initialize the application of a worker process
+
+    The keys found in the given store are served directly, exactly like the
+    Engine serves the keys held by the node, and every other request is
+    forwarded to the writer at the given host:port
+    """
+    app = Bottle()
+    pool = utils.ConnectionPool(pool_size=pool_size, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                                max_retries=0)
+    app.error()(handle_error)
+    app.error(404)(handle_error)
+
+    def is_local():
+        return request.query.get('local') in ('1', 'true')
+
+    def forward(body=None):
+        """Send the current request to the writer, returning its response as is
+        """
+        url = 'http://' + writer_address + request.path
+        if request.query_string:
+            url += '?' + request.query_string
+        headers = {'Content-Type': request.content_type} if request.content_type else {}
+        try:
+            writer_response = pool.session(url).request(
+                request.method, url, data=body if body is not None else request.body.read(), headers=headers,
+                timeout=pool.timeout, stream=True)
+        except requests.exceptions.RequestException as error:
+            raise ServiceError("The writer process could not be reached", url=url, exception=str(error))
+
+        return HTTPResponse(writer_response.iter_content(RESPONSE_CHUNK_SIZE), writer_response.status_code,
+                            {'Content-Type': writer_response.headers.get('Content-Type', 'text/html')})
+
+    @app.route('/get/<key>', method=['GET'])
+    def get(key):
+        """Get the value for the given key from the shared store, or from the writer when it is not there
+        """
+        value = store.get(key)
+        if value is not None:
+            return {key: value}
+        if is_local():
+            abort(404, "The key '{}' was not found in the key-value store".format(key))
+        return forward()
+
+    @app.route('/mget', method=['POST'])
+    def mget():
+        """Get the values for a list of keys, asking the writer only for the keys which are not in the shared store
+        """
+        keys = json.loads(request.body.read())
+
+        if not isinstance(keys, list):
+            abort(400, "The request data is not valid.. "
+                       "Please provide a JSON list of keys")
+
+        values = {}
+        missing_keys = []
+        for key in keys:
+            value = store.get(key)
+            if value is not None:
+                values[key] = value
+            else:
+                missing_keys.append(key)
+
+        if missing_keys and not is_local():
+            writer_response = forward(json.dumps(missing_keys))
+            if writer_response.status_code != 200:
+                return writer_response
+            values.update(json.loads(b''.join(writer_response.body)))
+        return values
+
+    @app.route('/', method=['GET', 'POST'])
+    @app.route('/<path:path>', method=['GET', 'POST'])
+    def forward_to_writer(path=None):
+        return forward()
+
+    return app
+
+
+def create_socket(host, port):
+    """Create a listening socket which other processes can bind to the same port
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise ValueError("The prefork server needs SO_REUSEPORT, which this platform does not support")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(socket.SOMAXCONN)
+    return sock
+
+
+def start_workers(store, writer_address, host, port, num_workers=DEFAULT_PREFORK_WORKERS, threads=4, **kwargs):
+    """Fork the worker processes, returning their process ids
+
+    This must be called before the calling process starts any thread, as
+    only the forking thread survives in the workers. The keyword arguments
+    are passed to initialize_worker
+    """
+    if num_workers < 1:
+        raise ValueError("The prefork server needs at least one worker, got {}".format(num_workers))
+
+    parent_pid = os.getpid()
+    pids = []
+    for _ in range(num_workers):
+        pid = os.fork()
+        if pid:
+            pids.append(pid)
+            continue
+
+        try:
+            run_worker(store, writer_address, host, port, parent_pid, threads, **kwargs)
+        finally:
+            os._exit(1)
+    return pids
+
+
+def run_worker(store, writer_address, host, port, parent_pid, threads, **kwargs):
+    """Serve the requests of a worker process until the writer exits
+    """
+    sock = create_socket(host, port)
+    app = initialize_worker(store, writer_address, **kwargs)
+
+    def exit_with_parent():
+        while os.getppid() == parent_pid:
+            time.sleep(PARENT_CHECK_INTERVAL)
+        os._exit(0)
+
+    threading.Thread(target=exit_with_parent, daemon=True).start()
+    print("Worker {} serving on {}:{}".format(os.getpid(), host, port))
+    sys.stdout.flush()
+    waitress.serve(app, sockets=[sock], threads=threads)
@@ -0,0 +1,25 @@
+from thunderdb.storage.in_memory_store import InMemoryStore
+from thunderdb.storage.compact_store import CompactStore
+from thunderdb.storage.shared_store import SharedMemoryStore
+from thunderdb.storage.capped_store import CappedStore
+
+# The storage backends which can be selected when starting a node
+STORAGE_BACKENDS = {
+    'memory': InMemoryStore,
+    'compact': CompactStore,
+    'shared': SharedMemoryStore,
+    'capped': CappedStore,
+}
+
+DEFAULT_STORAGE_BACKEND = 'memory'
+
+
+def create_store(backend=DEFAULT_STORAGE_BACKEND, **kwargs):
+    """Create the KeyValueStore implementation registered under the given name
+
+    The keyword arguments are passed to the constructor of the store
+    """
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError("Unknown storage backend '{}', expected one of: {}".format(
+            backend, ", ".join(sorted(STORAGE_BACKENDS))))
+    return STORAGE_BACKENDS[backend](**kwargs)
@@ -0,0 +1,380 @@
+import math
+import sys
+import threading
+import time
+
+from thunderdb.exceptions.errors import KeyValueStoreException
+from thunderdb.storage.eviction import create_eviction_policy, DEFAULT_EVICTION_POLICY
+from thunderdb.storage.key_value_store import KeyValueStore, DEFAULT_SCAN_LIMIT
+from thunderdb.storage.scan_order import ScanOrder
+
+# The number of bytes of keys and values the store holds by default
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# The estimated number of bytes the store and its eviction policy use to keep
+# track of every key, besides the key and the value themselves (from 200 bytes
+# with the LRU policy to 250 bytes with the sampled LRU policy)
+ENTRY_OVERHEAD = 250
+
+# The number of seconds of a tick of the timer wheel: keys expire at most this
+# long after their expiration time when nobody reads them
+DEFAULT_TIMER_RESOLUTION = 0.1
+
+# The timer wheel has WHEEL_LEVELS levels of 2 ** WHEEL_BITS slots, each slot
+# of a level spanning all the slots of the level below. With the default
+# resolution, the wheel covers about 19 days, and later expirations are
+# placed in its last slot until they get closer
+WHEEL_BITS = 6
+WHEEL_LEVELS = 4
+
+
+class TimerWheel(object):
+    """A hierarchical timer wheel: keys scheduled to expire at a time are returned once that time has passed
+
+    Time is divided into ticks of `resolution` seconds. The first level of
+    the wheel has a slot per tick for the next 2 ** WHEEL_BITS ticks, and
+    every other level has a slot per turn of the level below it. Scheduling
+    or cancelling a key takes constant time, whatever the number of keys
+    and however far their expiration time. Whenever a level completes a
+    turn, the next slot of the level above it is emptied into the lower
+    levels (the cascade of the Linux kernel timers), so expiring the keys
+    only ever looks at the slots of the ticks which passed. The ticks
+    before the next turn of the lowest level holding keys are skipped at
+    once, so advancing the wheel after it was idle, or after the clock
+    jumped, does not walk every tick in between.
+    """
+    def __init__(self, resolution=DEFAULT_TIMER_RESOLUTION, now=None):
+        self.resolution = resolution
+        self._tick = self._to_tick(time.time() if now is None else now)
+        self._levels = [[set() for _ in range(1 << WHEEL_BITS)] for _ in range(WHEEL_LEVELS)]
+        # The number of keys in the slots of every level
+        self._counts = [0] * WHEEL_LEVELS
+        self._timers = {}
+
+    def __len__(self):
+        return len(self._timers)
+
+    def schedule(self, key, expires_at):
+        """Schedule a key to expire at the given time, instead of the time it was scheduled at before, if any
+        """
+        self.cancel(key)
+        self._place(key, max(math.ceil(self._ticks(expires_at)), self._tick))
+
+    def cancel(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            _, level, index = timer
+            self._levels[level][index].discard(key)
+            self._counts[level] -= 1
+
+    def advance(self, now):
+        """Move the wheel up to the given time, returning the keys whose expiration time has passed
+        """
+        mask = (1 << WHEEL_BITS) - 1
+        target = self._to_tick(now)
+        expired = []
+        while self._tick <= target:
+            self._tick = self._next_tick(target)
+            if self._tick > target:
+                break
+            index = self._tick & mask
+            if index == 0:
+                self._cascade()
+
+            slot = self._levels[0][index]
+            if slot:
+                self._levels[0][index] = set()
+                self._counts[0] -= len(slot)
+                for key in slot:
+                    tick = self._timers[key][0]
+                    if tick <= self._tick:
+                        del self._timers[key]
+                        expired.append(key)
+                    else:
+                        # A key scheduled past the end of the wheel, whose tick is still to come
+                        self._place(key, tick)
+            self._tick += 1
+        return expired
+
+    def _next_tick(self, target):
+        """The first tick from the current one whose slots may hold keys, or target + 1 if none up to target
+
+        A level only receives keys from the levels above it at its turns, so
+        when the levels below the lowest one holding keys are empty, nothing
+        happens until the next turn of that level
+        """
+        for level, count in enumerate(self._counts):
+            if count:
+                shift = WHEEL_BITS * level
+                return min(((self._tick + (1 << shift) - 1) >> shift) << shift, target + 1)
+        return target + 1
+
+    def _to_tick(self, now):
+        return math.floor(self._ticks(now))
+
+    def _ticks(self, seconds):
+        # Round away the error of the division, so that a time which is a multiple of the resolution is a whole tick
+        return round(seconds / self.resolution, 6)
+
+    def _place(self, key, tick):
+        delta = min(tick - self._tick, (1 << (WHEEL_BITS * WHEEL_LEVELS)) - 1)
+        level = 0
+        while delta >= 1 << (WHEEL_BITS * (level + 1)):
+            level += 1
+        index = ((self._tick + delta) >> (WHEEL_BITS * level)) & ((1 << WHEEL_BITS) - 1)
+        self._levels[level][index].add(key)
+        self._counts[level] += 1
+        self._timers[key] = (tick, level, index)
+
+    def _cascade(self):
+        """Move the keys of the next slot of every level which completed a turn into the levels below it
+        """
+        for level in range(1, WHEEL_LEVELS):
+            index = (self._tick >> (WHEEL_BITS * level)) & ((1 << WHEEL_BITS) - 1)
+            slot = self._levels[level][index]
+            if slot:
+                self._levels[level][index] = set()
+                self._counts[level] -= len(slot)
+                for key in slot:
+                    self._place(key, self._timers[key][0])
+            if index != 0:
+                return
+
+
+class CappedStore(KeyValueStore):
+    """An in-memory KeyValueStore which holds at most max_bytes, and whose keys can expire
+
+    Once the keys, the values and the bookkeeping of the store take more
+    than max_bytes, keys are evicted in the order given by the eviction
+    policy (see EVICTION_POLICIES) until the store fits its budget again.
+    The size of a value is estimated with sys.getsizeof, so the values
+    which are not strings, like JSON objects, are only partly accounted for.
+
+    Keys put with an expiration time are scheduled on a TimerWheel, which a
+    background thread advances every tick, so expiring keys never scans
+    the store. A key read after its expiration time and before the wheel
+    reached it is not returned either. Putting a key without an expiration
+    time makes it persistent again.
+
+    The stores wrapping this one, which keep their own structures over its
+    keys, learn of the keys it evicts or expires through the listeners
+    added with add_removal_listener.
+    """
+    supports_expiration = True
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, eviction=DEFAULT_EVICTION_POLICY,
+                 timer_resolution=DEFAULT_TIMER_RESOLUTION, clock=time.time):
+        self.max_bytes = max_bytes
+        self.policy = create_eviction_policy(eviction) if isinstance(eviction, str) else eviction
+        self.size_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._clock = clock
+        self._data = {}
+        self._order = ScanOrder(self._data)
+        self._sizes = {}
+        self._expiration_times = {}
+        self._wheel = TimerWheel(timer_resolution, clock())
+        self._lock = threading.Lock()
+        self._removal_listeners = []
+        self._removed = []
+        self._expiry_thread = None
+        self._closed = threading.Event()
+
+    def put(self, key, value, expires_at=None):
+        """Store a key-value pair, which expires at the given time (as given by time.time) if any
+        """
+        size = self._size(key, value)
+        with self._lock:
+            self._put(key, value, size, expires_at)
+            self._evict()
+        self._notify_removals()
+        if expires_at is not None and self._expiry_thread is None:
+            self._start_expiry_thread()
+
+    def put_batch(self, data, expires_at=None):
+        sizes = {key: self._size(key, value) for key, value in data.items()}
+        with self._lock:
+            for key, value in data.items():
+                self._put(key, value, sizes[key], expires_at)
+            self._evict()
+        self._notify_removals()
+        if expires_at is not None and self._expiry_thread is None:
+            self._start_expiry_thread()
+
+    def put_batch_if_absent(self, data, expires_at=None):
+        """Store the key-value pairs whose keys are not in the store, or expired, returning the pairs stored
+        """
+        sizes = {key: self._size(key, value) for key, value in data.items()}
+        stored = {}
+        with self._lock:
+            now = self._clock()
+            for key, value in data.items():
+                expiration_time = self._expiration_times.get(key)
+                if key in self._data and (expiration_time is None or expiration_time > now):
+                    continue
+                self._put(key, value, sizes[key], expires_at)
+                stored[key] = value
+            self._evict()
+        self._notify_removals()
+        if expires_at is not None and self._expiry_thread is None:
+            self._start_expiry_thread()
+        return stored
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                return None
+            expired = key in self._expiration_times and self._expiration_times[key] <= self._clock()
+            if not expired:
+                self.policy.touch(key)
+                return value
+            self._remove(key, removed=True)
+            self.expirations += 1
+        self._notify_removals()
+        return None
+
+    def __contains__(self, key):
+        """Whether the store holds the key, without counting as a use of the key as get does
+        """
+        return key in self._data
+
+    def add_removal_listener(self, listener):
+        """Call listener(keys) with the keys the store evicts or expires, once they are removed
+
+        The listener is called without holding the lock of the store, so it
+        may call the store, and a key may have been put again by then
+        """
+        self._removal_listeners.append(listener)
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def items(self):
+        with self._lock:
+            if not self._expiration_times:
+                return self._data.copy().items()
+            now = self._clock()
+            return {key: value for key, value in self._data.items()
+                    if self._expiration_times.get(key, math.inf) > now}.items()
+
+    def __len__(self):
+        return len(self._data)
+
+    def scan(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        # Cursors are insertion sequence numbers, as in InMemoryStore, so the keys evicted or expired
+        # during a scan do not make it skip others
+        with self._lock:
+            now = self._clock()
+            keys, next_cursor = self._order.page(cursor, limit)
+            return [(key, self._data[key]) for key in keys
+                    if self._expiration_times.get(key, math.inf) > now], next_cursor
+
+    def expiration_time(self, key):
+        """The time at which a key expires, or None if it does not
+        """
+        return self._expiration_times.get(key)
+
+    def expire(self, now=None):
+        """Remove the keys whose expiration time has passed, returning how many were removed
+        """
+        try:
+            return self._expire(now)
+        finally:
+            self._notify_removals()
+
+    def _expire(self, now):
+        with self._lock:
+            now = self._clock() if now is None else now
+            removed = 0
+            for key in self._wheel.advance(now):
+                expires_at = self._expiration_times.get(key)
+                if expires_at is None:
+                    continue
+                if expires_at > now:
+                    self._wheel.schedule(key, expires_at)
+                    continue
+                self._remove(key, removed=True)
+                removed += 1
+            self.expirations += removed
+            return removed
+
+    def stats(self):
+        """The size and the counters of the store, as a dictionary
+        """
+        return {
+            'keys': len(self._data),
+            'bytes': self.size_bytes,
+            'max_bytes': self.max_bytes,
+            'expiring_keys': len(self._expiration_times),
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def close(self):
+        self._closed.set()
+
+    def _size(self, key, value):
+        size = sys.getsizeof(key) + sys.getsizeof(value) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            raise KeyValueStoreException("The key-value pair does not fit in the memory budget of the store",
+                                         key=key, max_bytes=self.max_bytes)
+        return size
+
+    def _evict(self):
+        while self.size_bytes > self.max_bytes:
+            self._remove(self.policy.victim(), removed=True)
+            self.evictions += 1
+
+    def _put(self, key, value, size, expires_at):
+        previous_size = self._sizes.get(key)
+        if previous_size is None:
+            self.policy.add(key)
+            self._order.add(key)
+        else:
+            self.size_bytes -= previous_size
+            self.policy.touch(key)
+        self._data[key] = value
+        self._sizes[key] = size
+        self.size_bytes += size
+
+        if expires_at is not None:
+            self._expiration_times[key] = expires_at
+            self._wheel.schedule(key, expires_at)
+        elif self._expiration_times.pop(key, None) is not None:
+            self._wheel.cancel(key)
+
+    def _remove(self, key, removed=False):
+        """Remove a key, queuing it for the removal listeners when the store removed it on its own
+        """
+        if removed and self._removal_listeners:
+            self._removed.append(key)
+        del self._data[key]
+        self._order.compact()
+        self.size_bytes -= self._sizes.pop(key)
+        self.policy.remove(key)
+        if self._expiration_times.pop(key, None) is not None:
+            self._wheel.cancel(key)
+
+    def _notify_removals(self):
+        if not self._removed:
+            return
+        with self._lock:
+            removed, self._removed = self._removed, []
+        if removed:
+            for listener in self._removal_listeners:
+                listener(removed)
+
+    def _start_expiry_thread(self):
+        with self._lock:
+            if self._expiry_thread is not None:
+                return
+            self._expiry_thread = threading.Thread(target=self._run_expiry, name="capped-store-expiry", daemon=True)
+        self._expiry_thread.start()
+
+    def _run_expiry(self):
+        while not self._closed.wait(self._wheel.resolution):
+            self.expire()
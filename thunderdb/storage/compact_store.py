@@ -0,0 +1,274 @@
+import array
+import bisect
+import re
+import struct
+import threading
+
+from thunderdb.storage.key_value_store import KeyValueStore, DEFAULT_SCAN_LIMIT
+from thunderdb.storage.scan_order import ScanOrder
+
+# Keys and values in their canonical textual UUID form are stored as 16 raw bytes
+UUID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\Z')
+SLOT_SIZE = 16
+
+# The smallest number of slots in the hash table, which is always a power of two
+MIN_CAPACITY = 1024
+
+# Index slots which do not point to any entry
+EMPTY = -1
+
+# The kind of each entry, telling how its 16-byte value slot is encoded
+DELETED = 0
+UUID_VALUE = 1
+ARENA_VALUE = 2
+
+# The number of unreferenced arena bytes which is tolerated before the table is rebuilt
+MAX_ARENA_GARBAGE = 1024 * 1024
+
+# Scan cursors hold the insertion sequence number of a key of either the table or the overflow dictionary
+TABLE_CURSOR = 't'
+OVERFLOW_CURSOR = 'o'
+
+# The value slot of an ARENA_VALUE entry holds the offset and length of the value in the arena
+ARENA_POINTER = struct.Struct('<QQ')
+
+
+class CompactStore(KeyValueStore):
+    """A memory-compact implementation of the KeyValueStore for UUID-shaped keys
+
+    Rather than keeping two Python strings and a dictionary slot per entry,
+    keys in the canonical UUID form are stored as 16 raw bytes in one
+    contiguous bytearray. Their values sit in a parallel bytearray: UUID
+    values as 16 raw bytes as well, any other string as an (offset, length)
+    pointer into a variable-length arena. An open-addressing hash table of
+    32-bit integers maps each key to the position of its entry.
+
+    Deleted entries are only marked as such, and overwritten arena values
+    are left in place; both are reclaimed when the table is resized. Keys
+    which are not UUIDs and values which are not strings do not fit this
+    layout, so they are kept in a regular dictionary instead.
+
+    Every entry also holds the insertion sequence number of its key, which
+    it keeps when the table is resized, and the scan cursors are these
+    numbers (see ScanOrder, which orders the keys of the dictionary), so
+    deleting keys during a scan does not make it skip others.
+    """
+    def __init__(self, capacity=MIN_CAPACITY):
+        self._lock = threading.RLock()
+        self._overflow = dict()
+        self._overflow_order = ScanOrder(self._overflow)
+        self._next_sequence = 1
+        self._allocate(capacity)
+
+    def put(self, key, value):
+        with self._lock:
+            self._put(key, value)
+
+    def put_batch(self, data):
+        with self._lock:
+            for key, value in data.items():
+                self._put(key, value)
+
+    def put_batch_if_absent(self, data):
+        with self._lock:
+            data = {key: value for key, value in data.items() if self.get(key) is None}
+            for key, value in data.items():
+                self._put(key, value)
+        return data
+
+    def get(self, key):
+        key_bytes = self._encode_uuid(key)
+        with self._lock:
+            if key_bytes is not None:
+                entry = self._find(key_bytes)[1]
+                if entry != EMPTY and self._kinds[entry] != DELETED:
+                    return self._decode_value(entry)
+            return self._overflow.get(key, None)
+
+    def delete(self, key):
+        key_bytes = self._encode_uuid(key)
+        with self._lock:
+            if key_bytes is not None:
+                self._delete(key_bytes)
+            self._remove_overflow(key)
+
+    def items(self):
+        with self._lock:
+            items = [(self._decode_key(entry), self._decode_value(entry))
+                     for entry in range(self._num_entries) if self._kinds[entry] != DELETED]
+            items.extend(self._overflow.items())
+        return items
+
+    def scan(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        location, sequence = (cursor[0], cursor[1:]) if cursor else (TABLE_CURSOR, None)
+        items = []
+        with self._lock:
+            if location == TABLE_CURSOR:
+                entry = bisect.bisect_right(self._sequences, int(sequence) if sequence else 0)
+                while entry < self._num_entries and len(items) < limit:
+                    if self._kinds[entry] != DELETED:
+                        items.append((self._decode_key(entry), self._decode_value(entry)))
+                    entry += 1
+                if len(items) == limit:
+                    return items, TABLE_CURSOR + str(self._sequences[entry - 1])
+                sequence = None
+
+            keys, next_sequence = self._overflow_order.page(sequence, limit - len(items))
+            items.extend((key, self._overflow[key]) for key in keys)
+        return items, OVERFLOW_CURSOR + next_sequence if next_sequence is not None else None
+
+    def __len__(self):
+        return self._size + len(self._overflow)
+
+    def _allocate(self, capacity):
+        """Reset the store to an empty table with the given number of slots
+        """
+        self._index = array.array('i', [EMPTY]) * capacity
+        self._mask = capacity - 1
+        self._keys = bytearray()
+        self._values = bytearray()
+        self._kinds = bytearray()
+        self._sequences = array.array('q')
+        self._arena = bytearray()
+        self._arena_garbage = 0
+        self._num_entries = 0
+        self._size = 0
+
+    def _put(self, key, value):
+        key_bytes = self._encode_uuid(key)
+        if key_bytes is None or not isinstance(value, str):
+            if key_bytes is not None:
+                self._delete(key_bytes)
+            if key not in self._overflow:
+                self._overflow_order.add(key)
+            self._overflow[key] = value
+            return
+
+        if self._overflow:
+            self._remove_overflow(key)
+
+        value_bytes = self._encode_uuid(value)
+        if value_bytes is not None:
+            kind = UUID_VALUE
+        else:
+            kind = ARENA_VALUE
+            encoded_value = value.encode()
+            value_bytes = ARENA_POINTER.pack(len(self._arena), len(encoded_value))
+            self._arena += encoded_value
+
+        slot, entry = self._find(key_bytes)
+        if entry != EMPTY:
+            # Overwrite the existing entry in place, reviving it if it was deleted
+            if self._kinds[entry] == DELETED:
+                self._size += 1
+            else:
+                self._release(entry)
+            self._values[entry * SLOT_SIZE:(entry + 1) * SLOT_SIZE] = value_bytes
+            self._kinds[entry] = kind
+
+            if self._arena_garbage > max(MAX_ARENA_GARBAGE, len(self._arena) // 2):
+                self._resize()
+            return
+
+        self._keys += key_bytes
+        self._values += value_bytes
+        self._kinds.append(kind)
+        self._sequences.append(self._next_sequence)
+        self._next_sequence += 1
+        self._index[slot] = self._num_entries
+        self._num_entries += 1
+        self._size += 1
+
+        # Keep the load factor of the table under 2/3
+        if 3 * self._num_entries >= 2 * len(self._index):
+            self._resize()
+
+    def _delete(self, key_bytes):
+        entry = self._find(key_bytes)[1]
+        if entry != EMPTY and self._kinds[entry] != DELETED:
+            self._release(entry)
+            self._kinds[entry] = DELETED
+            self._size -= 1
+
+    def _remove_overflow(self, key):
+        if key in self._overflow:
+            del self._overflow[key]
+            self._overflow_order.compact()
+
+    def _release(self, entry):
+        """Account for the arena bytes of an entry whose value is being dropped
+        """
+        if self._kinds[entry] == ARENA_VALUE:
+            self._arena_garbage += ARENA_POINTER.unpack_from(self._values, entry * SLOT_SIZE)[1]
+
+    def _find(self, key_bytes):
+        """Find the slot of a key in the index, returning (slot, entry)
+
+        The entry is EMPTY when the key is not in the table, in which case
+        the slot is where the key should be inserted
+        """
+        index, keys, mask = self._index, self._keys, self._mask
+        slot = hash(key_bytes) & mask
+        while True:
+            entry = index[slot]
+            if entry == EMPTY or keys[entry * SLOT_SIZE:(entry + 1) * SLOT_SIZE] == key_bytes:
+                return slot, entry
+            slot = (slot + 1) & mask
+
+    def _resize(self):
+        """Rebuild the table, dropping deleted entries and unreferenced arena values
+
+        The new table holds at most half as many entries as it has slots, and
+        every entry keeps its sequence number
+        """
+        capacity = MIN_CAPACITY
+        while capacity < 2 * self._size:
+            capacity *= 2
+
+        keys, values, kinds, sequences, arena = self._keys, self._values, self._kinds, self._sequences, self._arena
+        num_entries = self._num_entries
+        self._allocate(capacity)
+
+        for entry in range(num_entries):
+            kind = kinds[entry]
+            if kind == DELETED:
+                continue
+
+            key_bytes = bytes(keys[entry * SLOT_SIZE:(entry + 1) * SLOT_SIZE])
+            value_bytes = values[entry * SLOT_SIZE:(entry + 1) * SLOT_SIZE]
+            if kind == ARENA_VALUE:
+                offset, length = ARENA_POINTER.unpack(value_bytes)
+                value_bytes = ARENA_POINTER.pack(len(self._arena), length)
+                self._arena += arena[offset:offset + length]
+
+            slot = self._find(key_bytes)[0]
+            self._index[slot] = self._num_entries
+            self._keys += key_bytes
+            self._values += value_bytes
+            self._kinds.append(kind)
+            self._sequences.append(sequences[entry])
+            self._num_entries += 1
+            self._size += 1
+
+    def _decode_key(self, entry):
+        return self._decode_uuid(self._keys[entry * SLOT_SIZE:(entry + 1) * SLOT_SIZE])
+
+    def _decode_value(self, entry):
+        value_bytes = self._values[entry * SLOT_SIZE:(entry + 1) * SLOT_SIZE]
+        if self._kinds[entry] == UUID_VALUE:
+            return self._decode_uuid(value_bytes)
+        offset, length = ARENA_POINTER.unpack(value_bytes)
+        return self._arena[offset:offset + length].decode()
+
+    @staticmethod
+    def _encode_uuid(text):
+        """Returns the 16 bytes of a string in the canonical UUID form, or None for any other value
+        """
+        if isinstance(text, str) and len(text) == 36 and UUID_PATTERN.match(text):
+            return bytes.fromhex(text.replace('-', ''))
+        return None
+
+    @staticmethod
+    def _decode_uuid(uuid_bytes):
+        digits = uuid_bytes.hex()
+        return '{}-{}-{}-{}-{}'.format(digits[:8], digits[8:12], digits[12:16], digits[16:20], digits[20:])
@@ -0,0 +1,212 @@
+import collections
+import random
+from abc import abstractmethod
+
+# The number of keys drawn at random by the sampled LRU policy to pick the one to evict
+DEFAULT_EVICTION_SAMPLES = 5
+
+
+class EvictionPolicy(object):
+    """Decide which key a CappedStore evicts once it is over its memory budget
+
+    The store tells its policy about every key it adds, every key it reads
+    or overwrites (touch) and every key it removes, and asks it for the key
+    to evict next. Every one of these calls takes constant time. Policies
+    are not thread-safe: the store calls them under its lock.
+    """
+    @abstractmethod
+    def add(self, key):
+        """Track a key which was added to the store
+        """
+        pass
+
+    @abstractmethod
+    def touch(self, key):
+        """Record an access to a key, read or overwritten
+        """
+        pass
+
+    @abstractmethod
+    def remove(self, key):
+        """Stop tracking a key which was removed from the store
+        """
+        pass
+
+    @abstractmethod
+    def victim(self):
+        """The key to evict next, or None if the policy tracks no key
+        """
+        pass
+
+
+class LRUPolicy(EvictionPolicy):
+    """Evict the least recently used key
+
+    The keys are kept in an ordered dictionary, from the least to the most
+    recently used
+    """
+    def __init__(self):
+        self._keys = collections.OrderedDict()
+
+    def add(self, key):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+
+    def touch(self, key):
+        if key in self._keys:
+            self._keys.move_to_end(key)
+
+    def remove(self, key):
+        self._keys.pop(key, None)
+
+    def victim(self):
+        return next(iter(self._keys), None)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class LFUPolicy(EvictionPolicy):
+    """Evict the least frequently used key, and the least recently used one among them
+
+    The keys used the same number of times share a bucket, an ordered
+    dictionary, and the buckets are linked in increasing order of use
+    count, so a key moves to the next bucket, and the least used key is
+    found, in constant time
+    """
+    def __init__(self):
+        self._counts = {}
+        self._buckets = {}
+        self._next = {}
+        self._previous = {}
+        self._head = None
+
+    def add(self, key):
+        if key in self._counts:
+            return self.touch(key)
+        if 1 not in self._buckets:
+            self._link(None, 1)
+        self._buckets[1][key] = None
+        self._counts[key] = 1
+
+    def touch(self, key):
+        count = self._counts.get(key)
+        if count is None:
+            return
+        if count + 1 not in self._buckets:
+            self._link(count, count + 1)
+        self._buckets[count + 1][key] = None
+        self._counts[key] = count + 1
+        self._discard(key, count)
+
+    def remove(self, key):
+        count = self._counts.pop(key, None)
+        if count is not None:
+            self._discard(key, count)
+
+    def victim(self):
+        if self._head is None:
+            return None
+        return next(iter(self._buckets[self._head]))
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _link(self, count, new_count):
+        """Add the bucket of new_count right after the bucket of count, or first when count is None
+        """
+        following = self._head if count is None else self._next[count]
+        if count is None:
+            self._head = new_count
+        else:
+            self._next[count] = new_count
+        self._previous[new_count] = count
+        self._next[new_count] = following
+        if following is not None:
+            self._previous[following] = new_count
+        self._buckets[new_count] = collections.OrderedDict()
+
+    def _discard(self, key, count):
+        """Take a key out of the bucket of count, and drop the bucket once it is empty
+        """
+        bucket = self._buckets[count]
+        del bucket[key]
+        if bucket:
+            return
+
+        previous, following = self._previous.pop(count), self._next.pop(count)
+        if previous is None:
+            self._head = following
+        else:
+            self._next[previous] = following
+        if following is not None:
+            self._previous[following] = previous
+        del self._buckets[count]
+
+
+class SampledLRUPolicy(EvictionPolicy):
+    """Evict the least recently used of a few keys drawn at random, which approximates LRU
+
+    Only the time of the last use of every key is kept, in a dictionary,
+    along with an array of the keys to draw them from, so using a key does
+    not reorder anything. This is the approximation of LRU Redis makes
+    """
+    def __init__(self, samples=DEFAULT_EVICTION_SAMPLES, seed=None):
+        if samples < 1:
+            raise ValueError("The sampled LRU policy needs at least one sample, got {}".format(samples))
+        self.samples = samples
+        self._keys = []
+        self._positions = {}
+        self._last_used = {}
+        self._clock = 0
+        self._random = random.Random(seed)
+
+    def add(self, key):
+        if key not in self._positions:
+            self._positions[key] = len(self._keys)
+            self._keys.append(key)
+        self.touch(key)
+
+    def touch(self, key):
+        if key in self._positions:
+            self._clock += 1
+            self._last_used[key] = self._clock
+
+    def remove(self, key):
+        position = self._positions.pop(key, None)
+        if position is None:
+            return
+        del self._last_used[key]
+        # Move the last key into the hole left by the removed one
+        last_key = self._keys.pop()
+        if last_key != key:
+            self._keys[position] = last_key
+            self._positions[last_key] = position
+
+    def victim(self):
+        if not self._keys:
+            return None
+        draws = [self._keys[self._random.randrange(len(self._keys))] for _ in range(self.samples)]
+        return min(draws, key=self._last_used.__getitem__)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+# The eviction policies which can be selected for a CappedStore
+EVICTION_POLICIES = {
+    'lru': LRUPolicy,
+    'lfu': LFUPolicy,
+    'sampled-lru': SampledLRUPolicy,
+}
+
+DEFAULT_EVICTION_POLICY = 'lru'
+
+
+def create_eviction_policy(name=DEFAULT_EVICTION_POLICY):
+    """Create the EvictionPolicy registered under the given name
+    """
+    if name not in EVICTION_POLICIES:
+        raise ValueError("Unknown eviction policy '{}', expected one of: {}".format(
+            name, ", ".join(sorted(EVICTION_POLICIES))))
+    return EVICTION_POLICIES[name]()
@@ -0,0 +1,238 @@
+import base64
+import hashlib
+import math
+import threading
+import uuid
+
+import numpy as np
+
+from thunderdb.storage.key_value_store import KeyValueStore, DEFAULT_SCAN_LIMIT
+from thunderdb.storage.in_memory_store import InMemoryStore
+
+# The number of keys a key filter is sized for by default, and the rate of
+# false positives it has once it holds that many keys. A filter holding more
+# keys keeps working, with more false positives
+DEFAULT_FILTER_CAPACITY = 1000000
+DEFAULT_FILTER_ERROR_RATE = 0.01
+
+# The largest count of a counter of a CountingBloomFilter: a counter which
+# reached it is never decremented again, as it may have overflowed
+MAX_COUNT = 255
+
+# The number of changes of the bits of a filter kept to answer the other
+# nodes incrementally (see CountingBloomFilter.delta). A node which is
+# further behind is sent the whole filter again
+MAX_CHANGES = 100000
+
+
+def filter_positions(key, size, num_hashes):
+    """The positions of the counters (or bits) of a key in a filter of the given size
+
+    The positions are derived from the two halves of a 128-bit BLAKE2 hash
+    of the key (the double hashing of Kirsch and Mitzenmacher), which every
+    node computes the same way
+    """
+    value = int.from_bytes(hashlib.blake2b(key.encode('utf-8', 'surrogatepass'), digest_size=16).digest(), 'little')
+    position, step = value % size, (value >> 64) % size or 1
+    positions = [position]
+    for _ in range(num_hashes - 1):
+        # Adding the step modulo the size, without the cost of a division
+        position += step
+        if position >= size:
+            position -= size
+        positions.append(position)
+    return positions
+
+
+class CountingBloomFilter(object):
+    """A Bloom filter of the keys of a store, whose keys can be removed as well
+
+    Every key increments num_hashes counters of a byte each, and removing
+    it decrements them, so the filter tells that a key is definitely not
+    in the store when one of its counters is 0. The filter is sized for
+    `capacity` keys with an `error_rate` of false positives.
+
+    The other nodes only need to know which counters are not 0: every
+    change of that bit of a counter gets a new version, and the latest
+    MAX_CHANGES changes are kept, so a node which saw an earlier version
+    is sent the bits which changed since then instead of the whole filter.
+    The versions are only comparable within a generation of the filter, a
+    random id, so the nodes which knew the filter of a previous process of
+    the node are sent the whole filter. This is not thread-safe: the
+    callers hold a lock around every change.
+    """
+    def __init__(self, capacity=DEFAULT_FILTER_CAPACITY, error_rate=DEFAULT_FILTER_ERROR_RATE):
+        if capacity < 1:
+            raise ValueError("The capacity of a key filter must be at least 1, got {}".format(capacity))
+        if not 0 < error_rate < 1:
+            raise ValueError("The error rate of a key filter must be between 0 and 1, got {}".format(error_rate))
+
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.generation = uuid.uuid4().hex
+        self._counters = bytearray(self.size)
+        self._changes = []
+        self._first_version = 1
+
+    @property
+    def version(self):
+        return self._first_version + len(self._changes) - 1
+
+    def add(self, key):
+        counters = self._counters
+        for position in filter_positions(key, self.size, self.num_hashes):
+            count = counters[position]
+            if count == 0:
+                self._changes.append(position)
+            if count < MAX_COUNT:
+                counters[position] = count + 1
+        self._trim()
+
+    def remove(self, key):
+        """Remove a key which was added, decrementing its counters
+        """
+        counters = self._counters
+        for position in filter_positions(key, self.size, self.num_hashes):
+            count = counters[position]
+            if 0 < count < MAX_COUNT:
+                counters[position] = count - 1
+                if count == 1:
+                    self._changes.append(position)
+        self._trim()
+
+    def __contains__(self, key):
+        counters = self._counters
+        for position in filter_positions(key, self.size, self.num_hashes):
+            if not counters[position]:
+                return False
+        return True
+
+    def delta(self, since=0, generation=None):
+        """The changes of the filter since the given version, as a JSON-serializable dictionary
+
+        When the changes since that version of the given generation of the
+        filter are still known, the positions of the bits which were set and
+        cleared since then are returned.
+        Otherwise, the whole filter is returned as 'bits', the bits of the
+        counters packed as in numpy.packbits and encoded in base64
+        """
+        delta = {'generation': self.generation, 'version': self.version, 'size': self.size,
+                 'num_hashes': self.num_hashes}
+        if generation != self.generation or since < self._first_version - 1 or since > self.version:
+            bits = np.packbits(np.frombuffer(self._counters, dtype=np.uint8) > 0)
+            delta['bits'] = base64.b64encode(bits.tobytes()).decode('ascii')
+            return delta
+
+        changed = set(self._changes[since - self._first_version + 1:])
+        delta['set'] = sorted(position for position in changed if self._counters[position])
+        delta['cleared'] = sorted(position for position in changed if not self._counters[position])
+        return delta
+
+    def _trim(self):
+        if len(self._changes) > MAX_CHANGES:
+            # Drop the older half at once, so trimming costs a constant time per change
+            dropped = len(self._changes) // 2
+            del self._changes[:dropped]
+            self._first_version += dropped
+
+
+class BloomFilter(object):
+    """The copy of the key filter of another node, kept up to date from its deltas (see CountingBloomFilter.delta)
+    """
+    def __init__(self, delta):
+        self.generation = delta['generation']
+        self.size = delta['size']
+        self.num_hashes = delta['num_hashes']
+        self.version = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        self.apply(delta)
+
+    def apply(self, delta):
+        if 'bits' in delta:
+            self._bits = bytearray(base64.b64decode(delta['bits']))
+        else:
+            for position in delta['set']:
+                self._bits[position >> 3] |= 0x80 >> (position & 7)
+            for position in delta['cleared']:
+                self._bits[position >> 3] &= ~(0x80 >> (position & 7)) & 0xff
+        self.version = delta['version']
+
+    def add(self, key):
+        for position in filter_positions(key, self.size, self.num_hashes):
+            self._bits[position >> 3] |= 0x80 >> (position & 7)
+
+    def __contains__(self, key):
+        bits = self._bits
+        for position in filter_positions(key, self.size, self.num_hashes):
+            if not bits[position >> 3] & (0x80 >> (position & 7)):
+                return False
+        return True
+
+
+class FilteredStore(KeyValueStore):
+    """A KeyValueStore which keeps a CountingBloomFilter of its keys, for the other nodes
+
+    The key-value pairs are held by another KeyValueStore (an InMemoryStore
+    by default), which serves every operation. Writing a new key adds it to
+    the filter, and deleting it removes it, so the other nodes can tell the
+    keys the store does not hold without asking it (see PeerFilters). The
+    keys the inner store evicts or expires by itself stay in the filter,
+    which only makes it answer "maybe" for them.
+    """
+    def __init__(self, store=None, capacity=DEFAULT_FILTER_CAPACITY, error_rate=DEFAULT_FILTER_ERROR_RATE):
+        self.store = store if store is not None else InMemoryStore()
+        self.supports_expiration = getattr(self.store, 'supports_expiration', False)
+        self.key_filter = CountingBloomFilter(capacity, error_rate)
+        self._lock = threading.Lock()
+        for key, _ in self.store.items():
+            self.key_filter.add(key)
+
+    def put(self, key, value, **options):
+        with self._lock:
+            if self.store.get(key) is None:
+                self.key_filter.add(key)
+            self.store.put(key, value, **options)
+
+    def put_batch(self, data, **options):
+        with self._lock:
+            for key in data:
+                if self.store.get(key) is None:
+                    self.key_filter.add(key)
+            self.store.put_batch(data, **options)
+
+    def put_batch_if_absent(self, data, **options):
+        with self._lock:
+            data = self.store.put_batch_if_absent(data, **options)
+            for key in data:
+                self.key_filter.add(key)
+        return data
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def delete(self, key):
+        with self._lock:
+            if self.store.get(key) is not None:
+                self.key_filter.remove(key)
+            self.store.delete(key)
+
+    def key_filter_delta(self, since=0, generation=None):
+        """The changes of the key filter since the given version (see CountingBloomFilter.delta)
+        """
+        with self._lock:
+            return self.key_filter.delta(since, generation)
+
+    def items(self):
+        return self.store.items()
+
+    def __len__(self):
+        return len(self.store)
+
+    def scan(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        return self.store.scan(cursor, limit)
+
+    def iter_pages(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        return self.store.iter_pages(cursor, limit)
+
+    def range_scan(self, start=None, end=None, limit=DEFAULT_SCAN_LIMIT, cursor=None):
+        return self.store.range_scan(start, end, limit, cursor)
@@ -1,19 +1,69 @@
-from thunderdb.storage.key_value_store import KeyValueStore
+import itertools
+import threading
+
+from thunderdb.storage.key_value_store import KeyValueStore, DEFAULT_SCAN_LIMIT
+from thunderdb.storage.scan_order import ScanOrder
+
+# Stands for a key deleted between the page of a scan and the read of its value
+_MISSING = object()
 
 
 class InMemoryStore(KeyValueStore):
     """An in-memory implementation of the KeyValueStore
 
-    In this class, storage is handled by Python's built-in dictionary
+    In this class, storage is handled by Python's built-in dictionary.
+    Scan cursors are the insertion sequence numbers of the keys (see
+    ScanOrder), so deleting keys during a scan does not make it skip others.
+    Reads and writes go straight to the dictionary, new keys being listed
+    in the scan order as well, while scans, and the compactions of the scan
+    order which deletes trigger, hold a lock.
     """
     def __init__(self):
         self.data = dict()
+        self._order = ScanOrder(self.data)
+        self._lock = threading.Lock()
 
     def put(self, key, value):
+        # The key is listed in the scan order once it is in the dictionary, as a compaction drops the other keys
+        is_new = key not in self.data
         self.data[key] = value
+        if is_new:
+            self._order.add(key)
+
+    def put_batch(self, data):
+        new_keys = [key for key in data if key not in self.data]
+        self.data.update(data)
+        for key in new_keys:
+            self._order.add(key)
+
+    def put_batch_if_absent(self, data):
+        stored = {}
+        for key, value in data.items():
+            # setdefault checks and stores the key at once, so a concurrent put of the key is never overwritten
+            if key not in self.data and self.data.setdefault(key, value) is value:
+                self._order.add(key)
+                stored[key] = value
+        return stored
 
     def get(self, key):
         return self.data.get(key, None)
 
     def delete(self, key):
         self.data.pop(key, None)
+        if self._order.is_sparse():
+            with self._lock:
+                self._order.compact()
+
+    def items(self):
+        # Copying a dictionary is atomic, unlike iterating over it
+        return self.data.copy().items()
+
+    def __len__(self):
+        return len(self.data)
+
+    def scan(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        with self._lock:
+            keys, next_cursor = self._order.page(cursor, limit)
+        get = self.data.get
+        return [(key, value) for key, value in zip(keys, map(get, keys, itertools.repeat(_MISSING)))
+                if value is not _MISSING], next_cursor
@@ -1,4 +1,9 @@
+import heapq
 from abc import abstractmethod
+from operator import itemgetter
+
+# The number of key-value pairs returned by a single scan by default
+DEFAULT_SCAN_LIMIT = 1000
 
 
 class KeyValueStore(object):
@@ -11,6 +16,25 @@ class KeyValueStore(object):
         """
         pass
 
+    def put_batch(self, data):
+        """Store every key-value pair of a dictionary into the store
+
+        Implementations should override this when they can store a batch
+        more efficiently than one pair at a time
+        """
+        for key, value in data.items():
+            self.put(key, value)
+
+    def put_batch_if_absent(self, data):
+        """Store the key-value pairs of a dictionary whose keys are not in the store, returning the pairs stored
+
+        Implementations should override this to check and store the pairs
+        under their lock, so that no write of the same keys comes in between
+        """
+        data = {key: value for key, value in data.items() if self.get(key) is None}
+        self.put_batch(data)
+        return data
+
     @abstractmethod
     def get(self, key):
         """Get the value associated with a particular key
@@ -22,3 +46,58 @@ class KeyValueStore(object):
         """Delete the given key from the store
         """
         pass
+
+    @abstractmethod
+    def items(self):
+        """Get a point-in-time copy of every key-value pair in the store
+
+        The copy is safe to iterate over while the store is being modified
+        """
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        """Get the number of key-value pairs in the store
+        """
+        pass
+
+    @abstractmethod
+    def scan(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        """Get a page of at most `limit` key-value pairs, starting at the given cursor
+
+        Returns a list of (key, value) pairs and the cursor of the next page,
+        which is None once the whole store has been scanned. Cursors are
+        opaque strings, and a scan with no cursor starts from the beginning.
+        A scan is weakly consistent: pairs added or removed while the store is
+        being scanned may or may not be returned.
+        """
+        pass
+
+    def iter_pages(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        """Iterate over the pages of key-value pairs of the whole store, starting at the given cursor
+
+        Implementations should override this when they can keep their place
+        between pages more efficiently than by resuming from a cursor
+        """
+        while True:
+            items, cursor = self.scan(cursor, limit)
+            yield items
+            if cursor is None:
+                return
+
+    def range_scan(self, start=None, end=None, limit=DEFAULT_SCAN_LIMIT, cursor=None):
+        """Get at most `limit` key-value pairs whose key is in the range [start, end), in the order of their keys
+
+        A scan with a cursor resumes after the key given as cursor. Returns a
+        list of (key, value) pairs and the cursor of the next page, which is
+        the last key of the page, or None once the range has been scanned.
+
+        This implementation goes through every key-value pair of the store
+        on every call. Stores which keep their keys in order should override
+        it (see OrderedStore)
+        """
+        items = [(key, value) for key, value in self.items()
+                 if (start is None or key >= start) and (end is None or key < end)
+                 and (cursor is None or key > cursor)]
+        items = heapq.nsmallest(limit, items, key=itemgetter(0))
+        return items, items[-1][0] if len(items) == limit else None
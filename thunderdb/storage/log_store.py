@@ -0,0 +1,406 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from thunderdb.exceptions.errors import KeyValueStoreException
+from thunderdb.storage.key_value_store import KeyValueStore, DEFAULT_SCAN_LIMIT
+from thunderdb.storage.in_memory_store import InMemoryStore
+
+# When the write-ahead log is forced to disk:
+#   - always: every write waits until it is on disk (writes arriving together share one fsync)
+#   - interval: the log is forced to disk every fsync_interval seconds
+#   - never: the log is handed to the operating system, which decides when to write it
+FSYNC_ALWAYS = 'always'
+FSYNC_INTERVAL = 'interval'
+FSYNC_NEVER = 'never'
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+DEFAULT_FSYNC_INTERVAL = 1.0
+
+# The size the write-ahead log can reach before a checkpoint is taken
+DEFAULT_CHECKPOINT_BYTES = 64 * 1024 * 1024
+
+# The number of key-value pairs written in a single checkpoint block
+CHECKPOINT_BLOCK_SIZE = 65536
+
+# The kinds of block found in the log and checkpoint files. The values of
+# the blocks of pairs which expire are the JSON of [value, expires_at]
+PUT_BLOCK = 1
+PUT_JSON_BLOCK = 2
+DELETE_BLOCK = 3
+PUT_EXPIRING_BLOCK = 4
+
+# Every block starts with its kind, the number of keys, the size of the keys
+# and of the values, and the CRC-32 of both. Keys and values are stored as
+# UTF-8 strings separated by a 0xff byte, which never appears in UTF-8.
+BLOCK_HEADER = struct.Struct('<BIIII')
+SEPARATOR = b'\xff'
+
+SEGMENT_PREFIX = 'wal-'
+SEGMENT_SUFFIX = '.log'
+CHECKPOINT_PREFIX = 'checkpoint-'
+CHECKPOINT_SUFFIX = '.dat'
+TEMPORARY_SUFFIX = '.tmp'
+
+
+class LogStore(KeyValueStore):
+    """A durable implementation of the KeyValueStore, backed by an append-only log
+
+    The key-value pairs are served from an in-memory index (any other
+    KeyValueStore, an InMemoryStore by default), while every change is
+    appended to a write-ahead log in the given directory. A background
+    thread writes the pending changes in blocks (group commit) and forces
+    them to disk according to the fsync policy.
+
+    Once the log grows past checkpoint_bytes, a new log segment is started
+    and the content of the index is written to a checkpoint file, after
+    which the older segments are deleted. On startup the latest checkpoint
+    is memory-mapped and loaded into the index block by block, and only the
+    log segments written after it are replayed.
+
+    When the index can expire its keys (see CappedStore), so can the store:
+    the expiration times are written to the log and the checkpoints, and
+    the pairs which expired in the meantime are not recovered. The keys the
+    index evicts are not logged, so they are recovered and evicted again.
+    """
+    def __init__(self, directory, index=None,
+                 fsync=FSYNC_INTERVAL,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL,
+                 checkpoint_bytes=DEFAULT_CHECKPOINT_BYTES):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy '{}', expected one of: {}".format(
+                fsync, ", ".join(FSYNC_POLICIES)))
+
+        self.directory = directory
+        self.index = index if index is not None else InMemoryStore()
+        self.supports_expiration = getattr(self.index, 'supports_expiration', False)
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.checkpoint_bytes = checkpoint_bytes
+
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition(self._lock)
+        self._io_lock = threading.Lock()
+        self._pending = []
+        self._sequence = 0
+        self._durable_sequence = 0
+        self._closed = False
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._recover()
+
+        self._flusher = threading.Thread(target=self._run_flusher, name="log-store-flusher", daemon=True)
+        self._flusher.start()
+
+    def put(self, key, value, expires_at=None):
+        with self._lock:
+            if expires_at is None:
+                self.index.put(key, value)
+                self._append([(PUT_BLOCK, key, value)])
+            else:
+                self.index.put(key, value, expires_at=expires_at)
+                self._append([(PUT_EXPIRING_BLOCK, key, [value, expires_at])])
+
+    def put_batch(self, data, expires_at=None):
+        with self._lock:
+            if expires_at is None:
+                self.index.put_batch(data)
+                self._append([(PUT_BLOCK, key, value) for key, value in data.items()])
+            else:
+                self.index.put_batch(data, expires_at=expires_at)
+                self._append([(PUT_EXPIRING_BLOCK, key, [value, expires_at]) for key, value in data.items()])
+
+    def put_batch_if_absent(self, data, expires_at=None):
+        with self._lock:
+            if expires_at is None:
+                data = self.index.put_batch_if_absent(data)
+                operations = [(PUT_BLOCK, key, value) for key, value in data.items()]
+            else:
+                data = self.index.put_batch_if_absent(data, expires_at=expires_at)
+                operations = [(PUT_EXPIRING_BLOCK, key, [value, expires_at]) for key, value in data.items()]
+            if operations:
+                self._append(operations)
+        return data
+
+    def get(self, key):
+        return self.index.get(key)
+
+    def delete(self, key):
+        with self._lock:
+            self.index.delete(key)
+            self._append([(DELETE_BLOCK, key, None)])
+
+    def items(self):
+        return self.index.items()
+
+    def __len__(self):
+        return len(self.index)
+
+    def scan(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        return self.index.scan(cursor, limit)
+
+    def iter_pages(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        return self.index.iter_pages(cursor, limit)
+
+    def range_scan(self, start=None, end=None, limit=DEFAULT_SCAN_LIMIT, cursor=None):
+        return self.index.range_scan(start, end, limit, cursor)
+
+    def checkpoint(self):
+        """Start a new log segment and write the content of the index to a checkpoint
+
+        Once the checkpoint is on disk, the log segments it covers are deleted
+        """
+        with self._io_lock:
+            with self._lock:
+                operations, self._pending = self._pending, []
+                sequence = self._sequence
+                items = self.index.items()
+            expiration_time = self.index.expiration_time if self.supports_expiration else None
+
+            self._write(operations)
+            self._sync()
+            self._segment.close()
+            self._segment_id += 1
+            self._open_segment()
+            self._mark_durable(sequence)
+
+            checkpoint_path = self._path(CHECKPOINT_PREFIX, self._segment_id, CHECKPOINT_SUFFIX)
+            with open(checkpoint_path + TEMPORARY_SUFFIX, 'wb') as checkpoint:
+                batch = []
+                for item in items:
+                    batch.append(item)
+                    if len(batch) == CHECKPOINT_BLOCK_SIZE:
+                        checkpoint.write(self._encode_items(batch, expiration_time))
+                        batch = []
+                checkpoint.write(self._encode_items(batch, expiration_time))
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+            os.replace(checkpoint_path + TEMPORARY_SUFFIX, checkpoint_path)
+            self._sync_directory()
+            self._remove_files_before(self._segment_id)
+
+    def close(self):
+        """Write every pending change to disk and stop the background thread
+        """
+        with self._lock:
+            self._closed = True
+            self._flushed.notify_all()
+        self._flusher.join()
+        with self._io_lock:
+            self._flush()
+            self._segment.close()
+
+    def _append(self, operations):
+        """Queue operations for the write-ahead log, waiting for them to be on disk if required
+
+        Must be called while holding the lock
+        """
+        if self._closed:
+            raise KeyValueStoreException("The store is closed")
+
+        self._pending.extend(operations)
+        self._sequence += 1
+        if self.fsync == FSYNC_ALWAYS:
+            sequence = self._sequence
+            self._flushed.notify_all()
+            while self._durable_sequence < sequence and not self._closed:
+                self._flushed.wait()
+
+    def _run_flusher(self):
+        while True:
+            with self._lock:
+                if self.fsync == FSYNC_ALWAYS:
+                    while not self._pending and not self._closed:
+                        self._flushed.wait()
+                elif not self._closed:
+                    self._flushed.wait(self.fsync_interval)
+                if self._closed:
+                    return
+
+            with self._io_lock:
+                self._flush()
+                needs_checkpoint = self._segment.tell() >= self.checkpoint_bytes
+            if needs_checkpoint:
+                self.checkpoint()
+
+    def _flush(self):
+        """Write the pending operations to the current log segment
+
+        Must be called while holding the I/O lock
+        """
+        with self._lock:
+            operations, self._pending = self._pending, []
+            sequence = self._sequence
+        if operations:
+            self._write(operations)
+            if self.fsync != FSYNC_NEVER:
+                self._sync()
+        self._mark_durable(sequence)
+
+    def _write(self, operations):
+        """Write operations to the current log segment, grouping consecutive operations of the same kind
+        """
+        blocks = []
+        start = 0
+        for end in range(1, len(operations) + 1):
+            if end == len(operations) or operations[end][0] != operations[start][0]:
+                blocks.append(self._encode_operations(operations[start:end]))
+                start = end
+        self._segment.write(b''.join(blocks))
+        self._segment.flush()
+
+    def _sync(self):
+        os.fsync(self._segment.fileno())
+
+    def _mark_durable(self, sequence):
+        with self._lock:
+            self._durable_sequence = max(self._durable_sequence, sequence)
+            self._flushed.notify_all()
+
+    def _recover(self):
+        """Rebuild the index from the latest checkpoint and the log segments written after it
+        """
+        checkpoint_ids, segment_ids = [], []
+        for name in os.listdir(self.directory):
+            if name.endswith(TEMPORARY_SUFFIX):
+                os.remove(os.path.join(self.directory, name))
+            elif name.startswith(CHECKPOINT_PREFIX) and name.endswith(CHECKPOINT_SUFFIX):
+                checkpoint_ids.append(int(name[len(CHECKPOINT_PREFIX):-len(CHECKPOINT_SUFFIX)]))
+            elif name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                segment_ids.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+
+        first_segment_id = 0
+        if checkpoint_ids:
+            first_segment_id = max(checkpoint_ids)
+            path = self._path(CHECKPOINT_PREFIX, first_segment_id, CHECKPOINT_SUFFIX)
+            if self._load(path) != os.path.getsize(path):
+                raise KeyValueStoreException("The checkpoint is corrupted", path=path)
+
+        for segment_id in sorted(segment_ids):
+            if segment_id >= first_segment_id:
+                path = self._path(SEGMENT_PREFIX, segment_id, SEGMENT_SUFFIX)
+                valid_size = self._load(path)
+                if valid_size != os.path.getsize(path):
+                    # Drop the blocks torn by a crash in the middle of a write
+                    os.truncate(path, valid_size)
+
+        self._remove_files_before(first_segment_id)
+        self._segment_id = max(checkpoint_ids + segment_ids + [0]) + 1
+        self._open_segment()
+
+    def _load(self, path):
+        """Apply the blocks of a log or checkpoint file to the index, returning the size of its valid part
+        """
+        if os.path.getsize(path) == 0:
+            return 0
+
+        offset = 0
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            while offset + BLOCK_HEADER.size <= len(content):
+                kind, count, keys_size, values_size, checksum = BLOCK_HEADER.unpack_from(content, offset)
+                start = offset + BLOCK_HEADER.size
+                end = start + keys_size + values_size
+                if end > len(content):
+                    break
+                payload = content[start:end]
+                if zlib.crc32(payload) != checksum:
+                    break
+
+                keys = self._decode_strings(payload[:keys_size], count)
+                if kind == DELETE_BLOCK:
+                    for key in keys:
+                        self.index.delete(key)
+                elif kind == PUT_EXPIRING_BLOCK:
+                    now = time.time()
+                    for key, encoded in zip(keys, self._decode_strings(payload[keys_size:], count)):
+                        value, expires_at = json.loads(encoded)
+                        if expires_at > now:
+                            self.index.put(key, value, expires_at=expires_at)
+                        else:
+                            self.index.delete(key)
+                else:
+                    values = self._decode_strings(payload[keys_size:], count)
+                    if kind == PUT_JSON_BLOCK:
+                        values = [json.loads(value) for value in values]
+                    self.index.put_batch(dict(zip(keys, values)))
+                offset = end
+        return offset
+
+    def _open_segment(self):
+        self._segment = open(self._path(SEGMENT_PREFIX, self._segment_id, SEGMENT_SUFFIX), 'ab')
+        self._sync_directory()
+
+    def _remove_files_before(self, segment_id):
+        """Remove the log segments and checkpoints which are older than the given segment
+        """
+        for name in os.listdir(self.directory):
+            for prefix, suffix in ((SEGMENT_PREFIX, SEGMENT_SUFFIX), (CHECKPOINT_PREFIX, CHECKPOINT_SUFFIX)):
+                if name.startswith(prefix) and name.endswith(suffix) and \
+                        int(name[len(prefix):-len(suffix)]) < segment_id:
+                    os.remove(os.path.join(self.directory, name))
+
+    def _sync_directory(self):
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def _path(self, prefix, file_id, suffix):
+        return os.path.join(self.directory, "{}{:010d}{}".format(prefix, file_id, suffix))
+
+    @classmethod
+    def _encode_operations(cls, operations):
+        """Encode operations which all have the same kind into a block
+        """
+        kind = operations[0][0]
+        keys = [key for _, key, _ in operations]
+        if kind == DELETE_BLOCK:
+            return cls._encode_block(DELETE_BLOCK, keys, [])
+        if kind == PUT_EXPIRING_BLOCK:
+            return cls._encode_block(PUT_EXPIRING_BLOCK, keys, [json.dumps(value) for _, _, value in operations])
+        return cls._encode_items([(key, value) for _, key, value in operations])
+
+    @classmethod
+    def _encode_items(cls, items, expiration_time=None):
+        """Encode key-value pairs into blocks, keeping the values which are not strings as JSON
+
+        Consecutive pairs whose values are strings go into the same block, so
+        the order of the pairs is preserved. When expiration_time is given,
+        the pairs for which it returns a time go into expiring blocks
+        """
+        blocks = []
+        keys, values, kind = [], [], PUT_BLOCK
+        for key, value in items:
+            expires_at = expiration_time(key) if expiration_time is not None else None
+            if expires_at is not None:
+                value_kind, value = PUT_EXPIRING_BLOCK, [value, expires_at]
+            else:
+                value_kind = PUT_BLOCK if isinstance(value, str) else PUT_JSON_BLOCK
+            if value_kind != kind and keys:
+                blocks.append(cls._encode_block(kind, keys, values))
+                keys, values = [], []
+            kind = value_kind
+            keys.append(key)
+            values.append(value if value_kind == PUT_BLOCK else json.dumps(value))
+        if keys:
+            blocks.append(cls._encode_block(kind, keys, values))
+        return b''.join(blocks)
+
+    @staticmethod
+    def _encode_block(kind, keys, values):
+        encoded_keys = SEPARATOR.join([key.encode('utf-8', 'surrogatepass') for key in keys])
+        encoded_values = SEPARATOR.join([value.encode('utf-8', 'surrogatepass') for value in values])
+        payload = encoded_keys + encoded_values
+        header = BLOCK_HEADER.pack(kind, len(keys), len(encoded_keys), len(encoded_values), zlib.crc32(payload))
+        return header + payload
+
+    @staticmethod
+    def _decode_strings(encoded, count):
+        if count == 0:
+            return []
+        return [string.decode('utf-8', 'surrogatepass') for string in encoded.split(SEPARATOR)]
@@ -0,0 +1,235 @@
+import bisect
+import itertools
+import threading
+
+from thunderdb.storage.key_value_store import KeyValueStore, DEFAULT_SCAN_LIMIT
+from thunderdb.storage.in_memory_store import InMemoryStore
+
+# The number of keys of a chunk of the ordered index. A chunk is split in two
+# once it holds twice as many keys, so an insertion only shifts a few
+# thousand references at most, however many keys the index holds
+CHUNK_SIZE = 1024
+
+# A batch of keys larger than this fraction of the index is merged into it by
+# sorting everything again, rather than by inserting the keys one at a time
+REBUILD_RATIO = 0.125
+
+# The largest code point, which has no successor to end the range of a prefix with
+MAX_CODE_POINT = chr(0x10ffff)
+
+
+def prefix_range(prefix):
+    """Get the range [start, end) of the keys which start with the given prefix
+
+    The end is None when every key after the start has the prefix
+    """
+    stripped = prefix.rstrip(MAX_CODE_POINT)
+    if not stripped:
+        return prefix, None
+    return prefix, stripped[:-1] + chr(ord(stripped[-1]) + 1)
+
+
+class OrderedIndex(object):
+    """A sorted set of keys which supports incremental insertions and range iteration
+
+    The keys are kept in a list of sorted chunks, along with the largest key
+    of every chunk. Finding a key takes two binary searches, one over the
+    largest keys and one within a chunk, and inserting or removing it only
+    shifts the keys of its chunk. This is not thread-safe: the callers hold
+    a lock around every change and every iteration.
+    """
+    def __init__(self, keys=()):
+        self._chunks = []
+        self._maxes = []
+        self._len = 0
+        self.update(keys)
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, key):
+        index = bisect.bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            return False
+        chunk = self._chunks[index]
+        return chunk[bisect.bisect_left(chunk, key)] == key
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._chunks)
+
+    def add(self, key):
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            return
+
+        index = bisect.bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            # The key comes after every other key, at the end of the last chunk
+            index -= 1
+            chunk = self._chunks[index]
+            chunk.append(key)
+            self._maxes[index] = key
+        else:
+            chunk = self._chunks[index]
+            position = bisect.bisect_left(chunk, key)
+            if chunk[position] == key:
+                return
+            chunk.insert(position, key)
+
+        self._len += 1
+        if len(chunk) > 2 * CHUNK_SIZE:
+            self._chunks[index:index + 1] = [chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]]
+            self._maxes[index:index + 1] = [chunk[CHUNK_SIZE - 1], chunk[-1]]
+
+    def update(self, keys):
+        """Add many keys at once
+        """
+        keys = list(keys)
+        if len(keys) <= self._len * REBUILD_RATIO:
+            for key in keys:
+                self.add(key)
+            return
+
+        merged = sorted(set(itertools.chain(self, keys)))
+        self._chunks = [merged[position:position + CHUNK_SIZE] for position in range(0, len(merged), CHUNK_SIZE)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._len = len(merged)
+
+    def discard(self, key):
+        index = bisect.bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            return
+        chunk = self._chunks[index]
+        position = bisect.bisect_left(chunk, key)
+        if chunk[position] != key:
+            return
+
+        del chunk[position]
+        self._len -= 1
+        if not chunk:
+            del self._chunks[index]
+            del self._maxes[index]
+        elif position == len(chunk):
+            self._maxes[index] = chunk[-1]
+
+    def irange(self, start=None, end=None, after=None):
+        """Iterate over the keys in the range [start, end) which come after the given key, in order
+        """
+        lower, search = start, bisect.bisect_left
+        if after is not None and (lower is None or after >= lower):
+            lower, search = after, bisect.bisect_right
+
+        index, position = 0, 0
+        if lower is not None:
+            index = search(self._maxes, lower)
+            if index == len(self._maxes):
+                return
+            position = search(self._chunks[index], lower)
+
+        for chunk in itertools.islice(self._chunks, index, None):
+            for key in itertools.islice(chunk, position, None):
+                if end is not None and key >= end:
+                    return
+                yield key
+            position = 0
+
+
+class OrderedStore(KeyValueStore):
+    """A KeyValueStore which keeps its keys in order, for range and prefix scans
+
+    The key-value pairs are held by another KeyValueStore (an InMemoryStore
+    by default), which serves every operation but range_scan. The keys are
+    also kept in an OrderedIndex, so a range scan only walks the keys of
+    the page it returns instead of sorting the whole store. This costs an
+    ordered insertion on every write of a new key, and one reference to
+    every key.
+
+    When the inner store removes keys on its own, evicting or expiring them
+    (see CappedStore), they are dropped from the index as well. Expiration
+    times are passed to the inner store.
+    """
+    def __init__(self, store=None):
+        self.store = store if store is not None else InMemoryStore()
+        self.supports_expiration = getattr(self.store, 'supports_expiration', False)
+        # Reentrant, as the inner store tells about the keys it evicts while a write holds the lock
+        self._lock = threading.RLock()
+        self._index = OrderedIndex(key for key, _ in self.store.items())
+        self._removes_keys = hasattr(self.store, 'add_removal_listener')
+        if self._removes_keys:
+            self.store.add_removal_listener(self._forget)
+
+    def put(self, key, value, **options):
+        with self._lock:
+            self.store.put(key, value, **options)
+            self._index.add(key)
+            self._forget_if_removed(key)
+
+    def put_batch(self, data, **options):
+        with self._lock:
+            self.store.put_batch(data, **options)
+            self._index.update(data.keys())
+            if self._removes_keys:
+                for key in data:
+                    self._forget_if_removed(key)
+
+    def put_batch_if_absent(self, data, **options):
+        with self._lock:
+            data = self.store.put_batch_if_absent(data, **options)
+            self._index.update(data.keys())
+            if self._removes_keys:
+                for key in data:
+                    self._forget_if_removed(key)
+        return data
+
+    def expiration_time(self, key):
+        return self.store.expiration_time(key)
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def delete(self, key):
+        with self._lock:
+            self.store.delete(key)
+            self._index.discard(key)
+
+    def items(self):
+        return self.store.items()
+
+    def __len__(self):
+        return len(self.store)
+
+    def scan(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        return self.store.scan(cursor, limit)
+
+    def iter_pages(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        return self.store.iter_pages(cursor, limit)
+
+    def range_scan(self, start=None, end=None, limit=DEFAULT_SCAN_LIMIT, cursor=None):
+        items = []
+        while len(items) < limit:
+            wanted = limit - len(items)
+            with self._lock:
+                keys = list(itertools.islice(self._index.irange(start, end, cursor), wanted))
+
+            for key in keys:
+                value = self.store.get(key)
+                if value is not None:  # The key may have been deleted or expired since
+                    items.append((key, value))
+            if len(keys) < wanted:
+                break
+            cursor = keys[-1]
+        return items, items[-1][0] if len(items) == limit else None
+
+    def _forget(self, keys):
+        """Drop keys removed by the inner store from the index, unless they were put again since
+        """
+        with self._lock:
+            for key in keys:
+                self._forget_if_removed(key)
+
+    def _forget_if_removed(self, key):
+        # A key evicted by the write which put it is reported before it is added to the index
+        if self._removes_keys and key not in self.store:
+            self._index.discard(key)
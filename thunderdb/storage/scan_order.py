@@ -0,0 +1,103 @@
+import array
+import bisect
+
+from thunderdb.storage.key_value_store import DEFAULT_SCAN_LIMIT
+
+# The number of keys, removed ones included, a ScanOrder lists before it considers compacting the list
+MIN_COMPACTION_SIZE = 1024
+
+
+class ScanOrder(object):
+    """The insertion order of the keys of a store, for scan cursors which stay valid across deletes
+
+    Every key added gets the next sequence number, and a page of a scan is
+    the keys with the lowest numbers above the cursor, the cursor of the
+    next page being the number of the last key of the page. Removing a key
+    does not move the others, so a scan returns every key which is in the
+    store from its first page to its last. A key added during the scan is
+    returned when it was added after the page the scan is at, and a key
+    removed during the scan is not returned once removed; a key removed
+    and added again gets a new number, so it may be returned more than once.
+
+    Only the keys are kept, in a list in the order they were added, which
+    costs about 8 bytes per key on top of the dictionary of the store: the
+    number of a key is its place in the list. Whether a key is still in the
+    store is asked to that dictionary, so a removed key needs no
+    bookkeeping. It stays in the list until the keys of the list which are
+    not in the store make up half of it, and the list is compacted then:
+    the keys listed so far are replaced by the ones still in the store, in
+    place, and their numbers are kept in an array of 8 bytes per key. A
+    page starts at the bisection of the cursor, so it costs O(log n + limit)
+    whatever its place in the scan.
+
+    Adding a key is a single append to the list, which is atomic, so a
+    store may add keys without a lock. Compacting and paging must not run
+    concurrently, so the store calls them under its lock.
+    """
+    def __init__(self, data):
+        self._data = data
+        self._keys = []
+        # The numbers of the keys listed before the last compaction, and the
+        # number of the first key listed after it, the others following it
+        self._sequences = array.array('q')
+        self._next_sequence = 1
+
+    def add(self, key):
+        """Give a key which was not in the store the next sequence number
+        """
+        self._keys.append(key)
+
+    def is_sparse(self):
+        """True when the keys removed from the store make up most of the list, which should be compacted
+        """
+        return len(self._keys) > MIN_COMPACTION_SIZE and len(self._keys) > 2 * len(self._data)
+
+    def compact(self):
+        """Drop the keys removed from the store from the list, and the keys added again from their previous place
+        """
+        if not self.is_sparse():
+            return
+        size = len(self._keys)
+        data, seen = self._data, set()
+        keys, sequences = [], array.array('q')
+        for index in range(size - 1, -1, -1):
+            key = self._keys[index]
+            if key in data and key not in seen:
+                seen.add(key)
+                keys.append(key)
+                sequences.append(self._sequence(index))
+        keys.reverse()
+        sequences.reverse()
+
+        # The keys added while compacting are after the first size keys, which are replaced at once
+        self._next_sequence = self._sequence(size)
+        self._sequences = sequences
+        self._keys[:size] = keys
+
+    def page(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        """The keys of the page starting after the given cursor, and the cursor of the next page, or None
+        """
+        keys, contains = self._keys, self._data.__contains__
+        index = self._index(int(cursor) if cursor else 0)
+        page = {}
+        while index < len(keys) and len(page) < limit:
+            # Take the rest of the page at once, then the next keys if some of these were removed
+            end = index + limit - len(page)
+            page.update(dict.fromkeys(filter(contains, keys[index:end])))
+            index = end
+        next_cursor = str(self._sequence(index - 1)) if len(page) == limit else None
+        return list(page), next_cursor
+
+    def _sequence(self, index):
+        """The number of the key at the given place of the list
+        """
+        if index < len(self._sequences):
+            return self._sequences[index]
+        return self._next_sequence + index - len(self._sequences)
+
+    def _index(self, sequence):
+        """The place in the list of the first key whose number is above the given one
+        """
+        if sequence < self._next_sequence:
+            return bisect.bisect_right(self._sequences, sequence)
+        return len(self._sequences) + sequence - self._next_sequence + 1
@@ -0,0 +1,342 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from thunderdb.exceptions.errors import ServiceError
+from thunderdb.storage.key_value_store import KeyValueStore, DEFAULT_SCAN_LIMIT
+
+# The number of key-value pairs and of bytes of keys and values the store is sized for by default
+DEFAULT_MAX_KEYS = 1000000
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# The fraction of the slots which may be used before the table is full, so probe sequences stay short
+MAX_LOAD_FACTOR = 0.75
+
+# The header holds a magic number, the number of slots, the size of the data
+# region, the number of live keys, the number of used slots (live keys and
+# tombstones), the offset at which the next record is appended, the number of
+# bytes of records no slot points to anymore, and the generation of the table
+MAGIC = b'TDBSHM02'
+HEADER = struct.Struct('<8sQQQQQQQ')
+COUNTERS = struct.Struct('<QQQQ')
+COUNTERS_OFFSET = 24
+GENERATION = struct.Struct('<Q')
+GENERATION_OFFSET = HEADER.size - GENERATION.size
+
+# Every slot holds a sequence number, the hash of its key, and the offset and
+# sizes of its record. A record is the key followed by the kind of the value
+# and the value itself, so the value size of a live slot is never 0
+SLOT = struct.Struct('<QQQII')
+SEQUENCE = struct.Struct('<Q')
+DELETED = 0
+
+# How a value is encoded in its record: strings as UTF-8, anything else as JSON
+STRING_VALUE = b's'
+JSON_VALUE = b'j'
+
+
+class SharedMemoryStore(KeyValueStore):
+    """A KeyValueStore held in shared memory, which any number of processes can read without locks
+
+    The store is a fixed-size open-addressing hash table, followed by a
+    region the records of the keys and values are appended to, all in one
+    memory map: anonymous by default, so the processes forked after it is
+    created share it, or backed by the file at the given path, which any
+    process can open and which survives restarts.
+
+    Only one process may write to the store, and its threads are serialized
+    by a lock. Readers never lock: every slot is guarded by a sequence lock,
+    whose sequence number the writer makes odd while it updates the slot and
+    even again once it is done. A reader retries whenever it saw an odd
+    number, or a different number after reading the slot. Records are never
+    modified once appended, so a consistent slot always points to a
+    consistent record. This relies on the writes to the memory map becoming
+    visible in the order they are made, as they do on x86-64.
+
+    Neither the table nor the data region grow. Deleted keys leave a
+    tombstone in their slot, and overwritten values leave their previous
+    record behind. When a write does not fit, the store is compacted: the
+    table is rebuilt without its tombstones and the live records are moved
+    to the start of the data region. The whole table is guarded by a
+    sequence lock of its own, the generation, so the readers wait while it
+    is being compacted. A write which does not fit even then raises a
+    ServiceError.
+    """
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS, max_bytes=DEFAULT_MAX_BYTES, path=None):
+        if max_keys <= 0 or max_bytes <= 0:
+            raise ValueError("The shared store must hold at least one key and one byte, got {} keys and {} bytes"
+                             .format(max_keys, max_bytes))
+
+        num_slots = 1
+        while num_slots * MAX_LOAD_FACTOR < max_keys:
+            num_slots *= 2
+        self._data_offset = HEADER.size + num_slots * SLOT.size
+        size = self._data_offset + max_bytes
+
+        if path is None:
+            self._buffer = mmap.mmap(-1, size)
+        else:
+            self._buffer = self._map_file(path, size)
+
+        magic, stored_slots, stored_bytes = HEADER.unpack_from(self._buffer)[:3]
+        if magic != MAGIC:
+            HEADER.pack_into(self._buffer, 0, MAGIC, num_slots, max_bytes, 0, 0, self._data_offset, 0, 0)
+        elif (stored_slots, stored_bytes) != (num_slots, max_bytes):
+            raise ValueError("The shared store at '{}' was created for {} slots and {} bytes, not {} and {}".format(
+                path, stored_slots, stored_bytes, num_slots, max_bytes))
+
+        self.path = path
+        self._num_slots = num_slots
+        self._mask = num_slots - 1
+        self._max_used_slots = int(num_slots * MAX_LOAD_FACTOR)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _map_file(path, size):
+        descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(descriptor).st_size < size:
+                os.ftruncate(descriptor, size)
+            return mmap.mmap(descriptor, size)
+        finally:
+            os.close(descriptor)
+
+    def put(self, key, value):
+        self.put_batch({key: value})
+
+    def put_batch(self, data):
+        """Append the records of the key-value pairs in one write, then point their slots at them
+        """
+        records = [(key.encode('utf-8', 'surrogatepass'), self._encode_value(value)) for key, value in data.items()]
+        with self._lock:
+            self._write_records(records)
+
+    def put_batch_if_absent(self, data):
+        records = [(key.encode('utf-8', 'surrogatepass'), self._encode_value(value)) for key, value in data.items()]
+        with self._lock:
+            absent = [not self._holds(key_bytes) for key_bytes, _ in records]
+            self._write_records([record for record, is_absent in zip(records, absent) if is_absent])
+        return {key: value for (key, value), is_absent in zip(data.items(), absent) if is_absent}
+
+    def _holds(self, key_bytes):
+        """True if the key is in the store, for the writer
+        """
+        slot = self._find(key_bytes)[1]
+        return slot is not None and slot[4] != DELETED
+
+    def _write_records(self, records):
+        """Append encoded key-value records in one write, then point their slots at them
+
+        Must be called while holding the lock
+        """
+        size = sum(len(key_bytes) + len(value_bytes) for key_bytes, value_bytes in records)
+        count, used, end, garbage = COUNTERS.unpack_from(self._buffer, COUNTERS_OFFSET)
+        if (end + size > len(self._buffer) and garbage) or \
+                (used + len(records) > self._max_used_slots and used > count):
+            self._compact()
+            count, used, end, garbage = COUNTERS.unpack_from(self._buffer, COUNTERS_OFFSET)
+        if end + size > len(self._buffer):
+            raise ServiceError("The shared store is full", free_bytes=len(self._buffer) - end,
+                               requested_bytes=size)
+
+        self._buffer[end:end + size] = b''.join(key_bytes + value_bytes for key_bytes, value_bytes in records)
+        try:
+            for key_bytes, value_bytes in records:
+                position, slot = self._find(key_bytes)
+                if slot is None:
+                    if used >= self._max_used_slots:
+                        raise ServiceError("The shared store is full", max_keys=self._max_used_slots)
+                    used += 1
+                    count += 1
+                elif slot[4] == DELETED:
+                    count += 1
+                else:
+                    garbage += slot[3] + slot[4]
+                self._write_slot(position, zlib.crc32(key_bytes), end, len(key_bytes), len(value_bytes))
+                end += len(key_bytes) + len(value_bytes)
+        finally:
+            COUNTERS.pack_into(self._buffer, COUNTERS_OFFSET, count, used, end, garbage)
+
+    def get(self, key):
+        key_bytes = key.encode('utf-8', 'surrogatepass')
+        key_hash = zlib.crc32(key_bytes)
+        while True:
+            generation = self._stable_generation()
+            value = self._lookup(key_bytes, key_hash)
+            if GENERATION.unpack_from(self._buffer, GENERATION_OFFSET)[0] == generation:
+                return self._decode_value(value) if value is not None else None
+
+    def delete(self, key):
+        key_bytes = key.encode('utf-8', 'surrogatepass')
+        with self._lock:
+            position, slot = self._find(key_bytes)
+            if slot is not None and slot[4] != DELETED:
+                self._write_slot(position, slot[1], slot[2], slot[3], DELETED)
+                count, used, end, garbage = COUNTERS.unpack_from(self._buffer, COUNTERS_OFFSET)
+                COUNTERS.pack_into(self._buffer, COUNTERS_OFFSET, count - 1, used, end, garbage + slot[3] + slot[4])
+
+    def items(self):
+        while True:
+            generation = self._stable_generation()
+            records = self._scan_slots(0, self._num_slots)[0]
+            if GENERATION.unpack_from(self._buffer, GENERATION_OFFSET)[0] == generation:
+                return self._decode_records(records)
+
+    def __len__(self):
+        return COUNTERS.unpack_from(self._buffer, COUNTERS_OFFSET)[0]
+
+    def scan(self, cursor=None, limit=DEFAULT_SCAN_LIMIT):
+        # Cursors are positions in the table, in a given generation. When the
+        # table was compacted since the previous page, the scan starts over,
+        # so pairs may be returned twice but none is missed
+        cursor_generation, index = map(int, cursor.split(':')) if cursor else (None, 0)
+        while True:
+            generation = self._stable_generation()
+            start = index if cursor_generation in (None, generation) else 0
+            records, next_index = self._scan_slots(start, limit)
+            if GENERATION.unpack_from(self._buffer, GENERATION_OFFSET)[0] == generation:
+                break
+        next_cursor = '{}:{}'.format(generation, next_index) if next_index < self._num_slots else None
+        return self._decode_records(records), next_cursor
+
+    def close(self):
+        self._buffer.close()
+
+    def _stable_generation(self):
+        """Wait until the table is not being compacted, returning its generation
+        """
+        while True:
+            generation = GENERATION.unpack_from(self._buffer, GENERATION_OFFSET)[0]
+            if not generation & 1:
+                return generation
+            time.sleep(0)
+
+    def _lookup(self, key_bytes, key_hash):
+        """Find the encoded value of a key, or None, following the sequence lock of every slot probed
+        """
+        buffer = self._buffer
+        index = key_hash & self._mask
+        while True:
+            position = HEADER.size + index * SLOT.size
+            sequence, slot_hash, offset, key_size, value_size = SLOT.unpack_from(buffer, position)
+            if sequence & 1:
+                time.sleep(0)  # The writer is updating the slot
+                continue
+            if offset == 0:
+                return None
+
+            value = None
+            matches = slot_hash == key_hash and buffer[offset:offset + key_size] == key_bytes
+            if matches and value_size != DELETED:
+                value = buffer[offset + key_size:offset + key_size + value_size]
+            if SEQUENCE.unpack_from(buffer, position)[0] != sequence:
+                continue  # The slot changed while it was being read
+            if matches:
+                return value
+            index = (index + 1) & self._mask
+
+    def _scan_slots(self, index, limit):
+        """Read the records of the slots from the given one on, until limit records were found
+
+        Returns the (key size, record) pairs and the position of the slot
+        following the last one read
+        """
+        buffer = self._buffer
+        records = []
+        while index < self._num_slots and len(records) < limit:
+            position = HEADER.size + index * SLOT.size
+            sequence, _, offset, key_size, value_size = SLOT.unpack_from(buffer, position)
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            record = None
+            if offset != 0 and value_size != DELETED:
+                record = buffer[offset:offset + key_size + value_size]
+            if SEQUENCE.unpack_from(buffer, position)[0] != sequence:
+                continue
+            if record is not None:
+                records.append((key_size, record))
+            index += 1
+        return records, index
+
+    def _decode_records(self, records):
+        return [(record[:key_size].decode('utf-8', 'surrogatepass'), self._decode_value(record[key_size:]))
+                for key_size, record in records]
+
+    def _find(self, key_bytes):
+        """Find the slot of a key, as its position and its fields, or the slot it should be written to
+
+        Only the writer calls this, so the slots are read without checking
+        their sequence numbers. When the key is not in the table, the
+        position is the empty slot ending its probe sequence, and the fields
+        are None
+        """
+        key_hash = zlib.crc32(key_bytes)
+        index = key_hash & self._mask
+        while True:
+            position = HEADER.size + index * SLOT.size
+            slot = SLOT.unpack_from(self._buffer, position)
+            _, slot_hash, offset, key_size, _ = slot
+            if offset == 0:
+                return position, None
+            if slot_hash == key_hash and self._buffer[offset:offset + key_size] == key_bytes:
+                return position, slot
+            index = (index + 1) & self._mask
+
+    def _write_slot(self, position, key_hash, offset, key_size, value_size):
+        """Update a slot under its sequence lock
+        """
+        sequence = SEQUENCE.unpack_from(self._buffer, position)[0]
+        SEQUENCE.pack_into(self._buffer, position, sequence + 1)
+        self._buffer[position + SEQUENCE.size:position + SLOT.size] = \
+            SLOT.pack(0, key_hash, offset, key_size, value_size)[SEQUENCE.size:]
+        SEQUENCE.pack_into(self._buffer, position, sequence + 2)
+
+    def _compact(self):
+        """Rebuild the table without its tombstones, moving the live records to the start of the data region
+
+        The records are moved in the order of their offsets, so a record is
+        never overwritten before it has been moved
+        """
+        buffer = self._buffer
+        slots = []
+        for index in range(self._num_slots):
+            _, key_hash, offset, key_size, value_size = SLOT.unpack_from(buffer, HEADER.size + index * SLOT.size)
+            if offset != 0 and value_size != DELETED:
+                slots.append((offset, key_hash, key_size, value_size))
+        slots.sort()
+
+        generation = GENERATION.unpack_from(buffer, GENERATION_OFFSET)[0]
+        GENERATION.pack_into(buffer, GENERATION_OFFSET, generation + 1)
+        try:
+            buffer[HEADER.size:self._data_offset] = bytes(self._data_offset - HEADER.size)
+            end = self._data_offset
+            for offset, key_hash, key_size, value_size in slots:
+                size = key_size + value_size
+                if offset != end:
+                    buffer[end:end + size] = buffer[offset:offset + size]
+
+                index = key_hash & self._mask
+                while SLOT.unpack_from(buffer, HEADER.size + index * SLOT.size)[2] != 0:
+                    index = (index + 1) & self._mask
+                SLOT.pack_into(buffer, HEADER.size + index * SLOT.size, 0, key_hash, end, key_size, value_size)
+                end += size
+            COUNTERS.pack_into(buffer, COUNTERS_OFFSET, len(slots), len(slots), end, 0)
+        finally:
+            GENERATION.pack_into(buffer, GENERATION_OFFSET, generation + 2)
+
+    @staticmethod
+    def _encode_value(value):
+        if isinstance(value, str):
+            return STRING_VALUE + value.encode('utf-8', 'surrogatepass')
+        return JSON_VALUE + json.dumps(value).encode('utf-8')
+
+    @staticmethod
+    def _decode_value(value):
+        if value[:1] == STRING_VALUE:
+            return value[1:].decode('utf-8', 'surrogatepass')
+        return json.loads(value[1:].decode('utf-8'))
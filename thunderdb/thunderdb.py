@@ -1,8 +1,49 @@
+import logging
 import os
 from argparse import ArgumentParser
 
 from thunderdb.networking.http_server import initialize
+from thunderdb.networking import async_server
+from thunderdb.networking import prefork
 from thunderdb.config import Config
+from thunderdb.compute.node import Node
+from thunderdb.compute import utils
+from thunderdb.compute import cache
+from thunderdb.compute.async_node import DEFAULT_ASYNC_POOL_SIZE
+from thunderdb.compute.transport import BinaryTransport, DEFAULT_PEER_PORT_OFFSET
+from thunderdb.storage.backends import STORAGE_BACKENDS, DEFAULT_STORAGE_BACKEND, create_store
+from thunderdb.storage import shared_store
+from thunderdb.storage.log_store import LogStore, FSYNC_POLICIES, FSYNC_INTERVAL
+from thunderdb.storage.ordered_store import OrderedStore
+from thunderdb.storage.filtered_store import FilteredStore, DEFAULT_FILTER_CAPACITY, DEFAULT_FILTER_ERROR_RATE
+from thunderdb.storage.capped_store import DEFAULT_MAX_BYTES
+from thunderdb.storage.eviction import EVICTION_POLICIES, DEFAULT_EVICTION_POLICY
+from thunderdb.hashing.consistent_hashing import DEFAULT_NUM_VIRTUAL_NODES
+from thunderdb.compute.replication import DEFAULT_REPLICATION_FACTOR
+from thunderdb.compute.gossip import DEFAULT_GOSSIP_INTERVAL
+from thunderdb.compute.hedging import DEFAULT_HEDGE_PERCENTILE, DEFAULT_HEDGE_MAX_RATE
+from thunderdb.compute.peer_filters import DEFAULT_FILTER_SYNC_INTERVAL
+from thunderdb.compute.coalescing import DEFAULT_WRITE_DURABILITY, DEFAULT_MAX_WRITE_LINGER
+
+# The threaded server runs Bottle under waitress, with a fixed number of threads handling
+# the requests. The asyncio server handles every request on a single event loop instead.
+# The prefork server serves the reads from worker processes sharing the port of the node
+# and the key-value pairs in shared memory, and the rest from a threaded writer process
+SERVER_THREADED = 'threaded'
+SERVER_ASYNC = 'async'
+SERVER_PREFORK = 'prefork'
+SERVER_MODES = (SERVER_THREADED, SERVER_ASYNC, SERVER_PREFORK)
+DEFAULT_SERVER_MODE = SERVER_THREADED
+
+# The nodes reach each other over HTTP, like the clients do, or over a
+# binary protocol served on a port of its own (see BinaryTransport)
+PEER_TRANSPORT_HTTP = 'http'
+PEER_TRANSPORT_BINARY = 'binary'
+PEER_TRANSPORTS = (PEER_TRANSPORT_HTTP, PEER_TRANSPORT_BINARY)
+DEFAULT_PEER_TRANSPORT = PEER_TRANSPORT_HTTP
+
+DEFAULT_PORT = 80
+DEFAULT_SERVER_THREADS = 6
 
 
 def get_argument_parser():
@@ -15,6 +56,38 @@ def get_argument_parser():
     parser.add_argument('-d', '--data',
                         required=True,
                         help="Path to the file which contains the key-value pairs you want to load")
+    parser.add_argument('-s', '--storage',
+                        choices=sorted(STORAGE_BACKENDS),
+                        default=DEFAULT_STORAGE_BACKEND,
+                        help="The storage backend used to hold the key-value pairs (default: {})".format(
+                            DEFAULT_STORAGE_BACKEND))
+    parser.add_argument('-l', '--log-directory',
+                        help="Directory of the write-ahead log which makes the store durable (default: not durable)")
+    parser.add_argument('--fsync',
+                        choices=FSYNC_POLICIES,
+                        default=FSYNC_INTERVAL,
+                        help="When the write-ahead log is forced to disk (default: {})".format(FSYNC_INTERVAL))
+    parser.add_argument('--server',
+                        choices=SERVER_MODES,
+                        default=DEFAULT_SERVER_MODE,
+                        help="How the requests are served (default: {})".format(DEFAULT_SERVER_MODE))
+    parser.add_argument('--peer-transport',
+                        choices=PEER_TRANSPORTS,
+                        default=DEFAULT_PEER_TRANSPORT,
+                        help="How the nodes reach each other (default: {})".format(DEFAULT_PEER_TRANSPORT))
+    parser.add_argument('--ordered-index',
+                        action='store_true',
+                        help="Keep the keys in order, so /scan does not sort the whole store on every page")
+    parser.add_argument('--max-bytes',
+                        type=int,
+                        default=DEFAULT_MAX_BYTES,
+                        help="The memory budget of the capped storage backend, in bytes (default: {})".format(
+                            DEFAULT_MAX_BYTES))
+    parser.add_argument('--eviction',
+                        choices=sorted(EVICTION_POLICIES),
+                        default=DEFAULT_EVICTION_POLICY,
+                        help="The keys the capped storage backend evicts first (default: {})".format(
+                            DEFAULT_EVICTION_POLICY))
     return parser
 
 
@@ -53,12 +126,99 @@ def main():
     node_ip = os.environ.get('NODE_IP')
     next_node_id = int(os.environ.get('NEXT_NODE_ID'))
     next_node_ip = os.environ.get('NEXT_NODE_IP')
+    num_virtual_nodes = int(os.environ.get('NUM_VIRTUAL_NODES', DEFAULT_NUM_VIRTUAL_NODES))
+    replication_factor = int(os.environ.get('REPLICATION_FACTOR', DEFAULT_REPLICATION_FACTOR))
 
     relative_path_to_data_file = os.environ.get('DATA_FILE')
 
-    config = Config(node_id, node_ip, next_node_id, next_node_ip)
-    app = initialize(config, relative_path_to_data_file)
-    app.run(host='0.0.0.0', port=80, server='waitress', threads=6, loglevel='warning')
+    server_mode = os.environ.get('SERVER_MODE', DEFAULT_SERVER_MODE)
+    if server_mode not in SERVER_MODES:
+        raise ValueError("Unknown server mode '{}', expected one of {}".format(server_mode, SERVER_MODES))
+    port = int(os.environ.get('PORT', DEFAULT_PORT))
+    server_threads = int(os.environ.get('SERVER_THREADS', DEFAULT_SERVER_THREADS))
+
+    if server_mode == SERVER_PREFORK:
+        # The workers are forked before any thread is started, and read the
+        # key-value pairs the writer, the current process, stores in shared memory
+        storage = shared_store.SharedMemoryStore(
+            max_keys=int(os.environ.get('SHARED_STORE_KEYS', shared_store.DEFAULT_MAX_KEYS)),
+            max_bytes=int(os.environ.get('SHARED_STORE_BYTES', shared_store.DEFAULT_MAX_BYTES)),
+            path=os.environ.get('SHARED_STORE_PATH'))
+        writer_port = port + int(os.environ.get('PREFORK_WRITER_PORT_OFFSET', prefork.DEFAULT_WRITER_PORT_OFFSET))
+        prefork.start_workers(
+            storage, '127.0.0.1:{}'.format(writer_port), '0.0.0.0', port,
+            num_workers=int(os.environ.get('PREFORK_WORKERS', prefork.DEFAULT_PREFORK_WORKERS)),
+            threads=server_threads,
+            pool_size=int(os.environ.get('PEER_POOL_SIZE', utils.DEFAULT_POOL_SIZE)))
+    else:
+        storage_backend = os.environ.get('STORAGE_BACKEND', DEFAULT_STORAGE_BACKEND)
+        store_options = {}
+        if storage_backend == 'capped':
+            store_options = dict(max_bytes=int(os.environ.get('STORE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+                                 eviction=os.environ.get('EVICTION_POLICY', DEFAULT_EVICTION_POLICY))
+        storage = create_store(storage_backend, **store_options)
+
+    if os.environ.get('ORDERED_INDEX') in ('1', 'true'):
+        storage = OrderedStore(storage)
+
+    log_directory = os.environ.get('LOG_DIRECTORY')
+    if log_directory:
+        storage = LogStore(log_directory, storage, fsync=os.environ.get('FSYNC_POLICY', FSYNC_INTERVAL))
+
+    if os.environ.get('KEY_FILTER') in ('1', 'true'):
+        # The filter is built from the recovered key-value pairs, if any
+        storage = FilteredStore(storage,
+                                capacity=int(os.environ.get('KEY_FILTER_CAPACITY', DEFAULT_FILTER_CAPACITY)),
+                                error_rate=float(os.environ.get('KEY_FILTER_ERROR_RATE', DEFAULT_FILTER_ERROR_RATE)))
+
+    peer_options = dict(
+        connect_timeout=float(os.environ.get('PEER_CONNECT_TIMEOUT', utils.DEFAULT_CONNECT_TIMEOUT)),
+        read_timeout=float(os.environ.get('PEER_READ_TIMEOUT', utils.DEFAULT_READ_TIMEOUT)),
+        max_retries=int(os.environ.get('PEER_MAX_RETRIES', utils.DEFAULT_MAX_RETRIES)))
+    Node.configure_connection_pool(
+        pool_size=int(os.environ.get('PEER_POOL_SIZE', utils.DEFAULT_POOL_SIZE)), **peer_options)
+
+    peer_port = None
+    peer_transport = os.environ.get('PEER_TRANSPORT', DEFAULT_PEER_TRANSPORT)
+    if peer_transport not in PEER_TRANSPORTS:
+        raise ValueError("Unknown peer transport '{}', expected one of {}".format(peer_transport, PEER_TRANSPORTS))
+    if peer_transport == PEER_TRANSPORT_BINARY:
+        peer_port_offset = int(os.environ.get('PEER_PORT_OFFSET', DEFAULT_PEER_PORT_OFFSET))
+        peer_port = port + peer_port_offset
+        Node.configure_transport(BinaryTransport(port_offset=peer_port_offset, **peer_options))
+
+    read_cache = None
+    read_cache_entries = int(os.environ.get('READ_CACHE_ENTRIES', 0))
+    if read_cache_entries > 0:
+        read_cache = cache.ReadCache(
+            max_entries=read_cache_entries,
+            max_bytes=int(os.environ.get('READ_CACHE_BYTES', cache.DEFAULT_MAX_BYTES)),
+            ttl=float(os.environ.get('READ_CACHE_TTL', cache.DEFAULT_TTL)))
+
+    cluster_size = os.environ.get('CLUSTER_SIZE')
+    config = Config(node_id, node_ip, next_node_id, next_node_ip, num_virtual_nodes, replication_factor,
+                    cluster_size=int(cluster_size) if cluster_size else None,
+                    gossip_interval=float(os.environ.get('GOSSIP_INTERVAL', DEFAULT_GOSSIP_INTERVAL)),
+                    hedge_percentile=float(os.environ.get('HEDGE_PERCENTILE', DEFAULT_HEDGE_PERCENTILE)),
+                    hedge_max_rate=float(os.environ.get('HEDGE_MAX_RATE', DEFAULT_HEDGE_MAX_RATE)),
+                    filter_sync_interval=float(os.environ.get('KEY_FILTER_SYNC_INTERVAL',
+                                                              DEFAULT_FILTER_SYNC_INTERVAL)),
+                    write_durability=os.environ.get('WRITE_DURABILITY', DEFAULT_WRITE_DURABILITY),
+                    max_write_linger=float(os.environ.get('WRITE_MAX_LINGER', DEFAULT_MAX_WRITE_LINGER)))
+
+    if server_mode == SERVER_ASYNC:
+        app = async_server.initialize(
+            config, relative_path_to_data_file, storage, read_cache, peer_port,
+            pool_size=int(os.environ.get('PEER_POOL_SIZE', DEFAULT_ASYNC_POOL_SIZE)), **peer_options)
+        async_server.run(app, host='0.0.0.0', port=port)
+        return
+
+    logging.getLogger('waitress').setLevel(logging.WARNING)
+    app = initialize(config, relative_path_to_data_file, storage, read_cache, peer_port)
+    if server_mode == SERVER_PREFORK:
+        app.run(host='127.0.0.1', port=writer_port, server='waitress', threads=server_threads)
+        return
+    app.run(host='0.0.0.0', port=port, server='waitress', threads=server_threads)
 
 
 if __name__ == "__main__":